@@ -12,15 +12,18 @@ from requests_toolbelt import MultipartEncoder
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 import requests
+from requests.adapters import HTTPAdapter
 import logging
 import random
 import string
 import json
 import time
+import copy
 import re
 
 from . import types
-from .common import exceptions, utils, enums
+from .common import exceptions, utils, enums, fast_html
+from .common.cache import TTLCache, MISSING
 
 logger = logging.getLogger("FunPayAPI.account")
 PRIVATE_CHAT_ID_RE = re.compile(r"users-\d+-\d+$")
@@ -44,11 +47,19 @@ class Account:
 
     :param locale: текущий язык аккаунта, опционально.
     :type locale: :obj:`Literal["ru", "en", "uk"]` or :obj:`None`
+
+    :param pool_size: максимальное кол-во одновременно открытых (keep-alive) соединений с FunPay.
+    :type pool_size: :obj:`int`, опционально
+
+    :param adapter: общий пул соединений (если в одном процессе работает несколько аккаунтов). Куки у каждого
+        аккаунта остаются свои. Если не передан, создается собственный пул размером pool_size.
+    :type adapter: :class:`requests.adapters.HTTPAdapter` or :obj:`None`, опционально
     """
 
     def __init__(self, golden_key: str, user_agent: str | None = None,
                  requests_timeout: int | float = 10, proxy: Optional[dict] = None,
-                 locale: Literal["ru", "en", "uk"] | None = None):
+                 locale: Literal["ru", "en", "uk"] | None = None, pool_size: int = 10,
+                 adapter: HTTPAdapter | None = None):
         self.golden_key: str = golden_key
         """Токен (golden_key) аккаунта."""
         self.user_agent: str | None = user_agent
@@ -97,10 +108,24 @@ class Account:
         """Примерный общий баланс аккаунта в валюте аккаунта."""
         self.csrf_token: str | None = None
         """CSRF токен."""
-        self.phpsessid: str | None = None
-        """PHPSESSID сессии."""
+        self.session: requests.Session = requests.Session()
+        """HTTP-сессия с пулом keep-alive соединений и хранилищем куки. Потокобезопасна для отправки запросов."""
+        self.__shared_adapter: bool = adapter is not None
+        adapter = adapter or HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if user_agent:
+            self.session.headers["user-agent"] = user_agent
+        self.session.cookies.set("golden_key", golden_key, domain="funpay.com", path="/")
+        self.session.cookies.set("cookie_prefs", "1", domain="funpay.com", path="/")
         self.last_update: int | None = None
         """Последнее время обновления аккаунта."""
+        self.last_sales_ids: list[str] = []
+        """ID всех заказов последней полученной страницы продаж (включая пропущенные и исключенные)."""
+        self.order_cache: TTLCache = TTLCache(maxsize=256, ttl=60)
+        """Кэш :meth:`get_order` и :meth:`get_order_shortcut`."""
+        self.lot_cache: TTLCache = TTLCache(maxsize=128, ttl=300)
+        """Кэш :meth:`get_lot_page` и :meth:`get_lot_fields`."""
 
         self.interlocutor_ids: dict[int, int] = {}
         """{id чата: id собеседника}"""
@@ -130,7 +155,7 @@ class Account:
                exclude_phpsessid: bool = False, raise_not_200: bool = False,
                locale: Literal["ru", "en", "uk"] | None = None) -> requests.Response:
         """
-        Отправляет запрос к FunPay. Добавляет в заголовки запроса user_agent и куки.
+        Отправляет запрос к FunPay через общую HTTP-сессию (keep-alive соединения, куки из хранилища сессии).
 
         :param request_method: метод запроса ("get" / "post").
         :type request_method: :obj:`str` `post` or `get`
@@ -154,6 +179,39 @@ class Account:
         :rtype: :class:`requests.Response`
         """
 
+        link = self._prepare_link(request_method, api_method, locale)
+        if self.user_agent:
+            headers["user-agent"] = self.user_agent
+
+        if exclude_phpsessid:
+            # Запрос собирается вне сессии, чтобы не подставлять PHPSESSID из хранилища куки.
+            # Новый PHPSESSID из ответа все равно попадет в хранилище сессии.
+            request = requests.Request(request_method.upper(), link, headers={**self.session.headers, **headers},
+                                       data=payload, cookies=self._request_cookies(exclude_phpsessid)).prepare()
+            response = self.session.send(request, timeout=self.requests_timeout, proxies=self.proxy or {},
+                                         allow_redirects=True)
+        else:
+            response = self.session.request(request_method, link, headers=headers, data=payload,
+                                            timeout=self.requests_timeout, proxies=self.proxy or {},
+                                            allow_redirects=True)
+        return self._check_response(response, raise_not_200)
+
+    def _prepare_link(self, request_method: Literal["post", "get"], api_method: str,
+                      locale: Literal["ru", "en", "uk"] | None = None) -> str:
+        """
+        Формирует полную ссылку запроса с учетом языка аккаунта.
+        Используется как синхронным, так и асинхронным клиентом.
+
+        :param request_method: метод запроса ("get" / "post").
+        :type request_method: :obj:`str` `post` or `get`
+
+        :param api_method: метод API / полная ссылка.
+        :type api_method: :obj:`str`
+
+        :return: ссылка для запроса.
+        :rtype: :obj:`str`
+        """
+
         def normalize_url(api_method: str, locale: Literal["ru", "en", "uk"] | None = None) -> str:
             api_method = "https://funpay.com/" if api_method == "https://funpay.com" else api_method
             url = api_method if api_method.startswith("https://funpay.com/") else "https://funpay.com/" + api_method
@@ -166,18 +224,6 @@ class Account:
                 return url.replace(f"https://funpay.com/", f"https://funpay.com/{locale}/", 1)
             return url
 
-        def update_locale(redirect_url: str):
-            for locale in ("en", "uk"):
-                if redirect_url.startswith(f"https://funpay.com/{locale}/"):
-                    self.__locale = locale
-                    return
-            if redirect_url.startswith(f"https://funpay.com"):
-                self.__locale = "ru"
-
-        headers["cookie"] = f"golden_key={self.golden_key}; cookie_prefs=1"
-        headers["cookie"] += f"; PHPSESSID={self.phpsessid}" if self.phpsessid and not exclude_phpsessid else ""
-        if self.user_agent:
-            headers["user-agent"] = self.user_agent
         if request_method == "post" and locale:
             link = normalize_url(api_method, locale)
         else:
@@ -185,18 +231,43 @@ class Account:
         locale = locale or self.__set_locale
         if request_method == "get" and locale and locale != self.locale:
             link += f'{"&" if "?" in link else "?"}setlocale={locale}'
-        for i in range(10):
-            response = getattr(requests, request_method)(link, headers=headers, data=payload,
-                                                         timeout=self.requests_timeout,
-                                                         proxies=self.proxy or {}, allow_redirects=False)
-            if not (300 <= response.status_code < 400) or 'Location' not in response.headers:
-                break
-            link = response.headers['Location']
-            update_locale(link)
-        else:
-            response = getattr(requests, request_method)(link, headers=headers, data=payload,
-                                                         timeout=self.requests_timeout,
-                                                         proxies=self.proxy or {})
+        return link
+
+    def _request_cookies(self, exclude_phpsessid: bool = False) -> dict[str, str]:
+        """
+        Возвращает куки аккаунта из хранилища сессии.
+
+        :param exclude_phpsessid: исключить ли PHPSESSID?
+        :type exclude_phpsessid: :obj:`bool`
+
+        :return: куки в формате {название: значение}.
+        :rtype: :obj:`dict` {:obj:`str`: :obj:`str`}
+        """
+        return {cookie.name: cookie.value for cookie in self.session.cookies
+                if not (exclude_phpsessid and cookie.name == "PHPSESSID")}
+
+    def _check_response(self, response: requests.Response, raise_not_200: bool = False) -> requests.Response:
+        """
+        Обрабатывает ответ FunPay: обновляет язык аккаунта после редиректов, запоминает время 429 ошибки
+        и возбуждает исключения при ошибочном статус-коде.
+
+        :param response: объект ответа.
+        :type response: :class:`requests.Response`
+
+        :param raise_not_200: возбуждать ли исключение, если статус код ответа != 200?
+        :type raise_not_200: :obj:`bool`
+
+        :return: объект ответа.
+        :rtype: :class:`requests.Response`
+        """
+        if response.history:
+            for locale in ("en", "uk"):
+                if response.url.startswith(f"https://funpay.com/{locale}/"):
+                    self.__locale = locale
+                    break
+            else:
+                if response.url.startswith("https://funpay.com"):
+                    self.__locale = "ru"
         if response.status_code == 429:
             self.last_429_err_time = time.time()
 
@@ -206,6 +277,31 @@ class Account:
             raise exceptions.RequestFailedError(response)
         return response
 
+    @property
+    def phpsessid(self) -> str | None:
+        """
+        PHPSESSID сессии (хранится в куки сессии).
+        """
+        for cookie in self.session.cookies:
+            if cookie.name == "PHPSESSID":
+                return cookie.value
+        return None
+
+    @phpsessid.setter
+    def phpsessid(self, value: str | None):
+        for cookie in [c for c in self.session.cookies if c.name == "PHPSESSID"]:
+            self.session.cookies.clear(cookie.domain, cookie.path, cookie.name)
+        if value:
+            self.session.cookies.set("PHPSESSID", value, domain="funpay.com", path="/")
+
+    def close(self):
+        """
+        Закрывает все открытые соединения пула. Общий пул (параметр adapter) не закрывается.
+        """
+        if self.__shared_adapter:
+            self.session.adapters.clear()
+        self.session.close()
+
     def get(self, update_phpsessid: bool = True) -> Account:
         """
         Получает / обновляет данные об аккаунте. Необходимо вызывать каждые 40-60 минут, дабы обновить
@@ -217,9 +313,30 @@ class Account:
         :return: объект аккаунта с обновленными данными.
         :rtype: :class:`FunPayAPI.account.Account`
         """
+        self._prepare_get()
+        response = self.method("get", "https://funpay.com/", {}, {}, update_phpsessid, raise_not_200=True)
+        return self._parse_get(response, update_phpsessid)
+
+    def _prepare_get(self):
+        """
+        Выставляет язык аккаунта перед запросом главной страницы (см. :meth:`FunPayAPI.account.Account.get`).
+        """
         if not self.is_initiated:
             self.locale = self.__subcategories_parse_locale
-        response = self.method("get", "https://funpay.com/", {}, {}, update_phpsessid, raise_not_200=True)
+
+    def _parse_get(self, response: requests.Response, update_phpsessid: bool = True) -> Account:
+        """
+        Парсит главную страницу FunPay и обновляет данные аккаунта (см. :meth:`FunPayAPI.account.Account.get`).
+
+        :param response: ответ на запрос главной страницы.
+        :type response: :class:`requests.Response`
+
+        :param update_phpsessid: обновить :py:obj:`.Account.phpsessid` или использовать старый.
+        :type update_phpsessid: :obj:`bool`, опционально
+
+        :return: объект аккаунта с обновленными данными.
+        :rtype: :class:`FunPayAPI.account.Account`
+        """
         if not self.is_initiated:
             self.locale = self.__default_locale
         html_response = response.content.decode()
@@ -246,8 +363,8 @@ class Account:
         self.active_purchases = int(active_purchases.text) if active_purchases else 0
 
         cookies = response.cookies.get_dict()
-        if update_phpsessid or not self.phpsessid:
-            self.phpsessid = cookies.get("PHPSESSID", self.phpsessid)
+        if (update_phpsessid or not self.phpsessid) and cookies.get("PHPSESSID"):
+            self.phpsessid = cookies["PHPSESSID"]
         if not self.is_initiated:
             self.__setup_categories(html_response)
 
@@ -413,6 +530,16 @@ class Account:
         """
         if not self.is_initiated:
             raise exceptions.AccountNotInitiatedError()
+        if (lot_page := self.lot_cache.get((lot_id, "page", locale))) is not MISSING:
+            return lot_page
+        lot_page = self._get_lot_page(lot_id, locale)
+        self.lot_cache.set((lot_id, "page", locale), lot_page)
+        return lot_page
+
+    def _get_lot_page(self, lot_id: int, locale: Literal["ru", "en", "uk"] | None = None):
+        """
+        Запрашивает и парсит страницу лота без кэша (см. :meth:`get_lot_page`).
+        """
         headers = {
             "accept": "*/*"
         }
@@ -535,7 +662,8 @@ class Account:
                                      interlocutor_username, from_id)
 
     def get_chats_histories(self, chats_data: dict[int | str, str | None],
-                            interlocutor_ids: list[int] | None = None) -> dict[int, list[types.Message]]:
+                            interlocutor_ids: list[int] | None = None,
+                            last_message_ids: dict[int | str, int] | None = None) -> dict[int, list[types.Message]]:
         """
         Получает историю сообщений сразу нескольких чатов
         (до 50 сообщений на личный чат, до 25 сообщений на публичный чат).
@@ -545,16 +673,35 @@ class Account:
             Например: {48392847: "SLLMK", 58392098: "Amongus", 38948728: None}
         :type chats_data: :obj:`dict` {:obj:`int` or :obj:`str`: :obj:`str` or :obj:`None`}
 
+        :param last_message_ids: ID последних уже полученных сообщений чатов. Для таких чатов FunPay вернет
+            только более новые сообщения (остальные и не парсятся). Чаты без ID запрашиваются полностью.
+        :type last_message_ids: :obj:`dict` {:obj:`int` or :obj:`str`: :obj:`int`} or :obj:`None`, опционально
+
         :return: словарь с историями чатов в формате {ID чата: [список сообщений]}
         :rtype: :obj:`dict` {:obj:`int`: :obj:`list` of :class:`FunPayAPI.types.Message`}
         """
+        headers, payload = self._chats_histories_payload(chats_data, interlocutor_ids, last_message_ids)
+        response = self.method("post", "runner/", headers, payload, raise_not_200=True)
+        return self._parse_chats_histories(response, chats_data, last_message_ids)
+
+    def _chats_histories_payload(self, chats_data: dict[int | str, str | None],
+                                 interlocutor_ids: list[int] | None = None,
+                                 last_message_ids: dict[int | str, int] | None = None) -> tuple[dict, dict]:
+        """
+        Формирует заголовки и полезную нагрузку запроса историй чатов
+        (см. :meth:`FunPayAPI.account.Account.get_chats_histories`).
+
+        :return: (заголовки, полезная нагрузка).
+        :rtype: :obj:`tuple` (:obj:`dict`, :obj:`dict`)
+        """
         headers = {
             "accept": "*/*",
             "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
             "x-requested-with": "XMLHttpRequest"
         }
+        last_message_ids = last_message_ids or {}
         chats = [{"type": "chat_node", "id": i, "tag": "00000000",
-                  "data": {"node": i, "last_message": -1, "content": ""}} for i in chats_data]
+                  "data": {"node": i, "last_message": last_message_ids.get(i, -1), "content": ""}} for i in chats_data]
         buyers = [{"type": "c-p-u",
                    "id": str(buyer),
                    "tag": utils.random_tag(),
@@ -564,8 +711,18 @@ class Account:
             "request": False,
             "csrf_token": self.csrf_token
         }
-        response = self.method("post", "runner/", headers, payload, raise_not_200=True)
+        return headers, payload
+
+    def _parse_chats_histories(self, response: requests.Response, chats_data: dict[int | str, str | None],
+                               last_message_ids: dict[int | str, int] | None = None) -> dict[int, list[types.Message]]:
+        """
+        Парсит ответ на запрос историй чатов (см. :meth:`FunPayAPI.account.Account.get_chats_histories`).
+
+        :return: словарь с историями чатов в формате {ID чата: [список сообщений]}
+        :rtype: :obj:`dict` {:obj:`int`: :obj:`list` of :class:`FunPayAPI.types.Message`}
+        """
         json_response = response.json()
+        last_message_ids = last_message_ids or {}
 
         result = {}
         for i in json_response["objects"]:
@@ -584,7 +741,8 @@ class Account:
                     interlocutors.remove(str(self.id))
                     interlocutor_id = int(interlocutors[0])
                     interlocutor_name = chats_data[i.get("id")]
-                messages = self.__parse_messages(i["data"]["messages"], i.get("id"), interlocutor_id, interlocutor_name)
+                messages = self.__parse_messages(i["data"]["messages"], i.get("id"), interlocutor_id, interlocutor_name,
+                                                 last_message_ids.get(i.get("id"), -1) + 1)
                 result[i.get("id")] = messages
         return result
 
@@ -680,6 +838,20 @@ class Account:
         if not self.is_initiated:
             raise exceptions.AccountNotInitiatedError()
 
+        headers, payload = self._send_message_payload(chat_id, text, image_id, leave_as_unread)
+        response = self.method("post", "runner/", headers, payload, raise_not_200=True)
+        return self._parse_send_message(response, chat_id, text, chat_name, interlocutor_id, add_to_ignore_list,
+                                        update_last_saved_message, leave_as_unread)
+
+    def _send_message_payload(self, chat_id: int | str, text: Optional[str] = None, image_id: Optional[int] = None,
+                              leave_as_unread: bool = False) -> tuple[dict, dict]:
+        """
+        Формирует заголовки и полезную нагрузку запроса отправки сообщения
+        (см. :meth:`FunPayAPI.account.Account.send_message`).
+
+        :return: (заголовки, полезная нагрузка).
+        :rtype: :obj:`tuple` (:obj:`dict`, :obj:`dict`)
+        """
         headers = {
             "accept": "*/*",
             "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
@@ -710,7 +882,18 @@ class Account:
             "csrf_token": self.csrf_token
         }
 
-        response = self.method("post", "runner/", headers, payload, raise_not_200=True)
+        return headers, payload
+
+    def _parse_send_message(self, response: requests.Response, chat_id: int | str, text: Optional[str] = None,
+                            chat_name: Optional[str] = None, interlocutor_id: Optional[int] = None,
+                            add_to_ignore_list: bool = True, update_last_saved_message: bool = False,
+                            leave_as_unread: bool = False) -> types.Message:
+        """
+        Парсит ответ на запрос отправки сообщения (см. :meth:`FunPayAPI.account.Account.send_message`).
+
+        :return: экземпляр отправленного сообщения.
+        :rtype: :class:`FunPayAPI.types.Message`
+        """
         json_response = response.json()
         if not (resp := json_response.get("response")):
             raise exceptions.MessageNotDeliveredError(response, None, chat_id)
@@ -838,6 +1021,7 @@ class Account:
         }
 
         response = self.method("post", "orders/review", headers, payload)
+        self.invalidate_order(order_id)
         if response.status_code == 400:
             json_response = response.json()
             msg = json_response.get("msg")
@@ -871,6 +1055,7 @@ class Account:
         }
 
         response = self.method("post", "orders/reviewDelete", headers, payload)
+        self.invalidate_order(order_id)
 
         if response.status_code == 400:
             json_response = response.json()
@@ -903,6 +1088,7 @@ class Account:
         }
 
         response = self.method("post", "orders/refund", headers, payload, raise_not_200=True)
+        self.invalidate_order(order_id)
 
         if response.json().get("error"):
             raise exceptions.RefundError(response, response.json().get("msg"), order_id)
@@ -1177,7 +1363,13 @@ class Account:
         :rtype: :class:`FunPayAPI.types.OrderShortcut`
         """
         # todo взаимодействие с покупками
-        return self.runner.saved_orders.get(order_id, self.get_sales(id=order_id)[1][0])
+        if self.runner and (order := self.runner.saved_orders.get(order_id)):
+            return order
+        if (order := self.order_cache.get((order_id, "shortcut"))) is not MISSING:
+            return order
+        order = self.get_sales(id=order_id)[1][0]
+        self.order_cache.set((order_id, "shortcut"), order)
+        return order
 
     def get_order(self, order_id: str, locale: Literal["ru", "en", "uk"] | None = None) -> types.Order:
         """
@@ -1194,9 +1386,54 @@ class Account:
         headers = {
             "accept": "*/*"
         }
-        if not locale:
-            locale = self.__order_parse_locale
+        locale = self._order_locale(locale)
+        if (order := self.order_cache.get((order_id, "order", locale))) is not MISSING:
+            return order
         response = self.method("get", f"orders/{order_id}/", headers, {}, raise_not_200=True, locale=locale)
+        order = self._parse_order(response, order_id, locale)
+        self.order_cache.set((order_id, "order", locale), order)
+        return order
+
+    def invalidate_order(self, order_id: str):
+        """
+        Удаляет заказ из кэша :meth:`get_order` / :meth:`get_order_shortcut`. Вызывается при изменении
+        статуса заказа, отзыва или возврате средств.
+
+        :param order_id: ID заказа.
+        :type order_id: :obj:`str`
+        """
+        self.order_cache.invalidate(order_id)
+
+    def invalidate_lot(self, lot_id: int):
+        """
+        Удаляет лот из кэша :meth:`get_lot_page` / :meth:`get_lot_fields`.
+
+        :param lot_id: ID лота.
+        :type lot_id: :obj:`int`
+        """
+        self.lot_cache.invalidate(lot_id)
+
+    def cache_stats(self) -> dict[str, dict[str, int]]:
+        """
+        :return: статистика кэшей {"orders": {...}, "lots": {...}} (см. :meth:`FunPayAPI.common.cache.TTLCache.stats`).
+        :rtype: :obj:`dict`
+        """
+        return {"orders": self.order_cache.stats(), "lots": self.lot_cache.stats()}
+
+    def _order_locale(self, locale: Literal["ru", "en", "uk"] | None = None) -> Literal["ru", "en", "uk"] | None:
+        """
+        Возвращает язык, на котором будет запрошена страница заказа.
+        """
+        return locale or self.__order_parse_locale
+
+    def _parse_order(self, response: requests.Response, order_id: str,
+                     locale: Literal["ru", "en", "uk"] | None = None) -> types.Order:
+        """
+        Парсит страницу заказа (см. :meth:`FunPayAPI.account.Account.get_order`).
+
+        :return: объекст заказа.
+        :rtype: :class:`FunPayAPI.types.Order`
+        """
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
@@ -1309,7 +1546,8 @@ class Account:
                   state: Optional[Literal["closed", "paid", "refunded"]] = None, game: Optional[int] = None,
                   section: Optional[str] = None, server: Optional[int] = None,
                   side: Optional[int] = None, locale: Literal["ru", "en", "uk"] | None = None,
-                  sudcategories: dict[str, tuple[types.SubCategoryTypes, int]] = None, **more_filters) -> \
+                  sudcategories: dict[str, tuple[types.SubCategoryTypes, int]] = None,
+                  known_statuses: dict[str, types.OrderStatuses] | None = None, **more_filters) -> \
             tuple[str | None, list[types.OrderShortcut], Literal["ru", "en", "uk"],
             dict[str, types.SubCategory]]:
         """
@@ -1354,6 +1592,10 @@ class Account:
         :param side: ID стороны (платформы).
         :type side: :obj:`int`, опционально.
 
+        :param known_statuses: уже известные статусы заказов ({ID заказа: статус}). Заказы, статус которых
+            не изменился, не парсятся и не попадают в список (ID всех заказов страницы - в :attr:`last_sales_ids`).
+        :type known_statuses: :obj:`dict` {:obj:`str`: :class:`FunPayAPI.common.enums.OrderStatuses`}, опционально
+
         :param more_filters: доп. фильтры.
 
         :return: (ID след. заказа (для start_from), список заказов)
@@ -1362,7 +1604,23 @@ class Account:
         if not self.is_initiated:
             raise exceptions.AccountNotInitiatedError()
 
-        exclude_ids = exclude_ids or []
+        link, filters = self._sales_request(start_from, id, buyer, state, game, section, server, side, locale,
+                                            **more_filters)
+        response = self.method("post" if start_from else "get", link, {}, filters, raise_not_200=True, locale=locale)
+        return self._parse_sales(response, start_from, include_paid, include_closed, include_refunded, exclude_ids,
+                                 locale, sudcategories, known_statuses)
+
+    def _sales_request(self, start_from: str | None = None, id: Optional[str] = None, buyer: Optional[str] = None,
+                       state: Optional[Literal["closed", "paid", "refunded"]] = None, game: Optional[int] = None,
+                       section: Optional[str] = None, server: Optional[int] = None, side: Optional[int] = None,
+                       locale: Literal["ru", "en", "uk"] | None = None, **more_filters) -> tuple[str, dict]:
+        """
+        Формирует ссылку и фильтры запроса списка продаж (см. :meth:`FunPayAPI.account.Account.get_sales`).
+        Метод запроса: POST, если передан start_from, иначе GET.
+
+        :return: (ссылка, фильтры).
+        :rtype: :obj:`tuple` (:obj:`str`, :obj:`dict`)
+        """
         filters = {"id": id, "buyer": buyer, "state": state, "game": game, "section": section, "server": server,
                    "side": side}
         filters = {name: filters[name] for name in filters if filters[name]}
@@ -1379,7 +1637,24 @@ class Account:
             self.locale = locale
         else:
             self.locale = self.__profile_parse_locale
-        response = self.method("post" if start_from else "get", link, {}, filters, raise_not_200=True, locale=locale)
+        return link, filters
+
+    def _parse_sales(self, response: requests.Response, start_from: str | None = None, include_paid: bool = True,
+                     include_closed: bool = True, include_refunded: bool = True, exclude_ids: list[str] | None = None,
+                     locale: Literal["ru", "en", "uk"] | None = None,
+                     sudcategories: dict[str, tuple[types.SubCategoryTypes, int]] = None,
+                     known_statuses: dict[str, types.OrderStatuses] | None = None) -> \
+            tuple[str | None, list[types.OrderShortcut], Literal["ru", "en", "uk"],
+            dict[str, types.SubCategory]]:
+        """
+        Парсит страницу списка продаж (см. :meth:`FunPayAPI.account.Account.get_sales`).
+
+        :return: (ID след. заказа (для start_from), список заказов, язык, подкатегории)
+        :rtype: :obj:`tuple` (:obj:`str` or :obj:`None`, :obj:`list` of :class:`FunPayAPI.types.OrderShortcut`, ...)
+        """
+        exclude_ids = exclude_ids or []
+        known_statuses = known_statuses or {}
+        self.last_sales_ids = []
         if not start_from:
             self.locale = self.__default_locale
         html_response = response.content.decode()
@@ -1431,7 +1706,8 @@ class Account:
                 order_status = types.OrderStatuses.CLOSED
 
             order_id = div.find("div", {"class": "tc-order"}).text[1:]
-            if order_id in exclude_ids:
+            self.last_sales_ids.append(order_id)
+            if order_id in exclude_ids or known_statuses.get(order_id) == order_status:
                 continue
 
             description = div.find("div", {"class": "order-desc"}).find("div").text
@@ -1665,11 +1941,20 @@ class Account:
         :param lot_id: ID лота.
         :type lot_id: :obj:`int`
 
-        :return: объект с полями лота.
+        :return: объект с полями лота (копия, его можно изменять).
         :rtype: :class:`FunPayAPI.types.LotFields`
         """
         if not self.is_initiated:
             raise exceptions.AccountNotInitiatedError()
+        if (lot_fields := self.lot_cache.get((lot_id, "fields"))) is MISSING:
+            lot_fields = self._get_lot_fields(lot_id)
+            self.lot_cache.set((lot_id, "fields"), lot_fields)
+        return copy.deepcopy(lot_fields)
+
+    def _get_lot_fields(self, lot_id: int) -> types.LotFields:
+        """
+        Запрашивает и парсит поля лота без кэша (см. :meth:`get_lot_fields`).
+        """
         headers = {}
         response = self.method("get", f"lots/offerEdit?offer={lot_id}", headers, {}, raise_not_200=True)
 
@@ -1713,6 +1998,7 @@ class Account:
         fields["location"] = "trade"
 
         response = self.method("post", "lots/offerSave", headers, fields, raise_not_200=True)
+        self.invalidate_lot(lot_fields.lot_id)
         json_response = response.json()
         errors_dict = {}
         if (errors := json_response.get("errors")) or json_response.get("error"):
@@ -1909,6 +2195,7 @@ class Account:
                          interlocutor_id: Optional[int] = None, interlocutor_username: Optional[str] = None,
                          from_id: int = 0) -> list[types.Message]:
         messages = []
+        fragments = []
         ids = {self.id: self.username, 0: "FunPay"}
         badges = {}
         if interlocutor_id is not None:
@@ -1918,16 +2205,15 @@ class Account:
             if i["id"] < from_id:
                 continue
             author_id = i["author"]
-            parser = BeautifulSoup(i["html"].replace("<br>", "\n"), "lxml")
+            # каждое сообщение разбирается один раз, результат используется и ниже при определении бейджей
+            fragment = fast_html.parse_message_html(i["html"])
 
             # Если ник или бейдж написавшего неизвестен, но есть блок с данными об авторе сообщения
-            if None in [ids.get(author_id), badges.get(author_id)] and (
-                    author_div := parser.find("div", {"class": "media-user-name"})):
+            if None in [ids.get(author_id), badges.get(author_id)] and fragment["has_author_div"]:
                 if badges.get(author_id) is None:
-                    badge = author_div.find("span", {"class": "chat-msg-author-label label label-success"})
-                    badges[author_id] = badge.text if badge else 0
+                    badges[author_id] = fragment["badge"] if fragment["badge"] is not None else 0
                 if ids.get(author_id) is None:
-                    author = author_div.find("a").text.strip()
+                    author = fragment["author"]
                     ids[author_id] = author
                     if self.chat_id_private(chat_id) and author_id == interlocutor_id and not interlocutor_username:
                         interlocutor_username = author
@@ -1935,10 +2221,9 @@ class Account:
             by_bot = False
             by_vertex = False
             image_name = None
-            if self.chat_id_private(chat_id) and (image_tag := parser.find("a", {"class": "chat-img-link"})):
-                image_name = image_tag.find("img")
-                image_name = image_name.get('alt') if image_name else None
-                image_link = image_tag.get("href")
+            if self.chat_id_private(chat_id) and fragment["has_image"]:
+                image_name = fragment["image_name"]
+                image_link = fragment["image_link"]
                 message_text = None
                 # "Отправлено_с_помощью_бота_FunPay_Cardinal.png", "funpay_cardinal_image.png"
                 if isinstance(image_name, str) and "funpay_cardinal" in image_name.lower():
@@ -1949,9 +2234,9 @@ class Account:
             else:
                 image_link = None
                 if author_id == 0:
-                    message_text = parser.find("div", role="alert").text.strip()
+                    message_text = fragment["alert_text"]
                 else:
-                    message_text = parser.find("div", {"class": "chat-msg-text"}).text
+                    message_text = fragment["text"]
 
                 if message_text.startswith(self.__bot_character) or \
                         message_text.startswith(self.__old_bot_character) and author_id == self.id:
@@ -1968,12 +2253,12 @@ class Account:
             message_obj.type = types.MessageTypes.NON_SYSTEM if author_id != 0 else message_obj.get_message_type()
 
             messages.append(message_obj)
+            fragments.append(fragment)
 
-        for i in messages:
+        for i, fragment in zip(messages, fragments):
             i.author = ids.get(i.author_id)
             i.chat_name = interlocutor_username
             i.badge = badges.get(i.author_id) if badges.get(i.author_id) != 0 else None
-            parser = BeautifulSoup(i.html, "lxml")
             if i.badge:
                 i.is_employee = True
                 if i.badge in ("поддержка", "підтримка", "support"):
@@ -1982,18 +2267,16 @@ class Account:
                     i.is_moderation = True
                 elif i.badge in ("арбитраж", "арбітраж", "arbitration"):
                     i.is_arbitration = True
-            default_label = parser.find("div", {"class": "media-user-name"})
-            default_label = default_label.find("span", {
-                "class": "chat-msg-author-label label label-default"}) if default_label else None
-            if default_label:
-                if default_label.text in ("автовідповідь", "автоответ", "auto-reply"):
+            default_label = fragment["default_label"]
+            if default_label is not None:
+                if default_label in ("автовідповідь", "автоответ", "auto-reply"):
                     i.is_autoreply = True
-            i.badge = default_label.text if (i.badge is None and default_label is not None) else i.badge
+            i.badge = default_label if (i.badge is None and default_label is not None) else i.badge
             if i.type != types.MessageTypes.NON_SYSTEM:
-                users = parser.find_all('a', href=lambda href: href and '/users/' in href)
+                users = fragment["users"]
                 if users:
-                    i.initiator_username = users[0].text
-                    i.initiator_id = int(users[0]["href"].split("/")[-2])
+                    i.initiator_username = users[0][0]
+                    i.initiator_id = int(users[0][1].split("/")[-2])
                     if i.type in (types.MessageTypes.ORDER_PURCHASED, types.MessageTypes.ORDER_CONFIRMED,
                                   types.MessageTypes.NEW_FEEDBACK,
                                   types.MessageTypes.FEEDBACK_CHANGED,
@@ -2013,7 +2296,7 @@ class Account:
                             i.i_am_seller = False
                             i.i_am_buyer = True
                     elif len(users) > 1:
-                        last_user_id = int(users[-1]["href"].split("/")[-2])
+                        last_user_id = int(users[-1][1].split("/")[-2])
                         if i.type == types.MessageTypes.ORDER_CONFIRMED_BY_ADMIN:
                             if last_user_id == self.id:
                                 i.i_am_seller = True
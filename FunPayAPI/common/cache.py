@@ -0,0 +1,108 @@
+"""
+Кэш результатов запросов к FunPay с временем жизни записей (TTL) и вытеснением давно не использованных (LRU).
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+MISSING = object()
+"""Значение, которое :meth:`TTLCache.get` возвращает при промахе."""
+
+
+class TTLCache:
+    """
+    Потокобезопасный LRU-кэш с временем жизни записей.
+
+    Ключи - кортежи, первый элемент которых - ID объекта (заказа / лота): по нему записи удаляются
+    в :meth:`invalidate`.
+
+    :param maxsize: максимальное кол-во записей.
+    :type maxsize: :obj:`int`
+
+    :param ttl: время жизни записи (в секундах).
+    :type ttl: :obj:`int` or :obj:`float`
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: int | float = 60):
+        self.maxsize: int = maxsize
+        """Максимальное кол-во записей."""
+        self.ttl: int | float = ttl
+        """Время жизни записи (в секундах)."""
+        self.hits: int = 0
+        """Кол-во попаданий."""
+        self.misses: int = 0
+        """Кол-во промахов (в т.ч. из-за истекшего времени жизни)."""
+        self.__data: OrderedDict[tuple, tuple[float, Any]] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: tuple) -> Any:
+        """
+        Возвращает значение из кэша.
+
+        :param key: ключ.
+        :type key: :obj:`tuple`
+
+        :return: значение или :data:`MISSING`, если записи нет или она устарела.
+        """
+        with self.__lock:
+            item = self.__data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self.__data[key]
+                self.misses += 1
+                return MISSING
+            self.__data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: tuple, value: Any):
+        """
+        Сохраняет значение в кэш, вытесняя самые давно использованные записи при переполнении.
+
+        :param key: ключ.
+        :type key: :obj:`tuple`
+
+        :param value: значение.
+        """
+        with self.__lock:
+            self.__data[key] = (time.monotonic() + self.ttl, value)
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+
+    def invalidate(self, object_id: Hashable) -> int:
+        """
+        Удаляет все записи объекта.
+
+        :param object_id: ID объекта (первый элемент ключа).
+
+        :return: кол-во удаленных записей.
+        :rtype: :obj:`int`
+        """
+        object_id = str(object_id)
+        with self.__lock:
+            keys = [key for key in self.__data if str(key[0]) == object_id]
+            for key in keys:
+                del self.__data[key]
+            return len(keys)
+
+    def clear(self):
+        """
+        Очищает кэш (счетчики не сбрасываются).
+        """
+        with self.__lock:
+            self.__data.clear()
+
+    def stats(self) -> dict[str, int]:
+        """
+        :return: {"hits": попадания, "misses": промахи, "size": кол-во записей}.
+        :rtype: :obj:`dict`
+        """
+        with self.__lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.__data)}
+
+    def __len__(self) -> int:
+        return len(self.__data)
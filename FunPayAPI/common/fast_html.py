@@ -0,0 +1,183 @@
+"""
+Быстрый разбор HTML-фрагментов сообщений чата и списка чатов (chat_bookmarks).
+
+Фрагменты FunPay имеют фиксированную структуру, поэтому вместо построения дерева BeautifulSoup для каждого
+сообщения используются заранее скомпилированные XPath-выражения lxml. Если lxml недоступен или фрагмент
+не удалось разобрать, используется BeautifulSoup (результат тот же).
+"""
+from __future__ import annotations
+
+import logging
+
+from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:  # pragma: no cover
+    etree = None
+    lxml_html = None
+
+logger = logging.getLogger("FunPayAPI.fast_html")
+
+AUTHOR_BADGE_CLASS = "chat-msg-author-label label label-success"
+DEFAULT_LABEL_CLASS = "chat-msg-author-label label label-default"
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+if etree is not None:
+    _USER_NAME_DIV = etree.XPath(f".//div[{_has_class('media-user-name')}]")
+    _AUTHOR_LINK = etree.XPath(".//a")
+    _AUTHOR_BADGE = etree.XPath(f".//span[@class='{AUTHOR_BADGE_CLASS}']")
+    _DEFAULT_LABEL = etree.XPath(f".//span[@class='{DEFAULT_LABEL_CLASS}']")
+    _IMAGE_LINK = etree.XPath(f".//a[{_has_class('chat-img-link')}]")
+    _IMAGE = etree.XPath(".//img")
+    _ALERT = etree.XPath(".//div[@role='alert']")
+    _MESSAGE_TEXT = etree.XPath(f".//div[{_has_class('chat-msg-text')}]")
+    _USER_LINKS = etree.XPath(".//a[contains(@href, '/users/')]")
+    _CONTACT_ITEMS = etree.XPath(f"//a[{_has_class('contact-item')}]")
+    _CONTACT_MESSAGE = etree.XPath(f".//div[{_has_class('contact-item-message')}]")
+
+
+def _first(found: list):
+    return found[0] if found else None
+
+
+def parse_message_html(html: str) -> dict:
+    """
+    Разбирает HTML одного сообщения чата.
+
+    :param html: HTML сообщения (поле "html" сообщения из ответа FunPay).
+    :type html: :obj:`str`
+
+    :return: словарь с ключами:\n
+        has_author_div - есть ли блок с данными об авторе;\n
+        author - никнейм автора или None;\n
+        badge - текст зеленого бейджа автора (поддержка / арбитраж / ...) или None;\n
+        default_label - текст серого бейджа автора (автоответ / ...) или None;\n
+        has_image - есть ли в сообщении изображение;\n
+        image_link, image_name - ссылка на изображение и его имя (alt) или None;\n
+        alert_text - текст системного сообщения FunPay или None;\n
+        text - текст сообщения или None;\n
+        users - [(никнейм, ссылка), ...] пользователей, упомянутых в сообщении.
+    :rtype: :obj:`dict`
+    """
+    if lxml_html is not None:
+        try:
+            return _parse_message_lxml(html)
+        except Exception:
+            logger.debug("Не удалось разобрать сообщение через lxml, используется BeautifulSoup.", exc_info=True)
+    return _parse_message_bs(html)
+
+
+def _parse_message_lxml(html: str) -> dict:
+    root = lxml_html.fragment_fromstring(html.replace("<br>", "\n"), create_parent="div")
+    author_div = _first(_USER_NAME_DIV(root))
+    author_link = _first(_AUTHOR_LINK(author_div)) if author_div is not None else None
+    badge = _first(_AUTHOR_BADGE(author_div)) if author_div is not None else None
+    default_label = _first(_DEFAULT_LABEL(author_div)) if author_div is not None else None
+    image_link = _first(_IMAGE_LINK(root))
+    image = _first(_IMAGE(image_link)) if image_link is not None else None
+    alert = _first(_ALERT(root))
+    text = _first(_MESSAGE_TEXT(root))
+    return {
+        "has_author_div": author_div is not None,
+        "author": author_link.text_content().strip() if author_link is not None else None,
+        "badge": badge.text_content() if badge is not None else None,
+        "default_label": default_label.text_content() if default_label is not None else None,
+        "has_image": image_link is not None,
+        "image_link": image_link.get("href") if image_link is not None else None,
+        "image_name": image.get("alt") if image is not None else None,
+        "alert_text": alert.text_content().strip() if alert is not None else None,
+        "text": text.text_content() if text is not None else None,
+        "users": [(a.text_content(), a.get("href")) for a in _USER_LINKS(root)],
+    }
+
+
+def _parse_message_bs(html: str) -> dict:
+    parser = BeautifulSoup(html.replace("<br>", "\n"), "lxml" if lxml_html is not None else "html.parser")
+    author_div = parser.find("div", {"class": "media-user-name"})
+    author_link = author_div.find("a") if author_div else None
+    badge = author_div.find("span", {"class": AUTHOR_BADGE_CLASS}) if author_div else None
+    default_label = author_div.find("span", {"class": DEFAULT_LABEL_CLASS}) if author_div else None
+    image_link = parser.find("a", {"class": "chat-img-link"})
+    image = image_link.find("img") if image_link else None
+    alert = parser.find("div", role="alert")
+    text = parser.find("div", {"class": "chat-msg-text"})
+    return {
+        "has_author_div": author_div is not None,
+        "author": author_link.text.strip() if author_link else None,
+        "badge": badge.text if badge else None,
+        "default_label": default_label.text if default_label else None,
+        "has_image": image_link is not None,
+        "image_link": image_link.get("href") if image_link else None,
+        "image_name": image.get("alt") if image else None,
+        "alert_text": alert.text.strip() if alert else None,
+        "text": text.text if text else None,
+        "users": [(a.text, a["href"]) for a in parser.find_all("a", href=lambda href: href and "/users/" in href)],
+    }
+
+
+def parse_chat_bookmarks_html(html: str) -> list[dict]:
+    """
+    Разбирает HTML списка чатов (объект "chat_bookmarks" ответа runner/).
+
+    :param html: HTML списка чатов.
+    :type html: :obj:`str`
+
+    :return: список словарей с ключами:\n
+        id - ID чата (:obj:`int`);\n
+        node_msg, user_msg - атрибуты data-node-msg и data-user-msg (:obj:`str`);\n
+        classes - классы элемента чата (:obj:`list`);\n
+        message - текст последнего сообщения или None, если чат удален;\n
+        user_name - никнейм собеседника или None;\n
+        html - HTML элемента чата.
+    :rtype: :obj:`list` of :obj:`dict`
+    """
+    if lxml_html is not None:
+        try:
+            return _parse_bookmarks_lxml(html)
+        except Exception:
+            logger.debug("Не удалось разобрать список чатов через lxml, используется BeautifulSoup.", exc_info=True)
+    return _parse_bookmarks_bs(html)
+
+
+def _parse_bookmarks_lxml(html: str) -> list[dict]:
+    if not html.strip():
+        return []
+    root = lxml_html.fromstring(html)
+    result = []
+    for chat in _CONTACT_ITEMS(root):
+        message = _first(_CONTACT_MESSAGE(chat))
+        user_name = _first(_USER_NAME_DIV(chat))
+        result.append({
+            "id": int(chat.get("data-id")),
+            "node_msg": chat.get("data-node-msg"),
+            "user_msg": chat.get("data-user-msg"),
+            "classes": (chat.get("class") or "").split(),
+            "message": message.text_content() if message is not None else None,
+            "user_name": user_name.text_content() if user_name is not None else None,
+            "html": lxml_html.tostring(chat, encoding="unicode", with_tail=False),
+        })
+    return result
+
+
+def _parse_bookmarks_bs(html: str) -> list[dict]:
+    parser = BeautifulSoup(html, "lxml" if lxml_html is not None else "html.parser")
+    result = []
+    for chat in parser.find_all("a", {"class": "contact-item"}):
+        message = chat.find("div", {"class": "contact-item-message"})
+        user_name = chat.find("div", {"class": "media-user-name"})
+        result.append({
+            "id": int(chat["data-id"]),
+            "node_msg": chat.get("data-node-msg"),
+            "user_msg": chat.get("data-user-msg"),
+            "classes": chat.get("class") or [],
+            "message": message.text if message else None,
+            "user_name": user_name.text if user_name else None,
+            "html": str(chat),
+        })
+    return result
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, AsyncGenerator
+
+if TYPE_CHECKING:
+    from ..async_account import AsyncAccount
+
+import asyncio
+import logging
+
+from ..common import exceptions
+from .events import *
+from .poll_scheduler import PollScheduler, RequestBudget, request_budget
+from .runner import Runner
+
+logger = logging.getLogger("FunPayAPI.async_runner")
+
+
+class AsyncRunner(Runner):
+    """
+    Асинхронный вариант :class:`FunPayAPI.updater.runner.Runner`.
+    Использует те же парсеры и генерирует те же события, но запросы выполняет через
+    :class:`FunPayAPI.async_account.AsyncAccount`.
+
+    :param account: экземпляр асинхронного аккаунта (должен быть инициализирован с помощью метода
+        :meth:`FunPayAPI.async_account.AsyncAccount.get`).
+    :type account: :class:`FunPayAPI.async_account.AsyncAccount`
+
+    Остальные параметры аналогичны :class:`FunPayAPI.updater.runner.Runner`.
+    """
+
+    def __init__(self, account: AsyncAccount, disable_message_requests: bool = False,
+                 disabled_order_requests: bool = False,
+                 disabled_buyer_viewing_requests: bool = True,
+                 state_path: str | None = None):
+        super().__init__(account, disable_message_requests, disabled_order_requests, disabled_buyer_viewing_requests,
+                         state_path)
+        self.account: AsyncAccount = account
+        """Экземпляр асинхронного аккаунта, к которому привязан Runner."""
+
+    async def get_updates(self) -> dict:
+        """
+        Запрашивает список событий FunPay.
+
+        :return: ответ FunPay.
+        :rtype: :obj:`dict`
+        """
+        headers, payload = self._updates_payload()
+        response = await self.account.method("post", "runner/", headers, payload, raise_not_200=True)
+        json_response = response.json()
+        logger.debug(f"Получены данные о событиях: {json_response}")
+        return json_response
+
+    async def parse_updates(self, updates: dict) -> list[InitialChatEvent | ChatsListChangedEvent |
+                                                         LastChatMessageChangedEvent | NewMessageEvent |
+                                                         InitialOrderEvent | OrdersListChangedEvent | NewOrderEvent |
+                                                         OrderStatusChangedEvent]:
+        """
+        Парсит ответ FunPay и создает события (см. :meth:`FunPayAPI.updater.runner.Runner.parse_updates`).
+        """
+        events = []
+        for obj in self._sorted_updates(updates):
+            if obj.get("type") == "chat_bookmarks":
+                events.extend(await self.parse_chat_updates(obj))
+            elif obj.get("type") == "orders_counters":
+                events.extend(await self.parse_order_updates(obj))
+            elif obj.get("type") == "c-p-u":
+                self._save_buyer_viewing(obj)
+        self._end_first_request()
+        return events
+
+    async def parse_chat_updates(self, obj) -> list[InitialChatEvent | ChatsListChangedEvent |
+                                                    LastChatMessageChangedEvent | NewMessageEvent]:
+        """
+        Парсит события, связанные с чатами (см. :meth:`FunPayAPI.updater.runner.Runner.parse_chat_updates`).
+        """
+        events, lcmc_events_with_new_mess = self._parse_chat_bookmarks(obj)
+        while (pack := self._next_chats_pack(lcmc_events_with_new_mess)) is not None:
+            chats_pack, chats_data, bv_pack = pack
+            new_msg_events = await self.generate_new_message_events(chats_data, bv_pack)
+            self._add_new_message_events(chats_pack, new_msg_events, events)
+        return events
+
+    async def generate_new_message_events(self, chats_data: dict[int, str],
+                                          interlocutor_ids: list[int] | None = None) -> \
+            dict[int, list[NewMessageEvent]]:
+        """
+        Получает историю переданных чатов и генерирует события новых сообщений
+        (см. :meth:`FunPayAPI.updater.runner.Runner.generate_new_message_events`).
+        """
+        attempts = 3
+        while attempts:
+            attempts -= 1
+            try:
+                chats = await self.account.get_chats_histories(chats_data, interlocutor_ids,
+                                                               self._known_last_message_ids(chats_data))
+                break
+            except exceptions.RequestFailedError as e:
+                logger.error(e)
+            except:
+                logger.error(f"Не удалось получить истории чатов {list(chats_data.keys())}.")
+                logger.debug("TRACEBACK", exc_info=True)
+            await asyncio.sleep(1)
+        else:
+            logger.error(f"Не удалось получить истории чатов {list(chats_data.keys())}: превышено кол-во попыток.")
+            return {}
+        return self._build_new_message_events(chats)
+
+    async def parse_order_updates(self, obj) -> list[InitialOrderEvent | OrdersListChangedEvent | NewOrderEvent |
+                                                     OrderStatusChangedEvent]:
+        """
+        Парсит события, связанные с продажами (см. :meth:`FunPayAPI.updater.runner.Runner.parse_order_updates`).
+        """
+        events = self._parse_orders_counters(obj)
+        if not self.make_order_requests:
+            return events
+
+        attempts = 3
+        while attempts:
+            attempts -= 1
+            try:
+                orders_list = await self._fetch_sales()
+                break
+            except exceptions.RequestFailedError as e:
+                logger.error(e)
+            except:
+                logger.error("Не удалось обновить список заказов.")
+                logger.debug("TRACEBACK", exc_info=True)
+            await asyncio.sleep(1)
+        else:
+            logger.error("Не удалось обновить список продаж: превышено кол-во попыток.")
+            return events
+        self._add_order_events(orders_list, events)
+        return events
+
+    async def _fetch_sales(self) -> list[types.OrderShortcut]:
+        """
+        Получает новые заказы и заказы с изменившимся статусом (см. :meth:`FunPayAPI.updater.runner.Runner._fetch_sales`).
+        """
+        next_order_id, orders, *_ = await self.account.get_sales(known_statuses=self.order_statuses)
+        pages = 1
+        while self._need_next_sales_page(next_order_id, pages):
+            next_order_id, page, *_ = await self.account.get_sales(start_from=next_order_id,
+                                                                   known_statuses=self.order_statuses)
+            orders.extend(page)
+            pages += 1
+        return orders
+
+    async def listen(self, requests_delay: int | float = 6.0,
+                     ignore_exceptions: bool = True, min_delay: int | float = 1.0,
+                     max_delay: int | float = 120.0, burst_polls: int = 5,
+                     budget: RequestBudget | None = request_budget) -> AsyncGenerator[InitialChatEvent | ChatsListChangedEvent |
+                                                                       LastChatMessageChangedEvent | NewMessageEvent |
+                                                                       InitialOrderEvent | OrdersListChangedEvent |
+                                                                       NewOrderEvent | OrderStatusChangedEvent, None]:
+        """
+        Бесконечно отправляет запросы для получения новых событий. Между запросами уступает event loop другим задачам.
+        Интервал между запросами адаптивный, параметры аналогичны :meth:`FunPayAPI.updater.runner.Runner.listen`.
+
+        :return: асинхронный генератор событий FunPay.
+        :rtype: :obj:`AsyncGenerator`
+        """
+        self.poll_scheduler = PollScheduler(requests_delay, min_delay, max_delay, burst_polls, budget)
+        events = []
+        while True:
+            try:
+                self._set_pending_interlocutors(events)
+                updates = await self.get_updates()
+                events.extend(await self.parse_updates(updates))
+                ready_events, events = self._split_ready_events(events)
+                self.poll_scheduler.on_success(ready_events, self.account.last_429_err_time)
+                for event in ready_events:
+                    yield event
+                self.save_state()
+                self.buyers_viewing = {}
+            except Exception as e:
+                self.poll_scheduler.on_error(e, self.account.last_429_err_time)
+                if not ignore_exceptions:
+                    raise e
+                else:
+                    logger.error("Произошла ошибка при получении событий. "
+                                 "(ничего страшного, если это сообщение появляется нечасто).")
+                    logger.debug("TRACEBACK", exc_info=True)
+            await asyncio.sleep(self.poll_scheduler.delay())
@@ -0,0 +1,163 @@
+"""
+Адаптивный интервал опроса runner/ для :class:`FunPayAPI.updater.runner.Runner`.
+"""
+from __future__ import annotations
+
+import threading
+import time
+
+from ..common import exceptions
+from ..common.enums import EventTypes
+
+ACTIVITY_EVENTS = (EventTypes.CHATS_LIST_CHANGED, EventTypes.LAST_CHAT_MESSAGE_CHANGED, EventTypes.NEW_MESSAGE,
+                   EventTypes.ORDERS_LIST_CHANGED, EventTypes.NEW_ORDER, EventTypes.ORDER_STATUS_CHANGED)
+"""События, после которых Runner переходит в режим частого опроса."""
+
+
+class RequestBudget:
+    """
+    Общий для всех Runner'ов процесса лимит запросов runner/ (token bucket).
+
+    :param rate: кол-во запросов в секунду.
+    :type rate: :obj:`float`
+
+    :param burst: максимальное кол-во запросов подряд без ожидания.
+    :type burst: :obj:`int`
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 3):
+        self.rate: float = rate
+        """Кол-во запросов в секунду."""
+        self.burst: int = burst
+        """Максимальное кол-во запросов подряд без ожидания."""
+        self.__tokens: float = float(burst)
+        self.__updated: float = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Резервирует один запрос.
+
+        :return: сколько секунд нужно подождать перед запросом.
+        :rtype: :obj:`float`
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(float(self.burst), self.__tokens + (now - self.__updated) * self.rate)
+            self.__updated = now
+            self.__tokens -= 1
+            return 0.0 if self.__tokens >= 0 else -self.__tokens / self.rate
+
+
+request_budget = RequestBudget()
+"""Лимит запросов runner/ по умолчанию (общий для всех аккаунтов процесса)."""
+
+
+class PollScheduler:
+    """
+    Вычисляет задержку перед следующим запросом runner/.
+
+    После заказа или активности в чатах следующие burst_polls запросов выполняются с интервалом min_delay.
+    Без активности интервал растет в 2 раза за запрос до idle_delay. При ошибке 429 / 5xx (и повторных ошибках
+    запроса) интервал растет в 2 раза за ошибку до max_delay и не опускается ниже idle_delay, пока запросы
+    не станут успешными. Ошибка 429 на любом другом запросе аккаунта (Account.last_429_err_time) тоже
+    увеличивает интервал.
+
+    :param idle_delay: интервал опроса без активности (в секундах).
+    :type idle_delay: :obj:`float`
+
+    :param min_delay: интервал опроса после активности (в секундах).
+    :type min_delay: :obj:`float`
+
+    :param max_delay: максимальный интервал при ошибках (в секундах).
+    :type max_delay: :obj:`float`
+
+    :param burst_polls: сколько запросов подряд выполнять с интервалом min_delay после активности.
+    :type burst_polls: :obj:`int`
+
+    :param budget: общий лимит запросов (`None` - без лимита).
+    :type budget: :class:`FunPayAPI.updater.poll_scheduler.RequestBudget` or :obj:`None`
+    """
+
+    def __init__(self, idle_delay: float = 6.0, min_delay: float = 1.0, max_delay: float = 120.0,
+                 burst_polls: int = 5, budget: RequestBudget | None = request_budget):
+        self.idle_delay: float = idle_delay
+        self.min_delay: float = min(min_delay, idle_delay)
+        self.max_delay: float = max(max_delay, idle_delay)
+        self.burst_polls: int = burst_polls
+        self.budget: RequestBudget | None = budget
+
+        self.current_delay: float = idle_delay
+        """Текущий интервал опроса (в секундах)."""
+        self.errors_in_row: int = 0
+        """Кол-во неудачных запросов подряд."""
+        self.__burst_left: int = 0
+        self.__last_429_time: float = 0
+
+    def __new_429(self, last_429_time: float) -> bool:
+        is_new = last_429_time > self.__last_429_time
+        self.__last_429_time = max(self.__last_429_time, last_429_time)
+        return is_new
+
+    def __back_off(self):
+        self.__burst_left = 0
+        self.current_delay = min(self.max_delay, max(self.current_delay, self.idle_delay) * 2)
+
+    def on_success(self, events: list, last_429_time: float = 0) -> float:
+        """
+        Учитывает успешный запрос.
+
+        :param events: события, полученные в ответе.
+        :type events: :obj:`list`
+
+        :param last_429_time: время последней ошибки 429 аккаунта (Account.last_429_err_time).
+        :type last_429_time: :obj:`float`, опционально
+
+        :return: задержка перед следующим запросом.
+        :rtype: :obj:`float`
+        """
+        self.errors_in_row = 0
+        if self.__new_429(last_429_time):
+            self.__back_off()
+            return self.current_delay
+        if any(event.type in ACTIVITY_EVENTS for event in events):
+            self.__burst_left = self.burst_polls
+        if self.__burst_left > 0:
+            self.__burst_left -= 1
+            self.current_delay = self.min_delay
+        else:
+            self.current_delay = min(self.idle_delay, max(self.current_delay, self.min_delay) * 2)
+        return self.current_delay
+
+    def on_error(self, error: Exception, last_429_time: float = 0) -> float:
+        """
+        Учитывает неудачный запрос.
+
+        :param error: исключение запроса.
+        :type error: :obj:`Exception`
+
+        :param last_429_time: время последней ошибки 429 аккаунта (Account.last_429_err_time).
+        :type last_429_time: :obj:`float`, опционально
+
+        :return: задержка перед следующим запросом.
+        :rtype: :obj:`float`
+        """
+        self.errors_in_row += 1
+        self.__burst_left = 0
+        status_code = error.status_code if isinstance(error, exceptions.RequestFailedError) else None
+        new_429 = self.__new_429(last_429_time)
+        if new_429 or status_code == 429 or (status_code is not None and status_code >= 500) \
+                or self.errors_in_row > 1:
+            self.__back_off()
+        else:
+            # одиночная ошибка (обрыв соединения, ошибка парсинга) - повторяем с обычным интервалом
+            self.current_delay = max(self.current_delay, self.idle_delay)
+        return self.current_delay
+
+    def delay(self) -> float:
+        """
+        :return: задержка перед следующим запросом с учетом общего лимита запросов.
+        :rtype: :obj:`float`
+        """
+        wait = self.budget.reserve() if self.budget else 0.0
+        return max(self.current_delay, wait)
@@ -8,13 +8,22 @@ if TYPE_CHECKING:
 
 import json
 import logging
-from bs4 import BeautifulSoup
+import os
+import threading
 
-from ..common import exceptions
+from ..common import exceptions, fast_html
 from .events import *
+from .poll_scheduler import PollScheduler, RequestBudget, request_budget
 
 logger = logging.getLogger("FunPayAPI.runner")
 
+MAX_SAVED_ORDERS = 1000
+"""Сколько последних заказов хранит Runner (в памяти и в файле состояния)."""
+MAX_SALES_PAGES = 5
+"""Сколько страниц продаж можно загрузить за одно обновление, пока не встретится уже известный заказ."""
+STATE_VERSION = 1
+"""Версия формата файла состояния Runner'а."""
+
 
 class Runner:
     """
@@ -39,11 +48,18 @@ class Runner:
         Из событий, связанных с заказами, будет возвращаться только
         :class:`FunPayAPI.updater.events.OrdersListChangedEvent`.
     :type disabled_order_requests: :obj:`bool`, опционально
+
+    :param state_path: путь к JSON-файлу, в котором сохраняется состояние Runner'а (см. :meth:`save_state`).\n
+        Если файл есть, после перезапуска первый запрос обрабатывается как обычный: не генерируются
+        :class:`FunPayAPI.updater.events.InitialChatEvent` и :class:`FunPayAPI.updater.events.InitialOrderEvent`,
+        а сообщения и заказы, появившиеся за время простоя, приходят как новые.
+    :type state_path: :obj:`str` or :obj:`None`, опционально
     """
 
     def __init__(self, account: Account, disable_message_requests: bool = False,
                  disabled_order_requests: bool = False,
-                 disabled_buyer_viewing_requests: bool = True):
+                 disabled_buyer_viewing_requests: bool = True,
+                 state_path: str | None = None):
         # todo добавить события и исключение событий о новых покупках (не продажах!)
         if not account.is_initiated:
             raise exceptions.AccountNotInitiatedError()
@@ -64,6 +80,14 @@ class Runner:
         self.saved_orders: dict[str, types.OrderShortcut] = {}
         """Сохраненные состояния заказов ({ID заказа: экземпляр types.OrderShortcut})."""
 
+        self.order_statuses: dict[str, types.OrderStatuses] = {}
+        """Статусы известных заказов ({ID заказа: статус}) в порядке получения. Заказы с неизменившимся статусом
+        не парсятся повторно."""
+
+        self.state_path: str | None = state_path
+        """Путь к файлу состояния Runner'а."""
+        self.__saved_state: str | None = None
+
         self.runner_last_messages: dict[int, list[int, int, str | None]] = {}
         """ID последний сообщений {ID чата: [ID последего сообщения чата, ID последнего прочитанного сообщения чата, 
         текст последнего сообщения или None, если это изображение]}."""
@@ -82,11 +106,147 @@ class Runner:
         self.__interlocutor_ids: set = set()
         """Айди собеседников, у которых будет получено поле "Покупатель смотрит\""""
 
+        self.poll_scheduler: PollScheduler | None = None
+        """Планировщик интервала опроса (создается в :meth:`listen`)."""
+
         self.account: Account = account
         """Экземпляр аккаунта, к которому привязан Runner."""
         self.account.runner = self
 
+        self.ack_events: bool = False
+        """Сохранять ли события в состоянии только после подтверждения обработки (см. :meth:`ack`)."""
+        self.__unacked: dict[int, tuple] = {}
+        """Выданные, но не подтвержденные события ({id(событие): (событие, чат или заказ, откат)})."""
+        self.__unacked_lock = threading.Lock()
+        self.__previous_order_statuses: dict[str, types.OrderStatuses | None] = {}
+        """Статусы заказов до текущего запроса (для заказов, по которым созданы события)."""
+
         self.__msg_time_re = re.compile(r"\d{2}:\d{2}")
+        self._load_state()
+
+    def _load_state(self):
+        """
+        Восстанавливает состояние Runner'а из :attr:`state_path` (см. :meth:`save_state`).
+        """
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("version") != STATE_VERSION:
+                logger.warning(f"Неподдерживаемая версия состояния Runner'а в {self.state_path}, файл пропущен.")
+                return
+            self.order_statuses = {order_id: types.OrderStatuses[status]
+                                   for order_id, status in state["orders"].items()}
+            self.runner_last_messages = {int(chat_id): value
+                                         for chat_id, value in state["runner_last_messages"].items()}
+            self.last_messages_ids = {int(chat_id): value for chat_id, value in state["last_messages_ids"].items()}
+            self.by_bot_ids = {int(chat_id): value for chat_id, value in state["by_bot_ids"].items()}
+            self.__last_msg_event_tag = state["msg_tag"] or self.__last_msg_event_tag
+            self.__last_order_event_tag = state["order_tag"] or self.__last_order_event_tag
+        except:
+            logger.error(f"Не удалось загрузить состояние Runner'а из {self.state_path}.")
+            logger.debug("TRACEBACK", exc_info=True)
+            self.order_statuses, self.runner_last_messages, self.last_messages_ids, self.by_bot_ids = {}, {}, {}, {}
+            return
+        if self.runner_last_messages:
+            # чаты уже известны: первый запрос обрабатывается как обычный, без InitialChatEvent
+            self.__first_request = False
+        logger.info(f"Состояние Runner'а загружено из {self.state_path}: {len(self.runner_last_messages)} чатов, "
+                    f"{len(self.order_statuses)} заказов.")
+
+    def save_state(self):
+        """
+        Атомарно сохраняет состояние Runner'а (статусы заказов, последние сообщения чатов, ID сообщений бота
+        и теги событий) в :attr:`state_path`. Файл перезаписывается, только если состояние изменилось.
+
+        Если включен :attr:`ack_events`, события, обработка которых еще не подтверждена (см. :meth:`ack`),
+        в файл не попадают: для их чатов сохраняется ID сообщения перед первым неподтвержденным,
+        а их заказы сохраняются с прежним статусом (новые заказы - не сохраняются).
+        После перезапуска такие события будут выданы повторно.
+        """
+        if not self.state_path:
+            return
+        orders, runner_last_messages, last_messages_ids = self._acked_state()
+        state = json.dumps({
+            "version": STATE_VERSION,
+            "orders": {order_id: status.name for order_id, status in orders.items()},
+            "runner_last_messages": runner_last_messages,
+            "last_messages_ids": last_messages_ids,
+            "by_bot_ids": self.by_bot_ids,
+            "msg_tag": self.__last_msg_event_tag,
+            "order_tag": self.__last_order_event_tag,
+        }, ensure_ascii=False, separators=(",", ":"))
+        if state == self.__saved_state:
+            return
+        tmp_path = f"{self.state_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(state)
+            os.replace(tmp_path, self.state_path)
+            self.__saved_state = state
+        except:
+            logger.error(f"Не удалось сохранить состояние Runner'а в {self.state_path}.")
+            logger.debug("TRACEBACK", exc_info=True)
+
+    def _acked_state(self) -> tuple[dict, dict, dict]:
+        """
+        Возвращает статусы заказов, последние сообщения чатов и ID последних сообщений чатов без изменений,
+        внесенных неподтвержденными событиями.
+
+        :return: (статусы заказов, последние сообщения чатов, ID последних сообщений чатов).
+        :rtype: :obj:`tuple` (:obj:`dict`, :obj:`dict`, :obj:`dict`)
+        """
+        with self.__unacked_lock:
+            unacked = list(self.__unacked.values())
+        if not unacked:
+            return self.order_statuses, self.runner_last_messages, self.last_messages_ids
+        orders = dict(self.order_statuses)
+        runner_last_messages = dict(self.runner_last_messages)
+        last_messages_ids = dict(self.last_messages_ids)
+        for event, target, previous in unacked:
+            if isinstance(event, NewMessageEvent):
+                first_id = min(last_messages_ids.get(target, previous), previous)
+                last_messages_ids[target] = first_id
+                # чат будет считаться изменившимся, и его история будет запрошена начиная с first_id
+                runner_last_messages[target] = [first_id, first_id, None]
+            elif previous is None:
+                orders.pop(target, None)
+            else:
+                orders[target] = previous
+        return orders, runner_last_messages, last_messages_ids
+
+    def _track_events(self, events: list):
+        """
+        Запоминает события новых сообщений и заказов как неподтвержденные (если включен :attr:`ack_events`).
+        """
+        previous_statuses, self.__previous_order_statuses = self.__previous_order_statuses, {}
+        if not self.ack_events:
+            return
+        with self.__unacked_lock:
+            for event in events:
+                if isinstance(event, NewMessageEvent):
+                    self.__unacked[id(event)] = (event, event.message.chat_id, event.message.id - 1)
+                elif isinstance(event, (NewOrderEvent, OrderStatusChangedEvent)):
+                    self.__unacked[id(event)] = (event, event.order.id, previous_statuses.get(event.order.id))
+
+    def ack(self, event):
+        """
+        Подтверждает, что событие обработано: оно попадет в состояние при следующем сохранении
+        (см. :attr:`ack_events`). Может вызываться из любого потока.
+
+        :param event: событие, выданное :meth:`listen`.
+        """
+        with self.__unacked_lock:
+            self.__unacked.pop(id(event), None)
+
+    @property
+    def unacked_count(self) -> int:
+        """
+        Кол-во выданных событий, обработка которых еще не подтверждена.
+        """
+        with self.__unacked_lock:
+            return len(self.__unacked)
 
     def get_updates(self) -> dict:
         """
@@ -95,6 +255,20 @@ class Runner:
         :return: ответ FunPay.
         :rtype: :obj:`dict`
         """
+        headers, payload = self._updates_payload()
+        response = self.account.method("post", "runner/", headers, payload, raise_not_200=True)
+        json_response = response.json()
+        logger.debug(f"Получены данные о событиях: {json_response}")
+        return json_response
+
+    def _updates_payload(self) -> tuple[dict, dict]:
+        """
+        Формирует заголовки и полезную нагрузку запроса списка событий
+        (см. :meth:`FunPayAPI.updater.runner.Runner.get_updates`).
+
+        :return: (заголовки, полезная нагрузка).
+        :rtype: :obj:`tuple` (:obj:`dict`, :obj:`dict`)
+        """
         orders = {
             "type": "orders_counters",
             "id": self.account.id,
@@ -122,10 +296,7 @@ class Runner:
             "x-requested-with": "XMLHttpRequest"
         }
 
-        response = self.account.method("post", "runner/", headers, payload, raise_not_200=True)
-        json_response = response.json()
-        logger.debug(f"Получены данные о событиях: {json_response}")
-        return json_response
+        return headers, payload
 
     def parse_updates(self, updates: dict) -> list[InitialChatEvent | ChatsListChangedEvent |
                                                    LastChatMessageChangedEvent | NewMessageEvent | InitialOrderEvent |
@@ -146,18 +317,37 @@ class Runner:
             :class:`FunPayAPI.updater.events.OrderStatusChangedEvent`
         """
         events = []
-        # сортируем в т.ч. для того, корректно реагировало на сообщения покупателей сразу после оплаты (плагины автовыдачи)
-        for obj in sorted(updates["objects"], key=lambda x: x.get("type") == "orders_counters", reverse=True):
+        for obj in self._sorted_updates(updates):
             if obj.get("type") == "chat_bookmarks":
                 events.extend(self.parse_chat_updates(obj))
             elif obj.get("type") == "orders_counters":
                 events.extend(self.parse_order_updates(obj))
             elif obj.get("type") == "c-p-u":
-                bv = self.account.parse_buyer_viewing(obj)
-                self.buyers_viewing[bv.buyer_id] = bv
+                self._save_buyer_viewing(obj)
+        self._end_first_request()
+        return events
+
+    @staticmethod
+    def _sorted_updates(updates: dict) -> list[dict]:
+        """
+        Сортирует объекты ответа FunPay: события заказов обрабатываются первыми.
+        """
+        # сортируем в т.ч. для того, корректно реагировало на сообщения покупателей сразу после оплаты (плагины автовыдачи)
+        return sorted(updates["objects"], key=lambda x: x.get("type") == "orders_counters", reverse=True)
+
+    def _save_buyer_viewing(self, obj: dict):
+        """
+        Сохраняет поле "Покупатель смотрит" из объекта ответа FunPay, где "type" == "c-p-u".
+        """
+        bv = self.account.parse_buyer_viewing(obj)
+        self.buyers_viewing[bv.buyer_id] = bv
+
+    def _end_first_request(self):
+        """
+        Отмечает, что первый запрос событий обработан.
+        """
         if self.__first_request:
             self.__first_request = False
-        return events
 
     def parse_chat_updates(self, obj) -> list[InitialChatEvent | ChatsListChangedEvent | LastChatMessageChangedEvent |
                                               NewMessageEvent]:
@@ -174,22 +364,35 @@ class Runner:
             :class:`FunPayAPI.updater.events.LastChatMessageChangedEvent`,
             :class:`FunPayAPI.updater.events.NewMessageEvent`
         """
+        events, lcmc_events_with_new_mess = self._parse_chat_bookmarks(obj)
+        while (pack := self._next_chats_pack(lcmc_events_with_new_mess)) is not None:
+            chats_pack, chats_data, bv_pack = pack
+            new_msg_events = self.generate_new_message_events(chats_data, bv_pack)
+            self._add_new_message_events(chats_pack, new_msg_events, events)
+        return events
+
+    def _parse_chat_bookmarks(self, obj) -> tuple[list[InitialChatEvent | ChatsListChangedEvent |
+                                                       LastChatMessageChangedEvent],
+                                                  list[LastChatMessageChangedEvent]]:
+        """
+        Парсит список чатов из объекта "chat_bookmarks" без дополнительных запросов.
+
+        :return: (список событий, события изменения чатов, для которых нужно получить новые сообщения).
+        :rtype: :obj:`tuple` (:obj:`list`, :obj:`list` of :class:`FunPayAPI.updater.events.LastChatMessageChangedEvent`)
+        """
         events, lcmc_events = [], []
         self.__last_msg_event_tag = obj.get("tag")
-        parser = BeautifulSoup(obj["data"]["html"], "lxml")
-        chats = parser.find_all("a", {"class": "contact-item"})
+        chats = fast_html.parse_chat_bookmarks_html(obj["data"]["html"])
 
         # Получаем все изменившиеся чаты
         for chat in chats:
-            chat_id = int(chat["data-id"])
+            chat_id = chat["id"]
             # Если чат удален админами - скип.
-            if not (last_msg_text := chat.find("div", {"class": "contact-item-message"})):
+            if (last_msg_text := chat["message"]) is None:
                 continue
 
-            last_msg_text = last_msg_text.text
-
-            node_msg_id = int(chat.get('data-node-msg'))
-            user_msg_id = int(chat.get('data-user-msg'))
+            node_msg_id = int(chat["node_msg"])
+            user_msg_id = int(chat["user_msg"])
             by_bot = False
             by_vertex = False
             if last_msg_text.startswith(self.account.bot_character):
@@ -207,11 +410,11 @@ class Runner:
                 # значит сообщение отправлено ботом и оставлено непрочитанным - просто обновляем инфу
                 self.runner_last_messages[chat_id] = [node_msg_id, user_msg_id, last_msg_text_or_none]
                 continue
-            unread = True if "unread" in chat.get("class") else False
+            unread = True if "unread" in chat["classes"] else False
 
-            chat_with = chat.find("div", {"class": "media-user-name"}).text
+            chat_with = chat["user_name"]
             chat_obj = types.ChatShortcut(chat_id, chat_with, last_msg_text, node_msg_id,
-                                          user_msg_id, unread, str(chat))
+                                          user_msg_id, unread, chat["html"])
             if last_msg_text_or_none is not None:
                 chat_obj.last_by_bot = by_bot
                 chat_obj.last_by_vertex = by_vertex
@@ -232,7 +435,7 @@ class Runner:
 
         if not self.make_msg_requests:
             events.extend(lcmc_events)
-            return events
+            return events, []
 
         lcmc_events_without_new_mess = []
         lcmc_events_with_new_mess = []
@@ -250,32 +453,48 @@ class Runner:
                                                                      for i in lcmc_events_with_new_mess if
                                                                      i.chat.id in self.account.interlocutor_ids])
 
-        while lcmc_events_with_new_mess or len(self.__interlocutor_ids) >= self.runner_len - 2:
-            chats_pack = lcmc_events_with_new_mess[:self.runner_len]
-            del lcmc_events_with_new_mess[:self.runner_len]
-            bv_pack = []
-            while self.make_buyer_viewing_requests and \
-                    len(chats_pack) + len(bv_pack) < self.runner_len and self.__interlocutor_ids:
-                interlocutor_id = self.__interlocutor_ids.pop()
-                if interlocutor_id not in self.buyers_viewing:
-                    bv_pack.append(interlocutor_id)
-
-            chats_data = {i.chat.id: i.chat.name for i in chats_pack}
-            new_msg_events = self.generate_new_message_events(chats_data, bv_pack)
+        return events, lcmc_events_with_new_mess
 
-            if self.make_buyer_viewing_requests:
-                # Если раньше айди не знали, то добавляем
-                for chat_id, msgs in new_msg_events.items():
-                    if chat_id not in self.account.interlocutor_ids and msgs and msgs[0].message.interlocutor_id:
-                        self.account.interlocutor_ids[chat_id] = msgs[0].message.interlocutor_id
-                        self.__interlocutor_ids.add(msgs[0].message.interlocutor_id)
-
-            # [LastChatMessageChanged, NewMSG, NewMSG ..., LastChatMessageChanged, NewMSG, NewMSG ...]
-            for i in chats_pack:
-                events.append(i)
-                if new_msg_events.get(i.chat.id):
-                    events.extend(new_msg_events[i.chat.id])
-        return events
+    def _next_chats_pack(self, lcmc_events_with_new_mess: list[LastChatMessageChangedEvent]) -> \
+            tuple[list[LastChatMessageChangedEvent], dict[int, str], list[int]] | None:
+        """
+        Формирует следующую пачку чатов (и собеседников для поля "Покупатель смотрит") для запроса историй.
+        Изымает чаты пачки из переданного списка.
+
+        :return: (события пачки, {ID чата: никнейм собеседника}, ID собеседников) или None, если запрашивать нечего.
+        :rtype: :obj:`tuple` or :obj:`None`
+        """
+        if not lcmc_events_with_new_mess and len(self.__interlocutor_ids) < self.runner_len - 2:
+            return None
+        chats_pack = lcmc_events_with_new_mess[:self.runner_len]
+        del lcmc_events_with_new_mess[:self.runner_len]
+        bv_pack = []
+        while self.make_buyer_viewing_requests and \
+                len(chats_pack) + len(bv_pack) < self.runner_len and self.__interlocutor_ids:
+            interlocutor_id = self.__interlocutor_ids.pop()
+            if interlocutor_id not in self.buyers_viewing:
+                bv_pack.append(interlocutor_id)
+
+        chats_data = {i.chat.id: i.chat.name for i in chats_pack}
+        return chats_pack, chats_data, bv_pack
+
+    def _add_new_message_events(self, chats_pack: list[LastChatMessageChangedEvent],
+                                new_msg_events: dict[int, list[NewMessageEvent]], events: list):
+        """
+        Добавляет события пачки чатов и их новых сообщений в список событий.
+        """
+        if self.make_buyer_viewing_requests:
+            # Если раньше айди не знали, то добавляем
+            for chat_id, msgs in new_msg_events.items():
+                if chat_id not in self.account.interlocutor_ids and msgs and msgs[0].message.interlocutor_id:
+                    self.account.interlocutor_ids[chat_id] = msgs[0].message.interlocutor_id
+                    self.__interlocutor_ids.add(msgs[0].message.interlocutor_id)
+
+        # [LastChatMessageChanged, NewMSG, NewMSG ..., LastChatMessageChanged, NewMSG, NewMSG ...]
+        for i in chats_pack:
+            events.append(i)
+            if new_msg_events.get(i.chat.id):
+                events.extend(new_msg_events[i.chat.id])
 
     def generate_new_message_events(self, chats_data: dict[int, str],
                                     interlocutor_ids: list[int] | None = None) -> dict[int, list[NewMessageEvent]]:
@@ -294,7 +513,8 @@ class Runner:
         while attempts:
             attempts -= 1
             try:
-                chats = self.account.get_chats_histories(chats_data, interlocutor_ids)
+                chats = self.account.get_chats_histories(chats_data, interlocutor_ids,
+                                                         self._known_last_message_ids(chats_data))
                 break
             except exceptions.RequestFailedError as e:
                 logger.error(e)
@@ -305,7 +525,28 @@ class Runner:
         else:
             logger.error(f"Не удалось получить истории чатов {list(chats_data.keys())}: превышено кол-во попыток.")
             return {}
+        return self._build_new_message_events(chats)
 
+    def _known_last_message_ids(self, chats_data: dict[int, str]) -> dict[int, int]:
+        """
+        Возвращает ID последних уже обработанных сообщений переданных чатов, чтобы запрашивать у FunPay
+        только новые сообщения.
+
+        :return: {ID чата: ID последнего сообщения} для чатов, история которых уже запрашивалась.
+        :rtype: :obj:`dict` {:obj:`int`: :obj:`int`}
+        """
+        return {cid: self.last_messages_ids[cid] for cid in chats_data if self.last_messages_ids.get(cid)}
+
+    def _build_new_message_events(self, chats: dict[int, list[types.Message]]) -> dict[int, list[NewMessageEvent]]:
+        """
+        Генерирует события новых сообщений из полученных историй чатов.
+
+        :param chats: результат выполнения :meth:`FunPayAPI.account.Account.get_chats_histories`.
+        :type chats: :obj:`dict` {:obj:`int`: :obj:`list` of :class:`FunPayAPI.types.Message`}
+
+        :return: словарь с событиями новых сообщений в формате {ID чата: [список событий]}
+        :rtype: :obj:`dict` {:obj:`int`: :obj:`list` of :class:`FunPayAPI.updater.events.NewMessageEvent`}
+        """
         result = {}
 
         for cid in chats:
@@ -336,6 +577,10 @@ class Runner:
             self.by_bot_ids[cid] = [i for i in self.by_bot_ids[cid] if i > self.last_messages_ids[cid]]  # чистим память
 
             for msg in messages:
+                if msg.type not in (None, MessageTypes.NON_SYSTEM):
+                    # системное сообщение о заказе (отзыв, подтверждение, возврат) - данные заказа изменились
+                    for order_id in utils.RegularExpressions().ORDER_ID.findall(msg.text or ""):
+                        self.account.invalidate_order(order_id[1:])
                 event = NewMessageEvent(self.__last_msg_event_tag, msg, stack)
                 stack.add_events([event])
                 result[cid].append(event)
@@ -356,11 +601,7 @@ class Runner:
             :class:`FunPayAPI.updater.events.NewOrderEvent`,
             :class:`FunPayAPI.updater.events.OrderStatusChangedEvent`
         """
-        events = []
-        self.__last_order_event_tag = obj.get("tag")
-        if not self.__first_request:
-            events.append(OrdersListChangedEvent(self.__last_order_event_tag,
-                                                 obj["data"]["buyer"], obj["data"]["seller"]))
+        events = self._parse_orders_counters(obj)
         if not self.make_order_requests:
             return events
 
@@ -368,7 +609,7 @@ class Runner:
         while attempts:
             attempts -= 1
             try:
-                orders_list = self.account.get_sales()  # todo добавить возможность реакции на подтверждение очень старых заказов
+                orders_list = self._fetch_sales()
                 break
             except exceptions.RequestFailedError as e:
                 logger.error(e)
@@ -379,22 +620,79 @@ class Runner:
         else:
             logger.error("Не удалось обновить список продаж: превышено кол-во попыток.")
             return events
+        self._add_order_events(orders_list, events)
+        return events
+
+    def _fetch_sales(self) -> list[types.OrderShortcut]:
+        """
+        Получает новые заказы и заказы с изменившимся статусом.
+
+        Заказы с известным статусом не парсятся. Следующие страницы продаж загружаются, только пока на странице
+        нет ни одного известного заказа (не более :data:`MAX_SALES_PAGES` страниц).
+
+        :return: список новых / изменившихся заказов.
+        :rtype: :obj:`list` of :class:`FunPayAPI.types.OrderShortcut`
+        """
+        next_order_id, orders, *_ = self.account.get_sales(known_statuses=self.order_statuses)
+        pages = 1
+        while self._need_next_sales_page(next_order_id, pages):
+            next_order_id, page, *_ = self.account.get_sales(start_from=next_order_id,
+                                                             known_statuses=self.order_statuses)
+            orders.extend(page)
+            pages += 1
+        return orders
+
+    def _need_next_sales_page(self, next_order_id: str | None, pages: int) -> bool:
+        """
+        Нужно ли загружать следующую страницу продаж (см. :meth:`_fetch_sales`).
+        """
+        if not next_order_id or not self.order_statuses or pages >= MAX_SALES_PAGES:
+            return False
+        return not any(order_id in self.order_statuses for order_id in self.account.last_sales_ids)
 
-        saved_orders = {}
-        for order in orders_list[1]:
-            saved_orders[order.id] = order
-            if order.id not in self.saved_orders:
-                if self.__first_request:
+    def _parse_orders_counters(self, obj) -> list[OrdersListChangedEvent]:
+        """
+        Парсит объект "orders_counters" без дополнительных запросов.
+
+        :return: список событий (пустой при первом запросе).
+        :rtype: :obj:`list` of :class:`FunPayAPI.updater.events.OrdersListChangedEvent`
+        """
+        events = []
+        self.__last_order_event_tag = obj.get("tag")
+        if not self.__first_request:
+            events.append(OrdersListChangedEvent(self.__last_order_event_tag,
+                                                 obj["data"]["buyer"], obj["data"]["seller"]))
+        return events
+
+    def _add_order_events(self, orders: list[types.OrderShortcut], events: list):
+        """
+        Сравнивает полученные заказы с сохраненными статусами, добавляет события новых / изменившихся заказов
+        в список событий и обновляет сохраненные заказы.
+        """
+        initial = self.__first_request and not self.order_statuses
+        for order in orders:
+            if not initial and (order.id not in self.order_statuses
+                                or order.status != self.order_statuses[order.id]):
+                self.__previous_order_statuses.setdefault(order.id, self.order_statuses.get(order.id))
+            if order.id not in self.order_statuses:
+                if initial:
                     events.append(InitialOrderEvent(self.__last_order_event_tag, order))
                 else:
                     events.append(NewOrderEvent(self.__last_order_event_tag, order))
                     if order.status == types.OrderStatuses.CLOSED:
                         events.append(OrderStatusChangedEvent(self.__last_order_event_tag, order))
 
-            elif order.status != self.saved_orders[order.id].status:
+            elif order.status != self.order_statuses[order.id]:
                 events.append(OrderStatusChangedEvent(self.__last_order_event_tag, order))
-        self.saved_orders = saved_orders
-        return events
+                self.account.invalidate_order(order.id)
+
+        # продажи идут от новых к старым, а в словарях старые заказы должны быть первыми
+        for order in reversed(orders):
+            self.saved_orders[order.id] = order
+            self.order_statuses[order.id] = order.status
+        for order_id in list(self.order_statuses)[:-MAX_SAVED_ORDERS]:
+            del self.order_statuses[order_id]
+            self.saved_orders.pop(order_id, None)
 
     def update_last_message(self, chat_id: int, message_id: int, message_text: str | None):
         """
@@ -427,19 +725,43 @@ class Runner:
             self.by_bot_ids[chat_id].append(message_id)
 
     def listen(self, requests_delay: int | float = 6.0,
-               ignore_exceptions: bool = True) -> Generator[InitialChatEvent | ChatsListChangedEvent |
+               ignore_exceptions: bool = True, min_delay: int | float = 1.0,
+               max_delay: int | float = 120.0, burst_polls: int = 5,
+               budget: RequestBudget | None = request_budget,
+               ack_events: bool = False) -> Generator[InitialChatEvent | ChatsListChangedEvent |
                                                             LastChatMessageChangedEvent | NewMessageEvent |
                                                             InitialOrderEvent | OrdersListChangedEvent | NewOrderEvent |
                                                             OrderStatusChangedEvent]:
         """
         Бесконечно отправляет запросы для получения новых событий.
-
-        :param requests_delay: задержка между запросами (в секундах).
+        Интервал между запросами адаптивный (см. :class:`FunPayAPI.updater.poll_scheduler.PollScheduler`),
+        текущее значение доступно в :attr:`current_delay`.
+        Если задан :attr:`state_path`, состояние сохраняется после выдачи событий каждого запроса.
+        События обрабатываются асинхронно (например, в пуле потоков), нужно передать `ack_events=True` и вызывать
+        :meth:`ack` после обработки каждого события новых сообщений и заказов: до подтверждения событие не
+        попадает в сохраненное состояние, поэтому при падении оно будет выдано повторно, а не потеряно.
+
+        :param requests_delay: задержка между запросами без активности (в секундах).
         :type requests_delay: :obj:`int` or :obj:`float`, опционально
 
         :param ignore_exceptions: игнорировать ошибки?
         :type ignore_exceptions: :obj:`bool`, опционально
 
+        :param min_delay: задержка между запросами после нового заказа / сообщения (в секундах).
+        :type min_delay: :obj:`int` or :obj:`float`, опционально
+
+        :param max_delay: максимальная задержка при ошибках 429 / 5xx (в секундах).
+        :type max_delay: :obj:`int` or :obj:`float`, опционально
+
+        :param burst_polls: кол-во частых запросов после активности.
+        :type burst_polls: :obj:`int`, опционально
+
+        :param budget: общий лимит запросов runner/ для всех аккаунтов процесса (`None` - без лимита).
+        :type budget: :class:`FunPayAPI.updater.poll_scheduler.RequestBudget` or :obj:`None`, опционально
+
+        :param ack_events: сохранять события новых сообщений и заказов только после подтверждения (см. :meth:`ack`).
+        :type ack_events: :obj:`bool`, опционально
+
         :return: генератор событий FunPay.
         :rtype: :obj:`Generator` of :class:`FunPayAPI.updater.events.InitialChatEvent`,
             :class:`FunPayAPI.updater.events.ChatsListChangedEvent`,
@@ -449,31 +771,62 @@ class Runner:
             :class:`FunPayAPI.updater.events.NewOrderEvent`,
             :class:`FunPayAPI.updater.events.OrderStatusChangedEvent`
         """
+        self.poll_scheduler = PollScheduler(requests_delay, min_delay, max_delay, burst_polls, budget)
+        self.ack_events = ack_events
         events = []
         while True:
             try:
-                self.__interlocutor_ids = set([event.message.interlocutor_id for event in events
-                                               if event.type == EventTypes.NEW_MESSAGE])
+                self._set_pending_interlocutors(events)
                 updates = self.get_updates()
-                events.extend(self.parse_updates(updates))
-                next_events = []
-                for event in events:
-                    if self.make_msg_requests and self.make_buyer_viewing_requests \
-                            and event.type == EventTypes.NEW_MESSAGE \
-                            and event.message.interlocutor_id is not None:
-                        event.message.buyer_viewing = self.buyers_viewing.get(event.message.interlocutor_id)
-                        if event.message.buyer_viewing is None:
-                            next_events.append(event)
-                            continue
-
-                    yield event
-                events = next_events
+                new_events = self.parse_updates(updates)
+                self._track_events(new_events)
+                events.extend(new_events)
+                ready_events, events = self._split_ready_events(events)
+                self.poll_scheduler.on_success(ready_events, self.account.last_429_err_time)
+                yield from ready_events
+                self.save_state()
                 self.buyers_viewing = {}
             except Exception as e:
+                self.poll_scheduler.on_error(e, self.account.last_429_err_time)
                 if not ignore_exceptions:
                     raise e
                 else:
                     logger.error("Произошла ошибка при получении событий. "
                                  "(ничего страшного, если это сообщение появляется нечасто).")
                     logger.debug("TRACEBACK", exc_info=True)
-            time.sleep(requests_delay)
+            delay = self.poll_scheduler.delay()
+            logger.debug(f"Следующий запрос событий через {delay:.1f} с.")
+            time.sleep(delay)
+
+    @property
+    def current_delay(self) -> float | None:
+        """
+        Текущий интервал опроса runner/ (в секундах) или `None`, если :meth:`listen` еще не запускался.
+        """
+        return self.poll_scheduler.current_delay if self.poll_scheduler else None
+
+    def _set_pending_interlocutors(self, events: list):
+        """
+        Запоминает собеседников, для которых нужно получить поле "Покупатель смотрит" в следующем запросе.
+        """
+        self.__interlocutor_ids = set([event.message.interlocutor_id for event in events
+                                       if event.type == EventTypes.NEW_MESSAGE])
+
+    def _split_ready_events(self, events: list) -> tuple[list, list]:
+        """
+        Разделяет события на готовые к выдаче и ожидающие поля "Покупатель смотрит".
+
+        :return: (готовые события, отложенные события).
+        :rtype: :obj:`tuple` (:obj:`list`, :obj:`list`)
+        """
+        ready_events, next_events = [], []
+        for event in events:
+            if self.make_msg_requests and self.make_buyer_viewing_requests \
+                    and event.type == EventTypes.NEW_MESSAGE \
+                    and event.message.interlocutor_id is not None:
+                event.message.buyer_viewing = self.buyers_viewing.get(event.message.interlocutor_id)
+                if event.message.buyer_viewing is None:
+                    next_events.append(event)
+                    continue
+            ready_events.append(event)
+        return ready_events, next_events
@@ -0,0 +1,126 @@
+"""
+Задержка запросов Account.method: общая keep-alive сессия против нового соединения на каждый запрос.
+
+Поднимает локальный HTTP(S)-сервер-заглушку и выполняет одинаковые GET-запросы:
+- "per-call": requests.get() на каждый запрос (как Account.method до пула соединений);
+- "pooled": Account.method() через сессию Account; адаптер пула только подменяет адрес funpay.com на заглушку.
+Печатает p50/p99 задержки одного запроса в миллисекундах.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_account_http.py --requests 500
+    python benchmarks/bench_account_http.py --tls   # HTTPS с самоподписанным сертификатом (нужен openssl)
+"""
+import argparse
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from FunPayAPI.account import Account
+
+BODY = b"<html><body>" + b"x" * 2048 + b"</body></html>"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # заголовки и тело уходят разными send(): без этого keep-alive упирается в Nagle + delayed ACK (~40 мс)
+    disable_nagle_algorithm = True
+    delay = 0.0
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubAdapter(HTTPAdapter):
+    """Отправляет запросы к funpay.com на заглушку, не меняя остальной путь Account.method."""
+
+    def __init__(self, base: str, **kwargs):
+        self.base = base
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        request.url = request.url.replace("https://funpay.com", self.base, 1)
+        kwargs["verify"] = False
+        return super().send(request, **kwargs)
+
+
+def _self_signed_cert(directory: str) -> tuple[str, str]:
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-keyout", key, "-out", cert], check=True, capture_output=True)
+    return cert, key
+
+
+def _percentiles(samples: list[float]) -> tuple[float, float]:
+    samples = sorted(samples)
+    return statistics.median(samples) * 1000, samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+
+
+def _measure(call, n: int) -> list[float]:
+    call()  # прогрев
+    samples = []
+    for _ in range(n):
+        started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300, help="кол-во запросов в каждом режиме")
+    parser.add_argument("--delay", type=float, default=0.0, help="задержка ответа заглушки (секунды)")
+    parser.add_argument("--tls", action="store_true", help="HTTPS с самоподписанным сертификатом")
+    args = parser.parse_args()
+
+    StubHandler.delay = args.delay
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    tmp = tempfile.TemporaryDirectory()
+    scheme = "http"
+    if args.tls:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*_self_signed_cert(tmp.name))
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        scheme = "https"
+        warnings.filterwarnings("ignore", message="Unverified HTTPS request")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"{scheme}://127.0.0.1:{server.server_address[1]}"
+
+    headers = {"cookie": "golden_key=bench; cookie_prefs=1"}
+    per_call = _measure(lambda: requests.get(f"{base}/chat/", headers=headers, verify=False, timeout=10),
+                        args.requests)
+
+    account = Account("bench", adapter=StubAdapter(base, pool_connections=1, pool_maxsize=10))
+    pooled = _measure(lambda: account.method("get", "chat/", {}, {}, raise_not_200=True), args.requests)
+
+    print(f"{scheme.upper()}, {args.requests} запросов, задержка заглушки {args.delay * 1000:.0f} мс")
+    for name, samples in (("per-call", per_call), ("pooled", pooled)):
+        p50, p99 = _percentiles(samples)
+        print(f"{name:>9}: p50 {p50:7.2f} мс   p99 {p99:7.2f} мс")
+
+    server.shutdown()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Разбор HTML чата FunPay: XPath lxml (FunPayAPI.common.fast_html) против BeautifulSoup.
+
+Фикстуры в benchmarks/fixtures повторяют разметку FunPay, на которую рассчитаны парсеры:
+- chat_messages.json - сообщения чата в формате ответа FunPay (id, author, html): обычные сообщения,
+  сообщения с заголовком автора и бейджами, системные оповещения о заказах, изображения;
+- chat_bookmarks.html - список чатов из ответа runner/ (50 чатов).
+Перед замером проверяется, что оба парсера возвращают одинаковые данные (кроме сериализованного html элемента
+чата). Для сообщений дополнительно замеряется прежний путь: два дерева BeautifulSoup на сообщение.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_chat_parsing.py --repeat 20
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bs4 import BeautifulSoup
+
+from FunPayAPI.common import fast_html
+
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+
+
+def _without_html(chats: list[dict]) -> list[dict]:
+    return [{k: v for k, v in chat.items() if k != "html"} for chat in chats]
+
+
+def _check(messages: list[str], bookmarks: str) -> int:
+    mismatches = 0
+    for html in messages:
+        if fast_html._parse_message_lxml(html) != fast_html._parse_message_bs(html):
+            mismatches += 1
+            print(f"расхождение в сообщении: {html[:80]}...")
+    chats_lxml, chats_bs = fast_html._parse_bookmarks_lxml(bookmarks), fast_html._parse_bookmarks_bs(bookmarks)
+    if _without_html(chats_lxml) != _without_html(chats_bs):
+        mismatches += 1
+        print("расхождение в списке чатов")
+    return mismatches
+
+
+def _best(call, repeat: int, number: int) -> float:
+    """Лучшее время одного вызова в микросекундах."""
+    return min(timeit.repeat(call, repeat=repeat, number=number)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10, help="кол-во повторов замера (берется лучший)")
+    args = parser.parse_args()
+
+    with open(os.path.join(FIXTURES, "chat_messages.json"), encoding="utf-8") as f:
+        messages = [m["html"] for m in json.load(f)]
+    with open(os.path.join(FIXTURES, "chat_bookmarks.html"), encoding="utf-8") as f:
+        bookmarks = f.read()
+
+    mismatches = _check(messages, bookmarks)
+    print(f"сообщений: {len(messages)}, чатов: {len(fast_html.parse_chat_bookmarks_html(bookmarks))}, "
+          f"расхождений: {mismatches}")
+
+    def old_messages():
+        for html in messages:
+            fast_html._parse_message_bs(html)
+            BeautifulSoup(html, "lxml")
+
+    def bs_messages():
+        for html in messages:
+            fast_html._parse_message_bs(html)
+
+    def lxml_messages():
+        for html in messages:
+            fast_html._parse_message_lxml(html)
+
+    per_message = len(messages)
+    rows = [
+        ("сообщение, 2 x BeautifulSoup (до)", _best(old_messages, args.repeat, 5) / per_message),
+        ("сообщение, BeautifulSoup", _best(bs_messages, args.repeat, 5) / per_message),
+        ("сообщение, lxml XPath", _best(lxml_messages, args.repeat, 5) / per_message),
+        ("список чатов, BeautifulSoup", _best(lambda: fast_html._parse_bookmarks_bs(bookmarks), args.repeat, 5)),
+        ("список чатов, lxml XPath", _best(lambda: fast_html._parse_bookmarks_lxml(bookmarks), args.repeat, 5)),
+    ]
+    for name, us in rows:
+        print(f"{name:>36}: {us:9.1f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Выбор команды для сообщения чата: ChatCommandRouter против прежней цепочки if в handle_new_message.
+
+Корпус - benchmarks/fixtures/chat_corpus.txt (сообщения покупателей и оповещения FunPay, по одному на строку;
+строки "Покупатель ... / Продавец ... / Администратор ..." считаются сообщениями от FunPay). Маршрутизатор
+собирается из тех же команд, что регистрирует FunPayListener, плюс --extra синтетических команд-ключевых слов
+(как команды для новых игр), чтобы увидеть, как растет стоимость разбора с числом команд. Цепочка if повторяет
+прежний порядок проверок: text.lower() на каждую проверку. Перед замером проверяется, что при --extra 0 обе
+стороны выбирают одни и те же команды.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_chat_router.py --extra 0 10 50 200
+"""
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from chat_commands import ChatCommandRouter
+
+FUNPAY_PREFIXES = ("Покупатель ", "Продавец ", "Администратор ")
+
+
+def _handler(name: str):
+    def handler(listener, message, text, match):
+        return name
+    handler.__name__ = name
+    return handler
+
+
+def build_router(extra: int) -> ChatCommandRouter:
+    """Команды FunPayListener (в порядке регистрации) и extra синтетических ключевых слов."""
+    router = ChatCommandRouter()
+    router.command(prefix="!friend", exact=True)(_handler("friend"))
+    router.command(keywords=("оплатил", "аренд"), author="FunPay")(_handler("paid_order"))
+    router.command(keywords=("дай",))(_handler("test_rent"))
+    for i in range(extra):
+        router.command(keywords=(f"промокод{i}",))(_handler(f"extra{i}"))
+    router.command(keywords=("wassupbeijing",), final=False)(_handler("wassup"))
+    router.command(prefix="!check")(_handler("check"))
+    return router
+
+
+def build_chain(extra: int):
+    """Прежняя цепочка if: каждая проверка заново приводит текст к нижнему регистру."""
+    extra_keywords = [f"промокод{i}" for i in range(extra)]
+
+    def route(text: str, author: str):
+        if text.strip().lower() == "!friend":
+            return "friend"
+        if author == "FunPay" and ("оплатил" in text.lower() or "аренд" in text.lower()):
+            return "paid_order"
+        if "дай" in text.lower():
+            return "test_rent"
+        for i, keyword in enumerate(extra_keywords):
+            if keyword in text.lower():
+                return f"extra{i}"
+        if "wassupbeijing" in text.lower():
+            return "wassup"
+        if text.strip().lower().startswith("!check"):
+            return "check"
+        return None
+    return route
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--extra", type=int, nargs="+", default=[0, 10, 50, 200],
+                        help="кол-во дополнительных команд для замеров")
+    parser.add_argument("--repeat", type=int, default=5, help="кол-во повторов замера (берется лучший)")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "benchmarks", "fixtures", "chat_corpus.txt"), encoding="utf-8") as f:
+        corpus = [line.rstrip("\n") for line in f if line.strip()]
+    corpus = [(text, "FunPay" if text.startswith(FUNPAY_PREFIXES) else "buyer") for text in corpus]
+
+    router, chain = build_router(0), build_chain(0)
+    mismatches = 0
+    for text, author in corpus:
+        routed = router.route(text, author)
+        if (routed[0].name if routed else None) != chain(text, author):
+            mismatches += 1
+            print(f"расхождение: {text!r}")
+    print(f"сообщений в корпусе: {len(corpus)}, расхождений: {mismatches}")
+
+    for extra in args.extra:
+        router, chain = build_router(extra), build_chain(extra)
+        router.route("")  # компиляция выражений до замера
+        number = 200
+        router_us = min(timeit.repeat(lambda: [router.route(t, a) for t, a in corpus],
+                                      repeat=args.repeat, number=number)) / number / len(corpus) * 1e6
+        chain_us = min(timeit.repeat(lambda: [chain(t, a) for t, a in corpus],
+                                     repeat=args.repeat, number=number)) / number / len(corpus) * 1e6
+        print(f"команд {5 + extra:>4}: маршрутизатор {router_us:7.2f} мкс/сообщение, цепочка if {chain_us:7.2f} мкс")
+
+
+if __name__ == "__main__":
+    main()
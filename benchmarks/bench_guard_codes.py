@@ -0,0 +1,252 @@
+"""
+Время получения кода Steam Guard: брокер кодов (одно IMAP-соединение на ящик, IDLE) против опроса
+с новым подключением на каждой итерации.
+
+Поднимает локальный IMAP-сервер-заглушку (TLS с самоподписанным сертификатом, нужен openssl), регистрирует
+--rentals ожиданий кода на один ящик и кладет в ящик по письму Steam с кодом каждые --interval секунд.
+Для каждого письма измеряется время от доставки до получения кода и печатаются p50/max и число входов в ящик.
+- "broker": utils.email_utils.guard_broker.request() (с --no-idle сервер не объявляет IDLE, брокер опрашивает);
+- "poll": цикл вход -> fetch(непрочитанные, limit=10) -> выход -> пауза 3 секунды, как было до брокера.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_guard_codes.py --rentals 3
+    python benchmarks/bench_guard_codes.py --mode poll --rentals 3
+"""
+import argparse
+import os
+import random
+import socketserver
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from email.message import EmailMessage
+from email.utils import formatdate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from imap_tools import AND, MailBox
+
+from utils import email_utils
+
+
+class StubMailbox:
+    """Один ящик INBOX в памяти: письма (uid, флаги, RFC822) и подключения в режиме IDLE."""
+
+    def __init__(self):
+        self.messages: list[list] = []
+        self.idlers = set()
+        self.logins = 0
+        self.lock = threading.Lock()
+
+    def deliver(self, code: str):
+        msg = EmailMessage()
+        msg["From"] = "Steam <noreply@steampowered.com>"
+        msg["To"] = "bench@example.com"
+        msg["Subject"] = "Your Steam account: Access from new computer"
+        msg["Date"] = formatdate(localtime=True)
+        msg.set_content(f"Вот код Steam Guard, который понадобится для входа в аккаунт:\n\n{code}\n")
+        with self.lock:
+            self.messages.append([len(self.messages) + 1, set(), msg.as_bytes().replace(b"\n", b"\r\n")])
+            exists = len(self.messages)
+            idlers = list(self.idlers)
+        for handler in idlers:
+            handler.write(f"* {exists} EXISTS\r\n".encode())
+
+
+class StubIMAPHandler(socketserver.StreamRequestHandler):
+    """Подмножество IMAP4rev1, которое использует imap_tools: LOGIN, SELECT, STATUS, UID SEARCH/FETCH/STORE, IDLE."""
+
+    mailbox: StubMailbox = None
+    idle_supported = True
+
+    def setup(self):
+        super().setup()
+        self._write_lock = threading.Lock()
+
+    def write(self, data: bytes):
+        with self._write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+    def _uids(self, uid_set: str) -> list[list]:
+        with self.mailbox.lock:
+            messages = list(self.mailbox.messages)
+        last = messages[-1][0] if messages else 0
+        selected = []
+        for part in uid_set.split(","):
+            first, _, end = part.partition(":")
+            first = last if first == "*" else int(first)
+            end = first if not end else (last if end == "*" else int(end))
+            low, high = min(first, end), max(first, end)
+            selected.extend(m for m in messages if low <= m[0] <= high)
+        if not selected and "*" in uid_set and messages:
+            selected = [messages[-1]]
+        return selected
+
+    def _search(self, args: str) -> list[int]:
+        tokens = args.replace("(", " ").replace(")", " ").split()
+        if "UID" in tokens:
+            messages = self._uids(tokens[tokens.index("UID") + 1])
+        else:
+            with self.mailbox.lock:
+                messages = list(self.mailbox.messages)
+        if "UNSEEN" in tokens:
+            messages = [m for m in messages if "\\Seen" not in m[1]]
+        return [m[0] for m in messages]
+
+    def handle(self):
+        self.write(b"* OK IMAP4rev1 stub ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            if command == "UID":
+                sub, _, args = args.partition(" ")
+                command = f"UID {sub.upper()}"
+
+            if command == "CAPABILITY":
+                self.write(f"* CAPABILITY IMAP4rev1{' IDLE' if self.idle_supported else ''}\r\n".encode())
+            elif command == "LOGIN":
+                with self.mailbox.lock:
+                    self.mailbox.logins += 1
+            elif command in ("SELECT", "EXAMINE"):
+                with self.mailbox.lock:
+                    exists, uid_next = len(self.mailbox.messages), len(self.mailbox.messages) + 1
+                self.write(f"* {exists} EXISTS\r\n* 0 RECENT\r\n* OK [UIDVALIDITY 1] UIDs valid\r\n"
+                           f"* OK [UIDNEXT {uid_next}] Predicted next UID\r\n".encode())
+            elif command == "STATUS":
+                with self.mailbox.lock:
+                    uid_next = len(self.mailbox.messages) + 1
+                self.write(f"* STATUS INBOX (UIDNEXT {uid_next})\r\n".encode())
+            elif command == "UID SEARCH":
+                self.write(f"* SEARCH {' '.join(map(str, self._search(args)))}\r\n".encode())
+            elif command == "UID FETCH":
+                uid_set, _, parts = args.partition(" ")
+                for uid, flags, raw in self._uids(uid_set):
+                    if "PEEK" not in parts.upper():
+                        flags.add("\\Seen")
+                    self.write(f"* {uid} FETCH (UID {uid} FLAGS ({' '.join(flags)}) RFC822.SIZE {len(raw)} "
+                               f"BODY[] {{{len(raw)}}}\r\n".encode() + raw + b")\r\n")
+            elif command == "UID STORE":
+                uid_set, _, changes = args.partition(" ")
+                for message in self._uids(uid_set):
+                    if "\\SEEN" in changes.upper():
+                        message[1].add("\\Seen")
+            elif command == "IDLE" and self.idle_supported:
+                self.write(b"+ idling\r\n")
+                with self.mailbox.lock:
+                    self.mailbox.idlers.add(self)
+                try:
+                    self.rfile.readline()  # DONE
+                finally:
+                    with self.mailbox.lock:
+                        self.mailbox.idlers.discard(self)
+            elif command == "LOGOUT":
+                self.write(f"* BYE logging out\r\n{tag} OK LOGOUT completed\r\n".encode())
+                return
+            elif command not in ("NOOP", "CHECK", "CLOSE", "EXPUNGE"):
+                self.write(f"{tag} BAD unknown command\r\n".encode())
+                continue
+            self.write(f"{tag} OK {command} completed\r\n".encode())
+
+
+class TLSServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handler, context: ssl.SSLContext):
+        self.context = context
+        super().__init__(address, handler)
+
+    def get_request(self):
+        sock, address = super().get_request()
+        return self.context.wrap_socket(sock, server_side=True), address
+
+
+def _self_signed_context(directory: str) -> ssl.SSLContext:
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-keyout", key, "-out", cert], check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def _code() -> str:
+    return random.choice("ABCDEFGHJKMNPQRTVWXY") + random.choice("2346789") + \
+        "".join(random.choice("BCDFGHJKMNPQRTVWXY2346789") for _ in range(3))
+
+
+def _poll_waiter(port: int, resolved: dict, duplicates: list, stop: threading.Event):
+    """Ожидание кода как до брокера: новое подключение на каждой итерации. Код может достаться нескольким арендам."""
+    while not stop.is_set():
+        with MailBox("127.0.0.1", port=port).login("bench@example.com", "secret") as mailbox:
+            for msg in mailbox.fetch(AND(seen=False), reverse=True, limit=10):
+                code = email_utils.extract_login_code(msg)
+                if code:
+                    if code in resolved:
+                        duplicates.append(code)
+                    resolved.setdefault(code, time.time())
+                    return
+        stop.wait(3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("broker", "poll"), default="broker")
+    parser.add_argument("--rentals", type=int, default=3, help="кол-во одновременных ожиданий кода на один ящик")
+    parser.add_argument("--interval", type=float, default=2.0, help="пауза между письмами (секунды)")
+    parser.add_argument("--no-idle", action="store_true", help="сервер без IDLE (брокер опрашивает ящик)")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    StubIMAPHandler.mailbox = mailbox = StubMailbox()
+    StubIMAPHandler.idle_supported = not args.no_idle
+    server = TLSServer(("127.0.0.1", 0), StubIMAPHandler, _self_signed_context(tmp.name))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    resolved: dict[str, float] = {}
+    duplicates: list[str] = []
+    stop = threading.Event()
+    if args.mode == "broker":
+        email_utils.MailBox = lambda host: MailBox(host, port=port)
+        for i in range(args.rentals):
+            future = email_utils.guard_broker.request("bench@example.com", "secret", "127.0.0.1", account_id=i,
+                                                      timeout=60)
+            future.add_done_callback(lambda f: f.result() and resolved.setdefault(f.result(), time.time()))
+    else:
+        for _ in range(args.rentals):
+            threading.Thread(target=_poll_waiter, args=(port, resolved, duplicates, stop), daemon=True).start()
+
+    time.sleep(1)
+    delivered: dict[str, float] = {}
+    for _ in range(args.rentals):
+        code = _code()
+        delivered[code] = time.time()
+        mailbox.deliver(code)
+        time.sleep(args.interval)
+    deadline = time.time() + 15
+    while len(resolved) < len(delivered) and time.time() < deadline:
+        time.sleep(0.05)
+    stop.set()
+
+    delays = [(resolved[code] - at) * 1000 for code, at in delivered.items() if code in resolved]
+    print(f"{args.mode}{' без IDLE' if args.no_idle else ''}: ожиданий {args.rentals}, "
+          f"получено кодов {len(delays)}/{len(delivered)}, выдано повторно {len(duplicates)}, "
+          f"входов в ящик {mailbox.logins}")
+    if delays:
+        print(f"время до кода: p50 {statistics.median(delays):.0f} мс, max {max(delays):.0f} мс")
+    server.shutdown()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
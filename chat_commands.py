@@ -0,0 +1,154 @@
+"""
+Маршрутизация сообщений чата FunPay по командам.
+
+Команды регистрируются декоратором ChatCommandRouter.command() и бывают трех видов:
+- точные команды ("!friend"): все сообщение целиком, определяются поиском в словаре;
+- команды-префиксы ("!check <игра>"): начало сообщения, как str.startswith в прежней цепочке if;
+  все префиксы собраны в одно регулярное выражение, которое применяется к началу текста;
+- ключевые слова ("оплатил", "дай"): все ключевые слова собраны в одно регулярное выражение без групп
+  (именованная группа на команду отключает в re быстрый поиск по первому символу, и разбор растет квадратично
+  с числом команд), которое компилируется один раз и проходит по тексту сообщения один раз. Команда найденного
+  ключевого слова-строки определяется по словарю, ключевые слова-выражения проверяются только в месте совпадения.
+Текст приводится к нижнему регистру один раз, поэтому стоимость разбора сообщения почти не зависит
+от количества команд. Если подходит несколько команд, выполняется зарегистрированная раньше; после команды
+с final=False (в прежней цепочке if - без return) выполняется и следующая подходящая команда.
+"""
+import re
+import threading
+from typing import Callable, Optional
+
+
+class ChatCommand:
+    """Зарегистрированная команда чата."""
+
+    def __init__(self, name: str, handler: Callable, priority: int, prefix: Optional[str] = None,
+                 keywords: tuple = (), exact: bool = False, author: Optional[str] = None, final: bool = True):
+        self.name = name
+        self.handler = handler
+        self.priority = priority
+        self.prefix = prefix
+        self.keywords = keywords
+        self.exact = exact
+        self.author = author
+        self.final = final
+
+
+class ChatCommandRouter:
+    """
+    Набор команд чата с общим скомпилированным выражением ключевых слов.
+    """
+
+    def __init__(self):
+        self._commands: list[ChatCommand] = []
+        self._exact: dict[str, ChatCommand] = {}
+        self._prefixes_re: Optional[re.Pattern] = None
+        self._keywords_re: Optional[re.Pattern] = None
+        self._literals: dict[str, ChatCommand] = {}
+        self._patterns: list[tuple[ChatCommand, re.Pattern]] = []
+        self._lock = threading.Lock()
+
+    def command(self, prefix: Optional[str] = None, keywords: tuple = (), exact: bool = False,
+                author: Optional[str] = None, final: bool = True):
+        """
+        Декоратор обработчика команды. Обработчик вызывается как handler(listener, message, text, match).
+
+        Args:
+            prefix: начало сообщения (например, "!check"), без учета регистра и начальных пробелов
+            keywords: регулярные выражения ключевых слов, которые ищутся в любом месте сообщения
+            exact: команда-префикс должна быть всем сообщением
+            author: команда выполняется только для сообщений этого автора (например, "FunPay")
+            final: False - после обработчика выполняется и следующая подходящая команда
+        """
+        def decorator(handler: Callable) -> Callable:
+            with self._lock:
+                command = ChatCommand(handler.__name__, handler, len(self._commands),
+                                      prefix.lower() if prefix else None, tuple(keywords), exact, author, final)
+                self._commands.append(command)
+                if command.prefix and exact:
+                    self._exact[command.prefix] = command
+                self._prefixes_re = None
+                self._keywords_re = None
+            return handler
+        return decorator
+
+    def _compiled(self) -> tuple[re.Pattern, re.Pattern]:
+        """Возвращает (выражение префиксов, выражение ключевых слов), компилируя их после регистрации команд."""
+        with self._lock:
+            if self._keywords_re is None:
+                groups = [f"(?P<c{command.priority}>{re.escape(command.prefix)})"
+                          for command in self._commands if command.prefix and not command.exact]
+                self._prefixes_re = re.compile("|".join(groups)) if groups else re.compile(r"(?!x)x")
+                keywords = [(command, keyword) for command in self._commands for keyword in command.keywords]
+                literals, patterns = {}, []
+                for command, keyword in keywords:
+                    if re.escape(keyword) == keyword:
+                        literals.setdefault(keyword, command)
+                    elif not patterns or patterns[-1][0] is not command:
+                        patterns.append((command, re.compile("|".join(command.keywords))))
+                self._literals, self._patterns = literals, patterns
+                self._keywords_re = re.compile("|".join(k for _, k in keywords)) if keywords else re.compile(r"(?!x)x")
+            return self._prefixes_re, self._keywords_re
+
+    def _keyword_command(self, lowered: str, match: re.Match) -> Optional[ChatCommand]:
+        """
+        Команда ключевого слова, найденного выражением всех ключевых слов: в месте совпадения оно выбирает первую
+        по порядку регистрации подходящую альтернативу, поэтому здесь ищется такая же первая команда.
+        """
+        command = self._literals.get(match.group())
+        for candidate, pattern in self._patterns:
+            if command is not None and candidate.priority > command.priority:
+                break
+            if pattern.match(lowered, match.start()):
+                return candidate
+        return command
+
+    def _candidates(self, text: str, author: Optional[str]) -> list[tuple[ChatCommand, Optional[re.Match]]]:
+        """Подходящие команды в порядке регистрации, каждая один раз."""
+        lowered = text.lower()
+        stripped = lowered.strip()
+        prefixes_re, keywords_re = self._compiled()
+        found: dict[int, tuple[ChatCommand, Optional[re.Match]]] = {}
+
+        command = self._exact.get(stripped)
+        if command:
+            found[command.priority] = (command, None)
+        match = prefixes_re.match(stripped)
+        if match:
+            command = self._commands[int(match.lastgroup[1:])]
+            found[command.priority] = (command, None)
+        for match in keywords_re.finditer(lowered):
+            command = self._keyword_command(lowered, match)
+            if command is not None:
+                found.setdefault(command.priority, (command, match))
+        return [found[priority] for priority in sorted(found) if found[priority][0].author in (None, author)]
+
+    def route(self, text: str, author: Optional[str] = None) -> Optional[tuple[ChatCommand, Optional[re.Match]]]:
+        """
+        Находит команду сообщения.
+
+        Args:
+            text: текст сообщения
+            author: никнейм автора сообщения
+
+        Returns:
+            tuple | None: (команда, совпадение ключевого слова или None для команды-префикса) или None
+        """
+        candidates = self._candidates(text, author)
+        return candidates[0] if candidates else None
+
+    def dispatch(self, listener, message, text: str, author: Optional[str] = None):
+        """
+        Выполняет команду сообщения (и следующие за командами с final=False).
+
+        Returns:
+            результат обработчика последней выполненной команды с final=True; None, если такой нет
+        """
+        for command, match in self._candidates(text, author):
+            result = command.handler(listener, message, text, match)
+            if command.final:
+                return result
+        return None
+
+
+# Общий маршрутизатор команд чата процесса
+chat_router = ChatCommandRouter()
@@ -1,19 +1,10 @@
-import sqlite3
-import os
-
-DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'storage', 'plugins', 'steam_rental.db'))
+from db.repository import accounts_repo
 
 def get_account_by_id(acc_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT login, password, email_login, email_password, imap_host FROM accounts WHERE id=?", (acc_id,))
-    row = c.fetchone()
-    conn.close()
-    return row
+    row = accounts_repo.get(acc_id)
+    if not row:
+        return None
+    return row["login"], row["password"], row["email_login"], row["email_password"], row["imap_host"]
 
 def update_account_password(acc_id, new_password):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE accounts SET password = ? WHERE id = ?", (new_password, acc_id))
-    conn.commit()
-    conn.close()
+    accounts_repo.set_password(acc_id, new_password)
@@ -0,0 +1,29 @@
+"""
+Подключения к базе аренды.
+
+Режим WAL включается миграциями один раз и сохраняется в файле БД, поэтому читатели не блокируются
+записью. Здесь задаются только настройки, которые действуют в пределах одного подключения.
+"""
+import sqlite3
+
+from config import DB_PATH
+
+# Сколько миллисекунд ждать снятия блокировки записи, прежде чем выбросить "database is locked"
+BUSY_TIMEOUT_MS = 15000
+
+
+def get_connection(path: str = DB_PATH, **kwargs) -> sqlite3.Connection:
+    """
+    Открывает подключение к SQLite с настроенным busy_timeout.
+
+    Args:
+        path: путь к файлу БД (по умолчанию DB_PATH)
+        **kwargs: дополнительные параметры sqlite3.connect (например, isolation_level)
+
+    Returns:
+        sqlite3.Connection: новое подключение
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, **kwargs)
+    # в режиме WAL NORMAL не теряет целостность БД и не делает fsync на каждый коммит
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
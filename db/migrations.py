@@ -0,0 +1,232 @@
+"""
+Версионные миграции схемы базы аренды.
+
+Номер последней примененной миграции хранится в PRAGMA user_version. Миграции применяются по порядку
+при старте (tg_utils.db.init_db), каждая в своей транзакции. После миграций состав колонок accounts
+известен заранее, поэтому запросы не проверяют его через PRAGMA table_info.
+"""
+import logging
+import sqlite3
+from typing import Callable, Optional
+
+from db.connection import get_connection
+
+logger = logging.getLogger("db.migrations")
+
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> set[str]:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _base_schema(conn: sqlite3.Connection):
+    """Базовые таблицы. Для БД, созданных до миграций, добавляет недостающие колонки accounts."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS accounts (
+        id TEXT PRIMARY KEY,
+        login TEXT NOT NULL,
+        password TEXT NOT NULL,
+        game_name TEXT NOT NULL,
+        rented_until INTEGER,
+        status TEXT NOT NULL DEFAULT 'free',
+        tg_user_id INTEGER,
+        email_login TEXT,
+        email_password TEXT,
+        imap_host TEXT,
+        order_id TEXT,
+        steam_guard_enabled INTEGER DEFAULT 1,
+        warned_10min INTEGER DEFAULT 0,
+        bonus_given INTEGER DEFAULT 0,
+        lot_id TEXT,
+        friend_mode INTEGER DEFAULT 0,
+        rented_by INTEGER
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS authorized_users (
+        user_id INTEGER PRIMARY KEY,
+        is_authorized INTEGER DEFAULT 0,
+        access_attempts INTEGER DEFAULT 0,
+        last_attempt INTEGER
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS friend_mode_settings (
+        tg_user_id INTEGER PRIMARY KEY,
+        activated_at INTEGER NOT NULL,
+        is_active INTEGER DEFAULT 0
+    )''')
+    columns = _table_columns(conn, "accounts")
+    for name, definition in (
+        ("tg_user_id", "INTEGER"),
+        ("email_login", "TEXT"),
+        ("email_password", "TEXT"),
+        ("imap_host", "TEXT"),
+        ("steam_guard_enabled", "INTEGER DEFAULT 1"),
+        ("order_id", "TEXT"),
+        ("bonus_given", "INTEGER DEFAULT 0"),
+        ("friend_mode", "INTEGER DEFAULT 0"),
+        ("warned_10min", "INTEGER DEFAULT 0"),
+        ("rented_by", "INTEGER"),
+        ("lot_id", "TEXT"),
+    ):
+        if name not in columns:
+            conn.execute(f"ALTER TABLE accounts ADD COLUMN {name} {definition}")
+
+
+def _rental_jobs(conn: sqlite3.Connection):
+    """Очередь задач аренды (steam.rental_jobs)."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS rental_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        acc_id NOT NULL,
+        payload TEXT,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        run_at REAL NOT NULL,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rental_jobs_state_run_at ON rental_jobs(state, run_at)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_rental_jobs_active ON rental_jobs(kind, acc_id) "
+                 "WHERE state IN ('pending', 'running')")
+
+
+def _outbound_messages(conn: sqlite3.Connection):
+    """Очередь исходящих сообщений FunPay (funpay_outbox)."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS outbound_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT UNIQUE,
+        account_id INTEGER NOT NULL,
+        chat_id TEXT NOT NULL,
+        text TEXT NOT NULL,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        run_at REAL NOT NULL,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbound_messages_state_run_at ON outbound_messages(state, run_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbound_messages_chat "
+                 "ON outbound_messages(account_id, chat_id, state)")
+
+
+def _orders_ledger(conn: sqlite3.Connection):
+    """Журнал заказов и выданных по ним аккаунтов (db.orders)."""
+    conn.execute('''CREATE TABLE IF NOT EXISTS orders (
+        order_id TEXT PRIMARY KEY,
+        chat_id TEXT,
+        quantity INTEGER NOT NULL DEFAULT 1,
+        source TEXT,
+        state TEXT NOT NULL DEFAULT 'processing',
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS issued_accounts (
+        order_id TEXT NOT NULL,
+        account_id TEXT NOT NULL,
+        message_sent INTEGER NOT NULL DEFAULT 0,
+        issued_at REAL,
+        PRIMARY KEY (order_id, account_id)
+    )''')
+
+
+def _rental_jobs_text_acc_id(conn: sqlite3.Connection):
+    """Пересоздает rental_jobs с acc_id TEXT: без типа 5 и '5' считались разными аккаунтами в уникальном индексе."""
+    conn.execute('''CREATE TABLE rental_jobs_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        acc_id TEXT NOT NULL,
+        payload TEXT,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        run_at REAL NOT NULL,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )''')
+    # из активных дублей одного аккаунта (5 и '5') остается первая задача
+    conn.execute("UPDATE rental_jobs SET state='failed', last_error='дубль задачи' "
+                 "WHERE state IN ('pending', 'running') AND EXISTS (SELECT 1 FROM rental_jobs AS j WHERE j.kind=rental_jobs.kind "
+                 "AND CAST(j.acc_id AS TEXT)=CAST(rental_jobs.acc_id AS TEXT) AND j.state IN ('pending', 'running') "
+                 "AND j.id<rental_jobs.id)")
+    conn.execute("INSERT INTO rental_jobs_new SELECT id, kind, CAST(acc_id AS TEXT), payload, state, attempts, run_at, "
+                 "last_error, created_at, updated_at FROM rental_jobs")
+    conn.execute("DROP TABLE rental_jobs")
+    conn.execute("ALTER TABLE rental_jobs_new RENAME TO rental_jobs")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rental_jobs_state_run_at ON rental_jobs(state, run_at)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_rental_jobs_active ON rental_jobs(kind, acc_id) "
+                 "WHERE state IN ('pending', 'running')")
+
+
+def _accounts_indexes(conn: sqlite3.Connection):
+    """Индексы для выборок свободных аккаунтов, поиска по заказу/пользователю и восстановления таймеров."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_accounts_game_status ON accounts(game_name, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_accounts_order_id ON accounts(order_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_accounts_tg_user_id ON accounts(tg_user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_accounts_rented_until ON accounts(rented_until)")
+
+
+# (версия, описание, функция). Новые миграции добавляются только в конец списка. Примененная миграция
+# не меняется и не импортирует текущую схему из модулей: изменения схемы оформляются новой миграцией.
+MIGRATIONS: list[tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "базовые таблицы", _base_schema),
+    (2, "очередь задач аренды", _rental_jobs),
+    (3, "индексы accounts", _accounts_indexes),
+    (4, "очередь исходящих сообщений FunPay", _outbound_messages),
+    (5, "журнал заказов", _orders_ledger),
+    (6, "rental_jobs.acc_id TEXT", _rental_jobs_text_acc_id),
+]
+
+_accounts_columns: Optional[frozenset] = None
+
+
+def migrate(conn: Optional[sqlite3.Connection] = None) -> int:
+    """
+    Включает WAL и применяет непримененные миграции.
+
+    Args:
+        conn: подключение к БД (по умолчанию открывается новое)
+
+    Returns:
+        int: версия схемы после миграций
+    """
+    global _accounts_columns
+    own = conn is None
+    if own:
+        conn = get_connection(isolation_level=None)
+    try:
+        mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if mode.lower() != "wal":
+            logger.warning(f"[DB] Не удалось включить WAL, режим журнала: {mode}")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, description, apply in MIGRATIONS:
+            if number <= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                apply(conn)
+                conn.execute(f"PRAGMA user_version={number}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            version = number
+            logger.info(f"[DB] Применена миграция {number}: {description}")
+        _accounts_columns = frozenset(_table_columns(conn, "accounts"))
+        return version
+    finally:
+        if own:
+            conn.close()
+
+
+def accounts_columns() -> frozenset:
+    """
+    Returns:
+        frozenset: имена колонок таблицы accounts (читаются один раз, обновляются в migrate())
+    """
+    global _accounts_columns
+    if _accounts_columns is None:
+        conn = get_connection()
+        try:
+            _accounts_columns = frozenset(_table_columns(conn, "accounts"))
+        finally:
+            conn.close()
+    return _accounts_columns
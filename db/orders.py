@@ -0,0 +1,105 @@
+"""
+Журнал заказов FunPay.
+
+Таблица orders хранит по строке на заказ (первичный ключ - ID заказа) и его состояние обработки,
+таблица issued_accounts - аккаунты, выданные по заказу (запись добавляется в той же транзакции, в которой
+аккаунт занимается, см. AccountRepository.claim). Перед выдачей заказ занимается через claim(): повторное
+событие того же заказа (сообщение FunPay после события нового заказа, события после перезапуска) находит
+строку по первичному ключу и ничего не делает. Таблицы создают миграции БД (db.migrations, init_db()).
+"""
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from config import DB_PATH
+from db.connection import get_connection
+
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+# Через сколько секунд заказ в состоянии processing без выданных аккаунтов считается брошенным
+# (процесс остановился во время обработки) и может быть обработан заново
+STALE_PROCESSING = 10 * 60
+
+_INSERT = ("INSERT OR IGNORE INTO orders (order_id, chat_id, quantity, source, state, created_at, updated_at) "
+           "VALUES (?, ?, ?, ?, 'processing', ?, ?)")
+_RECLAIM = ("UPDATE orders SET state='processing', chat_id=?, quantity=?, source=?, last_error=NULL, updated_at=? "
+            "WHERE order_id=? AND (state='failed' OR (state='processing' AND updated_at<? "
+            "AND NOT EXISTS (SELECT 1 FROM issued_accounts WHERE order_id=?)))")
+_SET_STATE = "UPDATE orders SET state=?, last_error=?, updated_at=? WHERE order_id=?"
+_GET = "SELECT * FROM orders WHERE order_id=?"
+_ISSUED = "SELECT * FROM issued_accounts WHERE order_id=? ORDER BY issued_at"
+_SET_MESSAGE_SENT = "UPDATE issued_accounts SET message_sent=1 WHERE order_id=? AND account_id=?"
+_MESSAGE_SENT = "SELECT message_sent FROM issued_accounts WHERE order_id=? AND account_id=?"
+
+
+class OrderLedger:
+    """
+    Доступ к журналу заказов. Как и AccountRepository, каждый поток использует свое подключение
+    в режиме autocommit.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = get_connection(self.path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def claim(self, order_id: str, chat_id=None, quantity: int = 1, source: Optional[str] = None) -> bool:
+        """
+        Занимает заказ для обработки.
+
+        Args:
+            order_id: ID заказа
+            chat_id: ID чата покупателя
+            quantity: кол-во купленных услуг
+            source: откуда пришел заказ ("order" - событие заказа, "message" - сообщение FunPay)
+
+        Returns:
+            bool: False, если заказ уже обработан или обрабатывается
+        """
+        now = time.time()
+        chat_id = str(chat_id) if chat_id is not None else None
+        conn = self._conn()
+        if conn.execute(_INSERT, (order_id, chat_id, quantity, source, now, now)).rowcount:
+            return True
+        # заказ, обработка которого завершилась ошибкой или была прервана остановкой процесса
+        return conn.execute(_RECLAIM, (chat_id, quantity, source, now, order_id, now - STALE_PROCESSING,
+                                       order_id)).rowcount > 0
+
+    def finish(self, order_id: str):
+        """Отмечает заказ обработанным: повторные события заказа больше не обрабатываются."""
+        self._conn().execute(_SET_STATE, (DONE, None, time.time(), order_id))
+
+    def release(self, order_id: str, error: Optional[str] = None):
+        """Отмечает, что обработка заказа не удалась: заказ можно занять снова (запасной путь обработки)."""
+        self._conn().execute(_SET_STATE, (FAILED, error, time.time(), order_id))
+
+    def get(self, order_id: str) -> Optional[sqlite3.Row]:
+        """Возвращает запись заказа."""
+        return self._conn().execute(_GET, (order_id,)).fetchone()
+
+    def issued(self, order_id: str) -> list[sqlite3.Row]:
+        """Возвращает аккаунты, выданные по заказу."""
+        return self._conn().execute(_ISSUED, (order_id,)).fetchall()
+
+    def mark_message_sent(self, order_id: str, account_id):
+        """Отмечает, что данные аккаунта поставлены в очередь отправки покупателю."""
+        self._conn().execute(_SET_MESSAGE_SENT, (order_id, str(account_id)))
+
+    def message_sent(self, order_id: str, account_id) -> bool:
+        """Были ли данные аккаунта уже отправлены покупателю по этому заказу."""
+        row = self._conn().execute(_MESSAGE_SENT, (order_id, str(account_id))).fetchone()
+        return bool(row and row[0])
+
+
+# Общий журнал заказов процесса
+order_ledger = OrderLedger()
@@ -0,0 +1,234 @@
+"""
+Репозиторий таблицы accounts.
+
+Каждый поток получает одно долгоживущее подключение (threading.local), а SQL-запросы заданы константами,
+поэтому подготовленные выражения берутся из кэша sqlite3 этого подключения и не компилируются заново.
+Подключение работает в режиме autocommit: одиночные запросы атомарны сами по себе, а составные операции
+выполняются в transaction() с BEGIN IMMEDIATE, так что ожидание блокировки берет на себя busy_timeout,
+а не циклы повторов.
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from config import DB_PATH
+from db.connection import get_connection
+
+# Размер кэша подготовленных выражений на подключение
+CACHED_STATEMENTS = 256
+
+_GET = "SELECT * FROM accounts WHERE id=?"
+_FIND_FREE = "SELECT * FROM accounts WHERE game_name=? AND status='free' LIMIT 1"
+_FREE_IDS = "SELECT id FROM accounts WHERE game_name=? AND status='free' ORDER BY id LIMIT ?"
+_RENT = ("UPDATE accounts SET status='rented', tg_user_id=?, rented_until=?, order_id=?, "
+         "lot_id=COALESCE(?, lot_id), warned_10min=0 WHERE id=?")
+_EXTEND = ("UPDATE accounts SET rented_until=rented_until+? "
+           "WHERE id=? AND status='rented' AND rented_until>?")
+_RENTED_UNTIL = "SELECT rented_until FROM accounts WHERE id=?"
+_FREE = ("UPDATE accounts SET status='free', rented_until=NULL, tg_user_id=NULL, order_id=NULL, lot_id=NULL, "
+         "warned_10min=0, bonus_given=0 WHERE id=?")
+_BY_ORDER = "SELECT * FROM accounts WHERE order_id=? AND status='rented'"
+_RENTED_BY_USER = "SELECT * FROM accounts WHERE tg_user_id=? AND status='rented'"
+_COUNT_BY_GAME = "SELECT COUNT(*), COALESCE(SUM(status='free'), 0) FROM accounts WHERE game_name=?"
+_PAGE_BY_GAME = "SELECT * FROM accounts WHERE game_name=? ORDER BY id LIMIT ? OFFSET ?"
+_FREE_MATCHING = "SELECT game_name, COUNT(*) FROM accounts WHERE status='free' AND LOWER(game_name) LIKE ?"
+_NEAREST_RENTED_MATCHING = ("SELECT rented_until, game_name FROM accounts WHERE LOWER(game_name) LIKE ? "
+                            "AND status='rented' ORDER BY rented_until ASC LIMIT 1")
+_GAMES = "SELECT DISTINCT game_name FROM accounts"
+_FREE_GAMES = "SELECT DISTINCT game_name FROM accounts WHERE status='free'"
+_SET_BONUS_GIVEN = "UPDATE accounts SET bonus_given=? WHERE id=?"
+_SET_WARNED = "UPDATE accounts SET warned_10min=1 WHERE id=?"
+_SET_PASSWORD = "UPDATE accounts SET password=? WHERE id=?"
+_ISSUE = "INSERT OR IGNORE INTO issued_accounts (order_id, account_id, issued_at) VALUES (?, ?, ?)"
+
+
+class AccountRepository:
+    """
+    Доступ к аккаунтам аренды.
+
+    Строки возвращаются как sqlite3.Row: к полям можно обращаться и по имени, и по индексу (как к кортежу
+    из SELECT *).
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = get_connection(self.path, isolation_level=None, cached_statements=CACHED_STATEMENTS)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Выполняет вложенные вызовы репозитория одной транзакцией записи (BEGIN IMMEDIATE).
+        Блокировка записи берется сразу, поэтому чтение-изменение-запись внутри не конфликтует с другими потоками.
+        """
+        conn = self._conn()
+        if conn.in_transaction:
+            yield self
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self):
+        """Закрывает подключение текущего потока."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def get(self, acc_id) -> Optional[sqlite3.Row]:
+        """Возвращает аккаунт по ID."""
+        return self._conn().execute(_GET, (acc_id,)).fetchone()
+
+    def find_free(self, game_name: str) -> Optional[sqlite3.Row]:
+        """Возвращает любой свободный аккаунт игры."""
+        return self._conn().execute(_FIND_FREE, (game_name,)).fetchone()
+
+    def rent(self, acc_id, tg_user_id, rented_until: float, order_id: Optional[str] = None,
+             lot_id: Optional[str] = None) -> bool:
+        """
+        Помечает аккаунт арендованным до rented_until.
+
+        Args:
+            acc_id: ID аккаунта
+            tg_user_id: ID чата арендатора
+            rented_until: unix timestamp окончания аренды
+            order_id: ID заказа
+            lot_id: ID лота (None - не менять)
+
+        Returns:
+            bool: False, если аккаунт не найден
+        """
+        cur = self._conn().execute(_RENT, (tg_user_id, rented_until, order_id, lot_id, acc_id))
+        return cur.rowcount > 0
+
+    def claim(self, game_name: str, n: int, tg_user_id, rented_until: float, order_id: Optional[str] = None,
+              lot_id: Optional[str] = None, partial: bool = False) -> list[sqlite3.Row]:
+        """
+        Атомарно резервирует n разных свободных аккаунтов игры и помечает их арендованными.
+
+        Выбор и запись выполняются одной транзакцией BEGIN IMMEDIATE, поэтому одновременные заказы
+        не получают один и тот же аккаунт. В той же транзакции аккаунты записываются в журнал заказа
+        (issued_accounts, см. db.orders).
+
+        Args:
+            game_name: название игры
+            n: сколько аккаунтов нужно
+            tg_user_id: ID чата арендатора
+            rented_until: unix timestamp окончания аренды
+            order_id: ID заказа; при n > 1 каждому аккаунту назначается "<order_id>-<номер>"
+            lot_id: ID лота (None - не менять)
+            partial: занять сколько есть, если свободных меньше n
+
+        Returns:
+            list: занятые аккаунты (уже со статусом rented); пустой список, если занять не удалось
+        """
+        with self.transaction():
+            conn = self._conn()
+            ids = [row[0] for row in conn.execute(_FREE_IDS, (game_name, n))]
+            if not ids or (len(ids) < n and not partial):
+                return []
+            conn.executemany(_RENT, [
+                (tg_user_id, rented_until, f"{order_id}-{i + 1}" if order_id and n > 1 else order_id, lot_id, acc_id)
+                for i, acc_id in enumerate(ids)
+            ])
+            if order_id:
+                now = time.time()
+                conn.executemany(_ISSUE, [(order_id, acc_id, now) for acc_id in ids])
+            return [conn.execute(_GET, (acc_id,)).fetchone() for acc_id in ids]
+
+    def extend(self, acc_id, seconds: float) -> Optional[float]:
+        """
+        Продлевает действующую аренду на seconds секунд.
+
+        Returns:
+            float | None: новое время окончания или None, если аккаунт не в аренде или аренда уже истекла
+        """
+        with self.transaction():
+            cur = self._conn().execute(_EXTEND, (seconds, acc_id, time.time()))
+            if not cur.rowcount:
+                return None
+            return float(self._conn().execute(_RENTED_UNTIL, (acc_id,)).fetchone()[0])
+
+    def free(self, acc_id) -> bool:
+        """
+        Освобождает аккаунт и очищает данные аренды.
+
+        Returns:
+            bool: False, если аккаунт не найден
+        """
+        return self._conn().execute(_FREE, (acc_id,)).rowcount > 0
+
+    def by_order(self, order_id: str) -> Optional[sqlite3.Row]:
+        """Возвращает аккаунт, арендованный по заказу."""
+        return self._conn().execute(_BY_ORDER, (order_id,)).fetchone()
+
+    def rented_by_user(self, tg_user_id) -> Optional[sqlite3.Row]:
+        """Возвращает аккаунт, арендованный пользователем (чатом)."""
+        return self._conn().execute(_RENTED_BY_USER, (tg_user_id,)).fetchone()
+
+    def page_by_game(self, game_name: str, offset: int = 0, limit: int = 1) -> tuple[list[sqlite3.Row], int, int]:
+        """
+        Возвращает страницу аккаунтов игры (сортировка по ID) без загрузки остальных.
+
+        Args:
+            game_name: название игры
+            offset: номер первого аккаунта (приводится к диапазону 0..всего-1)
+            limit: размер страницы
+
+        Returns:
+            tuple: (аккаунты страницы, всего аккаунтов игры, из них свободных)
+        """
+        conn = self._conn()
+        total, free = conn.execute(_COUNT_BY_GAME, (game_name,)).fetchone()
+        if not total:
+            return [], 0, 0
+        offset = max(0, min(offset, total - 1))
+        return conn.execute(_PAGE_BY_GAME, (game_name, limit, offset)).fetchall(), total, free
+
+    def count_free_matching(self, query: str) -> tuple[Optional[str], int]:
+        """
+        Считает свободные аккаунты игр, в названии которых есть query (без учета регистра).
+
+        Returns:
+            tuple: (название одной из найденных игр или None, кол-во свободных аккаунтов)
+        """
+        game_name, count = self._conn().execute(_FREE_MATCHING, (f"%{query.lower()}%",)).fetchone()
+        return game_name, count
+
+    def nearest_rented_matching(self, query: str) -> Optional[sqlite3.Row]:
+        """Возвращает (rented_until, game_name) аккаунта игры с query в названии, который освободится раньше всех."""
+        return self._conn().execute(_NEAREST_RENTED_MATCHING, (f"%{query.lower()}%",)).fetchone()
+
+    def games(self, free_only: bool = False) -> list[str]:
+        """Возвращает названия игр, для которых есть аккаунты (или свободные аккаунты)."""
+        return [row[0] for row in self._conn().execute(_FREE_GAMES if free_only else _GAMES)]
+
+    def set_bonus_given(self, acc_id, value: bool = True):
+        """Отмечает, что бонус за отзыв по текущей аренде выдан."""
+        self._conn().execute(_SET_BONUS_GIVEN, (int(value), acc_id))
+
+    def set_warned(self, acc_id):
+        """Отмечает, что предупреждение за 10 минут до конца аренды отправлено."""
+        self._conn().execute(_SET_WARNED, (acc_id,))
+
+    def set_password(self, acc_id, password: str):
+        """Сохраняет новый пароль аккаунта."""
+        self._conn().execute(_SET_PASSWORD, (password, acc_id))
+
+
+# Общий репозиторий процесса
+accounts_repo = AccountRepository()
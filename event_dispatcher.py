@@ -0,0 +1,142 @@
+"""
+Параллельная обработка событий FunPay.
+
+Поток слушателя только получает события из Runner и ставит их обработчики в очередь, а обрабатывает их
+пул из нескольких потоков. Обработчики событий одного чата (или заказа) выполняются строго по очереди,
+в порядке получения событий, а разные чаты обрабатываются параллельно, поэтому медленный обработчик
+(запрос заказа, запись в БД, ожидание ответа FunPay) задерживает только свой чат.
+
+Если в очереди накопилось max_pending обработчиков, поток слушателя ждет, пока очередь не освободится,
+и новые запросы к runner/ не выполняются (обратное давление). Для каждого обработчика собирается статистика:
+кол-во вызовов, ошибки, время выполнения и время ожидания в очереди; медленные вызовы логируются.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Hashable, Optional
+
+logger = logging.getLogger("event_dispatcher")
+
+# Кол-во потоков обработки событий одного аккаунта FunPay
+EVENT_WORKERS = int(os.getenv("FUNPAY_EVENT_WORKERS", "4"))
+# Максимальное кол-во обработчиков в очереди, после которого слушатель ждет
+EVENT_QUEUE_SIZE = int(os.getenv("FUNPAY_EVENT_QUEUE_SIZE", "200"))
+# Обработчики дольше этого времени (в секундах) логируются как медленные
+SLOW_HANDLER_SECONDS = 5
+
+
+class EventDispatcher:
+    """
+    Пул потоков, выполняющий обработчики с сохранением порядка внутри ключа (чата / заказа).
+    Потоки запускаются при первом вызове submit().
+    """
+
+    def __init__(self, workers: int = EVENT_WORKERS, max_pending: int = EVENT_QUEUE_SIZE, name: str = "events"):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.name = name
+        # ключ -> обработчики ключа, ожидающие выполнения; ключ есть в словаре, пока у него есть
+        # ожидающие или выполняемый обработчик
+        self._queues: dict[Hashable, deque] = {}
+        # ключи, у которых есть ожидающие обработчики и нет выполняемого
+        self._ready: deque = deque()
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._threads: list[threading.Thread] = []
+        self._stats: dict[str, dict] = {}
+
+    def submit(self, key: Hashable, handler: Callable, *args, done: Optional[Callable] = None):
+        """
+        Ставит обработчик в очередь ключа. Если очередь заполнена, ждет, пока она не освободится.
+
+        Args:
+            key: ключ порядка (например, ID чата): обработчики одного ключа выполняются последовательно
+            handler: обработчик
+            *args: аргументы обработчика
+            done: вызывается с теми же аргументами после завершения обработчика (в т.ч. с ошибкой),
+                например, чтобы подтвердить обработку события (Runner.ack)
+        """
+        label = getattr(handler, "__name__", repr(handler))
+        with self._cond:
+            if self._pending >= self.max_pending:
+                logger.warning(f"[DISPATCH] Очередь событий {self.name} заполнена ({self._pending}), "
+                               f"ожидаем обработки")
+                while self._pending >= self.max_pending:
+                    self._cond.wait()
+            self._start_workers()
+            self._pending += 1
+            task = (handler, args, label, time.monotonic(), done)
+            queue = self._queues.get(key)
+            if queue is None:
+                self._queues[key] = deque([task])
+                self._ready.append(key)
+                self._cond.notify_all()
+            else:
+                queue.append(task)
+
+    def pending(self) -> int:
+        """Кол-во обработчиков в очереди (включая выполняемые)."""
+        with self._cond:
+            return self._pending
+
+    def stats(self) -> dict[str, dict]:
+        """
+        Returns:
+            dict: {обработчик: {"calls", "errors", "total", "avg", "max", "wait_max"}}, время в секундах
+        """
+        with self._cond:
+            result = {}
+            for label, item in self._stats.items():
+                result[label] = dict(item, avg=item["total"] / item["calls"] if item["calls"] else 0.0)
+            return result
+
+    def _start_workers(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}_worker_{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                key = self._ready.popleft()
+                handler, args, label, enqueued_at, done = self._queues[key].popleft()
+            started_at = time.monotonic()
+            error = False
+            try:
+                handler(*args)
+            except Exception as e:
+                error = True
+                logger.error(f"[DISPATCH] Ошибка в обработчике {label} ({key}): {e}", exc_info=True)
+            finished_at = time.monotonic()
+            if done is not None:
+                try:
+                    done(*args)
+                except Exception as e:
+                    logger.error(f"[DISPATCH] Ошибка после обработчика {label} ({key}): {e}", exc_info=True)
+            self._finish(key, label, started_at - enqueued_at, finished_at - started_at, error)
+
+    def _finish(self, key: Hashable, label: str, wait: float, elapsed: float, error: bool):
+        with self._cond:
+            self._pending -= 1
+            if self._queues[key]:
+                self._ready.append(key)
+            else:
+                del self._queues[key]
+            item = self._stats.setdefault(label, {"calls": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                                                  "wait_max": 0.0})
+            item["calls"] += 1
+            item["errors"] += int(error)
+            item["total"] += elapsed
+            item["max"] = max(item["max"], elapsed)
+            item["wait_max"] = max(item["wait_max"], wait)
+            self._cond.notify_all()
+        if elapsed >= SLOW_HANDLER_SECONDS:
+            logger.warning(f"[DISPATCH] Медленный обработчик {label} ({key}): {elapsed:.1f} с "
+                           f"(ожидание в очереди {wait:.1f} с)")
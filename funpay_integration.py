@@ -5,7 +5,13 @@ import re
 import sys
 from threading import Thread
 from time import time, sleep
-from steam.steam_account_rental_utils import find_free_account, mark_account_rented, mark_account_free, send_account_to_buyer, auto_end_rent
+from steam.steam_account_rental_utils import claim_accounts, mark_account_rented, mark_account_free, send_account_to_buyer, auto_end_rent
+from db.repository import accounts_repo
+from db.orders import order_ledger
+from lot_index import lot_index
+from funpay_outbox import outbox
+from event_dispatcher import EventDispatcher
+from chat_commands import chat_router
 from dotenv import load_dotenv
 
 import traceback
@@ -52,13 +58,70 @@ except Exception as e:
 # Сохраняем поддержку старого пути к настройкам для обратной совместимости
 SETTINGS_PATH = os.path.join(os.path.dirname(__file__), 'funpay_rent_settings.json')
 
+# Каталог для файлов состояния Runner'а (по одному на аккаунт FunPay)
+RUNNER_STATE_DIR = os.path.join(os.path.dirname(__file__), 'storage')
+
 from game_name_mapper import mapper
 
 # Время бонуса при получении отзыва в секундах
 REVIEW_BONUS_TIME = 30 * 60  # 30 минут
 
+# Регулярные выражения разбора сообщений (компилируются один раз)
+ORDER_ID_RE = re.compile(r'#([A-Za-z0-9]+)')
+QUANTITY_RE = re.compile(r'(\d+)\s*шт')
+TEST_MINUTES_RE = re.compile(r'дай\s+(\d+)', re.IGNORECASE)
+# Популярные игры, которые ищутся в тексте, если игру не удалось определить по лоту
+GAME_PATTERNS = (
+    (re.compile(r'(CS:GO|Counter-Strike:? ?GO?|КС:ГО|Контра|Каэс)', re.IGNORECASE), "Counter-Strike: GO"),
+    (re.compile(r'(Red Dead|RDR2|Redemption)', re.IGNORECASE), "Red Dead Redemption 2"),
+    (re.compile(r'(GTA|Grand Theft Auto)', re.IGNORECASE), "Grand Theft Auto V"),
+)
+
 class FunPayListener:
-    def __init__(self):
+    def __init__(self, golden_key=None, user_agent=None, adapter=None, poll_delay=None, name=None, manager=None):
+        """
+        Args:
+            golden_key: golden_key аккаунта FunPay (по умолчанию GOLDEN_KEY из .env или файла настроек)
+            user_agent: user-agent для golden_key, переданного явно
+            adapter: общий пул HTTP-соединений (несколько аккаунтов в одном процессе)
+            poll_delay: интервал опроса runner/ в секундах (по умолчанию как в Runner.listen)
+            name: имя профиля для логов
+            manager: FunPayListenerManager, которому сообщается, какие чаты принадлежат аккаунту
+        """
+        self.golden_key = golden_key
+        self.user_agent = user_agent
+        self.poll_delay = poll_delay
+        self.name = name
+        self.manager = manager
+
+        if self.golden_key is None:
+            self._load_golden_key()
+
+        if not self.golden_key:
+            raise RuntimeError('Golden key не найден ни в .env, ни в файле настроек. Проверьте наличие GOLDEN_KEY в файле .env')
+            
+        if Account is None:
+            raise ImportError('FunPayAPI не установлен!')
+            
+        # Передаём user_agent, если поддерживается
+        try:
+            self.account = Account(self.golden_key, user_agent=self.user_agent, adapter=adapter) if self.user_agent \
+                else Account(self.golden_key, adapter=adapter)
+        except TypeError:
+            self.account = Account(self.golden_key)
+        self.account.get()  # Авторизация и загрузка данных аккаунта
+        if self.name is None:
+            self.name = self.account.username
+        outbox.register_account(self.account)
+        os.makedirs(RUNNER_STATE_DIR, exist_ok=True)
+        self.updater = Runner(self.account, state_path=os.path.join(
+            RUNNER_STATE_DIR, f"funpay_runner_{self.account.id}.json"))
+        self.dispatcher = EventDispatcher(name=f"funpay_events_{self.name}")
+        # ID заказа -> числовой ID чата покупателя, найденный при постановке события заказа в очередь (_event_key)
+        self._order_chats = {}
+        self._order_chats_lock = threading.Lock()
+
+    def _load_golden_key(self):
         # Получаем GOLDEN_KEY из переменных окружения
         self.golden_key = os.getenv("GOLDEN_KEY")
         
@@ -78,20 +141,6 @@ class FunPayListener:
         else:
             # По умолчанию используем стандартный user_agent
             self.user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
-            
-        if not self.golden_key:
-            raise RuntimeError('Golden key не найден ни в .env, ни в файле настроек. Проверьте наличие GOLDEN_KEY в файле .env')
-            
-        if Account is None:
-            raise ImportError('FunPayAPI не установлен!')
-            
-        # Передаём user_agent, если поддерживается
-        try:
-            self.account = Account(self.golden_key, user_agent=self.user_agent) if self.user_agent else Account(self.golden_key)
-        except TypeError:
-            self.account = Account(self.golden_key)
-        self.account.get()  # Авторизация и загрузка данных аккаунта
-        self.updater = Runner(self.account)
 
     def normalize_game_name(self, game_name):
         return mapper.normalize(game_name)
@@ -100,29 +149,35 @@ class FunPayListener:
         from FunPayAPI.updater.events import OrderStatusChangedEvent, NewMessageEvent
         import logging
         def listen():
-            print_flush('[FunPay] Запуск слушателя событий...')
+            print_flush(f'[FunPay] Запуск слушателя событий ({self.name})...')
+            listen_kwargs = {"requests_delay": self.poll_delay} if self.poll_delay else {}
+            # Обработчики выполняются в пуле потоков, поэтому Runner сохраняет событие в файле состояния только
+            # после того, как его обработчики завершились (done=self.updater.ack): события, стоявшие в очереди
+            # при остановке процесса, будут выданы повторно после перезапуска
+            ack = self.updater.ack
             while True:
                 try:
-                    for event in self.updater.listen():
+                    for event in self.updater.listen(ack_events=True, **listen_kwargs):
+                        if self.manager is not None:
+                            self.manager.route_event(self, event)
+                        # Обработчики выполняются в пуле потоков: события одного чата / заказа по очереди,
+                        # разных чатов - параллельно
                         if isinstance(event, NewOrderEvent):
                             print_flush(f'[FunPay][EVENT] Новый заказ: {event.order.id}')
-                            self.handle_new_order(event)
+                            self.dispatcher.submit(self._event_key(event), self.handle_new_order, event, done=ack)
                         elif isinstance(event, OrderStatusChangedEvent):
                             print_flush(f'[FunPay][EVENT] Изменение статуса заказа: {event.order.id}')
-                            self.handle_order_status_changed(event)
+                            self.dispatcher.submit(self._event_key(event), self.handle_order_status_changed, event,
+                                                   done=ack)
                         elif isinstance(event, NewMessageEvent):
-                            # Выводим сообщение с принудительной очисткой буфера
                             print_flush(f'[FunPay][EVENT] Новое сообщение: {getattr(event.message, "text", None)}')
-                            
+                            key = self._event_key(event)
                             # Проверяем, является ли сообщение отзывом
-                            is_review = self.handle_review_message(event)
-                            
+                            self.dispatcher.submit(key, self.handle_review_message, event)
                             # Всегда обрабатываем сообщение даже если это отзыв
-                            # Это позволит боту реагировать на все сообщения
-                            self.handle_new_message(event)
-                            
-                            # Дополнительно сбрасываем буфер после обработки сообщения
-                            sys.stdout.flush()
+                            # Это позволит боту реагировать на все сообщения.
+                            # Обработчики одного чата выполняются по очереди, поэтому подтверждается второй
+                            self.dispatcher.submit(key, self.handle_new_message, event, done=ack)
                 except Exception as e:
                     print_flush(f'[FunPay][ERROR] Ошибка в слушателе событий: {e}')
                     import traceback
@@ -133,19 +188,103 @@ class FunPayListener:
                     time.sleep(5)
         
         # Запускаем поток слушателя с повышенным приоритетом
-        listener_thread = Thread(target=listen, daemon=True)
+        listener_thread = Thread(target=listen, name=f"funpay_listener_{self.name}", daemon=True)
         listener_thread.start()
-        print_flush('[FunPay] Слушатель событий запущен.')
+        # Индекс лотов строим заранее, чтобы первый заказ не ждал загрузки лотов
+        Thread(target=lot_index.ensure_fresh, args=(self.account,), name=f"lot_index_{self.name}", daemon=True).start()
+        print_flush(f'[FunPay] Слушатель событий запущен ({self.name}).')
+
+    def _event_key(self, event):
+        """
+        Ключ порядка обработки события: чат события, а если чат неизвестен - заказ.
+        Для нового заказа числовой ID чата запоминается до handle_new_order, чтобы заказ выдавался под тем же
+        ключом, что и сообщения его чата.
+        """
+        if getattr(event, "message", None) is not None:
+            return f"chat:{event.message.chat_id}"
+        order = event.order
+        if isinstance(event, NewOrderEvent):
+            chat_id = self._order_chat_id(order, make_request=True)
+            with self._order_chats_lock:
+                self._order_chats[order.id] = chat_id
+        else:
+            chat_id = self._order_chat_id(order)
+        if chat_id:
+            return f"chat:{chat_id}"
+        return f"order:{order.id}"
+
+    def _order_chat_id(self, order, make_request=False):
+        """
+        Числовой ID чата покупателя заказа или None. В OrderShortcut чат указан в текстовом виде
+        ("users-<id>-<id>"), а сообщения, режим "Для друга" и аренды хранят числовой ID чата, поэтому чат ищется
+        среди сохраненных чатов аккаунта.
+        """
+        try:
+            chat = self.account.get_chat_by_name(order.buyer_username, make_request)
+        except Exception as e:
+            print_flush(f'[FunPay] Не удалось получить чат покупателя {order.buyer_username}: {e}')
+            chat = None
+        return chat.id if chat else None
+
+    def _fulfil_order(self, chat_id, order_id, quantity, text, details=None, source=None):
+        """
+        Выдает аккаунт по заказу, если заказа еще нет в журнале заказов (db.orders).
+        Повторные события заказа (сообщение FunPay после события заказа, события после перезапуска)
+        ничего не делают. Заказ отмечается обработанным, только если _issue_order() вернул True
+        (аккаунт выдан или аренда продлена); в остальных случаях (игра или время аренды не определены,
+        нет свободных аккаунтов, ошибка) заказ может обработать запасной путь с полными данными заказа.
+
+        Returns:
+            результат _issue_order(); True, если заказ уже обработан
+        """
+        if order_id and not order_ledger.claim(order_id, chat_id, quantity, source):
+            print_flush(f"[FunPay][ORDER] Заказ {order_id} уже обработан, пропускаем")
+            return True
+        try:
+            result = self._issue_order(chat_id, order_id, quantity, text, details=details)
+        except Exception as e:
+            if order_id:
+                order_ledger.release(order_id, str(e))
+            raise
+        if order_id:
+            if result is True:
+                order_ledger.finish(order_id)
+            else:
+                order_ledger.release(order_id, "аккаунт не выдан")
+        return result
 
     def handle_new_order(self, event):
+        """
+        Выдает аккаунт сразу по событию нового заказа, используя данные OrderShortcut из списка продаж
+        (без запроса истории чата и страницы заказа). Если по OrderShortcut время аренды не определяется
+        (лота нет в индексе, а в кратком описании нет срока), запрашивается полный заказ (get_order);
+        если аккаунт так и не выдан, заказ остается необработанным для запасного пути (сообщение FunPay).
+        """
+        order = event.order
+        with self._order_chats_lock:
+            chat_id = self._order_chats.pop(order.id, None)
         try:
-            order = event.order
-            # Просто логируем заказ, не выдаём аккаунт
             desc = order.description
             print_flush('[FunPay][НОВЫЙ ЗАКАЗ]')
             print_flush(f'  Покупатель: {getattr(order, "buyer_username", "—")} (ID: {getattr(order, "buyer_id", "—")})')
             print_flush(f'  Описание заказа: {desc}')
+            if getattr(order.status, "name", None) != "PAID":
+                print_flush(f'[FunPay] Заказ {order.id} не в статусе "оплачен", аккаунт не выдается')
+                return
+            if not chat_id:
+                # без числового ID чата аккаунт выдаст сообщение FunPay о заказе: оно обрабатывается в очереди чата,
+                # а аренда и режим "Для друга" сохраняются под тем же ID, что и следующие сообщения покупателя
+                print_flush(f'[FunPay] Чат покупателя заказа {order.id} не найден, заказ обработает сообщение FunPay')
+                return
+            details = order
+            _, rent_seconds = lot_index.rent_terms(self.account, order)
+            if not rent_seconds:
+                # срок аренды есть только в полном описании заказа - _issue_order запросит get_order()
+                print_flush(f'[FunPay] Время аренды заказа {order.id} не найдено в списке продаж, запрашиваем заказ')
+                details = None
+            self._fulfil_order(chat_id, order.id, order.amount or 1, desc or "", details=details, source="order")
         except Exception as e:
+            # заказ отмечен в журнале как неудачный - выдать аккаунт сможет запасной путь (сообщение FunPay)
             print_flush(f'[FunPay] Ошибка при обработке нового заказа: {e}')
             import traceback
             traceback.print_exc(file=sys.stdout)
@@ -190,645 +329,477 @@ class FunPayListener:
         
     def handle_new_message(self, event):
         try:
-            import re
-            from steam.steam_account_rental_utils import find_free_account, mark_account_rented, auto_end_rent
-            from time import time
-            from tg_utils.db import cleanup_expired_friend_modes, clear_friend_mode
-            
-            # Очищаем устаревшие режимы friend
-            cleanup_expired_friend_modes()
-            
+            # Устаревшие режимы friend удаляет фоновый поток (tg_utils.db.FriendModeStore)
             message = event.message
             text = message.text or ""
-            chat_id = message.chat_id
-            
-            # Получаем информацию об отправителе
-            author = None
-            if hasattr(message, "author_username"):
-                author = message.author_username
-            elif hasattr(message, "author"):
-                author = message.author
-            elif hasattr(message, "from_user"):
-                author = message.from_user.username or message.from_user.first_name
+            author = self._message_author(message)
+            print_flush(f"[FunPay] Новое сообщение в чате: '{text}' (от {author}, чат {message.chat_id})")
+
+            # Команда сообщения определяется за один проход по тексту (см. chat_commands)
+            return chat_router.dispatch(self, message, text, author)
+        except Exception as e:
+            print_flush(f"[FunPay] Ошибка в обработчике нового сообщения: {e}")
+            import traceback
+            traceback.print_exc(file=sys.stdout)
+            sys.stdout.flush()
+
+    @staticmethod
+    def _message_author(message):
+        """Никнейм автора сообщения ("?", если неизвестен)."""
+        if hasattr(message, "author_username"):
+            return message.author_username
+        elif hasattr(message, "author"):
+            return message.author
+        elif hasattr(message, "from_user"):
+            return message.from_user.username or message.from_user.first_name
+        return "?"
+
+    @chat_router.command(prefix="!friend", exact=True)
+    def _cmd_friend(self, message, text, match):
+        """Команда !friend: включает режим 'Для друга' для чата."""
+        chat_id = message.chat_id
+        try:
+            from tg_utils.db import set_friend_mode, is_friend_mode_active
+
+            # Проверяем, не активирован ли уже режим
+            if is_friend_mode_active(chat_id):
+                self.funpay_send_message_wrapper(chat_id, "✅ Режим 'Для друга' уже активен! Действует 10 минут.")
+                return True
+
+            # Активируем режим
+            set_friend_mode(chat_id)
+            self.funpay_send_message_wrapper(chat_id, "✅ Режим 'Для друга' включен! Действует 10 минут. При покупке нескольких лотов вы получите отдельные аккаунты.")
+            return True
+        except Exception as e:
+            print_flush(f"[FunPay][ERROR] Ошибка при обработке команды !friend: {e}")
+            return False
+
+    @chat_router.command(keywords=("оплатил", "аренд"), author="FunPay")
+    def _cmd_paid_order(self, message, text, match):
+        """Сообщение FunPay об оплате заказа - запасной путь выдачи аккаунта (основной - событие нового заказа)."""
+        # Получаем order_id и chat_id
+        order_match = ORDER_ID_RE.search(text)
+        chat_id = message.chat_id
+        order_id = order_match.group(1) if order_match else None
+
+        # Проверяем количество купленных услуг
+        quantity_match = QUANTITY_RE.search(text)
+        quantity = int(quantity_match.group(1)) if quantity_match else 1
+
+        # Выводим для отладки исходный ID заказа и количество
+        print_flush(f"[FunPay][MSG] Исходный ID заказа: {order_id}, количество: {quantity}")
+
+        # Обычно заказ уже обработан по событию нового заказа - сообщение FunPay остается запасным путем
+        return self._fulfil_order(chat_id, order_id, quantity, text, source="message")
+
+    @chat_router.command(keywords=("дай",))
+    def _cmd_test_rent(self, message, text, match):
+        """Тестовая команда 'дай [минуты]': выдает тестовый аккаунт на указанное кол-во минут."""
+        author = self._message_author(message)
+        # Проверяем, что команда от определенного пользователя
+        allowed_users = ["dadayaredaze"]
+        if author.lower() not in [user.lower() for user in allowed_users]:
+            print_flush(f"[FunPay][TEST] Команда 'дай' от неавторизованного пользователя {author}. Игнорируем.")
+            return
+
+        # Проверяем, есть ли указание на количество в сообщении
+        quantity_match = TEST_MINUTES_RE.search(text)
+        test_quantity = int(quantity_match.group(1)) if quantity_match else 1
+
+        game_name = "Counter-Strike: GO"
+        print_flush(f"[FunPay][TEST] Команда 'дай' от {author}. Выдаём тестовый аккаунт {game_name} на {test_quantity} минут(ы).")
+        from steam.steam_account_rental_utils import auto_end_rent
+        # Резервируем аккаунт атомарно на указанное количество минут (для теста - заказ с префиксом TEST-)
+        test_order_id = f"TEST-{message.chat_id}-{int(time())}"
+        claimed = claim_accounts(game_name, 1, test_order_id, time() + 60 * test_quantity, tg_user_id=message.chat_id)
+        if not claimed:
+            self.funpay_send_message_wrapper(message.chat_id, "Нет свободных аккаунтов для теста.")
+            return
+        acc = claimed[0]
+        login, password, game_name_db = acc[1], acc[2], acc[3]
+        new_until = float(acc["rented_until"])
+
+        # Убираем информацию о длительности аренды из сообщения
+        msg = (
+            f"🎮 Ваш арендованный Steam-аккаунт:\n\n"
+            f"💼 Логин: {login}\n"
+            f"🔑 Пароль: {password}\n\n"
+            f"Для входа в аккаунт используйте клиент Steam."
+        )
+        self.funpay_send_message_wrapper(message.chat_id, msg)
+        # Steam Guard код (если есть)
+        self.send_steam_guard_code(acc[0], message.chat_id, new_until)
+        # Запускаем автоосвобождение и смену данных через указанное количество минут
+        try:
+            print_flush(f"[FunPay][TEST] Запускаем тестовую аренду на {test_quantity * 60} секунд для аккаунта {acc[0]}")
+            auto_end_rent(acc[0], message.chat_id, test_quantity * 60,
+                         notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message({'chat_id': tg_user_id, 'order_id': test_order_id}, lambda chat_id, text: self.funpay_send_message_wrapper(chat_id, text)))
+            print_flush(f"[FunPay][TEST] Таймер завершения аренды успешно запущен для аккаунта {acc[0]}")
+        except Exception as e:
+            print_flush(f"[FunPay][TEST] Не удалось запустить авто-завершение тестовой аренды: {e}")
+            traceback.print_exc(file=sys.stdout)
+            sys.stdout.flush()
+        return
+
+    @chat_router.command(keywords=("wassupbeijing",), final=False)
+    def _cmd_wassup(self, message, text, match):
+        self.funpay_send_message_wrapper(message.chat_id, 'wassup!')
+
+    @chat_router.command(prefix="!check")
+    def _cmd_check(self, message, text, match):
+        """Команда '!check <игра>': наличие свободных аккаунтов игры или время освобождения ближайшего."""
+        parts = text.strip().split(" ", 1)
+        if len(parts) < 2:
+            self.funpay_send_message_wrapper(message.chat_id, "Пожалуйста, укажите название игры после !check")
+            return
+        game_query = parts[1].strip() # Сохраняем оригинальный запрос игры для сообщения
+        game_query_lower = game_query.lower() # Используем нижний регистр для поиска
+
+        from steam.steam_account_rental_utils import format_msk_time # Импортируем format_msk_time
+        import time # Импортируем time
+
+        # Сначала ищем свободные аккаунты по частичному совпадению (регистр не важен)
+        game_name, count = accounts_repo.count_free_matching(game_query_lower)
+
+        if count > 0:
+            # Есть свободные аккаунты
+            if count == 1:
+                msg = f"Есть свободный аккаунт для игры {game_name}"
             else:
-                author = "?"
-            
-            print_flush(f"[FunPay] Новое сообщение в чате: '{text}' (от {author}, чат {chat_id})")
+                msg = f"{count} свободных аккаунтов для игры {game_name}"
+        else:
+            # Нет свободных аккаунтов, ищем ближайший занятый для этой игры
+            row_rented = accounts_repo.nearest_rented_matching(game_query_lower)
+
+            if row_rented and row_rented[0] is not None:
+                # Найден занятый аккаунт, сообщаем, когда он освободится
+                rented_until_timestamp = float(row_rented[0])
+                game_name_rented = row_rented[1] # Используем название игры из БД
 
-            # Обработка команды !friend
-            if text.strip().lower() == "!friend":
+                # Проверяем, что время освобождения в будущем
+                if rented_until_timestamp > time.time():
+                    free_time_msk = format_msk_time(rented_until_timestamp)
+                    msg = f"Нет свободных аккаунтов для игры {game_name_rented}. Ближайший освободится примерно {free_time_msk}."
+                else:
+                    # Аккаунт должен был уже освободиться, но статус не сброшен
+                    msg = f"Нет свободных аккаунтов для игры {game_query}. Пожалуйста, попробуйте позже."
+                    # Возможно, здесь стоит добавить логирование или уведомление администратору
+                    print_flush(f"[FunPay][MSG][WARN] Аккаунт для игры '{game_query_lower}' должен был освободиться, но статус 'rented'. acc_id: ???") # TODO: добавить acc_id в запрос если нужно
+
+            else:
+                # Нет ни свободных, ни занятых аккаунтов для этого запроса
+                msg = f"Нет свободных аккаунтов для игры {game_query}."
+
+        self.funpay_send_message_wrapper(message.chat_id, msg)
+        return
+
+    def _issue_friend_order(self, chat_id, order_id, quantity, game_name, rent_seconds):
+        """
+        Выдает заказ в режиме 'Для друга': по отдельному аккаунту на каждую купленную услугу.
+        Если свободных аккаунтов не хватает, продлевает текущую аренду покупателя или выдает сколько есть.
+
+        Returns:
+            bool | None: как у _issue_order()
+        """
+        from time import time
+        from tg_utils.db import clear_friend_mode
+
+        # Резервируем нужное количество разных аккаунтов одной транзакцией
+        free_accounts = claim_accounts(game_name, quantity, order_id, time() + rent_seconds, tg_user_id=chat_id)
+
+        if not free_accounts:
+            # Если недостаточно аккаунтов, отключаем режим friend и предлагаем продление
+            clear_friend_mode(chat_id)
+
+            # Проверяем, есть ли уже арендованный аккаунт
+            acc_row = accounts_repo.rented_by_user(chat_id)
+
+            if acc_row and order_id:
+                # Если есть арендованный аккаунт - продлеваем его
                 try:
-                    from tg_utils.db import set_friend_mode, is_friend_mode_active
-                    
-                    # Проверяем, не активирован ли уже режим
-                    if is_friend_mode_active(chat_id):
-                        self.funpay_send_message_wrapper(chat_id, "✅ Режим 'Для друга' уже активен! Действует 10 минут.")
-                        return True
-                    
-                    # Активируем режим
-                    set_friend_mode(chat_id)
-                    self.funpay_send_message_wrapper(chat_id, "✅ Режим 'Для друга' включен! Действует 10 минут. При покупке нескольких лотов вы получите отдельные аккаунты.")
+                    from steam.steam_account_rental_utils import mark_account_rented, auto_end_rent
+                    total_rent_seconds = rent_seconds * quantity
+                    new_until = mark_account_rented(acc_row[0], chat_id, bonus_seconds=total_rent_seconds, order_id=order_id)
+                    from steam.steam_account_rental_utils import format_msk_time
+                    end_time_msk = format_msk_time(new_until)
+                    message_text = f'✅ Аренда продлена до {end_time_msk}'
+                    self.funpay_send_message_wrapper(chat_id, message_text)
+                    remaining_time = new_until - time()
+                    auto_end_rent(
+                        acc_row[0], chat_id, remaining_time,
+                        notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message(tg_user_id)
+                    )
                     return True
                 except Exception as e:
-                    print_flush(f"[FunPay][ERROR] Ошибка при обработке команды !friend: {e}")
+                    print_flush(f'[ERROR][MSG] Ошибка при продлении аренды: {e}')
+                    traceback.print_exc(file=sys.stdout)
+                    sys.stdout.flush()
                     return False
 
-            # --- Обработка заказа: сообщение от FunPay о покупке или выдаче аккаунта ---
-            if author == "FunPay" and ("оплатил" in text.lower() or "аренд" in text.lower()):
-                # Получаем order_id и chat_id
-                order_match = re.search(r'#([A-Za-z0-9]+)', text)
-                chat_id = message.chat_id
-                order_id = order_match.group(1) if order_match else None
-                
-                # Проверяем количество купленных услуг
-                quantity_match = re.search(r'(\d+)\s*шт', text)
-                quantity = int(quantity_match.group(1)) if quantity_match else 1
-                
-                # Выводим для отладки исходный ID заказа и количество
-                print_flush(f"[FunPay][MSG] Исходный ID заказа: {order_id}, количество: {quantity}")
-                
-                # Проверяем режим friend
-                from tg_utils.db import is_friend_mode_active
-                
-                if is_friend_mode_active(chat_id):
-                    print_flush(f"[FunPay][MSG] Режим 'Для друга' активен. Выдаём {quantity} отдельных аккаунтов.")
-                    
-                    # Определяем название игры из сообщения
-                    game_name = None
+            # Если нет арендованного аккаунта - выдаём доступные
+            free_accounts = claim_accounts(game_name, quantity, order_id, time() + rent_seconds,
+                                           tg_user_id=chat_id, partial=True)
+            self._issue_friend_accounts(chat_id, free_accounts, order_id)
+
+            # Отправляем сообщение о недостатке аккаунтов
+            self.funpay_send_message_wrapper(chat_id, f"⚠️ Доступно только {len(free_accounts)} из {quantity} аккаунтов. Остальные будут выданы при освобождении.",
+                                             key=f"partial:{order_id}" if order_id else None)
+            # без выданных аккаунтов заказ остается необработанным
+            return True if free_accounts else None
+
+        # Выдаём каждый аккаунт отдельно
+        self._issue_friend_accounts(chat_id, free_accounts, order_id)
+
+        # Очищаем режим friend после успешной выдачи
+        clear_friend_mode(chat_id)
+        return True
+
+    def _issue_order(self, chat_id, order_id, quantity, text, details=None):
+        """
+        Выдает аккаунт (или продлевает аренду) по оплаченному заказу.
+
+        Args:
+            chat_id: ID чата покупателя
+            order_id: ID заказа (None - заказ неизвестен)
+            quantity: кол-во купленных услуг
+            text: текст, по которому дополнительно ищется игра (сообщение FunPay или описание заказа)
+            details: заказ (Order или OrderShortcut); если не передан, запрашивается get_order()
+
+        Returns:
+            bool | None: True - аккаунт выдан покупателю (или аренда продлена); False - ошибка выдачи;
+            None - заказ не обработан (не аренда, не удалось определить игру / время аренды, нет свободных аккаунтов)
+        """
+        try:
+            from time import time
+            from tg_utils.db import is_friend_mode_active, clear_friend_mode
+
+            # Детали заказа запрашиваются один раз; для OrderShortcut (событие нового заказа) запрос не нужен
+            if details is None and order_id:
+                try:
+                    details = self.account.get_order(order_id)
+                except Exception as e:
+                    print_flush(f"[FunPay][MSG] Ошибка при получении деталей заказа: {e}")
+            short_description = (getattr(details, "short_description", None)
+                                 or getattr(details, "description", None) or "")
+            full_description = getattr(details, "full_description", None) or ""
+
+            # Проверяем режим friend
+        
+            if is_friend_mode_active(chat_id):
+                print_flush(f"[FunPay][MSG] Режим 'Для друга' активен. Выдаём {quantity} отдельных аккаунтов.")
+            
+                # Игра и время аренды - из индекса лотов, для неизвестного лота - из описания заказа
+                try:
+                    game_name, rent_seconds = lot_index.rent_terms(self.account, details)
+                except Exception as e:
+                    print_flush(f"[FunPay][MSG] Ошибка при получении времени аренды: {e}")
+                    return False
+
+                if not game_name:
                     for game in ["Counter-Strike: GO", "CS:GO", "CS GO", "CSGO"]:
                         if game.lower() in text.lower():
                             game_name = "Counter-Strike: GO"
                             break
+
+                if not game_name:
+                    print_flush(f"[FunPay][MSG] Не удалось определить игру из сообщения")
+                    return False
+
+                if not rent_seconds:
+                    print_flush(f"[FunPay][MSG] Не удалось определить время аренды")
+                    return False
+            
+                return self._issue_friend_order(chat_id, order_id, quantity, game_name, rent_seconds)
+        
+            # Если режим friend не активен, проверяем продление
+            # Проверяем, есть ли уже арендованный аккаунт на этот chat_id
+            acc_row = accounts_repo.rented_by_user(chat_id)
+        
+            # Если аккаунт уже арендован этим пользователем и лот совпадает — продлеваем
+            if acc_row and order_id:
+                try:
+                    # Время аренды - из индекса лотов (или из описания заказа)
+                    from steam.steam_account_rental_utils import mark_account_rented, auto_end_rent
+                    from time import time
+                    _, rent_seconds = lot_index.rent_terms(self.account, details)
+                    if rent_seconds:
+                        # Умножаем время аренды на количество купленных услуг
+                        total_rent_seconds = rent_seconds * quantity
                     
-                    if not game_name:
-                        print_flush(f"[FunPay][MSG] Не удалось определить игру из сообщения")
-                        return False
+                        # Теперь получаем новое время аренды из функции mark_account_rented
+                        # Функция вернет фактическое время окончания аренды с учетом существующего времени
+                        # Используем bonus_seconds для добавления времени к существующей аренде
+                        new_until = mark_account_rented(acc_row[0], chat_id, bonus_seconds=total_rent_seconds, order_id=order_id)
                     
-                    # Получаем время аренды из описания заказа
-                    try:
-                        details = self.account.get_order(order_id)
-                        from steam.steam_account_rental_utils import parse_rent_time
-                        desc_for_parse = details.full_description or details.short_description or ""
-                        rent_seconds = parse_rent_time(desc_for_parse)
-                        if not rent_seconds:
-                            print_flush(f"[FunPay][MSG] Не удалось определить время аренды")
-                            return False
-                    except Exception as e:
-                        print_flush(f"[FunPay][MSG] Ошибка при получении времени аренды: {e}")
-                        return False
+                        # Получаем дату и время окончания аренды в МСК 
+                        from steam.steam_account_rental_utils import format_msk_time
+                        end_time_msk = format_msk_time(new_until)
                     
-                    # Находим нужное количество свободных аккаунтов
-                    free_accounts = []
-                    for _ in range(quantity):
-                        acc = find_free_account(game_name)
-                        if acc:
-                            free_accounts.append(acc)
-                        else:
-                            break
-
-                    if len(free_accounts) < quantity:
-                        # Если недостаточно аккаунтов, отключаем режим friend и предлагаем продление
-                        clear_friend_mode(chat_id)
-                        
-                        # Проверяем, есть ли уже арендованный аккаунт
-                        from steam.steam_account_rental_utils import DB_PATH
-                        import sqlite3
-                        conn = sqlite3.connect(DB_PATH)
-                        c = conn.cursor()
-                        c.execute("SELECT id, rented_until, order_id FROM accounts WHERE status='rented' AND tg_user_id=?", (chat_id,))
-                        acc_row = c.fetchone()
-                        conn.close()
-                        
-                        if acc_row and order_id:
-                            # Если есть арендованный аккаунт - продлеваем его
-                            try:
-                                details = self.account.get_order(order_id)
-                                from steam.steam_account_rental_utils import parse_rent_time, mark_account_rented, auto_end_rent
-                                desc_for_parse = details.full_description or details.short_description or ""
-                                rent_seconds = parse_rent_time(desc_for_parse)
-                                if rent_seconds:
-                                    total_rent_seconds = rent_seconds * quantity
-                                    new_until = mark_account_rented(acc_row[0], chat_id, bonus_seconds=total_rent_seconds, order_id=order_id)
-                                    from steam.steam_account_rental_utils import format_msk_time
-                                    end_time_msk = format_msk_time(new_until)
-                                    message_text = f'✅ Аренда продлена до {end_time_msk}'
-                                    self.funpay_send_message_wrapper(chat_id, message_text)
-                                    remaining_time = new_until - time()
-                                    auto_end_rent(
-                                        acc_row[0], chat_id, remaining_time,
-                                        notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message(tg_user_id)
-                                    )
-                            except Exception as e:
-                                print_flush(f'[ERROR][MSG] Ошибка при продлении аренды: {e}')
-                                traceback.print_exc(file=sys.stdout)
-                                sys.stdout.flush()
-                        else:
-                            # Если нет арендованного аккаунта - выдаём доступные
-                            for i, acc in enumerate(free_accounts):
-                                try:
-                                    acc_order_id = f"{order_id}-{i+1}" if order_id else None
-                                    new_until = mark_account_rented(acc[0], chat_id, rented_until=time() + rent_seconds, order_id=acc_order_id)
-                                    msg = (
-                                        f"🎮 Аккаунт #{i+1}:\n\n"
-                                        f"💼 Логин: {acc[1]}\n"
-                                        f"🔑 Пароль: {acc[2]}\n\n"
-                                        f"Для входа в аккаунт используйте клиент Steam."
-                                    )
-                                    self.funpay_send_message_wrapper(chat_id, msg)
-                                    remaining_time = new_until - time()
-                                    auto_end_rent(
-                                        acc[0], chat_id, remaining_time,
-                                        notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message(tg_user_id)
-                                    )
-                                    threading.Thread(target=self.send_steam_guard_code, args=(acc[0], chat_id, new_until), daemon=True).start()
-                                except Exception as e:
-                                    print_flush(f"[FunPay][ERROR] Ошибка при выдаче аккаунта #{i+1}: {e}")
-                                    continue
-                            
-                            # Отправляем сообщение о недостатке аккаунтов
-                            self.funpay_send_message_wrapper(chat_id, f"⚠️ Доступно только {len(free_accounts)} из {quantity} аккаунтов. Остальные будут выданы при освобождении.")
+                        # Формируем сообщение с информацией о времени окончания аренды
+                        message_text = f'✅ Аренда продлена до {end_time_msk}'
+                    
+                        self.funpay_send_message_wrapper(chat_id, message_text)
+                    
+                        # Запускаем только auto_end_rent — он реализует таймер предупреждения и автоосвобождение
+                        # Передаем оставшееся время до завершения аренды, а не полное время
+                        remaining_time = new_until - time()
+                        auto_end_rent(
+                            acc_row[0], chat_id, remaining_time,
+                            notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message(tg_user_id)
+                        )
                         return True
+                    # время аренды не определено - заказ остается необработанным
+                    return None
+                except Exception as e:
+                    print_flush(f'[ERROR][MSG] Ошибка при продлении аренды: {e}')
+                    import traceback
+                    traceback.print_exc(file=sys.stdout)
+                    sys.stdout.flush()
+                    return False
 
-                    for i, acc in enumerate(free_accounts):
-                        try:
-                            # Для каждого аккаунта создаём отдельный order_id
-                            acc_order_id = f"{order_id}-{i+1}" if order_id else None
-                            
-                            # Арендуем аккаунт
-                            new_until = mark_account_rented(acc[0], chat_id, rented_until=time() + rent_seconds, order_id=acc_order_id)
-                            
-                            # Отправляем данные аккаунта
-                            msg = (
-                                f"🎮 Аккаунт #{i+1}:\n\n"
-                                f"💼 Логин: {acc[1]}\n"
-                                f"🔑 Пароль: {acc[2]}\n\n"
-                                f"Для входа в аккаунт используйте клиент Steam."
-                            )
-                            self.funpay_send_message_wrapper(chat_id, msg)
-                            
-                            # Запускаем таймер для каждого аккаунта
-                            remaining_time = new_until - time()
-                            auto_end_rent(
-                                acc[0], chat_id, remaining_time,
-                                notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message(tg_user_id)
-                            )
-                            
-                            # Запускаем поиск Steam Guard кода
-                            threading.Thread(target=self.send_steam_guard_code, args=(acc[0], chat_id, new_until), daemon=True).start()
-                            
-                        except Exception as e:
-                            print_flush(f"[FunPay][ERROR] Ошибка при выдаче аккаунта #{i+1}: {e}")
-                            continue
-
-                    # Очищаем режим friend после успешной выдачи
-                    clear_friend_mode(chat_id)
-                    return True
-                
-                # Если режим friend не активен, проверяем продление
-                # Проверяем, есть ли уже арендованный аккаунт на этот chat_id
-                from steam.steam_account_rental_utils import DB_PATH
-                import sqlite3
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                c.execute("SELECT id, rented_until, order_id FROM accounts WHERE status='rented' AND tg_user_id=?", (chat_id,))
-                acc_row = c.fetchone()
-                conn.close()
+            # Инициализация для парсинга аренды
+            rent_seconds = None
+            game_name = None
+            # Вывод описаний заказа и лота при оплате
+            if details is not None:
+                print_flush(f"[FunPay][MSG] Краткое описание заказа: {short_description}")
+                print_flush(f"[FunPay][MSG] Полное описание заказа: {full_description}")
+                # Игра и время аренды - из индекса лотов, для неизвестного лота - из описания заказа
+                try:
+                    game_name, rent_seconds = lot_index.rent_terms(self.account, details)
+                    print_flush(f"[FunPay][MSG] Время аренды (сек): {rent_seconds}")
+                except Exception as e:
+                    print_flush(f"[FunPay][MSG] Не удалось распарсить время аренды: {e}")
                 
-                # Если аккаунт уже арендован этим пользователем и лот совпадает — продлеваем
-                if acc_row and order_id:
-                    try:
-                        # Получаем описание лота для парсинга времени
-                        details = self.account.get_order(order_id)
-                        from steam.steam_account_rental_utils import parse_rent_time, mark_account_rented, auto_end_rent
-                        from time import time
-                        desc_for_parse = details.full_description or details.short_description or ""
-                        rent_seconds = parse_rent_time(desc_for_parse)
-                        if rent_seconds:
-                            # Умножаем время аренды на количество купленных услуг
-                            total_rent_seconds = rent_seconds * quantity
-                            
-                            # Теперь получаем новое время аренды из функции mark_account_rented
-                            # Функция вернет фактическое время окончания аренды с учетом существующего времени
-                            # Используем bonus_seconds для добавления времени к существующей аренде
-                            new_until = mark_account_rented(acc_row[0], chat_id, bonus_seconds=total_rent_seconds, order_id=order_id)
-                            
-                            # Получаем дату и время окончания аренды в МСК 
-                            from steam.steam_account_rental_utils import format_msk_time
-                            end_time_msk = format_msk_time(new_until)
-                            
-                            # Формируем сообщение с информацией о времени окончания аренды
-                            message_text = f'✅ Аренда продлена до {end_time_msk}'
-                            
-                            self.funpay_send_message_wrapper(chat_id, message_text)
-                            
-                            # Запускаем только auto_end_rent — он реализует таймер предупреждения и автоосвобождение
-                            # Передаем оставшееся время до завершения аренды, а не полное время
-                            remaining_time = new_until - time()
-                            auto_end_rent(
-                                acc_row[0], chat_id, remaining_time,
-                                notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message(tg_user_id)
-                            )
-                        return
-                    except Exception as e:
-                        print_flush(f'[ERROR][MSG] Ошибка при продлении аренды: {e}')
-                        import traceback
-                        traceback.print_exc(file=sys.stdout)
-                        sys.stdout.flush()
-                        return
-
-                import re
-                # Инициализация для парсинга аренды
-                lot_page = None
-                details = None
-                rent_seconds = None
-                # Вывод описаний заказа и лота при оплате
-                order_match = re.search(r'#([A-Za-z0-9]+)', text)
-                if order_match:
-                    order_id = order_match.group(1)
-                    try:
-                        details = self.account.get_order(order_id)
-                        print_flush(f"[FunPay][MSG] Краткое описание заказа: {details.short_description}")
-                        print_flush(f"[FunPay][MSG] Полное описание заказа: {details.full_description}")
-                        # Парсим время аренды из описания заказа
-                        try:
-                            from steam.steam_account_rental_utils import parse_rent_time
-                            desc_for_parse = details.full_description or details.short_description or ""
-                            rent_seconds = parse_rent_time(desc_for_parse)
-                            print_flush(f"[FunPay][MSG] Время аренды (сек): {rent_seconds}")
-                        except Exception as e:
-                            print_flush(f"[FunPay][MSG] Не удалось распарсить время аренды: {e}")
-                    except Exception as e:
-                        print_flush(f"[FunPay][MSG] Ошибка при получении деталей заказа: {e}")
-                        
-                def is_rent_order(description: str) -> bool:
-                    rent_keywords = ["аренда", "rent"]
-                    desc = description.lower()
-                    return any(word in desc for word in rent_keywords)
-
-                is_rent = False
-
-                # 1. Проверяем подкатегорию
-                if details and hasattr(details, 'subcategory') and details.subcategory:
-                    subcat_name = getattr(details.subcategory, 'name', '').lower()
-                    if 'аренда' in subcat_name or 'rent' in subcat_name:
-                        is_rent = True
-
-                # 2. Проверяем параметры
-                if not is_rent and details and hasattr(details, 'params') and details.params:
-                    params_str = str(details.params).lower()
-                    if 'аренда' in params_str or 'rent' in params_str:
-                        is_rent = True
-
-                # 3. Проверяем описание (старый способ)
-                if not is_rent:
-                    desc_for_parse = (details.full_description or "") + " " + (details.short_description or "") if details else text
-                    is_rent = is_rent_order(desc_for_parse)
-
-                # 4. Проверяем текст сообщения (старый способ)
-                if not is_rent:
-                    is_rent = 'аренд' in text.lower() or 'rent' in text.lower()
-
-                if not is_rent:
-                    print_flush("[FunPay][MSG] В заказе нет признаков аренды, пропускаем выдачу аккаунта.")
-                    return
+            def is_rent_order(description: str) -> bool:
+                rent_keywords = ["аренда", "rent"]
+                desc = description.lower()
+                return any(word in desc for word in rent_keywords)
 
-                game_name = None
-                
-                game_match = re.search(r'(CS:GO|Counter-Strike:? ?GO?|КС:ГО|Контра|Каэс)', text, re.IGNORECASE)
-                if game_match:
-                    game_name = "Counter-Strike: GO"
-                    
-                # 2. Проверяем Red Dead Redemption 2 и другие популярные игры
-                elif re.search(r'(Red Dead|RDR2|Redemption)', text, re.IGNORECASE):
-                    game_name = "Red Dead Redemption 2"
-                elif re.search(r'(GTA|Grand Theft Auto)', text, re.IGNORECASE):
-                    game_name = "Grand Theft Auto V"
+            is_rent = False
+
+            # 1. Проверяем подкатегорию
+            if details and hasattr(details, 'subcategory') and details.subcategory:
+                subcat_name = getattr(details.subcategory, 'name', '').lower()
+                if 'аренда' in subcat_name or 'rent' in subcat_name:
+                    is_rent = True
+
+            # 2. Проверяем параметры
+            if not is_rent and details and hasattr(details, 'params') and details.params:
+                params_str = str(details.params).lower()
+                if 'аренда' in params_str or 'rent' in params_str:
+                    is_rent = True
+
+            # 3. Проверяем описание (старый способ)
+            if not is_rent:
+                desc_for_parse = full_description + " " + short_description if details else text
+                is_rent = is_rent_order(desc_for_parse)
+
+            # 4. Проверяем текст сообщения (старый способ)
+            if not is_rent:
+                is_rent = 'аренд' in text.lower() or 'rent' in text.lower()
+
+            if not is_rent:
+                print_flush("[FunPay][MSG] В заказе нет признаков аренды, пропускаем выдачу аккаунта.")
+                return None
+
+            if game_name:
+                print_flush(f"[FunPay][MSG] Игра определена по лоту: {game_name}")
+            else:
+                # CS:GO, Red Dead Redemption 2 и другие популярные игры - по названиям в тексте
+                game_name = next((name for pattern, name in GAME_PATTERNS if pattern.search(text)), None)
+        
+            if not game_name:
+                try:
+                    available_games = accounts_repo.games(free_only=True)
                 
-                if not game_name:
-                    try:
-                        conn = sqlite3.connect(DB_PATH)
-                        c = conn.cursor()
-                        c.execute("SELECT DISTINCT game_name FROM accounts WHERE status='free'")
-                        available_games = [row[0] for row in c.fetchall()]
-                        conn.close()
+                    # Ищем совпадение в тексте сообщения
+                    for game in available_games:
+                        if game.lower() in text.lower():
+                            game_name = game
+                            print_flush(f"[FunPay][MSG] Найдена игра в тексте сообщения: {game}")
+                            break
                         
-                        # Ищем совпадение в тексте сообщения
+                    if not game_name and details:
+                        desc_text = short_description + ' ' + full_description
                         for game in available_games:
-                            if game.lower() in text.lower():
+                            if game.lower() in desc_text.lower():
                                 game_name = game
-                                print_flush(f"[FunPay][MSG] Найдена игра в тексте сообщения: {game}")
+                                print_flush(f"[FunPay][MSG] Найдена игра в описании заказа: {game}")
                                 break
-                                
-                        if not game_name and details:
-                            desc_text = (details.short_description or '') + ' ' + (details.full_description or '')
-                            for game in available_games:
-                                if game.lower() in desc_text.lower():
+                            
+                    if not game_name:
+                        combined_text = text + ' ' + short_description + ' ' + full_description if details else text
+                        for game in available_games:
+                            game_words = [w for w in game.lower().split() if len(w) > 3]
+                            for word in game_words:
+                                if word in combined_text.lower():
                                     game_name = game
-                                    print_flush(f"[FunPay][MSG] Найдена игра в описании заказа: {game}")
-                                    break
-                                    
-                        if not game_name:
-                            combined_text = text + ' ' + (details.short_description or '') + ' ' + (details.full_description or '') if details else text
-                            for game in available_games:
-                                game_words = [w for w in game.lower().split() if len(w) > 3]
-                                for word in game_words:
-                                    if word in combined_text.lower():
-                                        game_name = game
-                                        print_flush(f"[FunPay][MSG] Найдена игра по ключевому слову '{word}': {game}")
-                                        break
-                                if game_name:
+                                    print_flush(f"[FunPay][MSG] Найдена игра по ключевому слову '{word}': {game}")
                                     break
-                    except Exception as e:
-                        print_flush(f"[FunPay][MSG] Ошибка при поиске игры в БД: {e}")
+                            if game_name:
+                                break
+                except Exception as e:
+                    print_flush(f"[FunPay][MSG] Ошибка при поиске игры в БД: {e}")
+        
+            if game_name:
+                print_flush(f"[FunPay][MSG] Обнаружена аренда игры: {game_name}")
+                from steam.steam_account_rental_utils import mark_account_rented, auto_end_rent
+                claimed = []
+                try:
+                    if rent_seconds is None:
+                        print_flush(f"[FunPay][MSG] Не удалось определить время аренды из описания заказа: {full_description or short_description}")
+                        return None
+                    # Теперь time() будет доступна здесь
+                    from time import time
                 
-                if game_name:
-                    print_flush(f"[FunPay][MSG] Обнаружена аренда игры: {game_name}")
-                    from steam.steam_account_rental_utils import find_free_account, mark_account_rented, auto_end_rent
-                    acc = find_free_account(game_name)
-                    if not acc:
-                        self.funpay_send_message_wrapper(message.chat_id, f'Нет свободных аккаунтов для игры {game_name}.')
-                        print_flush(f'[FunPay][MSG] Нет свободных аккаунтов для {game_name}')
-                        return
-                    try:
-                        if rent_seconds is None:
-                            print_flush(f"[FunPay][MSG] Не удалось определить время аренды из описания заказа: {details.full_description}")
-                            return
-                        # Теперь time() будет доступна здесь
-                        from time import time
-                        
-                        # Умножаем время аренды на количество купленных услуг
-                        total_rent_seconds = rent_seconds * quantity
-                        
-                        # Проверяем режим friend
-                        from tg_utils.db import is_friend_mode_active, clear_friend_mode
-                        
-                        if is_friend_mode_active(chat_id) and quantity > 1:
-                            # Если включен режим friend и куплено больше 1 лота
-                            print_flush(f"[FunPay][MSG] Режим 'Для друга' активен. Выдаём {quantity} отдельных аккаунтов.")
-                            
-                            # Находим нужное количество свободных аккаунтов
-                            free_accounts = []
-                            for _ in range(quantity):
-                                acc = find_free_account(game_name)
-                                if acc:
-                                    free_accounts.append(acc)
-                                else:
-                                    break
-
-                            if len(free_accounts) < quantity:
-                                # Если недостаточно аккаунтов, отключаем режим friend и предлагаем продление
-                                clear_friend_mode(chat_id)
-                                
-                                # Проверяем, есть ли уже арендованный аккаунт
-                                conn = sqlite3.connect(DB_PATH)
-                                c = conn.cursor()
-                                c.execute("SELECT id, rented_until, order_id FROM accounts WHERE status='rented' AND tg_user_id=?", (chat_id,))
-                                acc_row = c.fetchone()
-                                conn.close()
-                                
-                                if acc_row and order_id:
-                                    # Если есть арендованный аккаунт - продлеваем его
-                                    try:
-                                        details = self.account.get_order(order_id)
-                                        from steam.steam_account_rental_utils import parse_rent_time, mark_account_rented, auto_end_rent
-                                        desc_for_parse = details.full_description or details.short_description or ""
-                                        rent_seconds = parse_rent_time(desc_for_parse)
-                                        if rent_seconds:
-                                            total_rent_seconds = rent_seconds * quantity
-                                            new_until = mark_account_rented(acc_row[0], chat_id, bonus_seconds=total_rent_seconds, order_id=order_id)
-                                            from steam.steam_account_rental_utils import format_msk_time
-                                            end_time_msk = format_msk_time(new_until)
-                                            message_text = f'✅ Аренда продлена до {end_time_msk}'
-                                            self.funpay_send_message_wrapper(chat_id, message_text)
-                                            remaining_time = new_until - time()
-                                            auto_end_rent(
-                                                acc_row[0], chat_id, remaining_time,
-                                                notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message(tg_user_id)
-                                            )
-                                    except Exception as e:
-                                        print_flush(f'[ERROR][MSG] Ошибка при продлении аренды: {e}')
-                                        traceback.print_exc(file=sys.stdout)
-                                        sys.stdout.flush()
-                                else:
-                                    # Если нет арендованного аккаунта - выдаём доступные
-                                    for i, acc in enumerate(free_accounts):
-                                        try:
-                                            acc_order_id = f"{order_id}-{i+1}" if order_id else None
-                                            new_until = mark_account_rented(acc[0], chat_id, rented_until=time() + rent_seconds, order_id=acc_order_id)
-                                            msg = (
-                                                f"🎮 Аккаунт #{i+1}:\n\n"
-                                                f"💼 Логин: {acc[1]}\n"
-                                                f"🔑 Пароль: {acc[2]}\n\n"
-                                                f"Для входа в аккаунт используйте клиент Steam."
-                                            )
-                                            self.funpay_send_message_wrapper(chat_id, msg)
-                                            remaining_time = new_until - time()
-                                            auto_end_rent(
-                                                acc[0], chat_id, remaining_time,
-                                                notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message(tg_user_id)
-                                            )
-                                            threading.Thread(target=self.send_steam_guard_code, args=(acc[0], chat_id, new_until), daemon=True).start()
-                                        except Exception as e:
-                                            print_flush(f"[FunPay][ERROR] Ошибка при выдаче аккаунта #{i+1}: {e}")
-                                            continue
-                                    
-                                    # Отправляем сообщение о недостатке аккаунтов
-                                    self.funpay_send_message_wrapper(chat_id, f"⚠️ Доступно только {len(free_accounts)} из {quantity} аккаунтов. Остальные будут выданы при освобождении.")
-                                return True
-
-                            # Выдаём каждый аккаунт отдельно
-                            for i, acc in enumerate(free_accounts):
-                                try:
-                                    # Для каждого аккаунта создаём отдельный order_id
-                                    acc_order_id = f"{order_id}-{i+1}" if order_id else None
-                                    
-                                    # Арендуем аккаунт
-                                    new_until = mark_account_rented(acc[0], chat_id, rented_until=time() + rent_seconds, order_id=acc_order_id)
-                                    
-                                    # Отправляем данные аккаунта
-                                    msg = (
-                                        f"🎮 Аккаунт #{i+1}:\n\n"
-                                        f"💼 Логин: {acc[1]}\n"
-                                        f"🔑 Пароль: {acc[2]}\n\n"
-                                        f"Для входа в аккаунт используйте клиент Steam."
-                                    )
-                                    self.funpay_send_message_wrapper(chat_id, msg)
-                                    
-                                    # Запускаем таймер для каждого аккаунта
-                                    remaining_time = new_until - time()
-                                    auto_end_rent(
-                                        acc[0], chat_id, remaining_time,
-                                        notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message(tg_user_id)
-                                    )
-                                    
-                                    # Запускаем поиск Steam Guard кода
-                                    threading.Thread(target=self.send_steam_guard_code, args=(acc[0], chat_id, new_until), daemon=True).start()
-                                    
-                                except Exception as e:
-                                    print_flush(f"[FunPay][ERROR] Ошибка при выдаче аккаунта #{i+1}: {e}")
-                                    continue
-
-                            # Очищаем режим friend после успешной выдачи
-                            clear_friend_mode(chat_id)
-                            return True
-
-                        # Используем новую версию mark_account_rented, которая возвращает точное время окончания
-                        # При новой аренде передаем rented_until как абсолютный timestamp
-                        new_until = mark_account_rented(acc[0], message.chat_id, rented_until=time() + total_rent_seconds, order_id=order_id)
-                        
-                        # Логируем с учетом количества
-                        if quantity > 1:
-                            print_flush(f'[FunPay][MSG] Аккаунт {acc[0]} арендован на {total_rent_seconds // 60} минут ({quantity} шт. x {rent_seconds // 60} минут).')
-                        else:
-                            print_flush(f'[FunPay][MSG] Аккаунт {acc[0]} арендован на {total_rent_seconds // 60} минут.')
-                        
-                        # --- Запускаем таймеры для предупреждения и автоосвобождения ---
-                        # Передаем точное время до окончания аренды
-                        remaining_time = new_until - time()
-                        auto_end_rent(
-                            acc[0], message.chat_id, remaining_time,
-                            notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message(tg_user_id)
-                        )
-                    except Exception as e:
-                        print_flush(f'[ERROR][MSG] Не удалось пометить аккаунт как занятый: {e}')
-                        import traceback
-                        traceback.print_exc(file=sys.stdout)
-                        sys.stdout.flush()
-                    login, password, game_name_db = acc[1], acc[2], acc[3]
+                    # Умножаем время аренды на количество купленных услуг
+                    total_rent_seconds = rent_seconds * quantity
+                
+                    # Проверяем режим friend
+                    from tg_utils.db import is_friend_mode_active, clear_friend_mode
+                
+                    if is_friend_mode_active(chat_id) and quantity > 1:
+                        # Если включен режим friend и куплено больше 1 лота
+                        print_flush(f"[FunPay][MSG] Режим 'Для друга' активен. Выдаём {quantity} отдельных аккаунтов.")
                     
-                    # Убираем информацию о длительности аренды из сообщения
-                    msg = (
-                        f"🎮 Ваш арендованный Steam-аккаунт:\n\n"
-                        f"💼 Логин: {login}\n"
-                        f"🔑 Пароль: {password}\n\n"
-                        f"Для входа в аккаунт используйте клиент Steam."
-                    )
-                    try:
-                        self.funpay_send_message_wrapper(message.chat_id, msg)
-                        print_flush(f'[FunPay][MSG] Аккаунт {acc[0]} выдан.')
-                        # --- Через 3 секунды ищем Steam Guard код и отправляем клиенту ---
-                        def send_steam_guard_code():
-                            from utils.logger import logger as utils_logger
-                            print_flush(f"[FunPay][STEAM GUARD] Начинаем поиск Steam Guard кода для аккаунта {acc[0]}")
-                            from time import sleep
-                            sleep(3)
-                            
-                            # Проверяем настройку steam_guard_enabled
-                            import sqlite3
-                            from steam.steam_account_rental_utils import DB_PATH
-                            conn = sqlite3.connect(DB_PATH)
-                            c = conn.cursor()
-                            c.execute("SELECT steam_guard_enabled FROM accounts WHERE id=?", (acc[0],))
-                            steam_guard_enabled = c.fetchone()[0]
-                            conn.close()
-                            
-                            if not steam_guard_enabled:
-                                print_flush(f"[FunPay][STEAM GUARD] Поиск кода отключен для аккаунта {acc[0]}")
-                                return
-                            
-                            # Получаем почтовые данные из БД по ID аккаунта
-                            from db.accounts import get_account_by_id
-                            _, _, email_login, email_password, imap_host = get_account_by_id(acc[0])
-                            if not (email_login and email_password and imap_host):
-                                print_flush(f"[FunPay][STEAM GUARD] Нет почтовых данных для аккаунта {acc[0]}")
-                                return
-                            
-                            try:
-                                from utils.email_utils import fetch_steam_guard_code_from_email
-                                code = fetch_steam_guard_code_from_email(email_login, email_password, imap_host, logger=utils_logger)
-                                if code:
-                                    # Проверяем, что это не автоматический вход при окончании аренды
-                                    import sqlite3
-                                    from steam.steam_account_rental_utils import DB_PATH
-                                    conn = sqlite3.connect(DB_PATH)
-                                    c = conn.cursor()
-                                    c.execute("SELECT status, rented_until, order_id FROM accounts WHERE id=?", (acc[0],))
-                                    row = c.fetchone()
-                                    conn.close()
-                                    
-                                    # Если аккаунт в статусе rented и rented_until скоро будет истекать, вероятно это auto_end_rent
-                                    import time
-                                    current_time = time.time()
-                                    is_auto_end_rent = False
-                                    
-                                    if row and row[0] == 'rented' and row[1] is not None:
-                                        remaining_time = float(row[1]) - current_time
-                                        if remaining_time <= 60:  # Если осталось меньше минуты
-                                            is_auto_end_rent = True
-                                            print_flush(f"[FunPay][STEAM GUARD] Код {code} не будет отправлен клиенту, так как это автоматическое окончание аренды")
-                                    
-                                    # Отправляем код только если это не auto_end_rent
-                                    if not is_auto_end_rent:
-                                        # Используем новую функцию с форматированным сообщением
-                                        from steam.steam_account_rental_utils import send_steam_guard_code
-                                        # Получаем timestamp окончания аренды
-                                        rented_until = float(row[1]) if row and row[1] is not None else (current_time + 3600)  # Если нет - ставим 1 час
-                                        
-                                        # Функция-обёртка для self.account.send_message, обеспечивающая правильную передачу параметров
-                                        def send_msg_wrapper(chat_id, text):
-                                            try:
-                                                self.funpay_send_message_wrapper(chat_id, text)
-                                            except Exception as e:
-                                                print_flush(f"[FunPay][ERROR] Не удалось отправить сообщение: {e}")
-                                        
-                                        send_steam_guard_code(message.chat_id, code, rented_until, send_msg_wrapper)
-                                        print_flush(f"[FunPay][STEAM GUARD] Код {code} отправлен клиенту для аккаунта {acc[0]}")
-                                else:
-                                    print_flush(f"[FunPay][STEAM GUARD] Код не найден для аккаунта {acc[0]}")
-                            except Exception as e:
-                                print_flush(f"[FunPay][STEAM GUARD] Ошибка при поиске Steam Guard кода для аккаунта {acc[0]}: {e}")
-                                traceback.print_exc(file=sys.stdout)
-                                sys.stdout.flush()
-                        threading.Thread(target=send_steam_guard_code, daemon=True).start()
-                    except Exception as e:
-                        print_flush(f'[ERROR][MSG] Не удалось отправить данные аккаунта клиенту: {e}')
-                        import traceback
-                        traceback.print_exc(file=sys.stdout)
-                        sys.stdout.flush()
-                    return
-                else:
-                    # Не удалось определить игру по сообщению
-                    print_flush(f"[FunPay][MSG] Не удалось определить игру из сообщения: {text}")
-                    try:
-                        # Получаем список доступных игр
-                        conn = sqlite3.connect(DB_PATH)
-                        c = conn.cursor()
-                        c.execute("SELECT DISTINCT game_name FROM accounts WHERE status='free'")
-                        available_games = [row[0] for row in c.fetchall()]
-                        conn.close()
-                        
-                        if available_games:
-                            games_list = ", ".join(available_games)
-                            print_flush(f"[FunPay][MSG] Доступные игры: {games_list}")
-                            # Можно отправить список доступных игр клиенту, но это опционально
-                    except Exception as e:
-                        print_flush(f"[FunPay][MSG] Ошибка при получении списка игр: {e}")
-            # --- Тестовая команда: если сообщение содержит 'дай' ---
-            if "дай" in text.lower():
-                # Проверяем, что команда от определенного пользователя
-                allowed_users = ["dadayaredaze"]
-                if author.lower() not in [user.lower() for user in allowed_users]:
-                    print_flush(f"[FunPay][TEST] Команда 'дай' от неавторизованного пользователя {author}. Игнорируем.")
-                    return
+                        return self._issue_friend_order(chat_id, order_id, quantity, game_name, rent_seconds)
+
+                    # Резервируем свободный аккаунт атомарно: параллельный заказ не получит тот же аккаунт
+                    claimed = claim_accounts(game_name, 1, order_id, time() + total_rent_seconds, tg_user_id=chat_id)
+                    if not claimed:
+                        # заказ остается необработанным: повторная попытка (запасной путь) не дублирует сообщение
+                        self.funpay_send_message_wrapper(chat_id, f'Нет свободных аккаунтов для игры {game_name}.',
+                                                         key=f"no_accounts:{order_id}" if order_id else None)
+                        print_flush(f'[FunPay][MSG] Нет свободных аккаунтов для {game_name}')
+                        return None
+                    acc = claimed[0]
+                    new_until = float(acc["rented_until"])
                 
-                # Проверяем, есть ли указание на количество в сообщении
-                quantity_match = re.search(r'дай\s+(\d+)', text.lower())
-                test_quantity = int(quantity_match.group(1)) if quantity_match else 1
+                    # Логируем с учетом количества
+                    if quantity > 1:
+                        print_flush(f'[FunPay][MSG] Аккаунт {acc[0]} арендован на {total_rent_seconds // 60} минут ({quantity} шт. x {rent_seconds // 60} минут).')
+                    else:
+                        print_flush(f'[FunPay][MSG] Аккаунт {acc[0]} арендован на {total_rent_seconds // 60} минут.')
                 
-                game_name = "Counter-Strike: GO"
-                print_flush(f"[FunPay][TEST] Команда 'дай' от {author}. Выдаём тестовый аккаунт {game_name} на {test_quantity} минут(ы).")
-                from steam.steam_account_rental_utils import find_free_account, mark_account_rented, auto_end_rent
-                acc = find_free_account(game_name)
-                if not acc:
-                    self.funpay_send_message_wrapper(message.chat_id, "Нет свободных аккаунтов для теста.")
-                    return
+                    # --- Запускаем таймеры для предупреждения и автоосвобождения ---
+                    # Передаем точное время до окончания аренды
+                    remaining_time = new_until - time()
+                    auto_end_rent(
+                        acc[0], chat_id, remaining_time,
+                        notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message(tg_user_id)
+                    )
+                except Exception as e:
+                    print_flush(f'[ERROR][MSG] Не удалось пометить аккаунт как занятый: {e}')
+                    import traceback
+                    traceback.print_exc(file=sys.stdout)
+                    sys.stdout.flush()
+                    # аккаунт, занятый до ошибки, покупателю не выдан - возвращаем его в пул
+                    for row in claimed:
+                        mark_account_free(row[0])
+                    return False
                 login, password, game_name_db = acc[1], acc[2], acc[3]
-                # Пометить аккаунт как арендованный на указанное количество минут
-                from time import time
-                # Для тестового режима используем специальный префикс
-                # Передаем длительность аренды в bonus_seconds
-                new_until = mark_account_rented(acc[0], message.chat_id, bonus_seconds=60 * test_quantity, order_id=f"TEST-{acc[0]}")
-
+            
                 # Убираем информацию о длительности аренды из сообщения
                 msg = (
                     f"🎮 Ваш арендованный Steam-аккаунт:\n\n"
@@ -836,124 +807,44 @@ class FunPayListener:
                     f"🔑 Пароль: {password}\n\n"
                     f"Для входа в аккаунт используйте клиент Steam."
                 )
-                self.funpay_send_message_wrapper(message.chat_id, msg)
-                # Steam Guard код (если есть)
-                def send_steam_guard_code_test():
-                    from utils.logger import logger as utils_logger
-                    print_flush(f"[FunPay][STEAM GUARD TEST] Ищу Steam Guard кода для аккаунта {acc[0]}")
-                    from time import sleep
-                    sleep(3)
-                    from db.accounts import get_account_by_id
-                    _, _, email_login, email_password, imap_host = get_account_by_id(acc[0])
-                    if not (email_login and email_password and imap_host):
-                        print_flush(f"[FunPay][STEAM GUARD TEST] Нет почтовых данных для аккаунта {acc[0]}")
-                        return
-                    try:
-                        from utils.email_utils import fetch_steam_guard_code_from_email
-                        # Ищем код в течение 10 минут
-                        print_flush(f"[FunPay][STEAM GUARD TEST] Запускаем поиск кода с таймаутом 600 секунд (10 минут)")
-                        code = fetch_steam_guard_code_from_email(email_login, email_password, imap_host, logger=utils_logger)
-                        if code:
-                            # Используем новую функцию с форматированным сообщением
-                            from steam.steam_account_rental_utils import send_steam_guard_code
-                            # Для тестовой аренды на указанное количество минут
-                            current_time = time()
-
-                            # Функция-обёртка для self.account.send_message
-                            def send_msg_wrapper(chat_id, text):
-                                try:
-                                    self.funpay_send_message_wrapper(chat_id, text)
-                                except Exception as e:
-                                    print_flush(f"[FunPay][ERROR] Не удалось отправить тестовое сообщение: {e}")
-
-                            send_steam_guard_code(message.chat_id, code, current_time + (test_quantity * 60), send_msg_wrapper)
-                            print_flush(f"[FunPay][STEAM GUARD TEST] Код {code} отправлен клиенту для аккаунта {acc[0]}")
-                        else:
-                            print_flush(f"[FunPay][STEAM GUARD TEST] Код не найден для аккаунта {acc[0]} после 10 минут поиска")
-                    except Exception as e:
-                        print_flush(f"[FunPay][STEAM GUARD TEST] Ошибка при поиске Steam Guard кода для аккаунта {acc[0]}: {e}")
-                        traceback.print_exc(file=sys.stdout)
-                        sys.stdout.flush()
-                threading.Thread(target=send_steam_guard_code_test, daemon=True).start()
-                # Запускаем автоосвобождение и смену данных через указанное количество минут
                 try:
-                    print_flush(f"[FunPay][TEST] Запускаем тестовую аренду на {test_quantity * 60} секунд для аккаунта {acc[0]}")
-                    auto_end_rent(acc[0], message.chat_id, test_quantity * 60,
-                                 notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message({'chat_id': tg_user_id, 'order_id': f"TEST-{acc[0]}"}, lambda chat_id, text: self.funpay_send_message_wrapper(chat_id, text)))
-                    print_flush(f"[FunPay][TEST] Таймер завершения аренды успешно запущен для аккаунта {acc[0]}")
+                    self.funpay_send_message_wrapper(chat_id, msg,
+                                                     key=f"credentials:{order_id}:{acc[0]}" if order_id else None)
+                    if order_id:
+                        order_ledger.mark_message_sent(order_id, acc[0])
+                    print_flush(f'[FunPay][MSG] Аккаунт {acc[0]} выдан.')
                 except Exception as e:
-                    print_flush(f"[FunPay][TEST] Не удалось запустить авто-завершение тестовой аренды: {e}")
+                    print_flush(f'[ERROR][MSG] Не удалось отправить данные аккаунта клиенту: {e}')
+                    import traceback
                     traceback.print_exc(file=sys.stdout)
                     sys.stdout.flush()
-                return
-            if 'wassupbeijing' in text.lower():
-                self.funpay_send_message_wrapper(message.chat_id, 'wassup!')
-            # --- Обработка команды !check ---
-            if text.strip().lower().startswith("!check"):
-                parts = text.strip().split(" ", 1)
-                if len(parts) < 2:
-                    self.funpay_send_message_wrapper(message.chat_id, "Пожалуйста, укажите название игры после !check")
-                    return
-                game_query = parts[1].strip() # Сохраняем оригинальный запрос игры для сообщения
-                game_query_lower = game_query.lower() # Используем нижний регистр для поиска
-                
-                import sqlite3
-                from steam.steam_account_rental_utils import DB_PATH, format_msk_time # Импортируем format_msk_time
-                import time # Импортируем time
-                
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                
-                # Сначала ищем свободные аккаунты по частичному совпадению (регистр не важен)
-                c.execute("SELECT game_name, COUNT(*) FROM accounts WHERE status='free' AND LOWER(game_name) LIKE ?", (f"%{game_query_lower}%",))
-                row_free = c.fetchone()
-                
-                if row_free and row_free[1] > 0:
-                    # Есть свободные аккаунты
-                    count = row_free[1]
-                    game_name = row_free[0] # Используем название игры из БД
-                    if count == 1:
-                        msg = f"Есть свободный аккаунт для игры {game_name}"
-                    else:
-                        msg = f"{count} свободных аккаунтов для игры {game_name}"
-                else:
-                    # Нет свободных аккаунтов, ищем ближайший занятый для этой игры
-                    c.execute("""
-                        SELECT rented_until, game_name 
-                        FROM accounts 
-                        WHERE LOWER(game_name) LIKE ? AND status='rented' 
-                        ORDER BY rented_until ASC 
-                        LIMIT 1
-                    """, (f"%{game_query_lower}%",))
-                    row_rented = c.fetchone()
-                    
-                    if row_rented and row_rented[0] is not None:
-                        # Найден занятый аккаунт, сообщаем, когда он освободится
-                        rented_until_timestamp = float(row_rented[0])
-                        game_name_rented = row_rented[1] # Используем название игры из БД
-                        
-                        # Проверяем, что время освобождения в будущем
-                        if rented_until_timestamp > time.time():
-                            free_time_msk = format_msk_time(rented_until_timestamp)
-                            msg = f"Нет свободных аккаунтов для игры {game_name_rented}. Ближайший освободится примерно {free_time_msk}."
-                        else:
-                            # Аккаунт должен был уже освободиться, но статус не сброшен
-                            msg = f"Нет свободных аккаунтов для игры {game_query}. Пожалуйста, попробуйте позже."
-                            # Возможно, здесь стоит добавить логирование или уведомление администратору
-                            print_flush(f"[FunPay][MSG][WARN] Аккаунт для игры '{game_query_lower}' должен был освободиться, но статус 'rented'. acc_id: ???") # TODO: добавить acc_id в запрос если нужно
-                            
-                    else:
-                        # Нет ни свободных, ни занятых аккаунтов для этого запроса
-                        msg = f"Нет свободных аккаунтов для игры {game_query}."
+                    # данные не поставлены в очередь - аккаунт возвращается в пул, заказ можно выдать повторно
+                    mark_account_free(acc[0])
+                    return False
+                # --- Ждем Steam Guard код и отправляем клиенту, когда он придет на почту ---
+                try:
+                    self.send_steam_guard_code(acc[0], chat_id)
+                except Exception as e:
+                    print_flush(f'[FunPay][STEAM GUARD] Не удалось запустить ожидание кода для аккаунта {acc[0]}: {e}')
+                return True
+            else:
+                # Не удалось определить игру по сообщению
+                print_flush(f"[FunPay][MSG] Не удалось определить игру из сообщения: {text}")
+                try:
+                    # Получаем список доступных игр
+                    available_games = accounts_repo.games(free_only=True)
                 
-                conn.close()
-                self.funpay_send_message_wrapper(message.chat_id, msg)
-                return
+                    if available_games:
+                        games_list = ", ".join(available_games)
+                        print_flush(f"[FunPay][MSG] Доступные игры: {games_list}")
+                        # Можно отправить список доступных игр клиенту, но это опционально
+                except Exception as e:
+                    print_flush(f"[FunPay][MSG] Ошибка при получении списка игр: {e}")
         except Exception as e:
-            print_flush(f"[FunPay] Ошибка в обработчике нового сообщения: {e}")
-            import traceback
+            print_flush(f'[FunPay] Ошибка при выдаче аккаунта по заказу {order_id}: {e}')
             traceback.print_exc(file=sys.stdout)
             sys.stdout.flush()
+            return False
 
     def handle_review_message(self, event):
         """
@@ -1025,19 +916,10 @@ class FunPayListener:
 
             # --- ПРОВЕРКА И ВЫДАЧА БОНУСА ---
             # Проверяем, был ли уже выдан бонус за этот заказ
-            import sqlite3
-            from steam.steam_account_rental_utils import DB_PATH
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("PRAGMA table_info(accounts)")
-            columns = [column[1] for column in c.fetchall()]
             bonus_given = 0
-            if 'bonus_given' in columns:
-                c.execute("SELECT bonus_given FROM accounts WHERE id=?", (account_id,))
-                row = c.fetchone()
-                if row and row[0]:
-                    bonus_given = int(row[0])
-            conn.close()
+            row = accounts_repo.get(account_id)
+            if row and row["bonus_given"]:
+                bonus_given = int(row["bonus_given"])
             if bonus_given:
                 print_flush(f"[FunPay][REVIEW] Бонус уже был выдан для аккаунта {account_id} (order_id={order_id})")
                 return True
@@ -1066,12 +948,7 @@ class FunPayListener:
                             from steam.steam_account_rental_utils import mark_account_rented, auto_end_rent, format_msk_time
                             new_until = mark_account_rented(account_id, target_chat_id, bonus_seconds=REVIEW_BONUS_TIME, order_id=order_id)
                             # Ставим флаг bonus_given=1
-                            conn = sqlite3.connect(DB_PATH)
-                            c = conn.cursor()
-                            if 'bonus_given' in columns:
-                                c.execute("UPDATE accounts SET bonus_given=1 WHERE id=?", (account_id,))
-                                conn.commit()
-                            conn.close()
+                            accounts_repo.set_bonus_given(account_id)
 
                             # Получаем форматированное время окончания аренды
                             end_time_msk = format_msk_time(new_until)
@@ -1140,6 +1017,105 @@ class FunPayListener:
             return int(match.group(1))
         return 12  # по умолчанию 12 часов
 
+    def _issue_friend_accounts(self, chat_id, accounts, order_id=None):
+        """
+        Отправляет покупателю данные аккаунтов, занятых claim_accounts() в режиме 'Для друга',
+        и запускает для каждого таймеры аренды и поиск Steam Guard кода.
+        Аккаунты, данные которых по журналу заказа уже отправлены, пропускаются.
+        """
+        for i, acc in enumerate(accounts):
+            try:
+                if order_id and order_ledger.message_sent(order_id, acc[0]):
+                    print_flush(f"[FunPay][ORDER] Данные аккаунта {acc[0]} по заказу {order_id} уже отправлены")
+                    continue
+                new_until = float(acc["rented_until"])
+                msg = (
+                    f"🎮 Аккаунт #{i+1}:\n\n"
+                    f"💼 Логин: {acc[1]}\n"
+                    f"🔑 Пароль: {acc[2]}\n\n"
+                    f"Для входа в аккаунт используйте клиент Steam."
+                )
+                self.funpay_send_message_wrapper(chat_id, msg,
+                                                 key=f"credentials:{acc['order_id']}:{acc[0]}" if order_id else None)
+                if order_id:
+                    order_ledger.mark_message_sent(order_id, acc[0])
+                remaining_time = new_until - time()
+                auto_end_rent(
+                    acc[0], chat_id, remaining_time,
+                    notify_callback=lambda acc_id, tg_user_id: self.send_order_completed_message(tg_user_id)
+                )
+                self.send_steam_guard_code(acc[0], chat_id, new_until)
+            except Exception as e:
+                print_flush(f"[FunPay][ERROR] Ошибка при выдаче аккаунта #{i+1}: {e}")
+                continue
+
+    def send_steam_guard_code(self, acc_id, chat_id, rented_until=None):
+        """
+        Регистрирует ожидание Steam Guard кода аккаунта в брокере кодов (utils.email_utils.guard_broker):
+        код ставится в очередь отправки покупателю, как только письмо придет на почту. Поток на ожидание
+        не создается; ожидание отменяется при окончании аренды.
+
+        Args:
+            acc_id: ID аккаунта Steam
+            chat_id: ID чата покупателя
+            rented_until: время окончания аренды (timestamp); если не указано, берется из БД
+
+        Returns:
+            concurrent.futures.Future | None: ожидание кода или None, если код искать не нужно
+        """
+        from utils.email_utils import guard_broker, GUARD_CODE_MARGIN
+        from utils.logger import logger as utils_logger
+
+        row = accounts_repo.get(acc_id)
+        if not row:
+            return None
+        if not row["steam_guard_enabled"]:
+            print_flush(f"[FunPay][STEAM GUARD] Поиск кода отключен для аккаунта {acc_id}")
+            return None
+        if not (row["email_login"] and row["email_password"] and row["imap_host"]):
+            print_flush(f"[FunPay][STEAM GUARD] Нет почтовых данных для аккаунта {acc_id}")
+            return None
+        if rented_until is None and row["rented_until"] is not None:
+            rented_until = float(row["rented_until"])
+        # короткая аренда целиком укладывается в отступ - код за последнюю минуту нужен покупателю
+        short_rent = rented_until is not None and rented_until - time() <= GUARD_CODE_MARGIN
+
+        print_flush(f"[FunPay][STEAM GUARD] Ожидаем Steam Guard код для аккаунта {acc_id}")
+        future = guard_broker.request(row["email_login"], row["email_password"], row["imap_host"], account_id=acc_id,
+                                      until=rented_until, logger=utils_logger)
+
+        def on_code(future):
+            if future.cancelled():
+                print_flush(f"[FunPay][STEAM GUARD] Ожидание кода для аккаунта {acc_id} отменено: аренда завершена")
+                return
+            try:
+                code = future.result()
+                if not code:
+                    print_flush(f"[FunPay][STEAM GUARD] Код не найден для аккаунта {acc_id}")
+                    return
+                # Если до конца аренды меньше минуты, это вход при автоматическом окончании аренды
+                current = accounts_repo.get(acc_id)
+                until = float(current["rented_until"]) if current and current["rented_until"] is not None \
+                    else (rented_until or time() + 3600)
+                if not short_rent and current and current["status"] == 'rented' and until - time() <= GUARD_CODE_MARGIN:
+                    print_flush(f"[FunPay][STEAM GUARD] Код {code} не будет отправлен клиенту, так как это автоматическое окончание аренды")
+                    return
+                from steam.steam_account_rental_utils import send_steam_guard_code
+
+                def send_msg_wrapper(chat_id, text):
+                    try:
+                        self.funpay_send_message_wrapper(chat_id, text, key=f"guard:{acc_id}:{code}")
+                    except Exception as e:
+                        print_flush(f"[FunPay][ERROR] Не удалось отправить сообщение: {e}")
+
+                send_steam_guard_code(chat_id, code, until, send_msg_wrapper)
+                print_flush(f"[FunPay][STEAM GUARD] Код {code} отправлен клиенту для аккаунта {acc_id}")
+            except Exception as e:
+                print_flush(f"[FunPay][STEAM GUARD] Ошибка при поиске Steam Guard кода для аккаунта {acc_id}: {e}")
+
+        future.add_done_callback(on_code)
+        return future
+
     def send_order_completed_message(self, message_chat_id, order_id=None):
         """
         Отправляет сообщение о выполнении заказа
@@ -1152,22 +1128,11 @@ class FunPayListener:
             # Если order_id не передан или это тестовый/телеграм ID, пробуем найти настоящий ID заказа
             if not order_id or order_id.startswith('TG-') or order_id.startswith('TEST-'):
                 try:
-                    from steam.steam_account_rental_utils import DB_PATH
-                    import sqlite3
-                    conn = sqlite3.connect(DB_PATH)
-                    c = conn.cursor()
-                    # Проверяем наличие столбца order_id в таблице accounts
-                    c.execute("PRAGMA table_info(accounts)")
-                    columns = [column[1] for column in c.fetchall()]
-                    
-                    if 'order_id' in columns:
-                        # Ищем order_id по chat_id (tg_user_id) и статусу 'rented'
-                        c.execute("SELECT order_id FROM accounts WHERE tg_user_id=? AND status='rented'", (message_chat_id,))
-                        row = c.fetchone()
-                        if row and row[0] and not (row[0].startswith('TG-') or row[0].startswith('TEST-')):
-                            order_id = row[0]
-                            print_flush(f"[FunPay][ORDER] Найден ID заказа в БД: {order_id}")
-                    conn.close()
+                    # Ищем order_id по chat_id (tg_user_id) и статусу 'rented'
+                    row = accounts_repo.rented_by_user(message_chat_id)
+                    if row and row["order_id"] and not (row["order_id"].startswith('TG-') or row["order_id"].startswith('TEST-')):
+                        order_id = row["order_id"]
+                        print_flush(f"[FunPay][ORDER] Найден ID заказа в БД: {order_id}")
                 except Exception as e:
                     print_flush(f"[ERROR] Не удалось получить ID заказа из базы данных: {e}")
             
@@ -1186,20 +1151,22 @@ class FunPayListener:
         except Exception as e:
             print_flush(f"[FunPay][ERROR] Не удалось отправить сообщение о выполнении заказа: {e}")
 
-    def funpay_send_message_wrapper(self, chat_id, text):
+    def funpay_send_message_wrapper(self, chat_id, text, key=None):
         """
         Обертка для отправки сообщений в FunPay без HTML-тегов.
+        Сообщение ставится в очередь funpay_outbox и отправляется в фоне, поток событий не ждет отправки.
         
         Args:
             chat_id: ID чата FunPay
             text: Текст сообщения, возможно с HTML-тегами
+            key: ключ идемпотентности (сообщение с тем же ключом повторно не отправляется, в т.ч. после перезапуска)
         """
         try:
             # Удаляем HTML-теги <code> и </code>
             clean_text = text.replace("<code>", "").replace("</code>", "")
             # Исправляем экранированные переносы строк
             clean_text = clean_text.replace("\\n", "\n").replace('\r\n', '\n').replace('\r', '\n')
-            self.account.send_message(chat_id, clean_text)
+            outbox.enqueue(self.account.id, chat_id, clean_text, key=key)
             return True
         except Exception as e:
             print_flush(f"[ERROR] Ошибка при отправке сообщения в FunPay: {e}")
@@ -1216,25 +1183,9 @@ class FunPayListener:
             tuple: (account_id, rented_until, chat_id) или (None, None, None), если аккаунт не найден
         """
         try:
-            from steam.steam_account_rental_utils import DB_PATH
-            import sqlite3
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            
-            # Проверяем наличие столбца order_id
-            c.execute("PRAGMA table_info(accounts)")
-            columns = [column[1] for column in c.fetchall()]
-            
-            if 'order_id' in columns:
-                c.execute("SELECT id, rented_until, tg_user_id FROM accounts WHERE order_id=? AND status='rented'", (order_id,))
-                row = c.fetchone()
-                conn.close()
-                
-                if row:
-                    return row[0], row[1], row[2]
-            else:
-                conn.close()
-                print_flush(f"[FunPay][ERROR] В таблице accounts отсутствует столбец order_id")
+            row = accounts_repo.by_order(order_id)
+            if row:
+                return row["id"], row["rented_until"], row["tg_user_id"]
         except Exception as e:
             print_flush(f"[FunPay][ERROR] Ошибка при получении информации об аккаунте по ID заказа {order_id}: {e}")
             traceback.print_exc(file=sys.stdout)
@@ -0,0 +1,210 @@
+"""
+Несколько аккаунтов FunPay в одном процессе.
+
+Профили продавцов задаются переменной окружения GOLDEN_KEYS (через запятую, у каждого ключа можно указать свой
+интервал опроса: "key1,key2:3.5") или списком FunPay.accounts в файле настроек:
+    {"FunPay": {"accounts": [{"golden_key": "...", "user_agent": "...", "poll_delay": 4, "name": "main"}]}}
+Если ни то, ни другое не задано, запускается один аккаунт с GOLDEN_KEY, как раньше.
+
+Каждый аккаунт работает в своем FunPayListener (свой Account, Runner и поток опроса со своим интервалом),
+все аккаунты используют общий пул HTTP-соединений и общую БД аренды. Менеджер запоминает, какому аккаунту
+принадлежит чат, чтобы уведомления по аренде уходили от того же продавца, которому заплатил покупатель.
+
+Менеджер также хранит авторизованные аккаунты процесса: каждый golden_key авторизуется один раз, и все
+уведомления (в т.ч. отправленные до запуска слушателей, например при восстановлении таймеров аренды)
+используют уже созданный FunPayListener. Сессия (PHPSESSID и csrf-токен) обновляется лениво - перед отправкой
+сообщения, если она старше SESSION_MAX_AGE, или после ошибки авторизации.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("funpay_manager")
+
+# Размер общего пула соединений с FunPay в расчете на один аккаунт
+POOL_SIZE_PER_ACCOUNT = int(os.getenv("FUNPAY_POOL_SIZE_PER_ACCOUNT", "4"))
+# Через сколько секунд после авторизации сессия аккаунта считается устаревшей
+SESSION_MAX_AGE = int(os.getenv("FUNPAY_SESSION_MAX_AGE", "3600"))
+
+
+def load_profiles() -> list[dict]:
+    """
+    Читает профили аккаунтов из GOLDEN_KEYS или файла настроек.
+
+    Returns:
+        list: [{"golden_key", "user_agent", "poll_delay", "name"}, ...]; пустой список - профили не заданы
+    """
+    profiles = []
+    for entry in os.getenv("GOLDEN_KEYS", "").split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        key, _, delay = entry.partition(":")
+        profiles.append({"golden_key": key.strip(), "poll_delay": float(delay) if delay.strip() else None})
+    if profiles:
+        return profiles
+
+    from funpay_integration import SETTINGS_PATH
+    if not os.path.exists(SETTINGS_PATH):
+        return []
+    try:
+        with open(SETTINGS_PATH, encoding='utf-8') as f:
+            config = json.load(f)
+    except Exception as e:
+        logger.error(f"[FUNPAY_MANAGER] Ошибка при загрузке настроек из файла: {e}")
+        return []
+    funpay_cfg = config.get('FunPay', {}) if isinstance(config, dict) else {}
+    for item in funpay_cfg.get('accounts') or []:
+        if isinstance(item, dict) and item.get('golden_key'):
+            profiles.append({
+                "golden_key": item['golden_key'],
+                "user_agent": item.get('user_agent') or funpay_cfg.get('user_agent'),
+                "poll_delay": item.get('poll_delay'),
+                "name": item.get('name'),
+            })
+    return profiles
+
+
+class FunPayListenerManager:
+    """
+    Запускает FunPayListener для каждого профиля и маршрутизирует чаты по аккаунтам.
+    """
+
+    def __init__(self):
+        self.listeners: list = []
+        self._chat_owner: dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._adapter: Optional[HTTPAdapter] = None
+        # авторизованные слушатели процесса: golden_key -> FunPayListener (None - ключ по умолчанию)
+        self._registry: dict[Optional[str], object] = {}
+        self._registry_lock = threading.Lock()
+        self._session_locks: dict[int, threading.Lock] = {}
+
+    def start(self) -> list:
+        """
+        Авторизует все аккаунты и запускает их слушатели. Ошибка одного аккаунта не мешает остальным.
+
+        Returns:
+            list: запущенные FunPayListener
+
+        Raises:
+            RuntimeError: если не удалось запустить ни один аккаунт
+        """
+        profiles = load_profiles()
+        if not profiles:
+            # один аккаунт из GOLDEN_KEY / golden_key файла настроек
+            listener = self.authorize()
+            listener.start()
+            self.listeners = [listener]
+            return self.listeners
+
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE_PER_ACCOUNT * len(profiles))
+        errors = []
+        for i, profile in enumerate(profiles):
+            try:
+                listener = self.authorize(profile["golden_key"], user_agent=profile.get("user_agent"),
+                                          adapter=self._adapter, poll_delay=profile.get("poll_delay"),
+                                          name=profile.get("name"))
+            except Exception as e:
+                logger.error(f"[FUNPAY_MANAGER] Не удалось авторизовать аккаунт #{i + 1}: {e}")
+                errors.append(e)
+                continue
+            listener.start()
+            self.listeners.append(listener)
+            logger.info(f"[FUNPAY_MANAGER] Аккаунт {listener.name} запущен")
+        if not self.listeners:
+            raise RuntimeError(f"не удалось запустить ни один аккаунт FunPay: {errors[0]}")
+        return self.listeners
+
+    def authorize(self, golden_key: Optional[str] = None, **kwargs):
+        """
+        Возвращает FunPayListener аккаунта, авторизуя его только при первом обращении к golden_key.
+
+        Args:
+            golden_key: golden_key аккаунта (None - GOLDEN_KEY из .env или файла настроек)
+            **kwargs: остальные параметры FunPayListener (используются только при авторизации)
+
+        Returns:
+            FunPayListener: слушатель (поток опроса запускается отдельно через start())
+        """
+        from funpay_integration import FunPayListener
+
+        with self._registry_lock:
+            listener = self._registry.get(golden_key)
+            if listener is None:
+                listener = FunPayListener(golden_key, manager=self, **kwargs)
+                logger.info(f"[FUNPAY_MANAGER] Аккаунт {listener.name} авторизован")
+                self._registry[golden_key] = listener
+                self._registry.setdefault(listener.golden_key, listener)
+            return listener
+
+    def refresh_session(self, account, force: bool = False) -> bool:
+        """
+        Обновляет сессию аккаунта (Account.get()), если она старше SESSION_MAX_AGE. Ошибки только логируются.
+
+        Args:
+            account: FunPayAPI.Account
+            force: обновить независимо от возраста сессии (например, после ошибки авторизации)
+
+        Returns:
+            bool: True, если сессия обновлена
+        """
+        with self._lock:
+            lock = self._session_locks.setdefault(account.id, threading.Lock())
+        with lock:
+            if not force and time.time() - (account.last_update or 0) < SESSION_MAX_AGE:
+                return False
+            try:
+                account.get()
+            except Exception as e:
+                logger.error(f"[FUNPAY_MANAGER] Не удалось обновить сессию аккаунта {account.username}: {e}")
+                return False
+        logger.info(f"[FUNPAY_MANAGER] Сессия аккаунта {account.username} обновлена")
+        return True
+
+    def route_event(self, listener, event):
+        """Запоминает, что чат события принадлежит аккаунту listener."""
+        chat_id = None
+        if getattr(event, "message", None) is not None:
+            chat_id = event.message.chat_id
+        elif getattr(event, "chat", None) is not None:
+            chat_id = event.chat.id
+        elif getattr(event, "order", None) is not None:
+            chat_id = event.order.chat_id
+        if chat_id is not None:
+            with self._lock:
+                self._chat_owner[str(chat_id)] = listener
+
+    def listener_for_chat(self, chat_id=None):
+        """
+        Возвращает слушатель аккаунта, которому принадлежит чат (или первый аккаунт, если чат неизвестен).
+
+        Returns:
+            FunPayListener | None: None, если ни один аккаунт не запущен
+        """
+        with self._lock:
+            listener = self._chat_owner.get(str(chat_id)) if chat_id is not None else None
+        if listener is None and self.listeners:
+            listener = self.listeners[0]
+        return listener
+
+
+# Общий менеджер процесса
+listener_manager = FunPayListenerManager()
+
+
+def get_listener(chat_id=None):
+    """
+    Возвращает слушатель аккаунта для отправки сообщений в чат chat_id.
+    Если слушатели в этом процессе еще не запущены, возвращает общий FunPayListener для GOLDEN_KEY
+    (авторизуется один раз на процесс).
+    """
+    listener = listener_manager.listener_for_chat(chat_id)
+    if listener is None:
+        listener = listener_manager.authorize()
+    return listener
@@ -0,0 +1,302 @@
+"""
+Очередь исходящих сообщений FunPay.
+
+Сообщения покупателям (данные аккаунта, коды Steam Guard, предупреждения и уведомления об окончании аренды)
+не отправляются в потоке обработки событий, а записываются в таблицу outbound_messages. Поток-диспетчер берет
+первое неотправленное сообщение каждого чата (порядок сообщений внутри чата сохраняется), резервирует для него
+время отправки по общему лимиту аккаунта FunPay и лимиту чата и передает в кучу готовности (min-heap по времени
+отправки) потока этого аккаунта. Поток аккаунта сам ждет наступления времени отправки, обновляет сессию и
+отправляет сообщение, поэтому ограниченный чат или устаревшая сессия одного аккаунта не задерживают отправку
+сообщений остальных аккаунтов. При ошибке (в т.ч. "Нельзя отправлять сообщения слишком часто") отправка
+повторяется с экспоненциальной задержкой.
+
+У сообщения может быть ключ идемпотентности (например, "credentials:<заказ>:<аккаунт>"): сообщение с уже
+известным ключом повторно не ставится в очередь, в т.ч. после перезапуска процесса. Сообщение, отправка
+которого прервалась перезапуском, отправляется повторно.
+"""
+import heapq
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from db.connection import get_connection
+
+logger = logging.getLogger("funpay_outbox")
+
+PENDING = 'pending'
+RUNNING = 'running'
+SENT = 'sent'
+FAILED = 'failed'
+
+# Сколько хранить отправленные / неотправленные сообщения (и их ключи идемпотентности), в секундах
+RETENTION = 7 * 24 * 60 * 60
+# Сколько не отправлять сообщения аккаунта после ошибки "слишком часто", в секундах
+FLOOD_COOLDOWN = 10
+
+# Первое неотправленное сообщение каждого чата: следующие сообщения чата ждут, пока оно не будет отправлено
+_CHAT_HEAD = (
+    "state='pending' AND id=(SELECT MIN(id) FROM outbound_messages "
+    "WHERE account_id=m.account_id AND chat_id=m.chat_id AND state IN ('pending', 'running'))"
+)
+_NEXT_MESSAGES = (
+    "SELECT id, account_id, chat_id, text, attempts FROM outbound_messages AS m "
+    f"WHERE run_at<=? AND {_CHAT_HEAD} ORDER BY run_at, id LIMIT 100"
+)
+
+
+class _AccountSender:
+    """
+    Поток отправки сообщений одного аккаунта FunPay.
+
+    Сообщения лежат в min-heap по времени отправки, зарезервированному диспетчером. Перед отправкой поток
+    дополнительно выжидает паузу после ошибки "слишком часто", перекладывая сообщение в куче, а не засыпая.
+    """
+
+    def __init__(self, queue: "OutboundMessageQueue", account_id: int):
+        self.queue = queue
+        self.account_id = account_id
+        self._heap: list[tuple[float, int, tuple]] = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f"funpay_outbox_{account_id}", daemon=True)
+        self._thread.start()
+
+    def schedule(self, ready_at: float, message: tuple):
+        """Кладет сообщение (строку _NEXT_MESSAGES) в кучу с временем отправки ready_at."""
+        with self._cond:
+            heapq.heappush(self._heap, (ready_at, message[0], message))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    self._cond.wait(self._heap[0][0] - time.time() if self._heap else None)
+                _, _, message = heapq.heappop(self._heap)
+            account = self.queue._accounts[self.account_id]
+            flood_wait = account.last_flood_err_time + FLOOD_COOLDOWN - time.time()
+            if flood_wait > 0:
+                self.schedule(time.time() + flood_wait, message)
+                continue
+            try:
+                self.queue._deliver(account, *message)
+            except Exception as e:
+                logger.error(f"[OUTBOX] Ошибка отправки сообщения #{message[0]}: {e}", exc_info=True)
+                self.queue._update(message[0], PENDING, run_at=time.time() + self.queue.backoff_base, error=str(e))
+            # следующее сообщение чата стало первым - диспетчер может его взять
+            self.queue._wakeup()
+
+
+class OutboundMessageQueue:
+    """
+    Очередь исходящих сообщений с потоком-диспетчером и потоком отправки на каждый аккаунт FunPay.
+
+    Аккаунты FunPay, от имени которых отправляются сообщения, регистрируются через register_account():
+    сообщения аккаунта, который еще не зарегистрирован в этом процессе, ждут в очереди.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 3, chat_rate: float = 0.5, chat_burst: int = 2,
+                 max_attempts: int = 5, backoff_base: float = 5, backoff_max: float = 300,
+                 poll_interval: float = 30):
+        self.rate = rate
+        self.burst = burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self._accounts: dict = {}
+        self._budgets: dict = {}
+        self._chat_budgets: dict = {}
+        self._senders: dict[int, _AccountSender] = {}
+        self._cond = threading.Condition()
+        self._woken = False
+        self._thread: Optional[threading.Thread] = None
+
+    def register_account(self, account):
+        """
+        Регистрирует аккаунт FunPay (FunPayAPI.Account) для отправки его сообщений и запускает диспетчер.
+        """
+        from FunPayAPI.updater.poll_scheduler import RequestBudget
+
+        with self._cond:
+            self._accounts[account.id] = account
+            self._budgets.setdefault(account.id, RequestBudget(self.rate, self.burst))
+            if account.id not in self._senders:
+                self._senders[account.id] = _AccountSender(self, account.id)
+        self.start()
+        conn = self._connect()
+        try:
+            # сообщения, отложенные до регистрации аккаунта, отправляются сразу (задержки повторов сохраняются)
+            conn.execute("UPDATE outbound_messages SET run_at=? WHERE account_id=? AND state=? AND attempts=0",
+                         (time.time(), account.id, PENDING))
+        finally:
+            conn.close()
+        self._wakeup()
+
+    def start(self):
+        """
+        Запускает диспетчер. При первом запуске возвращает в очередь сообщения, отправка которых была прервана
+        остановкой процесса, и удаляет старые отправленные сообщения. Таблицу outbound_messages создают миграции БД
+        (db.migrations, init_db()).
+        """
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="funpay_outbox", daemon=True)
+        now = time.time()
+        conn = self._connect()
+        try:
+            cur = conn.execute("UPDATE outbound_messages SET state=?, updated_at=? WHERE state=?",
+                               (PENDING, now, RUNNING))
+            if cur.rowcount:
+                logger.info(f"[OUTBOX] Возвращено в очередь прерванных сообщений: {cur.rowcount}")
+            conn.execute("DELETE FROM outbound_messages WHERE state IN (?, ?) AND updated_at<?",
+                         (SENT, FAILED, now - RETENTION))
+        finally:
+            conn.close()
+        self._thread.start()
+
+    def enqueue(self, account_id: int, chat_id, text: str, key: Optional[str] = None) -> Optional[int]:
+        """
+        Ставит сообщение в очередь и сразу возвращает управление.
+
+        Args:
+            account_id: ID аккаунта FunPay, от имени которого отправляется сообщение
+            chat_id: ID чата FunPay
+            text: текст сообщения
+            key: ключ идемпотентности; сообщение с уже известным ключом не ставится в очередь повторно
+
+        Returns:
+            int | None: ID сообщения в очереди или None, если сообщение с таким ключом уже было
+        """
+        self.start()
+        now = time.time()
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO outbound_messages "
+                "(idempotency_key, account_id, chat_id, text, state, run_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, account_id, str(chat_id), text, PENDING, now, now, now))
+        finally:
+            conn.close()
+        if not cur.rowcount:
+            logger.info(f"[OUTBOX] Сообщение с ключом {key} уже было поставлено в очередь, пропускаем")
+            return None
+        self._wakeup()
+        return cur.lastrowid
+
+    @staticmethod
+    def _connect() -> sqlite3.Connection:
+        return get_connection(isolation_level=None)
+
+    def _wakeup(self):
+        with self._cond:
+            self._woken = True
+            self._cond.notify()
+
+    def _next_messages(self) -> list[tuple]:
+        conn = self._connect()
+        try:
+            return conn.execute(_NEXT_MESSAGES, (time.time(),)).fetchall()
+        finally:
+            conn.close()
+
+    def _wait_timeout(self) -> float:
+        conn = self._connect()
+        try:
+            row = conn.execute(f"SELECT MIN(run_at) FROM outbound_messages AS m WHERE {_CHAT_HEAD}").fetchone()
+        finally:
+            conn.close()
+        if not row or row[0] is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(row[0] - time.time(), 0.5))
+
+    def _update(self, message_id: int, state: str, run_at: Optional[float] = None, error: Optional[str] = None,
+                attempt: bool = False):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE outbound_messages SET state=?, run_at=COALESCE(?, run_at), last_error=?, "
+                "attempts=attempts+?, updated_at=? WHERE id=?",
+                (state, run_at, error, int(attempt), time.time(), message_id))
+        finally:
+            conn.close()
+
+    def _send_delay(self, account, chat_key: tuple) -> float:
+        """Резервирует отправку и возвращает, сколько до нее ждать: общий лимит аккаунта, лимит чата и пауза
+        после ошибки "слишком часто"."""
+        from FunPayAPI.updater.poll_scheduler import RequestBudget
+
+        with self._cond:
+            chat_budget = self._chat_budgets.get(chat_key)
+            if chat_budget is None:
+                if len(self._chat_budgets) > 1000:
+                    self._chat_budgets.clear()
+                chat_budget = self._chat_budgets[chat_key] = RequestBudget(self.chat_rate, self.chat_burst)
+            budget = self._budgets[account.id]
+        flood_wait = account.last_flood_err_time + FLOOD_COOLDOWN - time.time()
+        return max(budget.reserve(), chat_budget.reserve(), flood_wait, 0)
+
+    def _run(self):
+        while True:
+            try:
+                for message in self._next_messages():
+                    self._schedule(*message)
+                timeout = self._wait_timeout()
+                with self._cond:
+                    if not self._woken:
+                        self._cond.wait(timeout)
+                    self._woken = False
+            except Exception as e:
+                logger.error(f"[OUTBOX] Ошибка диспетчера: {e}", exc_info=True)
+                time.sleep(5)
+
+    def _schedule(self, message_id: int, account_id: int, chat_id: str, text: str, attempts: int):
+        with self._cond:
+            account = self._accounts.get(account_id)
+            sender = self._senders.get(account_id)
+        if account is None:
+            # аккаунт еще не авторизован в этом процессе - ждем register_account()
+            self._update(message_id, PENDING, run_at=time.time() + self.poll_interval)
+            return
+        # сообщение остается первым в чате, пока поток аккаунта его не отправит
+        self._update(message_id, RUNNING)
+        delay = self._send_delay(account, (account_id, chat_id))
+        sender.schedule(time.time() + delay, (message_id, account_id, chat_id, text, attempts))
+
+    def _deliver(self, account, message_id: int, account_id: int, chat_id: str, text: str, attempts: int):
+        from funpay_manager import listener_manager
+        from FunPayAPI.common.exceptions import UnauthorizedError
+
+        listener_manager.refresh_session(account)
+
+        attempt = attempts + 1
+        self._update(message_id, RUNNING, attempt=True)
+        started_at = time.time()
+        try:
+            account.send_message(int(chat_id) if chat_id.isdigit() else chat_id, text)
+        except Exception as e:
+            flood = account.last_flood_err_time >= started_at
+            if isinstance(e, UnauthorizedError):
+                # PHPSESSID / csrf-токен устарели - повтор уйдет с новой сессией
+                listener_manager.refresh_session(account, force=True)
+            if attempt >= self.max_attempts:
+                self._update(message_id, FAILED, error=str(e))
+                logger.error(f"[OUTBOX] Сообщение #{message_id} в чат {chat_id} не отправлено "
+                             f"за {attempt} попыток: {e}")
+                return
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+            self._update(message_id, PENDING, run_at=time.time() + delay, error=str(e))
+            logger.warning(f"[OUTBOX] Не удалось отправить сообщение #{message_id} в чат {chat_id}"
+                           f"{' (слишком часто)' if flood else ''}: {e}. Повтор через {delay:.0f} секунд")
+            return
+        self._update(message_id, SENT)
+        logger.info(f"[OUTBOX] Сообщение #{message_id} отправлено в чат {chat_id}")
+
+
+# Общая очередь процесса
+outbox = OutboundMessageQueue()
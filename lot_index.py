@@ -0,0 +1,173 @@
+"""
+Индекс лотов продавца: лот -> игра и длительность аренды.
+
+Индекс строится по собственным лотам аккаунта (профиль продавца + поля каждого лота) и хранит для каждого
+лота нормализованное название игры из БД аренды и время аренды, распарсенное из описания один раз.
+Заказ сопоставляется с лотом по подкатегории и названию (краткому описанию), поэтому при обработке заказа
+вместо разбора описания выполняется поиск в словаре. Индекс перестраивается раз в REFRESH_INTERVAL секунд,
+а также при заказе на неизвестный лот (новый или измененный), но не чаще раза в MIN_REFRESH_INTERVAL секунд.
+Если лот так и не найден, время аренды, как и раньше, парсится из описания заказа.
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger("lot_index")
+
+# Как часто перестраивать индекс (в секундах)
+REFRESH_INTERVAL = 30 * 60
+# Минимальный интервал между перестроениями из-за заказа на неизвестный лот (в секундах)
+MIN_REFRESH_INTERVAL = 60
+
+
+def _title_key(subcategory_id, title) -> Optional[tuple]:
+    title = (title or "").strip().lower()
+    return (subcategory_id, title) if title else None
+
+
+class LotIndex:
+    """
+    Индекс лотов всех аккаунтов FunPay процесса (отдельно для каждого аккаунта).
+    """
+
+    def __init__(self):
+        self._by_lot: dict[int, dict[int, dict]] = {}
+        self._by_title: dict[int, dict[tuple, dict]] = {}
+        self._built_at: dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def refresh(self, account) -> int:
+        """
+        Перестраивает индекс лотов аккаунта.
+
+        Args:
+            account: FunPayAPI.Account
+
+        Returns:
+            int: кол-во проиндексированных лотов
+        """
+        from db.repository import accounts_repo
+        from game_name_mapper import mapper
+        from steam.steam_account_rental_utils import parse_rent_time
+
+        with self._lock:
+            self._built_at[account.id] = time.time()
+        games = accounts_repo.games()
+        by_lot, by_title = {}, {}
+        for lot in account.get_user(account.id).get_lots():
+            if not isinstance(lot.id, int):
+                # лоты валюты (ID вида "1-2-3") не сдаются в аренду
+                continue
+            try:
+                fields = account.get_lot_fields(lot.id)
+            except Exception as e:
+                logger.warning(f"[LOT_INDEX] Не удалось получить поля лота {lot.id}: {e}")
+                fields = None
+            titles = [lot.description] + ([fields.title_ru, fields.title_en] if fields else [])
+            descriptions = [fields.description_ru, fields.description_en] if fields else []
+            texts = [t for t in descriptions + titles if t]
+            category_name = lot.subcategory.category.name if lot.subcategory else ""
+            entry = {
+                "lot_id": lot.id,
+                "subcategory_id": lot.subcategory.id if lot.subcategory else None,
+                "game_name": self._match_game(mapper.normalize(category_name), texts, games),
+                # как и при разборе заказа: сначала полное описание, затем название
+                "rent_seconds": next((s for s in map(parse_rent_time, texts) if s), None),
+            }
+            by_lot[lot.id] = entry
+            for title in titles:
+                if key := _title_key(entry["subcategory_id"], title):
+                    by_title[key] = entry
+        with self._lock:
+            self._by_lot[account.id] = by_lot
+            self._by_title[account.id] = by_title
+        logger.info(f"[LOT_INDEX] Индекс аккаунта {account.username}: {len(by_lot)} лотов")
+        return len(by_lot)
+
+    @staticmethod
+    def _match_game(category_name: str, texts: list[str], games: list[str]) -> Optional[str]:
+        """Название игры из БД аренды: по категории лота, затем по вхождению в название / описание."""
+        if category_name in games:
+            return category_name
+        lowered = [t.lower() for t in texts]
+        for game in games:
+            if any(game.lower() in t for t in lowered):
+                return game
+        return None
+
+    def get_lot(self, account, lot_id: int) -> Optional[dict]:
+        """
+        Returns:
+            dict | None: {"lot_id", "subcategory_id", "game_name", "rent_seconds"} или None, если лота нет в индексе
+        """
+        self.ensure_fresh(account)
+        with self._lock:
+            return self._by_lot.get(account.id, {}).get(int(lot_id))
+
+    def find_order_lot(self, account, order) -> Optional[dict]:
+        """
+        Ищет лот заказа по подкатегории и названию. Неизвестный лот вызывает перестроение индекса
+        (не чаще MIN_REFRESH_INTERVAL).
+
+        Args:
+            account: FunPayAPI.Account
+            order: FunPayAPI.types.Order или OrderShortcut
+
+        Returns:
+            dict | None: запись индекса (см. get_lot)
+        """
+        subcategory = getattr(order, "subcategory", None)
+        key = _title_key(subcategory.id if subcategory else None,
+                         getattr(order, "short_description", None) or getattr(order, "description", None))
+        if key is None:
+            return None
+        self.ensure_fresh(account)
+        with self._lock:
+            entry = self._by_title.get(account.id, {}).get(key)
+            stale = time.time() - self._built_at.get(account.id, 0) >= MIN_REFRESH_INTERVAL
+        if entry is None and stale:
+            self._safe_refresh(account)
+            with self._lock:
+                entry = self._by_title.get(account.id, {}).get(key)
+        return entry
+
+    def rent_terms(self, account, order) -> tuple[Optional[str], Optional[int]]:
+        """
+        Игра и время аренды заказа. Если лот не найден в индексе, время аренды парсится из описания заказа.
+
+        Returns:
+            tuple: (название игры или None, время аренды в секундах или None)
+        """
+        entry = self.find_order_lot(account, order)
+        if entry and entry["rent_seconds"]:
+            return entry["game_name"], entry["rent_seconds"]
+        from steam.steam_account_rental_utils import parse_rent_time
+        desc_for_parse = (getattr(order, "full_description", None) or getattr(order, "short_description", None)
+                          or getattr(order, "description", None) or "")
+        return entry["game_name"] if entry else None, parse_rent_time(desc_for_parse)
+
+    def invalidate(self, account=None):
+        """Помечает индекс аккаунта (или всех аккаунтов) устаревшим: он перестроится при следующем обращении."""
+        with self._lock:
+            if account is None:
+                self._built_at.clear()
+            else:
+                self._built_at.pop(account.id, None)
+
+    def ensure_fresh(self, account):
+        """Перестраивает индекс аккаунта, если он старше REFRESH_INTERVAL (ошибки только логируются)."""
+        with self._lock:
+            fresh = time.time() - self._built_at.get(account.id, 0) < REFRESH_INTERVAL
+        if not fresh:
+            self._safe_refresh(account)
+
+    def _safe_refresh(self, account):
+        try:
+            self.refresh(account)
+        except Exception as e:
+            logger.error(f"[LOT_INDEX] Ошибка построения индекса лотов: {e}")
+
+
+# Общий индекс процесса
+lot_index = LotIndex()
@@ -67,10 +67,9 @@ def main():
     
     # FunPayListener
     try:
-        from funpay_integration import FunPayListener
-        fp_listener = FunPayListener()
-        fp_listener.start()
-        logger.info("O_O FunPayListener успешно запущен. Ожидание заказов с FunPay...")
+        from funpay_manager import listener_manager
+        listeners = listener_manager.start()
+        logger.info(f"O_O FunPayListener успешно запущен (аккаунтов: {len(listeners)}). Ожидание заказов с FunPay...")
     except Exception as e:
         logger.warning(f"😭 FunPay интеграция не активна: {e}")
     
@@ -1,20 +1,11 @@
 # --- ВЫБОР ИГРЫ И НАВИГАЦИЯ ПО АККАУНТАМ ---
 import logging
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-import sqlite3
-import os
-
-# Путь к базе данных
-DB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'storage', 'plugins')
-DB_PATH = os.path.join(DB_DIR, 'steam_rental.db')
+from db.repository import accounts_repo
 
 # --- ВЫБОР ИГРЫ И НАВИГАЦИЯ ПО АККАУНТАМ ---
 def games_menu():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT game_name FROM accounts")
-    games = [r[0] for r in c.fetchall()]
-    conn.close()
+    games = accounts_repo.games()
     markup = InlineKeyboardMarkup()
     for game in games:
         markup.add(InlineKeyboardButton(game, callback_data=f"select_game:{game}"))
@@ -23,13 +14,7 @@ def games_menu():
 
 def show_accounts_page(bot, call, game, idx):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT id, login, password, status, steam_guard_enabled FROM accounts WHERE game_name=? ORDER BY id", (game,))
-        accounts = c.fetchall()
-        conn.close()
-        
-        total = len(accounts)
+        accounts, total, _ = accounts_repo.page_by_game(game, idx)
         if total == 0:
             markup = InlineKeyboardMarkup()
             markup.add(InlineKeyboardButton("⬅️ Назад", callback_data="list_accs"))
@@ -37,7 +22,9 @@ def show_accounts_page(bot, call, game, idx):
             return
             
         idx = max(0, min(idx, total-1))
-        acc_id, login, password, status, steam_guard_enabled = accounts[idx]
+        acc = accounts[0]
+        acc_id, login, password, status, steam_guard_enabled = (
+            acc["id"], acc["login"], acc["password"], acc["status"], acc["steam_guard_enabled"])
         
         text = f"<b>Игра:</b> <code>{game}</code>\n<b>Логин:</b> <code>{login}</code>\n<b>Пароль:</b> <code>{password}</code>\n<b>Статус:</b> <b>{'🟢 Свободен' if status=='free' else '🔴 В аренде'}</b>"
 
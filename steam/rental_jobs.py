@@ -0,0 +1,204 @@
+"""
+Очередь фоновых задач аренды в SQLite.
+
+Смена данных аккаунта после окончания аренды (вход через Playwright, код Steam Guard, смена пароля)
+выполняется не в отдельном потоке на каждую аренду, а задачей в таблице rental_jobs.
+Задачи разбирает ограниченный пул воркеров, неудачные попытки повторяются с экспоненциальной задержкой,
+а задачи, прерванные перезапуском процесса, при старте возвращаются в очередь.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+from db.connection import get_connection
+
+logger = logging.getLogger("rental_jobs")
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Смена данных аккаунта после окончания аренды
+ROTATE = 'rotate'
+
+class RentalJobQueue:
+    """
+    Очередь задач аренды с пулом воркеров.
+
+    Обработчик задачи вызывается как handler(acc_id, payload, callback) и возвращает True при успехе.
+    False или исключение - попытка неудачна, задача будет повторена через backoff_base * 2^(attempts-1) секунд
+    (не больше backoff_max), после max_attempts попыток задача переходит в состояние failed.
+    callback (например, notify_callback из auto_end_rent) хранится только в памяти и теряется при перезапуске.
+    """
+
+    def __init__(self, workers: int = 2, max_attempts: int = 5, backoff_base: float = 60,
+                 backoff_max: float = 3600, poll_interval: float = 30):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self._handlers: dict[str, Callable] = {}
+        self._callbacks: dict[int, Callable] = {}
+        self._cond = threading.Condition()
+        self._threads: list[threading.Thread] = []
+        self._started = False
+
+    def register(self, kind: str, handler: Callable):
+        """Регистрирует обработчик задач типа kind."""
+        self._handlers[kind] = handler
+
+    def start(self):
+        """
+        Запускает воркеры. При первом запуске возвращает в очередь задачи, которые выполнялись
+        в момент остановки процесса. Таблицу rental_jobs создают миграции БД (db.migrations, init_db()).
+        """
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        conn = self._connect()
+        try:
+            cur = conn.execute("UPDATE rental_jobs SET state=?, updated_at=? WHERE state=?",
+                               (PENDING, time.time(), RUNNING))
+            if cur.rowcount:
+                logger.info(f"[RENTAL_JOBS] Возвращено в очередь прерванных задач: {cur.rowcount}")
+        finally:
+            conn.close()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"rental_jobs_{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"[RENTAL_JOBS] Запущено воркеров: {self.workers}")
+
+    def enqueue(self, kind: str, acc_id, payload: Optional[dict] = None, callback: Optional[Callable] = None,
+                delay: float = 0) -> Optional[int]:
+        """
+        Ставит задачу в очередь. Если активная задача того же типа для аккаунта уже есть, новая не создается.
+
+        Returns:
+            int | None: ID задачи (новой или уже существующей)
+        """
+        self.start()
+        # acc_id хранится строкой (миграция 6): 5 и '5' - одна и та же задача аккаунта
+        acc_id = str(acc_id)
+        now = time.time()
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO rental_jobs (kind, acc_id, payload, state, run_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (kind, acc_id, json.dumps(payload or {}), PENDING, now + delay, now, now))
+            if cur.rowcount:
+                job_id = cur.lastrowid
+                logger.info(f"[RENTAL_JOBS] Задача {kind} #{job_id} для аккаунта {acc_id} поставлена в очередь")
+            else:
+                row = conn.execute("SELECT id FROM rental_jobs WHERE kind=? AND acc_id=? AND state IN (?, ?)",
+                                   (kind, acc_id, PENDING, RUNNING)).fetchone()
+                job_id = row[0] if row else None
+                logger.info(f"[RENTAL_JOBS] Задача {kind} для аккаунта {acc_id} уже в очереди (#{job_id})")
+        finally:
+            conn.close()
+        if job_id is not None and callback is not None:
+            self._callbacks[job_id] = callback
+        with self._cond:
+            self._cond.notify()
+        return job_id
+
+    @staticmethod
+    def _connect() -> sqlite3.Connection:
+        # autocommit: транзакции открываются явно (BEGIN IMMEDIATE) при захвате задачи
+        return get_connection(isolation_level=None)
+
+    def _claim(self) -> Optional[tuple]:
+        """Атомарно забирает ближайшую готовую задачу и переводит ее в running."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, kind, acc_id, payload, attempts FROM rental_jobs "
+                "WHERE state=? AND run_at<=? ORDER BY run_at LIMIT 1", (PENDING, time.time())).fetchone()
+            if row:
+                conn.execute("UPDATE rental_jobs SET state=?, attempts=attempts+1, updated_at=? WHERE id=?",
+                             (RUNNING, time.time(), row[0]))
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _next_run_at(self) -> Optional[float]:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT MIN(run_at) FROM rental_jobs WHERE state=?", (PENDING,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+    def _worker(self):
+        while True:
+            try:
+                job = self._claim()
+                if job is None:
+                    next_run_at = self._next_run_at()
+                    timeout = self.poll_interval if next_run_at is None else \
+                        min(self.poll_interval, max(next_run_at - time.time(), 0.5))
+                    with self._cond:
+                        self._cond.wait(timeout)
+                    continue
+                self._run(*job)
+            except Exception as e:
+                logger.error(f"[RENTAL_JOBS] Ошибка воркера: {e}", exc_info=True)
+                time.sleep(5)
+
+    def _run(self, job_id: int, kind: str, acc_id, payload: str, attempts: int):
+        attempt = attempts + 1
+        handler = self._handlers.get(kind)
+        error = None
+        logger.info(f"[RENTAL_JOBS] Задача {kind} #{job_id} для аккаунта {acc_id}, попытка {attempt}")
+        try:
+            if handler is None:
+                raise RuntimeError(f"нет обработчика для задач типа {kind}")
+            ok = bool(handler(acc_id, json.loads(payload or "{}"), self._callbacks.get(job_id)))
+        except Exception as e:
+            logger.error(f"[RENTAL_JOBS] Задача {kind} #{job_id} завершилась с ошибкой: {e}", exc_info=True)
+            ok, error = False, str(e)
+
+        now = time.time()
+        conn = self._connect()
+        try:
+            if ok:
+                conn.execute("UPDATE rental_jobs SET state=?, last_error=NULL, updated_at=? WHERE id=?",
+                             (DONE, now, job_id))
+                self._callbacks.pop(job_id, None)
+                logger.info(f"[RENTAL_JOBS] Задача {kind} #{job_id} выполнена")
+            elif attempt >= self.max_attempts:
+                conn.execute("UPDATE rental_jobs SET state=?, last_error=?, updated_at=? WHERE id=?",
+                             (FAILED, error or "неудачная попытка", now, job_id))
+                self._callbacks.pop(job_id, None)
+                logger.error(f"[RENTAL_JOBS] Задача {kind} #{job_id} для аккаунта {acc_id} не выполнена "
+                             f"за {attempt} попыток")
+            else:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                conn.execute("UPDATE rental_jobs SET state=?, run_at=?, last_error=?, updated_at=? WHERE id=?",
+                             (PENDING, now + delay, error or "неудачная попытка", now, job_id))
+                logger.warning(f"[RENTAL_JOBS] Задача {kind} #{job_id} будет повторена через {delay:.0f} секунд")
+        finally:
+            conn.close()
+
+
+def _rotate_account(acc_id, payload: dict, callback: Optional[Callable]) -> bool:
+    from steam.steam_account_rental_utils import finish_rent
+    return finish_rent(acc_id, payload.get("rent_seconds"), callback)
+
+
+# Общая очередь процесса
+rental_jobs = RentalJobQueue()
+rental_jobs.register(ROTATE, _rotate_account)
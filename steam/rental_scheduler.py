@@ -0,0 +1,178 @@
+"""
+Планировщик окончания аренд.
+
+Один поток с min-heap по времени срабатывания обслуживает предупреждения за 10 минут
+и завершение аренды для всех аккаунтов сразу (вместо двух спящих потоков на каждую аренду).
+Продления обрабатываются через reschedule() или сверкой rented_until из БД в момент срабатывания.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from db.connection import get_connection
+
+logger = logging.getLogger("rental_scheduler")
+
+# За сколько секунд до конца аренды отправлять предупреждение
+WARN_BEFORE_END = 600
+
+WARN = "warn"
+EXPIRE = "expire"
+
+
+class RentalScheduler:
+    """
+    Планировщик таймеров аренды.
+
+    На каждый аккаунт хранится одна актуальная запись аренды с версией. Записи хранятся под str(acc_id), как
+    в rental_jobs: из Telegram ID аккаунта приходит строкой из callback data, из FunPay и при восстановлении
+    аренд - числом. Устаревшие элементы кучи (после reschedule/cancel) не удаляются, а пропускаются при
+    срабатывании по несовпадению версии.
+    Обработчики выполняются в небольшом пуле потоков, чтобы не задерживать остальные таймеры.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self._heap: list[tuple[float, int, str, int, str]] = []
+        self._rentals: dict[str, dict] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="rental_scheduler")
+
+    def schedule(self, acc_id: int, tg_user_id, rented_until: float, rent_seconds: Optional[int] = None,
+                 notify_callback: Optional[Callable] = None):
+        """
+        Ставит (или заменяет) таймеры аренды аккаунта.
+
+        Args:
+            acc_id: ID аккаунта
+            tg_user_id: ID чата арендатора
+            rented_until: unix timestamp окончания аренды
+            rent_seconds: исходная длительность аренды (аренды до 60 секунд освобождаются даже при ошибке смены пароля)
+            notify_callback: вызывается как notify_callback(acc_id, tg_user_id) после освобождения аккаунта
+        """
+        acc_id = str(acc_id)
+        with self._cond:
+            previous = self._rentals.get(acc_id)
+            self._rentals[acc_id] = {
+                "version": previous["version"] + 1 if previous else 1,
+                "tg_user_id": tg_user_id,
+                "rented_until": float(rented_until),
+                "rent_seconds": rent_seconds if rent_seconds is not None else int(rented_until - time.time()),
+                "notify_callback": notify_callback,
+            }
+            self._push(acc_id)
+        logger.info(f"[RENT_SCHEDULER] Аренда аккаунта {acc_id} запланирована до {rented_until:.0f}")
+
+    def reschedule(self, acc_id: int, rented_until: float) -> bool:
+        """
+        Переносит окончание аренды (продление / бонусное время).
+
+        Returns:
+            bool: False, если для аккаунта нет запланированной аренды
+        """
+        acc_id = str(acc_id)
+        with self._cond:
+            rental = self._rentals.get(acc_id)
+            if not rental:
+                return False
+            rental["version"] += 1
+            rental["rented_until"] = float(rented_until)
+            self._push(acc_id)
+        logger.info(f"[RENT_SCHEDULER] Аренда аккаунта {acc_id} перенесена на {rented_until:.0f}")
+        return True
+
+    def cancel(self, acc_id: int) -> bool:
+        """
+        Отменяет таймеры аренды аккаунта.
+
+        Returns:
+            bool: False, если для аккаунта нет запланированной аренды
+        """
+        acc_id = str(acc_id)
+        with self._cond:
+            rental = self._rentals.pop(acc_id, None)
+            self._cond.notify()
+        if rental:
+            logger.info(f"[RENT_SCHEDULER] Таймеры аренды аккаунта {acc_id} отменены")
+        return rental is not None
+
+    def scheduled(self) -> dict[str, float]:
+        """
+        Returns:
+            dict: {ID аккаунта: rented_until} для всех запланированных аренд
+        """
+        with self._cond:
+            return {acc_id: rental["rented_until"] for acc_id, rental in self._rentals.items()}
+
+    def _push(self, acc_id: str):
+        """Кладет в кучу таймеры текущей версии аренды. Вызывается под self._cond."""
+        rental = self._rentals[acc_id]
+        rented_until = rental["rented_until"]
+        if rented_until - WARN_BEFORE_END > time.time():
+            heapq.heappush(self._heap, (rented_until - WARN_BEFORE_END, next(self._seq), acc_id,
+                                        rental["version"], WARN))
+        heapq.heappush(self._heap, (rented_until, next(self._seq), acc_id, rental["version"], EXPIRE))
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="rental_scheduler", daemon=True)
+            self._thread.start()
+        self._cond.notify()
+
+    def _is_current(self, acc_id: str, version: int) -> bool:
+        rental = self._rentals.get(acc_id)
+        return rental is not None and rental["version"] == version
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    self._cond.wait(self._heap[0][0] - time.time() if self._heap else None)
+                _, _, acc_id, version, kind = heapq.heappop(self._heap)
+                if not self._is_current(acc_id, version):
+                    continue
+                rental = dict(self._rentals[acc_id])
+            self._executor.submit(self._fire, acc_id, version, kind, rental)
+
+    def _fire(self, acc_id: str, version: int, kind: str, rental: dict):
+        from steam.steam_account_rental_utils import warn_rent_ending
+        from steam.rental_jobs import rental_jobs, ROTATE
+        try:
+            if kind == WARN:
+                warn_rent_ending(acc_id, rental["tg_user_id"])
+                return
+
+            conn = get_connection()
+            try:
+                row = conn.execute("SELECT status, rented_until FROM accounts WHERE id=?", (acc_id,)).fetchone()
+            finally:
+                conn.close()
+
+            with self._cond:
+                if not self._is_current(acc_id, version):
+                    return
+                if not row or row[0] != 'rented' or not row[1]:
+                    self._rentals.pop(acc_id, None)
+                    logger.info(f"[RENT_SCHEDULER] Аккаунт {acc_id} больше не в аренде, отмена завершения")
+                    return
+                if float(row[1]) > time.time() + 1:
+                    # аренду продлили в БД в обход reschedule()
+                    self._rentals[acc_id]["version"] += 1
+                    self._rentals[acc_id]["rented_until"] = float(row[1])
+                    self._push(acc_id)
+                    logger.info(f"[RENT_SCHEDULER] Аренда аккаунта {acc_id} продлена до {float(row[1]):.0f}")
+                    return
+                self._rentals.pop(acc_id, None)
+
+            # смена данных выполняется воркерами очереди задач с повторами
+            rental_jobs.enqueue(ROTATE, acc_id, {"rent_seconds": rental["rent_seconds"]},
+                                callback=rental["notify_callback"])
+        except Exception as e:
+            logger.error(f"[RENT_SCHEDULER] Ошибка обработки таймера {kind} аккаунта {acc_id}: {e}", exc_info=True)
+
+
+# Общий планировщик процесса
+rental_scheduler = RentalScheduler()
@@ -1,8 +1,8 @@
 import time
-import sqlite3
 from datetime import datetime, timedelta
 from typing import Optional, Tuple, Callable
 from config import DB_PATH, DB_DIR
+from db.repository import accounts_repo
 from tg_utils.logger import logger
 
 # Попытаемся импортировать pytz напрямую из виртуальной среды
@@ -112,89 +112,64 @@ def format_msk_time(timestamp):
 
 
 def find_free_account(game_name: str) -> Optional[Tuple]:
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "SELECT * FROM accounts WHERE game_name=? AND status='free' LIMIT 1", (game_name,))
-    acc = c.fetchone()
-    conn.close()
-    return acc
+    return accounts_repo.find_free(game_name)
+
+
+def claim_accounts(game_name: str, n: int, order_id, until: float, tg_user_id=None, partial: bool = False) -> list:
+    """
+    Резервирует n разных свободных аккаунтов игры одной транзакцией и помечает их арендованными до until.
+    В отличие от пары find_free_account + mark_account_rented, два одновременных заказа не получат один аккаунт.
+
+    Args:
+        game_name: название игры
+        n: количество аккаунтов
+        order_id: ID заказа (при n > 1 аккаунтам назначаются "<order_id>-1", "<order_id>-2", ...)
+        until: unix timestamp окончания аренды
+        tg_user_id: ID чата арендатора
+        partial: выдать сколько есть, если свободных меньше n
+
+    Returns:
+        list: занятые аккаунты; пустой список, если свободных аккаунтов не хватило
+    """
+    accounts = accounts_repo.claim(game_name, n, tg_user_id, until, order_id, partial=partial)
+    if accounts:
+        logger.debug(f"[RENT] Заказ {order_id}: заняты аккаунты {[acc['id'] for acc in accounts]} для {game_name}")
+    else:
+        logger.debug(f"[RENT] Заказ {order_id}: нет {n} свободных аккаунтов для {game_name}")
+    return accounts
 
 # --- Пометить аккаунт как арендованный ---
 
 
 def mark_account_rented(account_id, tg_user_id, rented_until=None, bonus_seconds=None, order_id=None):
     """Помечает аккаунт как арендованный"""
-    import sqlite3
-    import time
-    from time import time as current_time
-    
-    # Максимальное количество попыток и задержка между ними
-    max_attempts = 5
-    retry_delay = 0.5
-    
-    for attempt in range(max_attempts):
-        try:
-            conn = sqlite3.connect(DB_PATH, timeout=20)  # Увеличиваем timeout до 20 секунд
-            c = conn.cursor()
-            
-            # Получаем текущее время аренды
-            c.execute("SELECT rented_until FROM accounts WHERE id=?", (account_id,))
-            current_rented_until = c.fetchone()
-            
-            if current_rented_until and current_rented_until[0]:
-                current_until = float(current_rented_until[0])
-                if current_until > current_time():
-                    # Если есть bonus_seconds, добавляем их к текущему времени
-                    if bonus_seconds:
-                        new_until = current_until + bonus_seconds
-                        logger.debug(f"[RENT] Добавляем {bonus_seconds}с бонусного времени к аккаунту {account_id}. Текущее рассчитанное время: {current_until}, Новое время: {new_until}")
-                    else:
-                        new_until = current_until
+    now = time.time()
+    try:
+        # чтение текущего срока и запись выполняются одной транзакцией записи;
+        # ожидание занятой БД берет на себя busy_timeout подключения
+        with accounts_repo.transaction():
+            row = accounts_repo.get(account_id)
+            current_until = float(row["rented_until"]) if row and row["rented_until"] else None
+            if current_until and current_until > now:
+                # Если есть bonus_seconds, добавляем их к текущему времени
+                if bonus_seconds:
+                    new_until = current_until + bonus_seconds
+                    logger.debug(f"[RENT] Добавляем {bonus_seconds}с бонусного времени к аккаунту {account_id}. Текущее рассчитанное время: {current_until}, Новое время: {new_until}")
                 else:
-                    # Если текущее время истекло, используем новое время
-                    new_until = rented_until if rented_until else (current_time() + 3600)
-            else:
-                # Если нет текущего времени, используем новое
-                new_until = rented_until if rented_until else (current_time() + 3600)
-            
-            # Обновляем статус аккаунта
-            c.execute("""
-                UPDATE accounts 
-                SET status='rented', 
-                    tg_user_id=?, 
-                    rented_until=?, 
-                    order_id=?,
-                    warned_10min=0
-                WHERE id=?
-            """, (tg_user_id, new_until, order_id, account_id))
-            
-            conn.commit()
-            conn.close()
-            
-            # Форматируем время для лога
-            from datetime import datetime
-            msk_time = datetime.fromtimestamp(new_until).strftime('%d.%m.%Y, %H:%M')
-            logger.debug(f"[RENT] Аккаунт {account_id} помечен как арендованный до {msk_time} (MSK) для пользователя {tg_user_id} с order_id {order_id}")
-            
-            return new_until
-            
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e) and attempt < max_attempts - 1:
-                logger.warning(f"[RENT] База данных заблокирована, попытка {attempt + 1} из {max_attempts}")
-                time.sleep(retry_delay)
-                continue
+                    new_until = current_until
             else:
-                logger.error(f"[RENT] Ошибка при обновлении статуса аккаунта {account_id}: {e}")
-                raise
-        except Exception as e:
-            logger.error(f"[RENT] Неожиданная ошибка при обновлении статуса аккаунта {account_id}: {e}")
-            raise
-        finally:
-            try:
-                conn.close()
-            except:
-                pass
+                # Если текущего времени нет или оно истекло, используем новое
+                new_until = rented_until if rented_until else (now + 3600)
+            accounts_repo.rent(account_id, tg_user_id, new_until, order_id)
+    except Exception as e:
+        logger.error(f"[RENT] Ошибка при обновлении статуса аккаунта {account_id}: {e}")
+        raise
+
+    # Форматируем время для лога
+    msk_time = datetime.fromtimestamp(new_until).strftime('%d.%m.%Y, %H:%M')
+    logger.debug(f"[RENT] Аккаунт {account_id} помечен как арендованный до {msk_time} (MSK) для пользователя {tg_user_id} с order_id {order_id}")
+
+    return new_until
 
 # --- Вернуть аккаунт в пул свободных ---
 
@@ -206,25 +181,12 @@ def mark_account_free(acc_id: int):
     Args:
         acc_id: ID аккаунта
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Проверяем наличие столбца order_id и bonus_given в таблице
-    c.execute("PRAGMA table_info(accounts)")
-    columns = [column[1] for column in c.fetchall()]
-    
-    if 'order_id' in columns and 'bonus_given' in columns:
-        c.execute(
-            "UPDATE accounts SET status='free', rented_until=NULL, tg_user_id=NULL, order_id=NULL, lot_id=NULL, warned_10min=0, bonus_given=0 WHERE id=?", (acc_id,))
-    elif 'bonus_given' in columns:
-        c.execute(
-            "UPDATE accounts SET status='free', rented_until=NULL, tg_user_id=NULL, lot_id=NULL, warned_10min=0, bonus_given=0 WHERE id=?", (acc_id,))
-    else:
-        c.execute(
-            "UPDATE accounts SET status='free', rented_until=NULL, tg_user_id=NULL, lot_id=NULL, warned_10min=0 WHERE id=?", (acc_id,))
-    
-    conn.commit()
-    conn.close()
+    accounts_repo.free(acc_id)
+
+    from steam.rental_scheduler import rental_scheduler
+    from utils.email_utils import guard_broker
+    rental_scheduler.cancel(acc_id)
+    guard_broker.cancel(acc_id)
 
 
 # --- Парсинг времени аренды из описания лота ---
@@ -285,299 +247,250 @@ def parse_rent_time(description: str) -> int | None:
 
 
 def auto_end_rent(acc_id: int, tg_user_id: int, rent_seconds: int, notify_callback=None):
-    import threading
+    """
+    Ставит таймеры аренды (предупреждение за 10 минут и завершение) в общий планировщик.
+    Повторный вызов для того же аккаунта заменяет его таймеры.
+    """
     import logging
+    from steam.rental_scheduler import rental_scheduler
 
     logger = logging.getLogger("auto_end_rent")
     logger.info(
         f"[AUTO_END_RENT] Запущен таймер завершения аренды для аккаунта {acc_id}, пользователя {tg_user_id}, на {rent_seconds} секунд")
+    rental_scheduler.schedule(acc_id, tg_user_id, time.time() + rent_seconds, rent_seconds=rent_seconds,
+                              notify_callback=notify_callback)
+    return True
 
-    def warn_before_end():
-        import time
-        import sqlite3
-        try:
-            sleep_time = rent_seconds - 600
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                c.execute(
-                    "SELECT status, tg_user_id, rented_until, warned_10min FROM accounts WHERE id=?", (acc_id,))
-                row = c.fetchone()
-                if row and row[0] == 'rented' and row[1] == tg_user_id:
-                    left = int(row[2] - time.time())
-                    warned_10min = row[3] if len(row) > 3 else 0
-                    if left <= 600 and not warned_10min:
-                        try:
-                            from funpay_integration import FunPayListener
-                            funpay = FunPayListener()
-                            msg = '🔔 До конца аренды осталось 10 минут.\n\n' \
-                                  'Для продления — повторно оплатите товар на нужный срок.'
-                            funpay.account.send_message(tg_user_id, msg)
-                            c.execute(
-                                "UPDATE accounts SET warned_10min=1 WHERE id=?", (acc_id,))
-                            conn.commit()
-                            logger.info(
-                                f"[AUTO_END_RENT][WARN] Отправлено предупреждение о завершении аренды через 10 минут для аккаунта {acc_id}")
-                        except Exception as e:
-                            import traceback
-                            logger.error(
-                                f'[AUTO_END_RENT][ERROR] Не удалось отправить предупреждение за 10 минут: {e}')
-                            traceback.print_exc()
-                conn.close()
-        except Exception as e:
-            logger.error(
-                f'[AUTO_END_RENT][ERROR] Ошибка в warn_before_end: {e}')
-
-    threading.Thread(target=warn_before_end, daemon=True).start()
-    logger.info(
-        f"[AUTO_END_RENT] Запущен поток для предупреждения о завершении аренды")
-
-    def worker():
-        import time
-        import os
-        import sqlite3
-        from db.accounts import get_account_by_id
-        from utils.email_utils import fetch_steam_guard_code_from_email
-        from utils.password import generate_password
-        from playwright.sync_api import sync_playwright, TimeoutError as PWTimeoutError
-
-        # Ждем указанное время аренды, но проверяем актуальное время каждую минуту
-        while True:
-            # Проверяем актуальное время аренды в базе
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("SELECT rented_until FROM accounts WHERE id=? AND status='rented'", (acc_id,))
-            row = c.fetchone()
-            conn.close()
-            
-            if not row or not row[0]:
-                logger.info(f"[AUTO_END_RENT] Аккаунт {acc_id} больше не в аренде, отмена завершения")
-                return
-                
-            current_time = time.time()
-            rented_until = float(row[0])
-            
-            if rented_until <= current_time:
-                break
-                
-            # Ждем 60 секунд перед следующей проверкой
-            time.sleep(60)
-
-        # Проверяем, что аккаунт всё еще в аренде
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute(
-            "SELECT status, login, password FROM accounts WHERE id=?", (acc_id,))
-        row = c.fetchone()
-        conn.close()
-
-        if not row or row[0] != 'rented':
-            logger.info(
-                f"[AUTO_END_RENT] Аккаунт {acc_id} больше не в аренде или не найден, отмена смены данных")
-            return
 
-        logger.info(
-            f"[AUTO_END_RENT] Начинаем процесс завершения аренды аккаунта {acc_id}")
+def warn_rent_ending(acc_id: int, tg_user_id: int):
+    """Отправляет арендатору предупреждение о том, что до конца аренды осталось 10 минут."""
+    import logging
 
-        # Получаем данные аккаунта
-        acc = get_account_by_id(acc_id)
-        if not acc:
-            logger.error(
-                f"[AUTO_END_RENT] Аккаунт {acc_id} не найден в базе данных")
-            return
+    logger = logging.getLogger("auto_end_rent")
+    try:
+        row = accounts_repo.get(acc_id)
+        if row and row["status"] == 'rented' and row["tg_user_id"] == tg_user_id:
+            left = int(row["rented_until"] - time.time())
+            warned_10min = row["warned_10min"]
+            if left <= 600 and not warned_10min:
+                try:
+                    from funpay_manager import get_listener
+                    funpay = get_listener(tg_user_id)
+                    msg = '🔔 До конца аренды осталось 10 минут.\n\n' \
+                          'Для продления — повторно оплатите товар на нужный срок.'
+                    funpay.funpay_send_message_wrapper(tg_user_id, msg,
+                                                       key=f"warn:{acc_id}:{row['rented_until']}")
+                    accounts_repo.set_warned(acc_id)
+                    logger.info(
+                        f"[AUTO_END_RENT][WARN] Отправлено предупреждение о завершении аренды через 10 минут для аккаунта {acc_id}")
+                except Exception as e:
+                    import traceback
+                    logger.error(
+                        f'[AUTO_END_RENT][ERROR] Не удалось отправить предупреждение за 10 минут: {e}')
+                    traceback.print_exc()
+    except Exception as e:
+        logger.error(
+            f'[AUTO_END_RENT][ERROR] Ошибка в warn_before_end: {e}')
 
-        login, password, email_login, email_password, imap_host = acc
-        logger.info(
-            f"[AUTO_END_RENT] Получены данные аккаунта {acc_id}: {login}, почта: {email_login}")
-
-        # Получаем старый пароль из БД перед сменой
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('SELECT password FROM accounts WHERE id = ?', (acc_id,))
-        result = c.fetchone()
-        old_password_db = result[0] if result else "Неизвестно"
-        conn.close()
-
-        # Подготовка директорий для сессий и скриншотов
-        SESSIONS_DIR = os.path.join(os.path.dirname(
-                                os.path.abspath(__file__)), '..', 'sessions')
-        SCREENSHOTS_DIR = os.path.join(os.path.dirname(
-            os.path.abspath(__file__)), '..', 'screenshots')
-        os.makedirs(SESSIONS_DIR, exist_ok=True)
-        os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
-
-        session_file = os.path.join(
-                                SESSIONS_DIR, f"steam_{login}.json")
-        logger.info(f"[AUTO_END_RENT] Файл сессии: {session_file}")
-
-        # Генерируем новый пароль для смены
-        new_password = generate_password(length=12, special_chars=True)
+
+def finish_rent(acc_id: int, rent_seconds: int, notify_callback=None):
+    """
+    Завершает истекшую аренду: меняет пароль Steam через браузер, освобождает аккаунт
+    и уведомляет покупателя. Выполняется воркером очереди задач аренды (steam/rental_jobs.py).
+
+    Returns:
+        bool: True, если задача выполнена (или выполнять больше нечего), False - нужен повтор
+    """
+    import os
+    import logging
+    from utils.email_utils import fetch_steam_guard_code_from_email, guard_broker
+    from utils.password import generate_password
+    from playwright.sync_api import sync_playwright, TimeoutError as PWTimeoutError
+
+    logger = logging.getLogger("auto_end_rent")
+
+    # Проверяем, что аккаунт всё еще в аренде
+    row = accounts_repo.get(acc_id)
+
+    if not row or row["status"] != 'rented':
         logger.info(
-            f"[AUTO_END_RENT] Сгенерирован новый пароль для аккаунта {acc_id}")
+            f"[AUTO_END_RENT] Аккаунт {acc_id} больше не в аренде или не найден, отмена смены данных")
+        return True
 
-        # Логика смены данных через синхронный Playwright (как в cb_change_data)
-        try:
-            from utils.browser_config import get_browser_config
-            config = get_browser_config()
-            
-            with sync_playwright() as p:
-                browser = p.chromium.launch(**config)
-                time.sleep(2)
-                context = None
-                logged_in = False
-
-                # Попытка использовать сохраненную сессию
-                if os.path.exists(session_file):
-                    logger.info(
-                        f"[AUTO_END_RENT] Найден файл сессии, пробуем использовать")
-                    try:
-                        context = browser.new_context(
-                            storage_state=session_file)
-                        page = context.new_page()
-                        page.goto("https://store.steampowered.com/account/")
-                        page.wait_for_selector(
-                            "#account_pulldown", timeout=10000)
-                        logged_in = True
-                        logger.info(
-                            f"[AUTO_END_RENT] Успешный вход по сессии для аккаунта {login}")
-                        # Сохраняем скриншот для подтверждения
-                        page.screenshot(path=os.path.join(
-                            SCREENSHOTS_DIR, f"auto_end_login_session_{acc_id}.png"))
-                    except Exception as e:
-                        logged_in = False
-                        logger.warning(
-                            f"[AUTO_END_RENT] Не удалось войти по сессии: {e}")
-                        if context:
-                            context.close()
-                            context = None
-
-                # Если не удалось войти по сессии, выполняем обычный вход
-                if not logged_in:
-                    logger.info(
-                        f"[AUTO_END_RENT] Выполняем обычный вход для аккаунта {login}")
+    logger.info(
+        f"[AUTO_END_RENT] Начинаем процесс завершения аренды аккаунта {acc_id}")
+    # Аренда закончилась: код входа, который придет при смене данных, покупателю больше не отправляется
+    guard_broker.cancel(acc_id)
+
+    # Получаем данные аккаунта
+    login, password = row["login"], row["password"]
+    email_login, email_password, imap_host = row["email_login"], row["email_password"], row["imap_host"]
+    logger.info(
+        f"[AUTO_END_RENT] Получены данные аккаунта {acc_id}: {login}, почта: {email_login}")
+
+    # Старый пароль из БД для уведомления администраторов
+    old_password_db = password or "Неизвестно"
+
+    # Подготовка директорий для сессий и скриншотов
+    SESSIONS_DIR = os.path.join(os.path.dirname(
+                            os.path.abspath(__file__)), '..', 'sessions')
+    SCREENSHOTS_DIR = os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), '..', 'screenshots')
+    os.makedirs(SESSIONS_DIR, exist_ok=True)
+    os.makedirs(SCREENSHOTS_DIR, exist_ok=True)
+
+    session_file = os.path.join(
+                            SESSIONS_DIR, f"steam_{login}.json")
+    logger.info(f"[AUTO_END_RENT] Файл сессии: {session_file}")
+
+    # Генерируем новый пароль для смены
+    new_password = generate_password(length=12, special_chars=True)
+    logger.info(
+        f"[AUTO_END_RENT] Сгенерирован новый пароль для аккаунта {acc_id}")
+
+    # Логика смены данных через синхронный Playwright (как в cb_change_data)
+    try:
+        from utils.browser_pool import browser_pool
+
+        with sync_playwright() as p, browser_pool.browser(p) as browser:
+            context = None
+            logged_in = False
+
+            # Попытка использовать сохраненную сессию
+            if os.path.exists(session_file):
+                logger.info(
+                    f"[AUTO_END_RENT] Найден файл сессии, пробуем использовать")
+                try:
                     context = browser.new_context(
-                        user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
-                        viewport=None,
-                        locale="ru-RU",
-                        java_script_enabled=True,
-                        ignore_https_errors=True
-                    )
+                        storage_state=session_file)
                     page = context.new_page()
+                    page.goto("https://store.steampowered.com/account/")
+                    page.wait_for_selector(
+                        "#account_pulldown", timeout=10000)
+                    logged_in = True
+                    logger.info(
+                        f"[AUTO_END_RENT] Успешный вход по сессии для аккаунта {login}")
+                    # Сохраняем скриншот для подтверждения
+                    page.screenshot(path=os.path.join(
+                        SCREENSHOTS_DIR, f"auto_end_login_session_{acc_id}.png"))
+                except Exception as e:
+                    logged_in = False
+                    logger.warning(
+                        f"[AUTO_END_RENT] Не удалось войти по сессии: {e}")
+                    if context:
+                        context.close()
+                        context = None
+
+            # Если не удалось войти по сессии, выполняем обычный вход
+            if not logged_in:
+                logger.info(
+                    f"[AUTO_END_RENT] Выполняем обычный вход для аккаунта {login}")
+                context = browser.new_context(
+                    user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
+                    viewport=None,
+                    locale="ru-RU",
+                    java_script_enabled=True,
+                    ignore_https_errors=True
+                )
+                page = context.new_page()
+
+                # Переходим на страницу входа
+                page.goto("https://store.steampowered.com/login/")
+                page.wait_for_load_state("networkidle")
+
+                # Сохраняем скриншот страницы входа
+                page.screenshot(path=os.path.join(
+                    SCREENSHOTS_DIR, f"auto_end_login_start_{acc_id}.png"))
+
+                # Проверяем, что мы на странице логина
+                if "login" not in page.url:
+                    logger.error(
+                        f"[AUTO_END_RENT] Неожиданный URL после перехода на страницу логина: {page.url}")
+                    page.screenshot(path=os.path.join(
+                        SCREENSHOTS_DIR, f"auto_end_login_error_{acc_id}.png"))
+                    return False
 
-                    # Переходим на страницу входа
-                    page.goto("https://store.steampowered.com/login/")
-                    page.wait_for_load_state("networkidle")
-
-                    # Сохраняем скриншот страницы входа
+                # Ждем поля ввода логина и вводим данные
+                try:
+                    page.wait_for_selector(
+                        'input[type="text"]', timeout=20000)
+                except PWTimeoutError:
+                    logger.error(
+                        "[AUTO_END_RENT] Поле логина не найдено на странице")
                     page.screenshot(path=os.path.join(
-                        SCREENSHOTS_DIR, f"auto_end_login_start_{acc_id}.png"))
+                        SCREENSHOTS_DIR, f"auto_end_login_no_fields_{acc_id}.png"))
+                    return False
 
-                    # Проверяем, что мы на странице логина
-                    if "login" not in page.url:
-                        logger.error(
-                            f"[AUTO_END_RENT] Неожиданный URL после перехода на страницу логина: {page.url}")
-                        page.screenshot(path=os.path.join(
-                            SCREENSHOTS_DIR, f"auto_end_login_error_{acc_id}.png"))
-                        return
+                # Вводим логин и пароль
+                page.fill('input[type="text"]', login)
+                page.fill('input[type="password"]', password)
+                page.screenshot(path=os.path.join(
+                    SCREENSHOTS_DIR, f"auto_end_login_filled_{acc_id}.png"))
 
-                    # Ждем поля ввода логина и вводим данные
-                    try:
-                        page.wait_for_selector(
-                            'input[type="text"]', timeout=20000)
-                    except PWTimeoutError:
-                        logger.error(
-                            "[AUTO_END_RENT] Поле логина не найдено на странице")
-                        page.screenshot(path=os.path.join(
-                            SCREENSHOTS_DIR, f"auto_end_login_no_fields_{acc_id}.png"))
-                        return
+                # Нажимаем кнопку входа
+                page.click("button[type='submit']")
 
-                    # Вводим логин и пароль
-                    page.fill('input[type="text"]', login)
-                    page.fill('input[type="password"]', password)
+                # Ждем либо Steam Guard, либо успешный вход, либо ошибку
+                try:
+                    page.wait_for_selector(
+                        "#auth_buttonset_entercode, input[maxlength='1'], #account_pulldown, .newlogindialog_FormError", timeout=25000)
+                except PWTimeoutError:
+                    logger.error(
+                        "[AUTO_END_RENT] Время ожидания ответа от Steam истекло")
                     page.screenshot(path=os.path.join(
-                        SCREENSHOTS_DIR, f"auto_end_login_filled_{acc_id}.png"))
+                        SCREENSHOTS_DIR, f"auto_end_login_timeout_{acc_id}.png"))
+                    return False
 
-                    # Нажимаем кнопку входа
-                    page.click("button[type='submit']")
+                # Проверяем необходимость ввода Steam Guard
+                need_guard = False
+                if page.query_selector("#auth_buttonset_entercode") or page.query_selector("input[maxlength='1']"):
+                    need_guard = True
 
-                    # Ждем либо Steam Guard, либо успешный вход, либо ошибку
+                if need_guard:
+                    logger.info("[AUTO_END_RENT] Требуется код Steam Guard, получаем с почты")
+                    page.screenshot(path=os.path.join(
+                        SCREENSHOTS_DIR, f"auto_end_steam_guard_page_{acc_id}.png"))
+                    
+                    # Получаем код с почты
+                    if not (email_login and email_password and imap_host):
+                        logger.error("[AUTO_END_RENT] Для этого аккаунта не настроена почта")
+                        return False
+                    
+                    code = fetch_steam_guard_code_from_email(email_login, email_password, imap_host, mode='change')
+                    if not code:
+                        logger.error("[AUTO_END_RENT] Не удалось получить код Steam Guard с почты")
+                        page.screenshot(path=os.path.join(
+                            SCREENSHOTS_DIR, f"auto_end_no_confirmation_code_{acc_id}.png"))
+                        return False
+                    
+                    logger.debug(f"[AUTO_END_RENT] Получен код Steam Guard: {code}")
+                    
+                    # Вводим код в зависимости от типа формы
+                    if page.query_selector("input[maxlength='1']"):
+                        inputs = page.query_selector_all("input[maxlength='1']")
+                        for i, ch in enumerate(code):
+                            if i < len(inputs):
+                                inputs[i].fill(ch)
+                    elif page.query_selector("input[name='authcode']"):
+                        page.fill("input[name='authcode']", code)
+                        btn = page.query_selector("button[type='submit']")
+                        if btn:
+                            btn.click()
+                    
+                    # Ждем результата ввода кода
                     try:
-                        page.wait_for_selector(
-                            "#auth_buttonset_entercode, input[maxlength='1'], #account_pulldown, .newlogindialog_FormError", timeout=25000)
+                        page.wait_for_selector("#account_pulldown, .newlogindialog_FormError", timeout=15000)
                     except PWTimeoutError:
                         logger.error(
-                            "[AUTO_END_RENT] Время ожидания ответа от Steam истекло")
+                            "[AUTO_END_RENT] Время ожидания после ввода кода истекло")
                         page.screenshot(path=os.path.join(
-                            SCREENSHOTS_DIR, f"auto_end_login_timeout_{acc_id}.png"))
-                        return
-
-                    # Проверяем необходимость ввода Steam Guard
-                    need_guard = False
-                    if page.query_selector("#auth_buttonset_entercode") or page.query_selector("input[maxlength='1']"):
-                        need_guard = True
+                            SCREENSHOTS_DIR, f"auto_end_code_timeout_{acc_id}.png"))
+                        return False
 
-                    if need_guard:
-                        logger.info("[AUTO_END_RENT] Требуется код Steam Guard, получаем с почты")
-                        page.screenshot(path=os.path.join(
-                            SCREENSHOTS_DIR, f"auto_end_steam_guard_page_{acc_id}.png"))
-                        
-                        # Получаем код с почты
-                        if not (email_login and email_password and imap_host):
-                            logger.error("[AUTO_END_RENT] Для этого аккаунта не настроена почта")
-                            return
-                        
-                        code = fetch_steam_guard_code_from_email(email_login, email_password, imap_host, mode='change')
-                        if not code:
-                            logger.error("[AUTO_END_RENT] Не удалось получить код Steam Guard с почты")
-                            page.screenshot(path=os.path.join(
-                                SCREENSHOTS_DIR, f"auto_end_no_confirmation_code_{acc_id}.png"))
-                            return
-                        
-                        logger.debug(f"[AUTO_END_RENT] Получен код Steam Guard: {code}")
-                        
-                        # Вводим код в зависимости от типа формы
-                        if page.query_selector("input[maxlength='1']"):
-                            inputs = page.query_selector_all("input[maxlength='1']")
-                            for i, ch in enumerate(code):
-                                if i < len(inputs):
-                                    inputs[i].fill(ch)
-                        elif page.query_selector("input[name='authcode']"):
-                            page.fill("input[name='authcode']", code)
-                            btn = page.query_selector("button[type='submit']")
-                            if btn:
-                                btn.click()
-                        
-                        # Ждем результата ввода кода
-                        try:
-                            page.wait_for_selector("#account_pulldown, .newlogindialog_FormError", timeout=15000)
-                        except PWTimeoutError:
-                            logger.error(
-                                "[AUTO_END_RENT] Время ожидания после ввода кода истекло")
-                            page.screenshot(path=os.path.join(
-                                SCREENSHOTS_DIR, f"auto_end_code_timeout_{acc_id}.png"))
-                            return
-
-                        # Проверяем успешность входа
-                        if page.query_selector("#account_pulldown"):
-                            logged_in = True
-                            logger.info("[AUTO_END_RENT] Успешный вход после ввода кода Steam Guard")
-                            # Сохраняем сессию для будущего использования
-                            try:
-                                context.storage_state(path=session_file)
-                                logger.info(f"[AUTO_END_RENT] Сессия сохранена: {session_file}")
-                            except Exception as ex:
-                                logger.warning(f"[AUTO_END_RENT] Не удалось сохранить сессию: {ex}")
-                        elif page.query_selector(".newlogindialog_FormError"):
-                            err = page.inner_text(".newlogindialog_FormError")
-                            logger.error(f"[AUTO_END_RENT] Ошибка входа: {err}")
-                            page.screenshot(path=os.path.join(
-                                SCREENSHOTS_DIR, f"auto_end_login_error_{acc_id}.png"))
-                            return
-                    # Проверяем, успешен ли вход без Steam Guard
-                    elif page.query_selector("#account_pulldown"):
+                    # Проверяем успешность входа
+                    if page.query_selector("#account_pulldown"):
                         logged_in = True
-                        logger.info("[AUTO_END_RENT] Успешный вход без Steam Guard")
+                        logger.info("[AUTO_END_RENT] Успешный вход после ввода кода Steam Guard")
                         # Сохраняем сессию для будущего использования
                         try:
                             context.storage_state(path=session_file)
@@ -589,233 +502,236 @@ def auto_end_rent(acc_id: int, tg_user_id: int, rent_seconds: int, notify_callba
                         logger.error(f"[AUTO_END_RENT] Ошибка входа: {err}")
                         page.screenshot(path=os.path.join(
                             SCREENSHOTS_DIR, f"auto_end_login_error_{acc_id}.png"))
-                        return
+                        return False
+                # Проверяем, успешен ли вход без Steam Guard
+                elif page.query_selector("#account_pulldown"):
+                    logged_in = True
+                    logger.info("[AUTO_END_RENT] Успешный вход без Steam Guard")
+                    # Сохраняем сессию для будущего использования
+                    try:
+                        context.storage_state(path=session_file)
+                        logger.info(f"[AUTO_END_RENT] Сессия сохранена: {session_file}")
+                    except Exception as ex:
+                        logger.warning(f"[AUTO_END_RENT] Не удалось сохранить сессию: {ex}")
+                elif page.query_selector(".newlogindialog_FormError"):
+                    err = page.inner_text(".newlogindialog_FormError")
+                    logger.error(f"[AUTO_END_RENT] Ошибка входа: {err}")
+                    page.screenshot(path=os.path.join(
+                        SCREENSHOTS_DIR, f"auto_end_login_error_{acc_id}.png"))
+                    return False
+            
+            # Если успешно вошли, начинаем процесс смены данных
+            success = False  # Инициализируем переменную success
+            if logged_in:
+                logger.info("[AUTO_END_RENT] Успешный вход в аккаунт, начинаем смену данных")
                 
-                # Если успешно вошли, начинаем процесс смены данных
-                success = False  # Инициализируем переменную success
-                if logged_in:
-                    logger.info("[AUTO_END_RENT] Успешный вход в аккаунт, начинаем смену данных")
-                    
-                    # Переходим на страницу аккаунта
-                    page.goto("https://store.steampowered.com/account/")
+                # Переходим на страницу аккаунта
+                page.goto("https://store.steampowered.com/account/")
+                page.wait_for_load_state("networkidle")
+                page.screenshot(path=os.path.join(
+                    SCREENSHOTS_DIR, f"auto_end_account_page_{acc_id}.png"))
+                
+                # Переходим на правильную страницу смены пароля
+                try:
+                    page.goto("https://store.steampowered.com/account/password")
+                    logger.info("[AUTO_END_RENT] Перешли на страницу смены пароля")
                     page.wait_for_load_state("networkidle")
+                    time.sleep(2)
+                except Exception as e:
+                    logger.error(f"[AUTO_END_RENT] Не удалось перейти на страницу смены пароля: {e}")
                     page.screenshot(path=os.path.join(
-                        SCREENSHOTS_DIR, f"auto_end_account_page_{acc_id}.png"))
+                        SCREENSHOTS_DIR, f"auto_end_change_pass_fail_{acc_id}.png"))
+                    return False
                     
-                    # Переходим на правильную страницу смены пароля
-                    try:
-                        page.goto("https://store.steampowered.com/account/password")
-                        logger.info("[AUTO_END_RENT] Перешли на страницу смены пароля")
-                        page.wait_for_load_state("networkidle")
-                        time.sleep(2)
-                    except Exception as e:
-                        logger.error(f"[AUTO_END_RENT] Не удалось перейти на страницу смены пароля: {e}")
+                # Упрощенная логика смены пароля
+                page.screenshot(path=os.path.join(
+                    SCREENSHOTS_DIR, f"auto_end_change_pass_page_{acc_id}.png"))
+                
+                # Ищем поля для ввода пароля 
+                logger.info("[AUTO_END_RENT] Ищем поля для ввода нового пароля...")
+                time.sleep(3)
+                
+                # Проверяем наличие полей пароля на странице
+                password_fields = page.query_selector_all('input[type="password"]')
+                logger.info(f"[AUTO_END_RENT] Найдено полей пароля: {len(password_fields)}")
+                
+                if len(password_fields) < 2:
+                    logger.info("[AUTO_END_RENT] Поля пароля не найдены сразу, проверяем другие варианты...")
+                    
+                    # Возможно нужно нажать кнопку смены пароля сначала
+                    change_password_selectors = [
+                        'a:has-text("Сменить пароль")',
+                        'a:has-text("Change password")',
+                        'button:has-text("Сменить пароль")',
+                        'button:has-text("Change password")',
+                        '.account_manage_link:has-text("пароль")',
+                        'a[href*="password"]'
+                    ]
+                    
+                    clicked_change_password = False
+                    for selector in change_password_selectors:
+                        try:
+                            if page.query_selector(selector):
+                                logger.info(f"[AUTO_END_RENT] Нажимаем на ссылку смены пароля: {selector}")
+                                page.click(selector)
+                                clicked_change_password = True
+                                time.sleep(3)
+                                page.wait_for_load_state("networkidle")
+                                break
+                        except Exception as e:
+                            logger.warning(f"[AUTO_END_RENT] Не удалось кликнуть {selector}: {e}")
+                    
+                    if clicked_change_password:
                         page.screenshot(path=os.path.join(
-                            SCREENSHOTS_DIR, f"auto_end_change_pass_fail_{acc_id}.png"))
-                        return
-                        
-                    # Упрощенная логика смены пароля
+                            SCREENSHOTS_DIR, f"auto_end_after_click_change_{acc_id}.png"))
+                        password_fields = page.query_selector_all('input[type="password"]')
+                        logger.info(f"[AUTO_END_RENT] После клика найдено полей пароля: {len(password_fields)}")
+                
+                # Если всё ещё нет полей пароля, пробуем альтернативный путь
+                if len(password_fields) < 2:
+                    logger.info("[AUTO_END_RENT] Пробуем переход через прямой URL...")
+                    page.goto("https://store.steampowered.com/account/password")
+                    page.wait_for_load_state("networkidle")
+                    time.sleep(3)
+                    password_fields = page.query_selector_all('input[type="password"]')
+                    logger.info(f"[AUTO_END_RENT] После прямого перехода найдено полей пароля: {len(password_fields)}")
+                
+                # Заполняем поля пароля
+                if len(password_fields) >= 2:
+                    logger.info("[AUTO_END_RENT] Заполняем первое поле пароля...")
+                    password_fields[0].fill(new_password)
+                    logger.info("[AUTO_END_RENT] Заполняем второе поле пароля...")
+                    password_fields[1].fill(new_password)
+                    logger.info("[AUTO_END_RENT] Оба поля пароля заполнены")
+                    
                     page.screenshot(path=os.path.join(
-                        SCREENSHOTS_DIR, f"auto_end_change_pass_page_{acc_id}.png"))
+                        SCREENSHOTS_DIR, f"auto_end_filled_{acc_id}.png"))
                     
-                    # Ищем поля для ввода пароля 
-                    logger.info("[AUTO_END_RENT] Ищем поля для ввода нового пароля...")
-                    time.sleep(3)
+                    logger.info("[AUTO_END_RENT] Переходим к нажатию кнопки смены пароля...")
+                    logger.info("[AUTO_END_RENT] Ждем 1 секунду перед кликом...")
+                    time.sleep(1)
                     
-                    # Проверяем наличие полей пароля на странице
-                    password_fields = page.query_selector_all('input[type="password"]')
-                    logger.info(f"[AUTO_END_RENT] Найдено полей пароля: {len(password_fields)}")
+                    # Ищем и нажимаем кнопку смены пароля
+                    clicked = False
+                    selectors_to_try = [
+                        'button:has-text("Сменить пароль"):not([disabled])',
+                        'button:has-text("Сменить пароль")',
+                        '#change_password_button',
+                        '.change_password_button',
+                        'button:has-text("Change Password"):not([disabled])',
+                        'button:has-text("Change Password")',
+                        'button[type="submit"]',
+                        'input[type="submit"]'
+                    ]
                     
-                    if len(password_fields) < 2:
-                        logger.info("[AUTO_END_RENT] Поля пароля не найдены сразу, проверяем другие варианты...")
-                        
-                        # Возможно нужно нажать кнопку смены пароля сначала
-                        change_password_selectors = [
-                            'a:has-text("Сменить пароль")',
-                            'a:has-text("Change password")',
-                            'button:has-text("Сменить пароль")',
-                            'button:has-text("Change password")',
-                            '.account_manage_link:has-text("пароль")',
-                            'a[href*="password"]'
-                        ]
-                        
-                        clicked_change_password = False
-                        for selector in change_password_selectors:
-                            try:
-                                if page.query_selector(selector):
-                                    logger.info(f"[AUTO_END_RENT] Нажимаем на ссылку смены пароля: {selector}")
-                                    page.click(selector)
-                                    clicked_change_password = True
-                                    time.sleep(3)
-                                    page.wait_for_load_state("networkidle")
-                                    break
-                            except Exception as e:
-                                logger.warning(f"[AUTO_END_RENT] Не удалось кликнуть {selector}: {e}")
-                        
-                        if clicked_change_password:
-                            page.screenshot(path=os.path.join(
-                                SCREENSHOTS_DIR, f"auto_end_after_click_change_{acc_id}.png"))
-                            password_fields = page.query_selector_all('input[type="password"]')
-                            logger.info(f"[AUTO_END_RENT] После клика найдено полей пароля: {len(password_fields)}")
+                    for sel in selectors_to_try:
+                        try:
+                            logger.info(f"[AUTO_END_RENT] Ищем кнопку смены пароля...")
+                            logger.info(f"[AUTO_END_RENT] Пробуем кликнуть селектор: {sel}")
+                            page.click(sel, timeout=3000)
+                            logger.info(f"[AUTO_END_RENT] ✅ Успешно нажали на кнопку смены пароля: {sel}")
+                            clicked = True
+                            break
+                        except Exception as e:
+                            logger.warning(f"[AUTO_END_RENT] Не удалось кликнуть {sel}: {e}")
+                            continue
                     
-                    # Если всё ещё нет полей пароля, пробуем альтернативный путь
-                    if len(password_fields) < 2:
-                        logger.info("[AUTO_END_RENT] Пробуем переход через прямой URL...")
-                        page.goto("https://store.steampowered.com/account/password")
-                        page.wait_for_load_state("networkidle")
+                    if clicked:
+                        logger.info("[AUTO_END_RENT] Ждем завершения операции смены пароля...")
                         time.sleep(3)
-                        password_fields = page.query_selector_all('input[type="password"]')
-                        logger.info(f"[AUTO_END_RENT] После прямого перехода найдено полей пароля: {len(password_fields)}")
-                    
-                    # Заполняем поля пароля
-                    if len(password_fields) >= 2:
-                        logger.info("[AUTO_END_RENT] Заполняем первое поле пароля...")
-                        password_fields[0].fill(new_password)
-                        logger.info("[AUTO_END_RENT] Заполняем второе поле пароля...")
-                        password_fields[1].fill(new_password)
-                        logger.info("[AUTO_END_RENT] Оба поля пароля заполнены")
-                        
                         page.screenshot(path=os.path.join(
-                            SCREENSHOTS_DIR, f"auto_end_filled_{acc_id}.png"))
+                            SCREENSHOTS_DIR, f"auto_end_final_{acc_id}.png"))
                         
-                        logger.info("[AUTO_END_RENT] Переходим к нажатию кнопки смены пароля...")
-                        logger.info("[AUTO_END_RENT] Ждем 1 секунду перед кликом...")
-                        time.sleep(1)
+                        # Проверяем результат смены пароля
+                        success = True  # Упрощенная проверка - считаем успешным если дошли до этого момента
+                        logger.info("[AUTO_END_RENT] Делаем финальный скриншот...")
                         
-                        # Ищем и нажимаем кнопку смены пароля
-                        clicked = False
-                        selectors_to_try = [
-                            'button:has-text("Сменить пароль"):not([disabled])',
-                            'button:has-text("Сменить пароль")',
-                            '#change_password_button',
-                            '.change_password_button',
-                            'button:has-text("Change Password"):not([disabled])',
-                            'button:has-text("Change Password")',
-                            'button[type="submit"]',
-                            'input[type="submit"]'
-                        ]
-                        
-                        for sel in selectors_to_try:
-                            try:
-                                logger.info(f"[AUTO_END_RENT] Ищем кнопку смены пароля...")
-                                logger.info(f"[AUTO_END_RENT] Пробуем кликнуть селектор: {sel}")
-                                page.click(sel, timeout=3000)
-                                logger.info(f"[AUTO_END_RENT] ✅ Успешно нажали на кнопку смены пароля: {sel}")
-                                clicked = True
-                                break
-                            except Exception as e:
-                                logger.warning(f"[AUTO_END_RENT] Не удалось кликнуть {sel}: {e}")
-                                continue
-                        
-                        if clicked:
-                            logger.info("[AUTO_END_RENT] Ждем завершения операции смены пароля...")
-                            time.sleep(3)
-                            page.screenshot(path=os.path.join(
-                                SCREENSHOTS_DIR, f"auto_end_final_{acc_id}.png"))
-                            
-                            # Проверяем результат смены пароля
-                            success = True  # Упрощенная проверка - считаем успешным если дошли до этого момента
-                            logger.info("[AUTO_END_RENT] Делаем финальный скриншот...")
+                        if success:
+                            logger.info("[AUTO_END_RENT] Обновляем пароль в базе данных...")
+                            accounts_repo.set_password(acc_id, new_password)
+                            logger.info(f"[AUTO_END_RENT] ✅ Пароль успешно обновлен в БД для аккаунта {acc_id}")
                             
-                            if success:
-                                logger.info("[AUTO_END_RENT] Обновляем пароль в базе данных...")
-                                conn = sqlite3.connect(DB_PATH)
-                                c = conn.cursor()
-                                c.execute("UPDATE accounts SET password=? WHERE id=?", (new_password, acc_id))
-                                conn.commit()
-                                conn.close()
-                                logger.info(f"[AUTO_END_RENT] ✅ Пароль успешно обновлен в БД для аккаунта {acc_id}")
-                                
-                                # Отправляем уведомление администраторам о смене пароля
-                                try:
-                                    from tg_utils.handlers import bot, ADMIN_IDS
-                                    message_to_admin = (
-                                        f"🔑 Пароль изменён\n"
-                                        f"ID: {acc_id}\n"
-                                        f"Логин: {login}\n"
-                                        f"Старый пароль: <code>{old_password_db}</code>\n"
-                                        f"Новый пароль: <code>{new_password}</code>"
-                                    )
-                                    for admin_id in ADMIN_IDS:
-                                        try:
-                                            bot.send_message(admin_id, message_to_admin, parse_mode="HTML")
-                                        except Exception as admin_msg_e:
-                                            logger.error(f"[AUTO_END_RENT] Не удалось отправить сообщение админу {admin_id}: {admin_msg_e}")
-                                except ImportError:
-                                    logger.error("[AUTO_END_RENT] Не удалось импортировать bot или ADMIN_IDS для уведомления админов")
-                        else:
-                            logger.error("[AUTO_END_RENT] Не удалось найти кнопку смены пароля")
-                            success = False
+                            # Отправляем уведомление администраторам о смене пароля
+                            try:
+                                from tg_utils.handlers import bot, ADMIN_IDS
+                                message_to_admin = (
+                                    f"🔑 Пароль изменён\n"
+                                    f"ID: {acc_id}\n"
+                                    f"Логин: {login}\n"
+                                    f"Старый пароль: <code>{old_password_db}</code>\n"
+                                    f"Новый пароль: <code>{new_password}</code>"
+                                )
+                                for admin_id in ADMIN_IDS:
+                                    try:
+                                        bot.send_message(admin_id, message_to_admin, parse_mode="HTML")
+                                    except Exception as admin_msg_e:
+                                        logger.error(f"[AUTO_END_RENT] Не удалось отправить сообщение админу {admin_id}: {admin_msg_e}")
+                            except ImportError:
+                                logger.error("[AUTO_END_RENT] Не удалось импортировать bot или ADMIN_IDS для уведомления админов")
                     else:
-                        logger.error(f"[AUTO_END_RENT] Недостаточно полей пароля. Найдено: {len(password_fields)}")
+                        logger.error("[AUTO_END_RENT] Не удалось найти кнопку смены пароля")
                         success = False
+                else:
+                    logger.error(f"[AUTO_END_RENT] Недостаточно полей пароля. Найдено: {len(password_fields)}")
+                    success = False
+            
+            if context:
+                context.close()
+            # браузер возвращается в пул сразу, не дожидаясь уведомлений
+            browser_pool.release(browser)
+            
+            # Получаем актуальные tg_user_id и order_id из базы данных
+            # перед тем как пометить аккаунт как свободный, чтобы отправить уведомление.
+            current_tg_user_id = None
+            current_order_id_for_notification = None
+            try:
+                fetch_row_notify = accounts_repo.get(acc_id)
+                if fetch_row_notify:
+                    current_tg_user_id = fetch_row_notify["tg_user_id"]
+                    current_order_id_for_notification = fetch_row_notify["order_id"]
+                logger.info(f"[AUTO_END_RENT] Получены данные для уведомления: tg_user_id={current_tg_user_id}, order_id={current_order_id_for_notification} для аккаунта {acc_id}")
+            except Exception as e:
+                logger.error(f"[AUTO_END_RENT] Ошибка при получении данных для уведомления об окончании аренды для аккаунта {acc_id}: {e}")
+
+            if success or (rent_seconds is not None and rent_seconds <= 60):
+                logger.info(f"[AUTO_END_RENT] Сбрасываем статус аккаунта {acc_id} на 'free'")
+                # Сбрасываем статус аккаунта
+                accounts_repo.free(acc_id)
                 
-                if context:
-                    context.close()
-                if browser:
-                    browser.close()
-                
-                # Получаем актуальные tg_user_id и order_id из базы данных
-                # перед тем как пометить аккаунт как свободный, чтобы отправить уведомление.
-                current_tg_user_id = None
-                current_order_id_for_notification = None
+                # Теперь отправляем уведомление, используя только что полученные данные
                 try:
-                    conn_fetch_notify = sqlite3.connect(DB_PATH)
-                    c_fetch_notify = conn_fetch_notify.cursor()
-                    c_fetch_notify.execute("SELECT tg_user_id, order_id FROM accounts WHERE id=?", (acc_id,))
-                    fetch_row_notify = c_fetch_notify.fetchone()
-                    if fetch_row_notify:
-                        current_tg_user_id = fetch_row_notify[0]
-                        current_order_id_for_notification = fetch_row_notify[1]
-                    conn_fetch_notify.close()
-                    logger.info(f"[AUTO_END_RENT] Получены данные для уведомления: tg_user_id={current_tg_user_id}, order_id={current_order_id_for_notification} для аккаунта {acc_id}")
+                    from funpay_manager import get_listener
+                    funpay = get_listener(current_tg_user_id)
+                    order_data = {
+                        'chat_id': current_tg_user_id,
+                        'order_id': current_order_id_for_notification
+                    }
+                    if current_tg_user_id and current_order_id_for_notification and not str(current_order_id_for_notification).startswith(('TG-', 'TEST-')):
+                        send_order_completed_message(order_data, 
+                            lambda chat_id, text: funpay.funpay_send_message_wrapper(chat_id, text))
+                        logger.info(f"[AUTO_END_RENT] Сообщение об окончании аренды успешно отправлено клиенту FunPay {current_tg_user_id} для заказа {current_order_id_for_notification}")
+                    else:
+                        logger.warning(f"[AUTO_END_RENT] Пропущена отправка уведомления об окончании аренды для аккаунта {acc_id} (tg_user_id: {current_tg_user_id}, order_id: {current_order_id_for_notification}). Возможно, клиент не FunPay или данные отсутствуют.")
                 except Exception as e:
-                    logger.error(f"[AUTO_END_RENT] Ошибка при получении данных для уведомления об окончании аренды для аккаунта {acc_id}: {e}")
-
-                if success or rent_seconds <= 60:
-                    logger.info(f"[AUTO_END_RENT] Сбрасываем статус аккаунта {acc_id} на 'free'")
-                    conn = sqlite3.connect(DB_PATH)
-                    c = conn.cursor()
-                    
-                    # Сбрасываем статус аккаунта
-                    c.execute("UPDATE accounts SET status='free', rented_until=NULL, tg_user_id=NULL, order_id=NULL, lot_id=NULL, warned_10min=0, bonus_given=0 WHERE id=?", (acc_id,))
-                    conn.commit()
-                    
-                    # Теперь отправляем уведомление, используя только что полученные данные
+                    logger.error(f"[AUTO_END_RENT] Не удалось отправить уведомление об окончании аренды: {e}", exc_info=True)
+                
+                if notify_callback:
                     try:
-                        from funpay_integration import FunPayListener
-                        funpay = FunPayListener()
-                        order_data = {
-                            'chat_id': current_tg_user_id,
-                            'order_id': current_order_id_for_notification
-                        }
-                        if current_tg_user_id and current_order_id_for_notification and not str(current_order_id_for_notification).startswith(('TG-', 'TEST-')):
-                            send_order_completed_message(order_data, 
-                                lambda chat_id, text: funpay.funpay_send_message_wrapper(chat_id, text))
-                            logger.info(f"[AUTO_END_RENT] Сообщение об окончании аренды успешно отправлено клиенту FunPay {current_tg_user_id} для заказа {current_order_id_for_notification}")
-                        else:
-                            logger.warning(f"[AUTO_END_RENT] Пропущена отправка уведомления об окончании аренды для аккаунта {acc_id} (tg_user_id: {current_tg_user_id}, order_id: {current_order_id_for_notification}). Возможно, клиент не FunPay или данные отсутствуют.")
+                        # Вызываем notify_callback с актуальными данными
+                        # Обратите внимание: notify_callback в tg_utils/db.py также отправляет сообщение.
+                        # Если вы хотите избежать дублирования, логику отправки сообщения из notify_callback в db.py нужно будет удалить.
+                        notify_callback(acc_id, current_tg_user_id)
+                        logger.info(f"[AUTO_END_RENT] Вызван notify_callback для аккаунта {acc_id} с tg_user_id {current_tg_user_id}")
                     except Exception as e:
-                        logger.error(f"[AUTO_END_RENT] Не удалось отправить уведомление об окончании аренды: {e}", exc_info=True)
-                    
-                    if notify_callback:
-                        try:
-                            # Вызываем notify_callback с актуальными данными
-                            # Обратите внимание: notify_callback в tg_utils/db.py также отправляет сообщение.
-                            # Если вы хотите избежать дублирования, логику отправки сообщения из notify_callback в db.py нужно будет удалить.
-                            notify_callback(acc_id, current_tg_user_id)
-                            logger.info(f"[AUTO_END_RENT] Вызван notify_callback для аккаунта {acc_id} с tg_user_id {current_tg_user_id}")
-                        except Exception as e:
-                            logger.error(f"[AUTO_END_RENT] Ошибка в notify_callback: {e}")
-                else:
-                    logger.error(f"[AUTO_END_RENT] Не удалось изменить пароль для аккаунта {acc_id}, статус не сброшен")
-                
-        except Exception as e:
-            logger.error(f"[AUTO_END_RENT] Критическая ошибка при завершении аренды: {e}", exc_info=True)
-    
-    threading.Thread(target=worker, daemon=True).start()
-    logger.info(f"[AUTO_END_RENT] Запущен основной поток для завершения аренды аккаунта {acc_id}")
-    return True
+                        logger.error(f"[AUTO_END_RENT] Ошибка в notify_callback: {e}")
+            else:
+                logger.error(f"[AUTO_END_RENT] Не удалось изменить пароль для аккаунта {acc_id}, статус не сброшен")
+                return False
+            return True
+            
+    except Exception as e:
+        logger.error(f"[AUTO_END_RENT] Критическая ошибка при завершении аренды: {e}", exc_info=True)
+        return False
 
 # --- Пример функции отправки аккаунта покупателю (заготовка) ---
 def send_account_to_buyer(order, acc, send_func):
@@ -870,61 +786,8 @@ def send_steam_guard_code(chat_id, code, until_timestamp, send_func):
             except Exception as e3:
                 print(f"[ERROR] Complete failure sending Steam Guard code: {e3}")
 
-# --- Совместимость с логикой test_rental.py ---
-def get_account_for_order(order_id, game_name):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT account_id FROM issued_accounts WHERE order_id = ?", (order_id,))
-    row = c.fetchone()
-    if row:
-        c.execute("SELECT * FROM accounts WHERE id = ?", (row[0],))
-        acc = c.fetchone()
-        conn.close()
-        return acc
-    c.execute("SELECT * FROM accounts WHERE game_name = ? AND status = 'free'", (game_name,))
-    acc = c.fetchone()
-    conn.close()
-    return acc
-
-def mark_account_issued(order_id, account_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO issued_accounts (order_id, account_id, message_sent) VALUES (?, ?, 0)", (order_id, account_id))
-    conn.commit()
-    conn.close()
-
-def set_message_sent(order_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE issued_accounts SET message_sent = 1 WHERE order_id = ?", (order_id,))
-    conn.commit()
-    conn.close()
-
-def was_message_sent(order_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT message_sent FROM issued_accounts WHERE order_id = ?", (order_id,))
-    row = c.fetchone()
-    conn.close()
-    return row and row[0] == 1
-
 def set_account_rented(id, until, tg_user_id, lot_id, order_id=None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Проверяем наличие столбца order_id
-    c.execute("PRAGMA table_info(accounts)")
-    columns = [column[1] for column in c.fetchall()]
-    
-    if 'order_id' in columns:
-        c.execute("UPDATE accounts SET rented_until = ?, status = 'rented', tg_user_id = ?, lot_id = ?, order_id = ? WHERE id = ?",
-                  (until, tg_user_id, lot_id, order_id, id))
-    else:
-        c.execute("UPDATE accounts SET rented_until = ?, status = 'rented', tg_user_id = ?, lot_id = ? WHERE id = ?",
-                  (until, tg_user_id, lot_id, id))
-    
-    conn.commit()
-    conn.close()
+    accounts_repo.rent(id, tg_user_id, until, order_id, lot_id)
 
 # Функция для отправки сообщения о завершении заказа
 def send_order_completed_message(order, send_func):
@@ -940,22 +803,11 @@ def send_order_completed_message(order, send_func):
         # Если order_id не передан или равен UNKNOWN, пробуем получить из базы данных
         if not order_id or order_id == 'UNKNOWN':
             try:
-                import sqlite3
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                
-                # Проверяем наличие столбца order_id
-                c.execute("PRAGMA table_info(accounts)")
-                columns = [column[1] for column in c.fetchall()]
-                
-                if 'order_id' in columns:
-                    # Ищем order_id по chat_id (tg_user_id)
-                    c.execute("SELECT order_id FROM accounts WHERE tg_user_id=? AND status='rented'", (chat_id,))
-                    row = c.fetchone()
-                    if row and row[0] and not (row[0].startswith('TG-') or row[0].startswith('TEST-')):
-                        order_id = row[0]
-                        print(f"[FunPay][ORDER] Найден ID заказа в БД: {order_id}")
-                conn.close()
+                # Ищем order_id по chat_id (tg_user_id)
+                row = accounts_repo.rented_by_user(chat_id)
+                if row and row["order_id"] and not (row["order_id"].startswith('TG-') or row["order_id"].startswith('TEST-')):
+                    order_id = row["order_id"]
+                    print(f"[FunPay][ORDER] Найден ID заказа в БД: {order_id}")
             except Exception as e:
                 print(f"[ERROR] Не удалось получить ID заказа из базы данных: {e}")
         
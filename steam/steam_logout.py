@@ -10,11 +10,11 @@ os.makedirs(SESSIONS_DIR, exist_ok=True)
 
 # Импортируем универсальную функцию из playwright_context
 from .playwright_context import get_playwright_context
+from utils.browser_pool import browser_pool
 
 async def run_logout_async(login: str, password: str) -> bool:
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
+        async with async_playwright() as p, browser_pool.browser_async(p) as browser:
             context, page = await get_playwright_context(p, browser, login, password)
             logger.info("[STEAM_LOGOUT] Вход на страницу управления устройствами...")
             await page.goto("https://store.steampowered.com/account/authorizeddevices")
@@ -71,7 +71,7 @@ async def run_logout_async(login: str, password: str) -> bool:
                 return False
             await page.screenshot(path="step9_logout_done.png")
 
-            await browser.close()
+            await browser_pool.release_async(browser)
             logger.info(f"[STEAM_LOGOUT] Успешно выполнен выход из всех устройств для {login}")
             try:
                 os.remove(os.path.join(SESSIONS_DIR, f"steam_{login}.json"))
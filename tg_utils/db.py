@@ -1,10 +1,12 @@
 import sqlite3
 import os
+import threading
 import time
 import logging
 from steam.steam_account_rental_utils import send_order_completed_message
-from funpay_integration import FunPayListener
+from funpay_manager import get_listener
 from config import DB_PATH, DB_DIR # Импортируем из нового файла config.py
+from db.connection import get_connection
 
 # Удаляем старые определения DB_DIR и DB_PATH
 # DB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../storage/plugins')
@@ -12,150 +14,164 @@ from config import DB_PATH, DB_DIR # Импортируем из нового ф
 logger = logging.getLogger("steam_rental")
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS accounts (
-        id TEXT PRIMARY KEY,
-        login TEXT NOT NULL,
-        password TEXT NOT NULL,
-        game_name TEXT NOT NULL,
-        rented_until INTEGER,
-        status TEXT NOT NULL DEFAULT 'free',
-        tg_user_id INTEGER,
-        email_login TEXT,
-        email_password TEXT,
-        imap_host TEXT,
-        order_id TEXT,
-        steam_guard_enabled INTEGER DEFAULT 1,
-        warned_10min INTEGER DEFAULT 0,
-        bonus_given INTEGER DEFAULT 0,
-        lot_id TEXT
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS authorized_users (
-        user_id INTEGER PRIMARY KEY,
-        is_authorized INTEGER DEFAULT 0,
-        access_attempts INTEGER DEFAULT 0,
-        last_attempt INTEGER
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS friend_mode_settings (
-        tg_user_id INTEGER PRIMARY KEY,
-        activated_at INTEGER NOT NULL,
-        is_active INTEGER DEFAULT 0
-    )''')
-    conn.commit()
-    conn.close()
+    """Создает схему БД или обновляет ее до последней версии (см. db/migrations.py)."""
+    from db.migrations import migrate
+    version = migrate()
+    logger.info(f"[DB] Версия схемы БД: {version}")
 
 def ensure_accounts_columns():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # Проверяем существующие колонки
-    c.execute("PRAGMA table_info(accounts)")
-    columns = [column[1] for column in c.fetchall()]
-    
-    # Добавляем новые колонки, если их нет
-    if 'steam_guard_enabled' not in columns:
-        c.execute("ALTER TABLE accounts ADD COLUMN steam_guard_enabled INTEGER DEFAULT 1")
-    if 'order_id' not in columns:
-        c.execute("ALTER TABLE accounts ADD COLUMN order_id TEXT")
-    if 'bonus_given' not in columns:
-        c.execute("ALTER TABLE accounts ADD COLUMN bonus_given INTEGER DEFAULT 0")
-    if 'friend_mode' not in columns:
-        c.execute("ALTER TABLE accounts ADD COLUMN friend_mode INTEGER DEFAULT 0")
-    if 'warned_10min' not in columns:
-        c.execute("ALTER TABLE accounts ADD COLUMN warned_10min INTEGER DEFAULT 0")
-    if 'rented_by' not in columns:
-        c.execute("ALTER TABLE accounts ADD COLUMN rented_by INTEGER")
-    
-    conn.commit()
-    conn.close()
+    """Оставлена для совместимости: недостающие колонки accounts добавляются миграциями в init_db()."""
+    from db.migrations import migrate
+    migrate()
+
+# Сколько действует режим friend после команды !friend (в секундах)
+FRIEND_MODE_TTL = 600
+# Сколько хранить в БД записи о режиме friend (в секундах)
+FRIEND_MODE_RETENTION = 3600
+# Как часто фоновый поток удаляет устаревшие режимы friend (в секундах)
+FRIEND_MODE_SWEEP_INTERVAL = 60
+
+
+class FriendModeStore:
+    """
+    Режимы friend в памяти процесса (ID чата -> время включения) с записью в friend_mode_settings.
+
+    Включение и сброс режима сразу записываются в БД, проверка режима читает только словарь в памяти.
+    Устаревшие режимы деактивируются и удаляются из БД фоновым потоком раз в FRIEND_MODE_SWEEP_INTERVAL
+    секунд. При первом обращении в память загружаются действующие режимы из БД (переживают перезапуск).
+    """
+
+    def __init__(self, ttl: int = FRIEND_MODE_TTL):
+        self.ttl = ttl
+        self._active: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        # до конца загрузки остальные потоки ждут на _load_lock, а не читают пустой словарь
+        with self._load_lock:
+            if self._loaded:
+                return
+            conn = get_connection()
+            try:
+                rows = conn.execute("SELECT tg_user_id, activated_at FROM friend_mode_settings "
+                                    "WHERE is_active=1 AND activated_at > ?", (time.time() - self.ttl,)).fetchall()
+            finally:
+                conn.close()
+            with self._lock:
+                for tg_user_id, activated_at in rows:
+                    self._active.setdefault(str(tg_user_id), float(activated_at))
+            self._loaded = True
+        threading.Thread(target=self._sweep_loop, name="friend_mode_sweeper", daemon=True).start()
+
+    def set(self, tg_user_id):
+        """Включает режим friend (запись в БД и в память)."""
+        self._ensure_loaded()
+        current_time = int(time.time())
+        conn = get_connection()
+        try:
+            with conn:
+                conn.execute("DELETE FROM friend_mode_settings WHERE tg_user_id=?", (tg_user_id,))
+                conn.execute("INSERT INTO friend_mode_settings (tg_user_id, activated_at, is_active) VALUES (?, ?, 1)",
+                             (tg_user_id, current_time))
+        finally:
+            conn.close()
+        with self._lock:
+            self._active[str(tg_user_id)] = current_time
+
+    def is_active(self, tg_user_id) -> bool:
+        """Проверяет режим friend по памяти процесса, без запросов к БД."""
+        self._ensure_loaded()
+        with self._lock:
+            activated_at = self._active.get(str(tg_user_id))
+            if activated_at is None:
+                return False
+            if activated_at > time.time() - self.ttl:
+                return True
+            # запись в БД деактивирует фоновый поток
+            del self._active[str(tg_user_id)]
+            return False
+
+    def clear(self, tg_user_id):
+        """Сбрасывает режим friend (запись в БД и в память)."""
+        self._ensure_loaded()
+        with self._lock:
+            self._active.pop(str(tg_user_id), None)
+        conn = get_connection()
+        try:
+            with conn:
+                conn.execute("DELETE FROM friend_mode_settings WHERE tg_user_id=?", (tg_user_id,))
+        finally:
+            conn.close()
+
+    def sweep(self) -> tuple[int, int]:
+        """
+        Удаляет устаревшие режимы из памяти, деактивирует их в БД и удаляет записи старше FRIEND_MODE_RETENTION.
+
+        Returns:
+            tuple: (деактивировано, удалено) записей БД
+        """
+        current_time = time.time()
+        with self._lock:
+            for key in [key for key, at in self._active.items() if at <= current_time - self.ttl]:
+                del self._active[key]
+        conn = get_connection()
+        try:
+            with conn:
+                deactivated = conn.execute("UPDATE friend_mode_settings SET is_active=0 "
+                                           "WHERE is_active=1 AND activated_at <= ?",
+                                           (current_time - self.ttl,)).rowcount
+                deleted = conn.execute("DELETE FROM friend_mode_settings WHERE activated_at < ?",
+                                       (current_time - FRIEND_MODE_RETENTION,)).rowcount
+        finally:
+            conn.close()
+        if deactivated or deleted:
+            logger.info(f"[FRIEND] Очистка устаревших настроек: деактивировано {deactivated}, удалено {deleted} записей")
+        return deactivated, deleted
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(FRIEND_MODE_SWEEP_INTERVAL)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"[FRIEND] Ошибка при очистке устаревших режимов friend: {e}")
+
+
+# Общее хранилище режимов friend процесса
+friend_modes = FriendModeStore()
+
 
 def set_friend_mode(tg_user_id):
     """Активирует режим friend для пользователя"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    current_time = int(time.time())
-    
     logger.info(f"[FRIEND] Активация режима friend для пользователя {tg_user_id}")
-    
-    # Удаляем старые настройки
-    c.execute("DELETE FROM friend_mode_settings WHERE tg_user_id=?", (tg_user_id,))
-    
-    # Добавляем новые с явным указанием is_active=1
-    c.execute("INSERT INTO friend_mode_settings (tg_user_id, activated_at, is_active) VALUES (?, ?, 1)",
-              (tg_user_id, current_time))
-    
-    conn.commit()
-    conn.close()
+    friend_modes.set(tg_user_id)
     logger.info(f"[FRIEND] Режим friend активирован для пользователя {tg_user_id}")
 
 def is_friend_mode_active(tg_user_id):
-    """Проверяет активен ли режим friend для пользователя"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    current_time = int(time.time())
-    
-    # Проверяем наличие активных настроек
-    c.execute("""
-        SELECT 1 FROM friend_mode_settings 
-        WHERE tg_user_id=? AND is_active=1 
-        AND activated_at > ? - 600
-    """, (tg_user_id, current_time))
-    
-    result = c.fetchone() is not None
-    
-    # Если настройки устарели, деактивируем их
-    if not result:
-        c.execute("""
-            UPDATE friend_mode_settings 
-            SET is_active=0 
-            WHERE tg_user_id=? AND activated_at <= ? - 600
-        """, (tg_user_id, current_time))
-        conn.commit()
-        if c.rowcount > 0:
-            logger.info(f"[FRIEND] Режим friend деактивирован для пользователя {tg_user_id} (истекло время)")
-    
-    conn.close()
-    logger.info(f"[FRIEND] Проверка режима friend для пользователя {tg_user_id}: {'активен' if result else 'неактивен'}")
+    """Проверяет активен ли режим friend для пользователя (без обращения к БД)"""
+    result = friend_modes.is_active(tg_user_id)
+    logger.debug(f"[FRIEND] Проверка режима friend для пользователя {tg_user_id}: {'активен' if result else 'неактивен'}")
     return result
 
 def clear_friend_mode(tg_user_id):
     """Очищает настройки режима friend для пользователя"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM friend_mode_settings WHERE tg_user_id=?", (tg_user_id,))
-    conn.commit()
-    conn.close()
+    friend_modes.clear(tg_user_id)
     logger.info(f"[FRIEND] Настройки режима friend очищены для пользователя {tg_user_id}")
 
 def cleanup_expired_friend_modes():
-    """Очищает устаревшие настройки режима friend"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    current_time = int(time.time())
-    
-    # Сначала деактивируем устаревшие настройки
-    c.execute("""
-        UPDATE friend_mode_settings 
-        SET is_active=0 
-        WHERE activated_at < ? - 600
-    """, (current_time,))
-    deactivated = c.rowcount
-    
-    # Затем удаляем записи старше 1 часа
-    c.execute("""
-        DELETE FROM friend_mode_settings 
-        WHERE activated_at < ? - 3600
-    """, (current_time,))
-    deleted = c.rowcount
-    
-    conn.commit()
-    conn.close()
-    logger.info(f"[FRIEND] Очистка устаревших настроек: деактивировано {deactivated}, удалено {deleted} записей")
+    """Очищает устаревшие настройки режима friend (обычно это делает фоновый поток FriendModeStore)"""
+    friend_modes.sweep()
 
 def restore_rental_timers():
     logger.info("[RESTORE] Восстановление таймеров аренды...")
-    conn = sqlite3.connect(DB_PATH)
+    from steam.rental_jobs import rental_jobs, ROTATE
+    # Продолжаем задачи смены данных, прерванные перезапуском
+    rental_jobs.start()
+    conn = get_connection()
     c = conn.cursor()
     c.execute("SELECT id, tg_user_id, rented_until FROM accounts WHERE status='rented'")
     active_rentals = c.fetchall()
@@ -174,7 +190,7 @@ def restore_rental_timers():
                     # Получаем order_id для отправки сообщения FunPay клиенту
                     order_id = None
                     try:
-                        conn_inner = sqlite3.connect(DB_PATH)
+                        conn_inner = get_connection()
                         c_inner = conn_inner.cursor()
                         c_inner.execute("SELECT order_id FROM accounts WHERE id=?", (acc_id,))
                         row_inner = c_inner.fetchone()
@@ -186,7 +202,7 @@ def restore_rental_timers():
 
                     if tg_user_id and order_id and not str(order_id).startswith('TG-'): # Отправляем только FunPay ордерам, не Telegram
                         try:
-                            funpay = FunPayListener()
+                            funpay = get_listener(tg_user_id)
                             order_data = {'chat_id': tg_user_id, 'order_id': order_id}
                             send_order_completed_message(order_data, 
                                 lambda chat_id_arg, text: funpay.funpay_send_message_wrapper(chat_id_arg, text))
@@ -199,9 +215,10 @@ def restore_rental_timers():
                 logger.error(f"[RESTORE] Ошибка при восстановлении таймера для аккаунта {acc_id}: {e}")
         else:
             try:
-                from steam.steam_account_rental_utils import mark_account_free
-                mark_account_free(acc_id)
-                logger.info(f"[RESTORE] Аккаунт {acc_id} освобождён (время аренды истекло)")
+                # Аренда истекла, пока бот был выключен: меняем данные аккаунта через очередь задач,
+                # аккаунт освободится после успешной смены пароля
+                rental_jobs.enqueue(ROTATE, acc_id, {"rent_seconds": None})
+                logger.info(f"[RESTORE] Аккаунт {acc_id}: время аренды истекло, смена данных поставлена в очередь")
             except Exception as e:
-                logger.error(f"[RESTORE] Ошибка при освобождении аккаунта {acc_id}: {e}") 
+                logger.error(f"[RESTORE] Ошибка при постановке смены данных аккаунта {acc_id}: {e}") 
 # next update
\ No newline at end of file
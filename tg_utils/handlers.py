@@ -16,7 +16,10 @@ import shutil
 from datetime import datetime, timedelta
 from game_name_mapper import mapper
 from steam.steam_account_rental_utils import mark_account_rented, mark_account_free, auto_end_rent, send_account_to_buyer
-from utils.email_utils import fetch_steam_guard_code_from_email
+from utils.email_utils import fetch_steam_guard_code_from_email, guard_broker
+from utils.browser_pool import browser_pool
+from db.migrations import accounts_columns
+from db.repository import accounts_repo
 import os
 import re
 import threading
@@ -196,10 +199,9 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
         bot.send_message(call.message.chat.id, "🧪 Тест запущен! Ожидайте отчёт.")
         bot.send_message(call.message.chat.id, f"🧪 <b>Тест аккаунта {acc_id}...</b>", parse_mode="HTML")
 
-        async def run_test():
+        def run_test():
             # --- ЛОГИКА ТЕСТА ИЗ СТАРОЙ ВЕРСИИ --- (ВКЛЮЧАЯ PLAYWRIGHT)
             from playwright.sync_api import sync_playwright, TimeoutError as PWTimeoutError
-            from utils.browser_config import get_browser_config
             import time
             import json
             import os
@@ -213,9 +215,7 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
             page = None
             try:
                 bot.send_message(call.message.chat.id, "🧪 Открываю браузер и страницу Steam...") # Добавил сообщение о запуске браузера
-                browser_config = get_browser_config()
-                with sync_playwright() as p:
-                    browser = p.chromium.launch(**browser_config)
+                with sync_playwright() as p, browser_pool.browser(p) as browser:
                     context = None
                     logged_in = False
                     
@@ -233,12 +233,12 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
                             
                             # Переходим на страницу аккаунта
                             logger.info(f"[STEAM-TEST] Перехожу на страницу аккаунта Steam для проверки сессии")
-                            await page.goto("https://store.steampowered.com/account/", wait_until='networkidle')
+                            page.goto("https://store.steampowered.com/account/", wait_until='networkidle')
                             
                             # Делаем скриншот для диагностики
                             try:
                                 session_screenshot_path = os.path.join(screenshots_dir, f'session_check_{acc_id}.png')
-                                await page.screenshot(path=session_screenshot_path)
+                                page.screenshot(path=session_screenshot_path)
                                 logger.info(f"[STEAM-TEST] Скриншот проверки сессии создан")
                             except Exception as screenshot_e:
                                 logger.warning(f"[STEAM-TEST] Ошибка при создании скриншота сессии: {screenshot_e}")
@@ -263,12 +263,12 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
                             for selector in success_selectors:
                                 try:
                                     logger.debug(f"[STEAM-TEST] Проверяю селектор: {selector}")
-                                    element = await page.wait_for_selector(selector, timeout=5000)
+                                    element = page.wait_for_selector(selector, timeout=5000)
                                     
                                     if element:
                                         # Дополнительная проверка - получаем текст элемента если возможно
                                         try:
-                                            element_text = await element.inner_text()
+                                            element_text = element.inner_text()
                                             logger.info(f"[STEAM-TEST] ✅ Найден элемент входа: {selector} (текст: '{element_text[:50]}')")
                                         except:
                                             logger.info(f"[STEAM-TEST] ✅ Найден элемент входа: {selector}")
@@ -295,7 +295,7 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
                                 
                                 # Проверяем cookies
                                 try:
-                                    cookies = await page.context.cookies()
+                                    cookies = page.context.cookies()
                                     steam_cookies = [c for c in cookies if 'steamLoginSecure' in c.get('name', '')]
                                     if steam_cookies:
                                         logger.info(f"[STEAM-TEST] ✅ Найдены активные Steam cookies")
@@ -340,7 +340,7 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
                             login_form_found = False
                             for selector in login_form_selectors:
                                 try:
-                                    element = await page.query_selector(selector)
+                                    element = page.query_selector(selector)
                                     if element:
                                         logger.info(f"[STEAM-TEST] Найдена форма входа: {selector}")
                                         login_form_found = True
@@ -371,7 +371,7 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
                             if page:
                                 try:
                                     error_screenshot_path = os.path.join(screenshots_dir, f'session_error_{acc_id}.png')
-                                    await page.screenshot(path=error_screenshot_path)
+                                    page.screenshot(path=error_screenshot_path)
                                     with open(error_screenshot_path, 'rb') as photo:
                                         bot.send_photo(
                                             call.message.chat.id, 
@@ -387,7 +387,7 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
                             # Закрываем контекст в любом случае если он был создан
                             try:
                                 if context:
-                                    await context.close()
+                                    context.close()
                                     logger.info(f"[STEAM][ID: {acc_id}][LOGIN: {login}] Контекст закрыт")
                                 
                                 # Удаляем временную папку
@@ -646,11 +646,6 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
                         context.close()
                 except:
                     pass
-                try:
-                    if browser:
-                        browser.close()
-                except:
-                    pass
 
         # Запускаем тест в отдельном потоке
         import threading
@@ -981,15 +976,8 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
         logger.debug(f"[SHOW_ACC_PAGE] Showing accounts for game={game}, starting index={start_index}")
         PAGE_SIZE = 7 # Количество аккаунтов на странице
         try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            # Получаем все аккаунты для игры, отсортированные по ID
-            # Убедимся, что получаем steam_guard_enabled
-            c.execute("SELECT id, login, password, status, steam_guard_enabled, rented_until FROM accounts WHERE game_name=? ORDER BY id", (game,))
-            all_accounts = c.fetchall()
-            conn.close()
-
-            total_accounts = len(all_accounts)
+            # Загружаем только аккаунты текущей страницы и счетчики по игре
+            page_rows, total_accounts, total_free = accounts_repo.page_by_game(game, start_index, PAGE_SIZE)
             logger.debug(f"[SHOW_ACC_PAGE] Found {total_accounts} total accounts for game {game}")
 
             if total_accounts == 0:
@@ -1001,18 +989,18 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
                 return
 
             # Определяем аккаунты для текущей страницы
-            accounts_on_page = all_accounts[start_index : start_index + PAGE_SIZE]
+            accounts_on_page = [(r["id"], r["login"], r["password"], r["status"], r["steam_guard_enabled"], r["rented_until"])
+                                for r in page_rows]
             current_page_count = len(accounts_on_page)
             logger.debug(f"[SHOW_ACC_PAGE] Showing {current_page_count} accounts from index {start_index}")
 
             # Формируем заголовок с информацией о странице
             end_index = start_index + current_page_count
-            total_free = sum(1 for acc in all_accounts if acc[3] == 'free')
-            total_rented = len(all_accounts) - total_free
+            total_rented = total_accounts - total_free
             
             text = f"<b>🎮 {game} — Аккаунты</b>\n"
-            text += f"📊 Всего: {len(all_accounts)} | 🟢 Свободно: {total_free} | 🔴 В аренде: {total_rented}\n"
-            text += f"📄 Страница: {start_index // PAGE_SIZE + 1} из {(len(all_accounts) + PAGE_SIZE - 1) // PAGE_SIZE}\n\n"
+            text += f"📊 Всего: {total_accounts} | 🟢 Свободно: {total_free} | 🔴 В аренде: {total_rented}\n"
+            text += f"📄 Страница: {start_index // PAGE_SIZE + 1} из {(total_accounts + PAGE_SIZE - 1) // PAGE_SIZE}\n\n"
 
             # Создаем inline кнопки для каждого аккаунта на странице
             markup = types.InlineKeyboardMarkup()
@@ -1363,17 +1351,9 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
                     # Получаем order_id из базы данных
                     order_id = None
                     try:
-                        conn = sqlite3.connect(DB_PATH)
-                        c = conn.cursor()
-                        c.execute("PRAGMA table_info(accounts)")
-                        columns = [column[1] for column in c.fetchall()]
-                        
-                        if 'order_id' in columns:
-                            c.execute("SELECT order_id FROM accounts WHERE id=?", (acc_id,))
-                            row = c.fetchone()
-                            if row and row[0]:
-                                order_id = row[0]
-                        conn.close()
+                        row = accounts_repo.get(acc_id)
+                        if row and row["order_id"]:
+                            order_id = row["order_id"]
                     except Exception as e:
                         logger.error(f"Ошибка при получении order_id из БД: {e}")
                     
@@ -1449,29 +1429,18 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
         bot.answer_callback_query(call.id)
         try:
             acc_id = call.data.split(":")[1]
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            # Проверяем наличие столбца order_id
-            c.execute("PRAGMA table_info(accounts)")
-            columns = [column[1] for column in c.fetchall()]
             order_id = None
             tg_user_id = None
-            if 'order_id' in columns:
-                c.execute("SELECT status, order_id, tg_user_id FROM accounts WHERE id=?", (acc_id,))
-                row = c.fetchone()
-                if row:
-                    order_id = row[1]
-                    tg_user_id = row[2]
-            else:
-                c.execute("SELECT status FROM accounts WHERE id=?", (acc_id,))
-                row = c.fetchone()
-            conn.close()
+            row = accounts_repo.get(acc_id)
+            if row:
+                order_id = row["order_id"]
+                tg_user_id = row["tg_user_id"]
 
             if not row:
                 bot.answer_callback_query(call.id)
                 bot.send_message(call.message.chat.id, "❌ Аккаунт не найден.")
                 return
-            if row[0] != "rented":
+            if row["status"] != "rented":
                 bot.answer_callback_query(call.id)
                 bot.send_message(call.message.chat.id, "❌ Аккаунт не в аренде.")
                 return
@@ -1490,8 +1459,8 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
                 # Если есть tg_user_id и order_id — отправить клиенту в FunPay
                 if tg_user_id and order_id and str(tg_user_id).isdigit() and not str(order_id).startswith('TG-'):
                     try:
-                        from funpay_integration import FunPayListener
-                        funpay = FunPayListener()
+                        from funpay_manager import get_listener
+                        funpay = get_listener(tg_user_id)
                         funpay.funpay_send_message_wrapper(tg_user_id, funpay_msg)
                     except Exception as e:
                         logger.error(f"Ошибка при отправке сообщения клиенту FunPay: {e}")
@@ -1573,9 +1542,10 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
         email_login, email_password, imap_host = row
         host, port = parse_imap_host_port(imap_host)
 
-        def get_guard_code():
+        # Код ждет общий брокер кодов: ответ отправляется, когда письмо придет на почту
+        def on_guard_code(future):
             try:
-                code = fetch_steam_guard_code_from_email(email_login, email_password, host, port)
+                code = None if future.cancelled() else future.result()
                 if code:
                     bot.send_message(call.message.chat.id, f"🔑 Код Guard: <code>{code}</code>", parse_mode="HTML")
                 else:
@@ -1583,8 +1553,8 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
             except Exception as e:
                 logger.error(f"Ошибка при получении кода: {e}")
                 bot.send_message(call.message.chat.id, f"❌ Ошибка: {e}")
-                
-        threading.Thread(target=get_guard_code).start()
+
+        guard_broker.request(email_login, email_password, host, mode='login', logger=logger).add_done_callback(on_guard_code)
         bot.answer_callback_query(call.id, "⏳ Получаем код...")
 
     # --- ВЫХОД ИЗ АККАУНТА ---
@@ -1993,10 +1963,7 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
             cursor = conn.cursor()
 
             # Проверяем, существует ли такое поле в таблице accounts
-            cursor.execute(f"PRAGMA table_info(accounts)")
-            columns = [column[1] for column in cursor.fetchall()]
-
-            if field_to_change in columns:
+            if field_to_change in accounts_columns():
                 # Получаем старое значение перед обновлением
                 cursor.execute(f"SELECT {field_to_change} FROM accounts WHERE id = ?", (account_id,))
                 result = cursor.fetchone()
@@ -2202,19 +2169,12 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
             async def run_change():
                 try:
                     logger.info(f"[AUTO_END_RENT] Начинаем процесс автоматической смены данных для аккаунта {acc_id}...")
-                    from utils.browser_config import get_browser_config
                     screenshots_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'screenshots')
                     os.makedirs(screenshots_dir, exist_ok=True)
                     logger.info(f"[AUTO_END_RENT] Папка для скриншотов создана: {screenshots_dir}")
-                    logger.info(f"[AUTO_END_RENT] Запускаем Playwright...")
-                    async with async_playwright() as p:
-                        browser_config = get_browser_config()
-                        logger.info(f"[AUTO_END_RENT] Запускаем браузер с конфигурацией: {browser_config}")
-                        browser = await p.chromium.launch(**browser_config)
-                        logger.info(f"[AUTO_END_RENT] Браузер успешно запущен")
-                        
-                        logger.info(f"[AUTO_END_RENT] Ждем 2 секунды...")
-                        await asyncio.sleep(2)
+                    logger.info(f"[AUTO_END_RENT] Получаем браузер из пула...")
+                    async with async_playwright() as p, browser_pool.browser_async(p) as browser:
+                        logger.info(f"[AUTO_END_RENT] Браузер получен")
                         
                         logger.info(f"[AUTO_END_RENT] Создаем новый контекст браузера...")
                         try:
@@ -3388,52 +3348,48 @@ def init_handlers(bot_instance, is_user_authorized_func=None, auth_required_deco
                 f"⏳ Ищу новые письма от Steam...", 
                 parse_mode="HTML")
             
-            # Импортируем и используем функцию получения кода
-            from utils.email_utils import fetch_steam_guard_code_from_email
-            import logging
-            
-            # Создаем логгер для отслеживания процесса
-            logger = logging.getLogger(__name__)
-            
-            # Получаем код (таймаут 60 секунд для быстрого поиска)
-            code = fetch_steam_guard_code_from_email(
-                email_login=email_login,
-                email_password=email_password,
-                imap_host=imap_host,
-                timeout=60,
-                logger=logger,
-                mode='login',
-                force_new=True
-            )
-            
-            if code:
-                # Успешно получен код
-                bot.edit_message_text(
-                    f"✅ <b>Код Steam Guard найден!</b>\n\n"
-                    f"🎯 Аккаунт: {login}\n"
-                    f"🔑 Код: <code>{code}</code>\n\n"
-                    f"📋 Нажмите на код, чтобы скопировать",
-                    chat_id=call.message.chat.id,
-                    message_id=status_msg.message_id,
-                    parse_mode="HTML"
-                )
-            else:
-                # Код не найден
-                bot.edit_message_text(
-                    f"❌ <b>Код Steam Guard не найден</b>\n\n"
-                    f"🎯 Аккаунт: {login}\n"
-                    f"📧 Почта: {email_login[:3]}***@{email_login.split('@')[1]}\n\n"
-                    f"🔍 Возможные причины:\n"
-                    f"• Нет новых писем от Steam\n"
-                    f"• Неправильные настройки почты\n"
-                    f"• Код уже использован\n"
-                    f"• Проблемы с IMAP подключением\n\n"
-                    f"💡 Попробуйте запросить новый код входа в Steam",
-                    chat_id=call.message.chat.id,
-                    message_id=status_msg.message_id,
-                    parse_mode="HTML"
-                )
-                
+            # Получаем код через общий брокер кодов (таймаут 60 секунд для быстрого поиска):
+            # поток обработчика не блокируется, сообщение обновляется, когда письмо придет на почту
+            def on_code(future):
+                try:
+                    code = None if future.cancelled() else future.result()
+                except Exception as e:
+                    logger.error(f"[GET_CODE] Ошибка при получении кода: {e}")
+                    code = None
+                try:
+                    if code:
+                        # Успешно получен код
+                        bot.edit_message_text(
+                            f"✅ <b>Код Steam Guard найден!</b>\n\n"
+                            f"🎯 Аккаунт: {login}\n"
+                            f"🔑 Код: <code>{code}</code>\n\n"
+                            f"📋 Нажмите на код, чтобы скопировать",
+                            chat_id=call.message.chat.id,
+                            message_id=status_msg.message_id,
+                            parse_mode="HTML"
+                        )
+                    else:
+                        # Код не найден
+                        bot.edit_message_text(
+                            f"❌ <b>Код Steam Guard не найден</b>\n\n"
+                            f"🎯 Аккаунт: {login}\n"
+                            f"📧 Почта: {email_login[:3]}***@{email_login.split('@')[1]}\n\n"
+                            f"🔍 Возможные причины:\n"
+                            f"• Нет новых писем от Steam\n"
+                            f"• Неправильные настройки почты\n"
+                            f"• Код уже использован\n"
+                            f"• Проблемы с IMAP подключением\n\n"
+                            f"💡 Попробуйте запросить новый код входа в Steam",
+                            chat_id=call.message.chat.id,
+                            message_id=status_msg.message_id,
+                            parse_mode="HTML"
+                        )
+                except Exception as e:
+                    logger.error(f"[GET_CODE] Не удалось обновить сообщение с кодом: {e}")
+
+            guard_broker.request(email_login, email_password, imap_host, mode='login', timeout=60,
+                                 logger=logger).add_done_callback(on_code)
+
         except Exception as e:
             logger.error(f"[GET_CODE] Ошибка при получении кода: {e}")
             bot.send_message(call.message.chat.id, 
@@ -0,0 +1,298 @@
+"""
+Пул "теплых" браузеров Chromium для Playwright.
+
+Холодный запуск Chromium занимает несколько секунд и сотни мегабайт памяти, а при одновременном окончании
+нескольких аренд каждая задача поднимала свой браузер. Пул держит не больше BROWSER_POOL_SIZE процессов
+Chromium, запущенных в отдельном потоке-владельце с открытым портом отладки. Вызывающий код подключается
+к свободному браузеру через CDP из своего Playwright (синхронного или асинхронного) и работает в отдельном
+контексте, который удаляется при отключении. Браузер перезапускается после BROWSER_POOL_MAX_USES аренд.
+
+Пример:
+    with sync_playwright() as p, browser_pool.browser(p) as browser:
+        context = browser.new_context()
+        ...
+"""
+import asyncio
+import atexit
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+from utils.browser_config import get_browser_config
+
+logger = logging.getLogger("browser_pool")
+
+# Кол-во одновременно запущенных браузеров (и одновременных сессий Playwright)
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+# Через сколько аренд браузер перезапускается
+BROWSER_POOL_MAX_USES = int(os.getenv("BROWSER_POOL_MAX_USES", "20"))
+# Сколько секунд ждать свободный браузер
+BROWSER_POOL_ACQUIRE_TIMEOUT = float(os.getenv("BROWSER_POOL_ACQUIRE_TIMEOUT", "900"))
+
+ENSURE = "ensure"
+RECYCLE = "recycle"
+STOP = "stop"
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_endpoint(endpoint: str, timeout: float = 15):
+    """Ждет, пока браузер начнет принимать CDP-подключения."""
+    deadline = time.time() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f"{endpoint}/json/version", timeout=2) as resp:
+                json.loads(resp.read())
+                return
+        except Exception:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+class BrowserPool:
+    """
+    Пул браузеров Chromium.
+
+    Объекты Playwright привязаны к потоку (sync) или event loop'у (async), в котором созданы, поэтому процессы
+    браузеров запускает и перезапускает один поток-владелец, а вызывающие потоки получают от него только
+    CDP-адрес. Семафор ограничивает число одновременных аренд браузеров размером пула.
+    Если браузер из пула получить не удалось, на занятом слоте запускается обычный (холодный) браузер, поэтому
+    при сбоях пула число браузеров тоже не превышает размер пула.
+    """
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, max_uses: int = BROWSER_POOL_MAX_USES,
+                 acquire_timeout: float = BROWSER_POOL_ACQUIRE_TIMEOUT):
+        self.size = size
+        self.max_uses = max_uses
+        self.acquire_timeout = acquire_timeout
+        self._slots = [{"index": i, "browser": None, "endpoint": None, "uses": 0} for i in range(size)]
+        self._free = list(reversed(self._slots))
+        self._semaphore = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._leases: dict[int, tuple] = {}
+        self._commands: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- поток-владелец ---
+
+    def _call(self, command: str, slot: Optional[dict] = None, wait: bool = True):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._owner, name="browser_pool", daemon=True)
+                self._thread.start()
+        future = Future()
+        self._commands.put((command, slot, future))
+        if wait:
+            return future.result(timeout=120)
+
+    def _owner(self):
+        try:
+            from playwright.sync_api import sync_playwright
+            with sync_playwright() as p:
+                while True:
+                    command, slot, future = self._commands.get()
+                    try:
+                        if command == STOP:
+                            for s in self._slots:
+                                self._close_browser(s)
+                            future.set_result(None)
+                            return
+                        if command == RECYCLE:
+                            self._close_browser(slot)
+                            future.set_result(None)
+                        elif command == ENSURE:
+                            future.set_result(self._ensure_browser(p, slot))
+                    except Exception as e:
+                        future.set_exception(e)
+        except Exception as e:
+            logger.error(f"[BROWSER_POOL] Поток пула браузеров остановлен: {e}", exc_info=True)
+            while True:
+                try:
+                    _, _, future = self._commands.get_nowait()
+                except queue.Empty:
+                    break
+                future.set_exception(e)
+
+    def _ensure_browser(self, p, slot: dict) -> str:
+        """Возвращает CDP-адрес браузера слота, при необходимости (пере)запуская его."""
+        browser = slot["browser"]
+        if browser is not None and browser.is_connected():
+            return slot["endpoint"]
+        self._close_browser(slot)
+        port = _free_port()
+        config = get_browser_config()
+        config["args"] = list(config.get("args", [])) + [f"--remote-debugging-port={port}",
+                                                         "--remote-debugging-address=127.0.0.1"]
+        started = time.time()
+        slot["browser"] = p.chromium.launch(**config)
+        slot["endpoint"] = f"http://127.0.0.1:{port}"
+        _wait_endpoint(slot["endpoint"])
+        logger.info(f"[BROWSER_POOL] Браузер #{slot['index']} запущен за {time.time() - started:.1f} с "
+                    f"({slot['endpoint']})")
+        return slot["endpoint"]
+
+    @staticmethod
+    def _close_browser(slot: dict):
+        browser = slot["browser"]
+        slot["browser"] = None
+        slot["endpoint"] = None
+        slot["uses"] = 0
+        if browser is None:
+            return
+        try:
+            browser.close()
+            logger.info(f"[BROWSER_POOL] Браузер #{slot['index']} остановлен")
+        except Exception as e:
+            logger.warning(f"[BROWSER_POOL] Ошибка остановки браузера #{slot['index']}: {e}")
+
+    # --- аренда слотов ---
+
+    def _acquire(self) -> dict:
+        """Ждет свободный слот пула."""
+        if not self._semaphore.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"нет свободного браузера в пуле за {self.acquire_timeout:.0f} секунд")
+        with self._lock:
+            return self._free.pop()
+
+    def _endpoint(self, slot: dict) -> str:
+        """Возвращает CDP-адрес браузера слота, при необходимости запуская его в потоке-владельце."""
+        endpoint = self._call(ENSURE, slot)
+        slot["uses"] += 1
+        return endpoint
+
+    def _release_slot(self, slot: dict, broken: bool = False):
+        if broken or slot["uses"] >= self.max_uses:
+            # перезапуск выполнится раньше следующего ENSURE для этого слота: команды обрабатываются по очереди
+            self._call(RECYCLE, slot, wait=False)
+        with self._lock:
+            self._free.append(slot)
+        self._semaphore.release()
+
+    def _lease(self, browser, slot: dict, cold: bool = False):
+        with self._lock:
+            self._leases[id(browser)] = (browser, slot, cold)
+
+    def _unlease(self, browser) -> tuple[bool, Optional[dict], bool]:
+        with self._lock:
+            if id(browser) not in self._leases:
+                return False, None, False
+            _, slot, cold = self._leases.pop(id(browser))
+            return True, slot, cold
+
+    def connect(self, p):
+        """
+        Подключается к браузеру из пула через синхронный Playwright.
+
+        Args:
+            p: объект sync_playwright() текущего потока
+
+        Returns:
+            Browser: браузер, который нужно вернуть через release()
+        """
+        slot = self._acquire()
+        try:
+            browser = p.chromium.connect_over_cdp(self._endpoint(slot))
+            cold = False
+        except Exception as e:
+            logger.warning(f"[BROWSER_POOL] Не удалось подключиться к браузеру #{slot['index']}, запускаю новый: {e}")
+            try:
+                browser = p.chromium.launch(**get_browser_config())
+            except Exception:
+                self._release_slot(slot, broken=True)
+                raise
+            cold = True
+        self._lease(browser, slot, cold)
+        return browser
+
+    def release(self, browser):
+        """
+        Закрывает контексты, созданные через browser, и возвращает браузер в пул.
+        Повторный вызов для того же браузера ничего не делает.
+        """
+        leased, slot, cold = self._unlease(browser)
+        if not leased:
+            return
+        try:
+            browser.close()
+        except Exception as e:
+            logger.debug(f"[BROWSER_POOL] Ошибка отключения от браузера: {e}")
+        # слот холодного браузера перезапускается: браузер пула в нем не отвечал
+        self._release_slot(slot, broken=cold)
+
+    async def connect_async(self, p):
+        """
+        Подключается к браузеру из пула через асинхронный Playwright (см. connect()).
+
+        Args:
+            p: объект async_playwright() текущего event loop'а
+        """
+        slot = await asyncio.to_thread(self._acquire)
+        try:
+            browser = await p.chromium.connect_over_cdp(await asyncio.to_thread(self._endpoint, slot))
+            cold = False
+        except Exception as e:
+            logger.warning(f"[BROWSER_POOL] Не удалось подключиться к браузеру #{slot['index']}, запускаю новый: {e}")
+            try:
+                browser = await p.chromium.launch(**get_browser_config())
+            except Exception:
+                self._release_slot(slot, broken=True)
+                raise
+            cold = True
+        self._lease(browser, slot, cold)
+        return browser
+
+    async def release_async(self, browser):
+        """Асинхронный вариант release()."""
+        leased, slot, cold = self._unlease(browser)
+        if not leased:
+            return
+        try:
+            await browser.close()
+        except Exception as e:
+            logger.debug(f"[BROWSER_POOL] Ошибка отключения от браузера: {e}")
+        # слот холодного браузера перезапускается: браузер пула в нем не отвечал
+        self._release_slot(slot, broken=cold)
+
+    @contextmanager
+    def browser(self, p):
+        """Контекстный менеджер: connect() на входе, release() на выходе."""
+        browser = self.connect(p)
+        try:
+            yield browser
+        finally:
+            self.release(browser)
+
+    @asynccontextmanager
+    async def browser_async(self, p):
+        """Асинхронный контекстный менеджер: connect_async() на входе, release_async() на выходе."""
+        browser = await self.connect_async(p)
+        try:
+            yield browser
+        finally:
+            await self.release_async(browser)
+
+    def close(self):
+        """Останавливает все браузеры пула."""
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._call(STOP)
+            except Exception as e:
+                logger.warning(f"[BROWSER_POOL] Ошибка остановки пула: {e}")
+
+
+# Общий пул процесса
+browser_pool = BrowserPool()
+atexit.register(browser_pool.close)
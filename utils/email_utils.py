@@ -1,438 +1,625 @@
-from imap_tools import MailBox, AND
+from imap_tools import MailBox, AND, U, MailMessageFlags
+from collections import OrderedDict
+from concurrent.futures import Future, InvalidStateError
+from typing import Optional
+import heapq
+import itertools
+import logging
 import re
-from datetime import datetime, timedelta
+import socket
+import threading
+from datetime import datetime, timedelta, date
 import time
 
+watcher_logger = logging.getLogger("email_watcher")
+
+# Сколько секунд держать IDLE до переподключения команды (серверы рвут IDLE примерно через 29 минут)
+IDLE_TIMEOUT = 60
+# Интервал опроса для серверов без IDLE
+POLL_INTERVAL = 3
+# Сколько секунд держать соединение открытым после ухода последнего ожидающего
+KEEPALIVE = 300
+# Сколько последних писем загружать при подключении и хранить в памяти
+SEED_LIMIT = 30
+CACHE_SIZE = 100
+# За сколько секунд до окончания аренды перестать ждать код (код входа при окончании аренды покупателю не нужен).
+# К арендам не длиннее GUARD_CODE_MARGIN отступ не применяется: код ждется до конца аренды
+GUARD_CODE_MARGIN = 60
+
+STEAM_SENDER = 'noreply@steampowered.com'
+
+code_regex = re.compile(r"\b([A-Z0-9]{5,7})\b")
+
+code_after_label_regex = re.compile(r"(?:ваш\s+код|code|код|код\s*:|code\s*:)\s*[\"']?([A-Z0-9]{5,7})[\"']?", re.IGNORECASE)
+
+steam_guard_code_regex = re.compile(r"(?:steam\s*guard|подтверждения)(?:.*?)([A-Z0-9]{5,7})", re.IGNORECASE | re.DOTALL)
+
+account_confirm_regex = re.compile(r"(?:код\s+подтверждения\s+аккаунта|account\s+confirmation\s+code)(?:\s*:?\s*)([A-Z0-9]{5,7})", re.IGNORECASE | re.DOTALL)
+
+isolated_code_regex = re.compile(r"<[^>]*>\s*([A-Z0-9]{5,7})\s*</[^>]*>", re.IGNORECASE)
+
+quoted_code_regex = re.compile(r"[\"'«»]([A-Z0-9]{5,7})[\"'«»]", re.IGNORECASE)
+
+steam_guard_pattern_regex = re.compile(r"(?:вам\s+понадобится\s+код|код\s+steam\s+guard|you\s+need\s+a\s+code|your\s+steam\s+code).*?([A-Z0-9]{5})", re.IGNORECASE | re.DOTALL)
+
+invalid_words = [
+    "STEAM", "SCREEN", "HTTPS", "GUARD", "VALVE", "HELP", "LOGIN", "EMAIL", "ПОСМОТР",
+    "DOCTYPE", "HTML", "HEAD", "BODY", "DIV", "SPAN", "SCRIPT", "CLASS",
+    "WIDTH", "HEIGHT", "STYLE", "COLOR", "TABLE", "TITLE", "HTTP", "META",
+    "CONTENT", "FORM", "INPUT", "BUTTON", "IMAGE", "FRAME", "TYPE", "VIEW",
+    "https"
+]
+
+change_markers = [
+    "сменить пароль", "смена пароля", "смены данных", "change your steam login credentials",
+    "verification code", "код подтверждения", "код был выслан", "код был отправлен",
+    "подтверждение аккаунта", "code was sent", "help.steampowered.com"
+]
+
+
+def is_valid_code(code, strict=False, mode='login', logger=None):
+    if not code:
+        return False
+
+    if len(code) < 5 or len(code) > 7:
+        if logger and strict:
+            logger.warning(f"[EMAIL] Неверная длина кода: {code} (длина {len(code)})")
+        return False
+
+    if not code.isalnum():
+        if logger and strict:
+            logger.warning(f"[EMAIL] Код содержит недопустимые символы: {code}")
+        return False
+
+    if code.upper() in invalid_words:
+        if logger:
+            logger.warning(f"[EMAIL] Обнаружено недопустимое слово вместо кода: {code}")
+        return False
+
+    if strict and mode == 'login':
+        has_letters = any(c.isalpha() for c in code)
+        has_digits = any(c.isdigit() for c in code)
+
+        if not (has_letters and has_digits) and len(code) != 5:
+            if logger:
+                logger.warning(f"[EMAIL] Код не соответствует формату Steam Guard (должен содержать буквы и цифры): {code}")
+            return False
+
+        for i in range(len(code) - 2):
+            if code[i] == code[i+1] == code[i+2]:
+                if logger:
+                    logger.warning(f"[EMAIL] Код содержит повторяющиеся символы: {code}")
+                return False
+
+        digit_count = sum(1 for c in code if c.isdigit())
+        if digit_count == len(code) and len(code) > 5:
+            if logger:
+                logger.warning(f"[EMAIL] Код содержит только цифры: {code}")
+            return False
+
+    return True
+
+
+def extract_login_code(msg, logger=None):
+    """
+    Ищет код Steam Guard для входа в письме.
+
+    Returns:
+        str | None: найденный код
+    """
+    body = (msg.text or '') + '\n' + (msg.html or '')
+    text_content = msg.text or ''
+
+    steam_guard_pattern = steam_guard_pattern_regex.search(text_content)
+    if steam_guard_pattern:
+        found_code = steam_guard_pattern.group(1)
+        if is_valid_code(found_code, strict=True, logger=logger):
+            if logger:
+                logger.info(f"[EMAIL] Найден код для входа (стандартный шаблон): {found_code}")
+            return found_code
+
+    for line in text_content.split('\n'):
+        line = line.strip()
+        if 5 <= len(line) <= 7 and line.isalnum() and line.isupper():
+            if is_valid_code(line, strict=True, logger=logger):
+                if logger:
+                    logger.info(f"[EMAIL] Найден код для входа (отдельная строка): {line}")
+                return line
+
+    for regex_name, regex in [
+        ("код после метки", code_after_label_regex),
+        ("код в контексте Steam Guard", steam_guard_code_regex),
+        ("код подтверждения аккаунта", account_confirm_regex),
+        ("код в кавычках", quoted_code_regex),
+        ("общий шаблон", code_regex)
+    ]:
+        m = regex.search(body)
+        if m:
+            found_code = m.group(1)
+            if is_valid_code(found_code, strict=True, logger=logger):
+                if logger:
+                    logger.info(f"[EMAIL] Найден код для входа ({regex_name}): {found_code}")
+                return found_code
+            elif logger:
+                logger.warning(f"[EMAIL] Обнаружен недействительный код ({regex_name}): {found_code}")
+    return None
+
+
+def extract_change_code(msg, logger=None):
+    """
+    Ищет код подтверждения смены данных в письме Steam.
+    Письма без характерных фраз проверяются теми же шаблонами и дополнительно пишутся в email_fallback.log.
+
+    Returns:
+        str | None: найденный код
+    """
+    subj = (msg.subject or '').lower()
+    from_ = (msg.from_ or '').lower()
+    body = (msg.text or '') + '\n' + (msg.html or '')
+    if STEAM_SENDER not in from_:
+        return None
+
+    if any(marker in subj or marker in body.lower() for marker in change_markers):
+        prefix = ""
+        if logger:
+            logger.info(f"[EMAIL] Проверяем письмо для смены данных: {subj}")
+    else:
+        prefix = "Fallback: "
+        try:
+            with open('email_fallback.log', 'a', encoding='utf-8') as flog:
+                flog.write(f"FALLBACK UID: {msg.uid} FROM: {from_} SUBJECT: {subj}\nBODY: {body[:200]}\n\n")
+            if logger:
+                logger.info(f"[EMAIL] Fallback поиск кода в письме: {subj[:50]}")
+        except Exception:
+            pass
+
+    for regex_name, regex in [
+        ("код после метки", code_after_label_regex),
+        ("код в контексте Steam Guard", steam_guard_code_regex),
+        ("код подтверждения аккаунта", account_confirm_regex),
+        ("изолированный код", isolated_code_regex),
+        ("код в кавычках", quoted_code_regex),
+        ("код по общему шаблону", code_regex)
+    ]:
+        m = regex.search(body)
+        if m:
+            found_code = m.group(1)
+            if is_valid_code(found_code, mode='change', logger=logger):
+                if logger:
+                    logger.info(f"[EMAIL] {prefix}Найден {regex_name}: {found_code}")
+                return found_code
+            elif logger:
+                logger.warning(f"[EMAIL] {prefix}Найден недопустимый {regex_name}: {found_code}")
+    if logger:
+        logger.warning(f"[EMAIL] В письме не найден код: {subj[:50]}")
+    return None
+
+
+class MailboxWatcher:
+    """
+    Постоянное IMAP-соединение с одним ящиком.
+
+    Поток наблюдателя держит авторизованную сессию, ждет новые письма через IMAP IDLE
+    (или опрашивает ящик раз в POLL_INTERVAL секунд, если сервер не поддерживает IDLE),
+    догружает только письма с UID больше последнего известного и проверяет их для всех запросов кода
+    этого ящика (см. GuardCodeBroker). Все аренды с общим ящиком обслуживаются одним соединением;
+    письмо, из которого код уже взят, другим запросам не выдается. Соединение закрывается через
+    KEEPALIVE секунд без ожидающих запросов.
+    """
+
+    def __init__(self, key: tuple, imap_host: str, email_login: str, email_password: str):
+        self.key = key
+        self.imap_host = imap_host
+        self.email_login = email_login
+        self.email_password = email_password
+        self.error = None
+        self.closed = False
+        self._mailbox = None
+        self._last_uid = None
+        self._messages: OrderedDict = OrderedDict()
+        self._consumed = set()
+        self._to_flag = []
+        self._requests: list[_GuardRequest] = []
+        self._waiters = 0
+        self._last_used = time.time()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=f"email_watcher_{email_login}", daemon=True)
+
+    # --- поток наблюдателя ---
+
+    def _connect(self):
+        self._mailbox = MailBox(self.imap_host).login(self.email_login, self.email_password)
+        watcher_logger.info(f"[EMAIL] Подключение к {self.imap_host} для {self.email_login[:3]}*** открыто")
+        # при каждом подключении догружаем последние письма: UID могли смениться (UIDVALIDITY)
+        seed = list(self._mailbox.fetch(AND(date_gte=date.today() - timedelta(days=1)), limit=SEED_LIMIT,
+                                        mark_seen=False, reverse=True, bulk=True))
+        if seed:
+            self._store(seed)
+        elif self._last_uid is None:
+            uid_next = self._mailbox.folder.status(options=['UIDNEXT']).get('UIDNEXT')
+            self._last_uid = int(uid_next) - 1 if uid_next else 0
+
+    def _disconnect(self):
+        mailbox, self._mailbox = self._mailbox, None
+        if mailbox is not None:
+            try:
+                mailbox.logout()
+            except Exception:
+                pass
+
+    def _store(self, msgs):
+        with self._cond:
+            for msg in sorted(msgs, key=lambda m: int(m.uid)):
+                uid = int(msg.uid)
+                self._messages[uid] = msg
+                self._last_uid = max(self._last_uid or 0, uid)
+            while len(self._messages) > CACHE_SIZE:
+                self._messages.popitem(last=False)
+            requests = list(self._requests)
+        for request in requests:
+            self._resolve(request)
+
+    def _fetch_new(self):
+        # U(n, '*') всегда возвращает последнее письмо, даже если его UID меньше n
+        msgs = [m for m in self._mailbox.fetch(AND(uid=U(self._last_uid + 1, '*')), mark_seen=False, bulk=True)
+                if int(m.uid) > self._last_uid]
+        if msgs:
+            watcher_logger.info(f"[EMAIL] Новых писем в ящике {self.email_login[:3]}***: {len(msgs)}")
+            self._store(msgs)
+
+    def _apply_flags(self):
+        with self._cond:
+            uids, self._to_flag = self._to_flag, []
+        if uids:
+            self._mailbox.flag([str(uid) for uid in uids], MailMessageFlags.SEEN, True)
+
+    def _wait_changes(self):
+        if 'IDLE' in self._mailbox.client.capabilities:
+            self._mailbox.idle.wait(timeout=IDLE_TIMEOUT)
+        else:
+            time.sleep(POLL_INTERVAL)
+
+    def _should_close(self) -> bool:
+        with _watchers_lock:
+            if self._waiters or time.time() - self._last_used < KEEPALIVE:
+                return False
+            self.closed = True
+            _watchers.pop(self.key, None)
+            return True
+
+    def _run(self):
+        while not self._should_close():
+            try:
+                if self._mailbox is None:
+                    self._connect()
+                self._fetch_new()
+                self._apply_flags()
+                self._wait_changes()
+            except Exception as e:
+                self._disconnect()
+                if isinstance(e, socket.gaierror) or "authentication" in str(e).lower() or "login" in str(e).lower():
+                    watcher_logger.error(f"[EMAIL] ❌ Наблюдение за ящиком {self.email_login[:3]}*** остановлено: {e}")
+                    with _watchers_lock:
+                        self.closed = True
+                        _watchers.pop(self.key, None)
+                    with self._cond:
+                        self.error = e
+                        requests, self._requests = self._requests, []
+                    for request in requests:
+                        request.fail(e)
+                    return
+                watcher_logger.error(f"[EMAIL] ❌ Ошибка соединения с почтой ({type(e).__name__}: {e}), "
+                                     f"переподключение через 5 секунд")
+                time.sleep(5)
+        self._disconnect()
+        watcher_logger.info(f"[EMAIL] Подключение к ящику {self.email_login[:3]}*** закрыто (нет ожидающих)")
+
+    # --- запросы кода ---
+
+    def add_request(self, request: "_GuardRequest"):
+        """Регистрирует запрос кода и сразу проверяет для него уже загруженные письма."""
+        with self._cond:
+            error = self.error
+            if error is None:
+                self._requests.append(request)
+        if error is not None:
+            request.fail(error)
+            return
+        self._resolve(request)
+
+    def remove_request(self, request: "_GuardRequest"):
+        with self._cond:
+            if request in self._requests:
+                self._requests.remove(request)
+
+    def _resolve(self, request: "_GuardRequest"):
+        """
+        Проверяет для запроса письма, которые он еще не видел (начиная с новых), и завершает запрос найденным кодом.
+        matcher вызывается не больше одного раза для каждого письма.
+        """
+        with request.lock:
+            if request.future.done():
+                return
+            with self._cond:
+                candidates = [(uid, msg) for uid, msg in reversed(self._messages.items())
+                              if uid not in request.checked and uid not in self._consumed]
+            for uid, msg in candidates:
+                request.checked.add(uid)
+                try:
+                    code = request.matcher(msg)
+                except Exception as e:
+                    watcher_logger.error(f"[EMAIL] Ошибка при обработке письма: {e}")
+                    continue
+                if not code:
+                    continue
+                with self._cond:
+                    if uid in self._consumed:
+                        continue
+                    self._consumed.add(uid)
+                break
+            else:
+                return
+        if not request.finish(code):
+            # запрос успели отменить - письмо остается доступным другим запросам
+            with self._cond:
+                self._consumed.discard(uid)
+            return
+        if request.mark_seen:
+            with self._cond:
+                self._to_flag.append(uid)
+
+
+_watchers: dict[tuple, MailboxWatcher] = {}
+_watchers_lock = threading.Lock()
+
+
+def _acquire_watcher(imap_host, email_login, email_password) -> MailboxWatcher:
+    key = (imap_host, email_login, email_password)
+    with _watchers_lock:
+        watcher = _watchers.get(key)
+        if watcher is None or watcher.closed:
+            watcher = MailboxWatcher(key, imap_host, email_login, email_password)
+            _watchers[key] = watcher
+            watcher._thread.start()
+        watcher._waiters += 1
+        return watcher
+
+
+def _release_watcher(watcher: MailboxWatcher):
+    with _watchers_lock:
+        watcher._waiters -= 1
+        watcher._last_used = time.time()
+
+
+def _code_matcher(mode: str, since=None, logger=None):
+    """
+    Args:
+        mode: 'login' - код для входа, 'change' - код подтверждения смены данных
+        since: время начала поиска (timestamp или datetime); None - только письма с момента запроса
+
+    Returns:
+        функция (письмо) -> код или None; None для неизвестного режима
+    """
+    if since is None:
+        min_date_obj = (datetime.utcnow() - timedelta(seconds=10)).date()
+    elif isinstance(since, (int, float)):
+        min_date_obj = datetime.fromtimestamp(since - 60).date()
+    else:
+        min_date_obj = (since - timedelta(seconds=60)).date()
+
+    def is_recent(msg):
+        return not msg.date or msg.date.date() >= min_date_obj
+
+    if mode == 'login':
+        def matcher(msg):
+            if MailMessageFlags.SEEN in msg.flags or STEAM_SENDER not in (msg.from_ or '').lower() \
+                    or not is_recent(msg):
+                return None
+            if logger:
+                logger.info(f"[EMAIL] Проверяем письмо: {msg.subject} (UID: {msg.uid})")
+            return extract_login_code(msg, logger)
+        return matcher
+    if mode == 'change':
+        def matcher(msg):
+            if not is_recent(msg):
+                return None
+            return extract_change_code(msg, logger)
+        return matcher
+    if logger:
+        logger.warning(f"[EMAIL] Неизвестный режим поиска кода: {mode}")
+    return None
+
+
+class _GuardRequest:
+    """Запрос кода Steam Guard, ожидающий письма в ящике."""
+
+    def __init__(self, account_id: Optional[str], mode: str, matcher, deadline: float):
+        self.account_id = account_id
+        self.mode = mode
+        self.matcher = matcher
+        self.mark_seen = mode == 'login'
+        self.deadline = deadline
+        self.future = Future()
+        self.checked = set()
+        self.lock = threading.Lock()
+
+    def finish(self, code) -> bool:
+        """Завершает запрос кодом (None - код не найден). False, если запрос уже завершен или отменен."""
+        try:
+            self.future.set_result(code)
+            return True
+        except InvalidStateError:
+            return False
+
+    def fail(self, error: Exception):
+        try:
+            self.future.set_exception(error)
+        except InvalidStateError:
+            pass
+
+
+class GuardCodeBroker:
+    """
+    Ожидание кодов Steam Guard без отдельного потока на каждую выдачу.
+
+    Вызывающий регистрирует интерес (аккаунт, ящик, время начала поиска, режим) через request() и сразу
+    получает concurrent.futures.Future. Код находит поток наблюдателя ящика (MailboxWatcher): каждое новое
+    письмо проверяется для всех запросов этого ящика. Запрос завершается результатом None, если время вышло
+    (таймауты отслеживает один поток брокера), исключением - если ящик недоступен, и отменяется cancel()
+    при окончании аренды аккаунта. Обработчики результата (Future.add_done_callback) выполняются в потоке,
+    завершившем запрос, поэтому должны быть короткими (например, поставить сообщение в очередь отправки).
+    """
+
+    def __init__(self):
+        self._deadlines: list[tuple] = []
+        self._by_account: dict[str, set] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def request(self, email_login, email_password, imap_host, account_id=None, mode: str = 'login', since=None,
+                timeout: float = 600, until: Optional[float] = None, logger=None) -> Future:
+        """
+        Регистрирует запрос кода.
+
+        Args:
+            email_login: логин почты
+            email_password: пароль почты
+            imap_host: IMAP-сервер почты
+            account_id: ID аккаунта Steam; запросы аккаунта отменяются через cancel(account_id)
+            mode: 'login' - код для входа, 'change' - код подтверждения смены данных
+            since: время начала поиска (timestamp или datetime); None - только письма с момента запроса
+            timeout: максимальное время ожидания кода в секундах
+            until: время окончания аренды (timestamp): код перестает ожидаться за GUARD_CODE_MARGIN секунд до него
+                (если до окончания аренды осталось не больше GUARD_CODE_MARGIN секунд - в момент окончания)
+            logger: логгер разбора писем
+
+        Returns:
+            Future: результат - код или None, если код не найден за отведенное время
+        """
+        now = time.time()
+        deadline = now + timeout
+        if until is not None:
+            deadline = min(deadline, until - GUARD_CODE_MARGIN if until - now > GUARD_CODE_MARGIN else until)
+        matcher = _code_matcher(mode, since, logger)
+        request = _GuardRequest(str(account_id) if account_id is not None else None, mode, matcher, deadline)
+        if not (email_login and email_password and imap_host) or matcher is None or deadline <= now:
+            request.finish(None)
+            return request.future
+
+        watcher = _acquire_watcher(imap_host, email_login, email_password)
+        with self._cond:
+            self._start()
+            heapq.heappush(self._deadlines, (deadline, next(self._seq), request))
+            if request.account_id is not None:
+                self._by_account.setdefault(request.account_id, set()).add(request)
+            self._cond.notify()
+        request.future.add_done_callback(lambda _: self._done(watcher, request))
+        watcher.add_request(request)
+        return request.future
+
+    def cancel(self, account_id) -> int:
+        """
+        Отменяет ожидание кодов аккаунта (например, при окончании аренды).
+
+        Returns:
+            int: кол-во отмененных запросов
+        """
+        with self._cond:
+            requests = self._by_account.pop(str(account_id), set())
+        cancelled = sum(1 for request in requests if request.future.cancel())
+        if cancelled:
+            watcher_logger.info(f"[GUARD] Отменено ожиданий кода для аккаунта {account_id}: {cancelled}")
+        return cancelled
+
+    def pending(self) -> int:
+        """Кол-во незавершенных запросов кода."""
+        with self._cond:
+            return sum(1 for _, _, request in self._deadlines if not request.future.done())
+
+    def _done(self, watcher: MailboxWatcher, request: _GuardRequest):
+        with self._cond:
+            requests = self._by_account.get(request.account_id)
+            if requests is not None:
+                requests.discard(request)
+                if not requests:
+                    del self._by_account[request.account_id]
+        watcher.remove_request(request)
+        _release_watcher(watcher)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="guard_code_broker", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            expired = []
+            with self._cond:
+                while not expired:
+                    now = time.time()
+                    while self._deadlines and (self._deadlines[0][2].future.done() or self._deadlines[0][0] <= now):
+                        _, _, request = heapq.heappop(self._deadlines)
+                        if not request.future.done():
+                            expired.append(request)
+                    if not expired:
+                        self._cond.wait(self._deadlines[0][0] - now if self._deadlines else None)
+            for request in expired:
+                request.finish(None)
+
+
+# Общий брокер кодов Steam Guard процесса
+guard_broker = GuardCodeBroker()
+
+
 def fetch_steam_guard_code_from_email(email_login, email_password, imap_host, timeout=600, logger=None, mode='login', force_new=True, start_time=None):
     """
     mode: 'login' — для входа (обычный Steam Guard), 'change' — для смены данных (change credentials).
     force_new: если True, игнорирует ранее проверенные письма и ищет только новые.
     start_time: время начала поиска (если None, используется текущее время минус 15 минут)
     timeout: максимальное время ожидания кода в секундах (по умолчанию 10 минут)
+
+    Блокирующая обертка над guard_broker.request(): письма приходят через общее для ящика соединение
+    (см. MailboxWatcher), и функция возвращает код, как только сервер сообщает о новом письме.
     """
     if logger:
         logger.info(f"[EMAIL] Начинаем поиск кода Steam Guard")
         logger.info(f"[EMAIL] Режим: {mode}, Email: {email_login[:3]}***@{email_login.split('@')[1] if '@' in email_login else 'unknown'}")
         logger.info(f"[EMAIL] IMAP хост: {imap_host}, Таймаут: {timeout} сек")
-    
+
     if not (email_login and email_password and imap_host):
         if logger:
             logger.warning(f"[EMAIL] Нет почтовых данных: email={email_login}, imap_host={imap_host}")
         return None
-    
+
     # Защита от некорректного timeout
     if timeout is None or not isinstance(timeout, (int, float)) or timeout <= 0:
         if logger:
             logger.warning(f"[EMAIL] Некорректный timeout: {timeout}, используется значение по умолчанию 600")
         timeout = 600
-    
-    # Сохраняем время начала поиска сразу
-    search_start_datetime = datetime.utcnow()
-    
-    code_regex = re.compile(r"\b([A-Z0-9]{5,7})\b")
-    
-    code_after_label_regex = re.compile(r"(?:ваш\s+код|code|код|код\s*:|code\s*:)\s*[\"']?([A-Z0-9]{5,7})[\"']?", re.IGNORECASE)
-    
-    steam_guard_code_regex = re.compile(r"(?:steam\s*guard|подтверждения)(?:.*?)([A-Z0-9]{5,7})", re.IGNORECASE | re.DOTALL)
-    
-    account_confirm_regex = re.compile(r"(?:код\s+подтверждения\s+аккаунта|account\s+confirmation\s+code)(?:\s*:?\s*)([A-Z0-9]{5,7})", re.IGNORECASE | re.DOTALL)
-    
-    isolated_code_regex = re.compile(r"<[^>]*>\s*([A-Z0-9]{5,7})\s*</[^>]*>", re.IGNORECASE)
-    
-    quoted_code_regex = re.compile(r"[\"'«»]([A-Z0-9]{5,7})[\"'«»]", re.IGNORECASE)
-    
-    invalid_words = [
-        "STEAM", "SCREEN", "HTTPS", "GUARD", "VALVE", "HELP", "LOGIN", "EMAIL", "ПОСМОТР", 
-        "DOCTYPE", "HTML", "HEAD", "BODY", "DIV", "SPAN", "SCRIPT", "CLASS",
-        "WIDTH", "HEIGHT", "STYLE", "COLOR", "TABLE", "TITLE", "HTTP", "META",
-        "CONTENT", "FORM", "INPUT", "BUTTON", "IMAGE", "FRAME", "TYPE", "VIEW",
-        "https"
-    ]
-    
-    def is_valid_code(code, strict=False):
-        if not code:
-            return False
-            
-        if len(code) < 5 or len(code) > 7:
-            if logger and strict:
-                logger.warning(f"[EMAIL] Неверная длина кода: {code} (длина {len(code)})")
-            return False
-            
-        if not code.isalnum():
-            if logger and strict:
-                logger.warning(f"[EMAIL] Код содержит недопустимые символы: {code}")
-            return False
-            
-        if code.upper() in invalid_words:
-            if logger:
-                logger.warning(f"[EMAIL] Обнаружено недопустимое слово вместо кода: {code}")
-            return False
-        
-        if strict and mode == 'login':
-            has_letters = any(c.isalpha() for c in code)
-            has_digits = any(c.isdigit() for c in code)
-            
-            if not (has_letters and has_digits) and len(code) != 5:
-                if logger:
-                    logger.warning(f"[EMAIL] Код не соответствует формату Steam Guard (должен содержать буквы и цифры): {code}")
-                return False
-                
-            for i in range(len(code) - 2):
-                if code[i] == code[i+1] == code[i+2]:
-                    if logger:
-                        logger.warning(f"[EMAIL] Код содержит повторяющиеся символы: {code}")
-                    return False
-                    
-            digit_count = sum(1 for c in code if c.isdigit())
-            if digit_count == len(code) and len(code) > 5:
-                if logger:
-                    logger.warning(f"[EMAIL] Код содержит только цифры: {code}")
-                return False
-                
-        return True
-    
-    start = time.time()
-    
+
     if force_new:
-        # Если force_new=True, ищем письма точно с момента запуска функции (плюс небольшой буфер)
-        min_date_obj = (search_start_datetime - timedelta(seconds=10)).date()
+        # ищем письма с момента запуска функции (плюс небольшой буфер)
+        since = None
     else:
-        # Иначе используем логику на основе start_time или стандартный интервал
-        if start_time is not None:
-            if isinstance(start_time, (int, float)):
-                min_date = datetime.fromtimestamp(start_time - 60)
-            else:
-                min_date = start_time - timedelta(seconds=60)
-        else:
-            min_date = datetime.now() - timedelta(minutes=15)
-        
-        min_date_obj = min_date.date()
-    
-    checked_uids = set()
-    
-    total_checked = 0
-    
+        since = start_time if start_time is not None else datetime.now() - timedelta(minutes=15)
+
     if logger:
-        logger.info(f"[EMAIL] Начинаем поиск кода для {mode}. Таймаут: {timeout}с, минимальная дата: {min_date_obj}")
-    
-    while time.time() - start < timeout:
-        try:
-            elapsed = time.time() - start
-            if logger:
-                logger.info(f"[EMAIL] ПОПЫТКА ПОДКЛЮЧЕНИЯ к почте (прошло {elapsed:.1f}с из {timeout}с)")
-            
-            with MailBox(imap_host).login(email_login, email_password) as mailbox:
-                if logger:
-                    logger.info(f"[EMAIL] ✅ УСПЕШНОЕ ПОДКЛЮЧЕНИЕ к почтовому серверу")
-                if mode == 'login':
-                    login_subjects = [
-                        "Steam", 
-                        "new steam login", 
-                        "steam guard", 
-                        "вход в steam"
-                    ]
-                    
-                    found_code = None
-                    
-                    if logger:
-                        logger.info(f"[EMAIL] РЕЖИМ LOGIN - ищем новые письма от noreply@steampowered.com с {min_date_obj}")
-                        
-                    msgs = sorted(
-                        mailbox.fetch(AND(seen=False, date_gte=min_date_obj, from_='noreply@steampowered.com'), reverse=True, limit=10),
-                        key=lambda m: m.date if hasattr(m, 'date') and m.date else datetime.now(),
-                        reverse=True
-                    )
-                    
-                    if logger:
-                        logger.info(f"[EMAIL] ✅ НАЙДЕНО {len(msgs)} писем для проверки")
-                    
-                    for msg in msgs:
-                        if msg.uid in checked_uids:
-                            continue
-                            
-                        checked_uids.add(msg.uid)
-                        total_checked += 1
-                            
-                        if logger:
-                            logger.info(f"[EMAIL] Проверяем письмо: {msg.subject} (UID: {msg.uid})")
-                                
-                        try:
-                            body = (msg.text or '') + '\n' + (msg.html or '')
-                            
-                            text_content = msg.text or ''
-                            
-                            steam_guard_pattern = re.search(r"(?:вам\s+понадобится\s+код|код\s+steam\s+guard|you\s+need\s+a\s+code|your\s+steam\s+code).*?([A-Z0-9]{5})", text_content, re.IGNORECASE | re.DOTALL)
-                            
-                            if steam_guard_pattern:
-                                found_code = steam_guard_pattern.group(1)
-                                if is_valid_code(found_code, strict=True):
-                                    mailbox.flag(msg.uid, 'SEEN', True)
-                                    if logger:
-                                        logger.info(f"[EMAIL] Найден код для входа (стандартный шаблон): {found_code}")
-                                    return found_code
-                            
-                            lines = text_content.split('\n')
-                            for line in lines:
-                                line = line.strip()
-                                if 5 <= len(line) <= 7 and line.isalnum() and line.isupper():
-                                    if is_valid_code(line, strict=True):
-                                        mailbox.flag(msg.uid, 'SEEN', True)
-                                        if logger:
-                                            logger.info(f"[EMAIL] Найден код для входа (отдельная строка): {line}")
-                                        return line
-                            
-                            for regex_name, regex in [
-                                ("код после метки", code_after_label_regex),
-                                ("код в контексте Steam Guard", steam_guard_code_regex),
-                                ("код подтверждения аккаунта", account_confirm_regex),
-                                ("код в кавычках", quoted_code_regex),
-                                ("общий шаблон", code_regex)
-                            ]:
-                                try:
-                                    m = regex.search(body)
-                                    if m:
-                                        found_code = m.group(1)
-                                        
-                                        if is_valid_code(found_code, strict=True):
-                                            mailbox.flag(msg.uid, 'SEEN', True)
-                                            if logger:
-                                                logger.info(f"[EMAIL] Найден код для входа ({regex_name}): {found_code}")
-                                            return found_code
-                                        elif logger:
-                                            logger.warning(f"[EMAIL] Обнаружен недействительный код ({regex_name}): {found_code}")
-                                except Exception as e:
-                                    if logger:
-                                        logger.error(f"[EMAIL] Ошибка при поиске кода ({regex_name}): {e}")
-                        except Exception as e:
-                            if logger:
-                                logger.error(f"[EMAIL] Ошибка при обработке письма: {e}")
-                            continue
-                    
-                elif mode == 'change':
-                    if logger:
-                        logger.info(f"[EMAIL] РЕЖИМ CHANGE - поиск писем для смены данных с {min_date_obj}")
-                    
-                    msgs = sorted(
-                        mailbox.fetch(AND(date_gte=min_date_obj), reverse=True, limit=30),
-                        key=lambda m: m.date if hasattr(m, 'date') and m.date else datetime.now(),
-                        reverse=True
-                    )
-                    
-                    if logger:
-                        logger.info(f"[EMAIL] ✅ НАЙДЕНО {len(msgs)} писем для проверки в режиме change")
-                    found_code = None
-                    for msg in msgs:
-                        if msg.uid in checked_uids:
-                            continue
-                        subj = (msg.subject or '').lower()
-                        from_ = (msg.from_ or '').lower()
-                        body = (msg.text or '') + '\n' + (msg.html or '')
-                        
-                        if (
-                            ('noreply@steampowered.com' in from_)
-                            and (
-                                "сменить пароль" in subj or
-                                "сменить пароль" in body or
-                                "смена пароля" in subj or
-                                "смена пароля" in body or
-                                "смены данных" in subj or
-                                "смены данных" in body or
-                                "change your steam login credentials" in body or
-                                "verification code" in subj or
-                                "код подтверждения" in subj or
-                                "код подтверждения" in body or
-                                "код был выслан" in body.lower() or
-                                "код был отправлен" in body.lower() or
-                                "подтверждение аккаунта" in body.lower() or
-                                "code was sent" in body.lower() or
-                                "help.steampowered.com" in body.lower()
-                            )
-                        ):
-                            checked_uids.add(msg.uid)
-                            if logger:
-                                logger.info(f"[EMAIL] Проверяем письмо для смены данных: {subj}")
-                            
-                            found_code = None
-                            
-                            m = code_after_label_regex.search(body)
-                            if m:
-                                found_code = m.group(1)
-                                if is_valid_code(found_code):
-                                    if logger:
-                                        logger.info(f"[EMAIL] Найден код после метки: {found_code}")
-                                    break
-                                elif logger:
-                                    logger.warning(f"[EMAIL] Найден недопустимый код после метки: {found_code}")
-                                
-                            m = steam_guard_code_regex.search(body)
-                            if m:
-                                found_code = m.group(1)
-                                if is_valid_code(found_code):
-                                    if logger:
-                                        logger.info(f"[EMAIL] Найден код в контексте Steam Guard: {found_code}")
-                                    break
-                                elif logger:
-                                    logger.warning(f"[EMAIL] Найден недопустимый код в контексте Steam Guard: {found_code}")
-                                
-                            m = account_confirm_regex.search(body)
-                            if m:
-                                found_code = m.group(1)
-                                if is_valid_code(found_code):
-                                    if logger:
-                                        logger.info(f"[EMAIL] Найден код подтверждения аккаунта: {found_code}")
-                                    break
-                                elif logger:
-                                    logger.warning(f"[EMAIL] Найден недопустимый код подтверждения аккаунта: {found_code}")
-                                
-                            m = isolated_code_regex.search(body)
-                            if m:
-                                found_code = m.group(1)
-                                if is_valid_code(found_code):
-                                    if logger:
-                                        logger.info(f"[EMAIL] Найден изолированный код: {found_code}")
-                                    break
-                                elif logger:
-                                    logger.warning(f"[EMAIL] Найден недопустимый изолированный код: {found_code}")
-                            
-                            m = quoted_code_regex.search(body)
-                            if m:
-                                found_code = m.group(1)
-                                if is_valid_code(found_code):
-                                    if logger:
-                                        logger.info(f"[EMAIL] Найден код в кавычках: {found_code}")
-                                    break
-                                elif logger:
-                                    logger.warning(f"[EMAIL] Найден недопустимый код в кавычках: {found_code}")
-                                
-                            m = code_regex.search(body)
-                            if m:
-                                found_code = m.group(1)
-                                if is_valid_code(found_code):
-                                    if logger:
-                                        logger.info(f"[EMAIL] Найден код по общему шаблону: {found_code}")
-                                    break
-                                elif logger:
-                                    logger.warning(f"[EMAIL] Найден недопустимый код по общему шаблону: {found_code}")
-                            else:
-                                if logger:
-                                    logger.warning(f"[EMAIL] В письме не найден код: {subj[:50]}")
-                    if mode == 'change' and found_code:
-                        if is_valid_code(found_code):
-                            if logger:
-                                logger.info(f"[EMAIL] Возвращаем найденный код для смены данных: {found_code}")
-                            return found_code
-                        elif logger:
-                            logger.warning(f"[EMAIL] Найденный код недопустим: {found_code}")
-                    if mode == 'change' and not found_code:
-                        for msg in msgs:
-                            if msg.uid in checked_uids:
-                                continue
-                            subj = (msg.subject or '').lower()
-                            from_ = (msg.from_ or '').lower()
-                            body = (msg.text or '') + '\n' + (msg.html or '')
-                            if 'noreply@steampowered.com' in from_:
-                                try:
-                                    with open('email_fallback.log', 'a', encoding='utf-8') as flog:
-                                        flog.write(f"FALLBACK UID: {msg.uid} FROM: {from_} SUBJECT: {subj}\nBODY: {body[:200]}\n\n")
-                                    if logger:
-                                        logger.info(f"[EMAIL] Fallback поиск кода в письме: {subj[:50]}")
-                                except Exception:
-                                    pass
-
-                                m = code_after_label_regex.search(body)
-                                if m:
-                                    found_code = m.group(1)
-                                    if is_valid_code(found_code):
-                                        if logger:
-                                            logger.info(f"[EMAIL] Fallback: найден код после метки: {found_code}")
-                                        return found_code
-
-                                m = steam_guard_code_regex.search(body)
-                                if m:
-                                    found_code = m.group(1)
-                                    if is_valid_code(found_code):
-                                        if logger:
-                                            logger.info(f"[EMAIL] Fallback: найден код в контексте Steam Guard: {found_code}")
-                                        return found_code
-
-                                m = account_confirm_regex.search(body)
-                                if m:
-                                    found_code = m.group(1)
-                                    if is_valid_code(found_code):
-                                        if logger:
-                                            logger.info(f"[EMAIL] Fallback: найден код подтверждения аккаунта: {found_code}")
-                                        return found_code
-
-                                m = isolated_code_regex.search(body)
-                                if m:
-                                    found_code = m.group(1)
-                                    if is_valid_code(found_code):
-                                        if logger:
-                                            logger.info(f"[EMAIL] Fallback: найден изолированный код: {found_code}")
-                                        return found_code
-
-                                m = quoted_code_regex.search(body)
-                                if m:
-                                    found_code = m.group(1)
-                                    if is_valid_code(found_code):
-                                        if logger:
-                                            logger.info(f"[EMAIL] Fallback: найден код в кавычках: {found_code}")
-                                        return found_code
-
-                                m = code_regex.search(body)
-                                if m:
-                                    found_code = m.group(1)
-                                    if is_valid_code(found_code):
-                                        if logger:
-                                            logger.info(f"[EMAIL] Fallback: найден код по общему шаблону: {found_code}")
-                                        return found_code
-                                    elif logger:
-                                        logger.warning(f"[EMAIL] Fallback: найден недопустимый код по общему шаблону: {found_code}")
-                            checked_uids.add(msg.uid)
-        except Exception as e:
-            if logger:
-                logger.error(f"[EMAIL] ❌ ОШИБКА подключения к почте: {e}")
-                logger.error(f"[EMAIL] Тип ошибки: {type(e).__name__}")
-            
-            import socket
-            if isinstance(e, socket.gaierror):
-                if logger:
-                    logger.error(f"[EMAIL] ❌ Некорректный IMAP хост: {imap_host}")
-                break
-            elif "authentication" in str(e).lower() or "login" in str(e).lower():
-                if logger:
-                    logger.error(f"[EMAIL] ❌ Ошибка авторизации - неверные email/пароль")
-                break
-            elif "timeout" in str(e).lower():
-                if logger:
-                    logger.error(f"[EMAIL] ❌ Таймаут подключения к почте")
-            elif "connection" in str(e).lower():
-                if logger:
-                    logger.error(f"[EMAIL] ❌ Ошибка соединения с почтовым сервером")
-            else:
-                if logger:
-                    logger.error(f"[EMAIL] ❌ Общая ошибка при поиске кода: {e}")
-                    
-            # Пауза перед повторной попыткой
-            if logger:
-                logger.info(f"[EMAIL] Ждем 5 секунд перед повторной попыткой...")
-            time.sleep(5)
-        
-        elapsed = time.time() - start
-        if elapsed < 60:
-            sleep_time = 3
-        elif elapsed < 180:
-            sleep_time = 5
-        else:
-            sleep_time = 10
-            
-        if logger and total_checked > 0:
-            remaining = timeout - elapsed
-            logger.info(f"[EMAIL] Пока не нашли код. Прошло {int(elapsed)}с, осталось {int(remaining)}с. Проверено {total_checked} писем.")
-            
-        time.sleep(sleep_time)
-    
+        logger.info(f"[EMAIL] Начинаем поиск кода для {mode}. Таймаут: {timeout}с")
+
+    future = guard_broker.request(email_login, email_password, imap_host, mode=mode, since=since, timeout=timeout,
+                                  logger=logger)
+    try:
+        code = future.result()
+    except Exception as e:
+        if logger:
+            logger.error(f"[EMAIL] ❌ Почта недоступна: {e}")
+        return None
+
+    if code:
+        if logger:
+            logger.info(f"[EMAIL] Возвращаем найденный код ({mode}): {code}")
+        return code
     if logger:
-        logger.warning(f"[EMAIL] Не удалось найти код за отведенное время ({timeout}с). Проверено {total_checked} писем.")
-    
+        logger.warning(f"[EMAIL] Не удалось найти код за отведенное время ({timeout}с).")
     return None